@@ -85,7 +85,7 @@ void setJointPositions(JsonObject &positions) {
     }
     updateAll(true);
   }
-  Serial.println("{“status”: “move_done”}");
+  Serial.println("{\"status\": \"move_done\"}");
 }
 
 // The function that your loop() will call frequently
@@ -289,7 +289,7 @@ void homeAll() {
   for (int j = 0; j < NUM_MOTORS; j++) {
     home(j);  // blocking call from above
   }
-  Serial.println("{“status”: “home_done”}");
+  Serial.println("{\"status\": \"home_done\"}");
 }
 
 long angleToSteps(float angle) {
@@ -1,14 +1,22 @@
-from fastapi import FastAPI, WebSocket, HTTPException, Request, BackgroundTasks
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Request, Response, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, PlainTextResponse
 import asyncio
-import sys
 import os
 import time
-from config import SIMULATION_MODE
+from typing import Optional
+from config import SIMULATION_MODE, ARDUINO_CONFIG, METRICS_CONFIG
 from arduino_communication import ArduinoCommunicator
-from routers import motion, programs
+from message_encoding import available_encodings, POSITION_FIELDS
+from broadcaster import TOPICS
+from log import get_logger, setup_logging, shutdown_logging
+from metrics import REGISTRY
+from routers import motion, programs, admin
+import recorder
+import dry_run
+
+logger = get_logger('app')
 
 app = FastAPI(title="Robotic Arm Control API")
 
@@ -27,13 +35,17 @@ if os.path.exists(frontend_build_path):
 
 app.include_router(motion.router, prefix="/api/motion", tags=["motion"])
 app.include_router(programs.router, prefix="/api", tags=["programs"])
+app.include_router(admin.router, prefix="/api/admin", tags=["admin"])
 
-arduino = None
-if not SIMULATION_MODE:
+# Simulation mode drives the simulated Arduino, so moves report move_done as on the hardware
+if SIMULATION_MODE or ARDUINO_CONFIG.get('BACKEND') == 'simulated':
+    from arduino_simulator import SimulatedArduino
+    arduino = SimulatedArduino()
+else:
     arduino = ArduinoCommunicator()
     if not arduino.connected:
-        print("WARNING: Failed to connect to Arduino. Operating in simulation mode.")
-        sys.stdout.flush()
+        logger.warning("Failed to connect to Arduino. Operating in simulation mode.")
+REGISTRY.register_collector(arduino.stats.collect)
 
 # Pass Arduino communicator to motion module
 motion.arduino_communicator = arduino
@@ -42,27 +54,45 @@ motion.arduino_communicator = arduino
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
     
-    connection_id = len(motion.active_connections)
-    motion.active_connections.append(websocket)
+    # Position stream encoding is negotiated with query parameters, e.g. /ws?encoding=packed&delta=true
+    requested_encoding = websocket.query_params.get('encoding')
+    requested_delta = websocket.query_params.get('delta')
+    encoding = requested_encoding if requested_encoding in available_encodings() else 'json'
+    delta = (requested_delta or '').lower() in ('1', 'true', 'yes')
+    
+    # Initial topic subscriptions, e.g. /ws?topics=program,homing (all topics by default)
+    requested_topics = websocket.query_params.get('topics')
+    topics = None
+    if requested_topics is not None:
+        topics = [topic for topic in requested_topics.split(',') if topic in TOPICS]
     
-    print(f"New WebSocket connection accepted. Active connections: {len(motion.active_connections)}")
-    sys.stdout.flush()
+    # All sends to this socket go through its writer task in the broadcaster
+    await motion.broadcaster.register(websocket, encoding, delta, topics)
+    
+    logger.info("New WebSocket connection accepted. Active connections: %s", len(motion.broadcaster.clients))
     
     try:
         initial_message = {
             "type": "position_update",
             "timestamp": time.time(),
-            "joint_positions": motion.current_joint_positions,
+            "joint_positions": motion.current_joint_positions.copy(),
             "ee_position": motion.current_ee_position
         }
-        await websocket.send_json(initial_message)
-        print(f"Position update sent to connection {connection_id}")
-        sys.stdout.flush()
+        if requested_encoding is not None or requested_delta is not None:
+            # Tell the client what was actually negotiated before the first frame
+            motion.broadcaster.send_to(websocket, {
+                "type": "connection_info",
+                "encoding": encoding,
+                "delta": delta,
+                "available_encodings": available_encodings(),
+                "position_fields": list(POSITION_FIELDS),
+                "timestamp": time.time()
+            })
+        motion.broadcaster.send_to(websocket, initial_message)
         
         while True:
             data = await websocket.receive_json()
-            print(f"Received WebSocket message: {data}")
-            sys.stdout.flush()
+            logger.debug("Received WebSocket message: %s", data)
             
             message_type = data.get('type', '')
             
@@ -75,8 +105,7 @@ async def websocket_endpoint(websocket: WebSocket):
                     await motion.handle_jog_start(data)
                     
                     if motion.jog_state['active']:
-                        background_tasks = BackgroundTasks()
-                        background_tasks.add_task(motion.jog_motion_control, background_tasks)
+                        motion.start_jog_loop()
                 
                 elif message_type == 'jog_stop':
                     await motion.handle_jog_stop()
@@ -88,9 +117,8 @@ async def websocket_endpoint(websocket: WebSocket):
                     # Additional validation before passing to handler
                     if mode := data.get('mode'):
                         if mode == 'joint' and 'joint' not in data:
-                            print(f"Error: Missing 'joint' key in jog_increment message: {data}")
-                            sys.stdout.flush()
-                            await websocket.send_json({
+                            logger.warning("Missing 'joint' key in jog_increment message: %s", data)
+                            motion.broadcaster.send_to(websocket, {
                                 'type': 'error',
                                 'message': "Missing 'joint' key in jog_increment message",
                                 'timestamp': time.time()
@@ -98,9 +126,8 @@ async def websocket_endpoint(websocket: WebSocket):
                             continue
                         
                         if mode == 'cartesian' and 'axis' not in data:
-                            print(f"Error: Missing 'axis' key in jog_increment message: {data}")
-                            sys.stdout.flush()
-                            await websocket.send_json({
+                            logger.warning("Missing 'axis' key in jog_increment message: %s", data)
+                            motion.broadcaster.send_to(websocket, {
                                 'type': 'error',
                                 'message': "Missing 'axis' key in jog_increment message",
                                 'timestamp': time.time()
@@ -119,10 +146,48 @@ async def websocket_endpoint(websocket: WebSocket):
                 elif message_type == 'emergency_stop':
                     await motion.handle_emergency_stop()
                 
+                elif message_type == 'snap':
+                    # Move to the closest saved position, e.g. at the end of a jog
+                    result = await programs.snap_to_position(data.get('radius'))
+                    motion.broadcaster.send_to(websocket, {
+                        'type': 'snap_result',
+                        **result,
+                        'timestamp': time.time()
+                    })
+                
+                elif message_type.startswith('program_'):
+                    # program_start {program_id, repeat, priority, paused}, program_cancel {job_id},
+                    # program_pause, program_resume, program_step, program_stop, program_reset
+                    action = message_type[len('program_'):]
+                    result = programs.control_executor(action, data)
+                    motion.broadcaster.send_to(websocket, {
+                        'type': 'program_control',
+                        'action': action,
+                        **result,
+                        'timestamp': time.time()
+                    })
+                
+                elif message_type == 'subscribe':
+                    # e.g. {"type": "subscribe", "topics": ["program"], "rates": {"position": 5}}
+                    subscription = motion.broadcaster.subscribe(
+                        websocket, data.get('topics', []), data.get('rates'))
+                    motion.broadcaster.send_to(websocket, {
+                        'type': 'subscriptions',
+                        **subscription,
+                        'timestamp': time.time()
+                    })
+                
+                elif message_type == 'unsubscribe':
+                    subscription = motion.broadcaster.unsubscribe(websocket, data.get('topics', []))
+                    motion.broadcaster.send_to(websocket, {
+                        'type': 'subscriptions',
+                        **subscription,
+                        'timestamp': time.time()
+                    })
+                
                 else:
-                    print(f"Unknown message type: {message_type}")
-                    sys.stdout.flush()
-                    await websocket.send_json({
+                    logger.info("Unknown message type: %s", message_type)
+                    motion.broadcaster.send_to(websocket, {
                         'type': 'error',
                         'message': f"Unknown message type: {message_type}",
                         'timestamp': time.time()
@@ -131,28 +196,24 @@ async def websocket_endpoint(websocket: WebSocket):
             except Exception as e:
                 # Send error back to client but don't close the connection
                 error_message = str(e)
-                print(f"Error processing {message_type} message: {error_message}")
-                sys.stdout.flush()
+                logger.warning("Error processing %s message: %s", message_type, error_message)
                 
-                try:
-                    await websocket.send_json({
-                        'type': 'error',
-                        'message': f"Error processing {message_type}: {error_message}",
-                        'timestamp': time.time()
-                    })
-                except Exception as send_error:
-                    print(f"Failed to send error message to client: {send_error}")
-                    sys.stdout.flush()
+                if not motion.broadcaster.send_to(websocket, {
+                    'type': 'error',
+                    'message': f"Error processing {message_type}: {error_message}",
+                    'timestamp': time.time()
+                }):
+                    logger.warning("Failed to queue error message for client")
+    
+    except WebSocketDisconnect:
+        pass
     
     except Exception as e:
-        print(f"WebSocket error: {e}")
-        sys.stdout.flush()
+        logger.warning("WebSocket error: %s", e)
     
     finally:
-        if websocket in motion.active_connections:
-            motion.active_connections.remove(websocket)
-        print(f"WebSocket connection closed. Active connections: {len(motion.active_connections)}")
-        sys.stdout.flush()
+        await motion.broadcaster.unregister(websocket)
+        logger.info("WebSocket connection closed. Active connections: %s", len(motion.broadcaster.clients))
 
 @app.get("/")
 def read_root():
@@ -170,9 +231,9 @@ def get_ee_position():
 async def api_jog_start(command: motion.JogCommand, background_tasks: BackgroundTasks):
     await motion.handle_jog_start(command.dict())
     
-    # Start background task if not already running
+    # Start the control loop if not already running
     if motion.jog_state['active']:
-        background_tasks.add_task(motion.jog_motion_control, background_tasks)
+        motion.start_jog_loop()
     
     return {"success": True}
 
@@ -196,8 +257,9 @@ async def api_save_position(request: programs.SavePositionRequest):
     return await programs.api_save_position(request)
 
 @app.get("/api/saved_positions")
-def api_get_saved_positions():
-    return programs.api_get_saved_positions()
+def api_get_saved_positions(request: Request, response: Response, name: Optional[str] = None,
+                            cursor: Optional[str] = None, limit: Optional[int] = None):
+    return programs.api_get_saved_positions(request, response, name, cursor, limit)
 
 @app.delete("/api/saved_positions/{position_id}")
 def api_delete_position(position_id: str):
@@ -207,6 +269,13 @@ def api_delete_position(position_id: str):
 async def api_home():
     return await motion.api_home()
 
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus metrics for the control loop, kinematics, broadcaster, programs and serial link"""
+    if not METRICS_CONFIG['ENABLED']:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/{full_path:path}")
 async def serve_frontend(full_path: str, request: Request):
     frontend_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "frontend", "build")
@@ -222,8 +291,52 @@ async def serve_frontend(full_path: str, request: Request):
 
 @app.on_event("startup")
 async def startup_event():
-    programs.saved_positions = programs.load_data_from_file("saved_positions.json", {})
-    programs.programs = programs.load_data_from_file("programs.json", {})
+    global arduino_events_task
+    # Start the background log writer again if an earlier shutdown stopped it
+    setup_logging()
+    programs.load_storage()
+    # The executor's and run queue's events belong to the loop the app runs on
+    programs.executor.open()
+    programs.run_queue.start()
+    # Shutdown disconnects the backend; connect it again if the app is started again
+    if not arduino.connected:
+        arduino.connect()
+    
+    motion.position_publisher.start()
     
-    print("Application startup: saved positions and programs loaded")
-    sys.stdout.flush()
+    if ARDUINO_CONFIG.get('STATS_INTERVAL'):
+        asyncio.create_task(log_serial_stats(ARDUINO_CONFIG['STATS_INTERVAL']))
+    
+    if hasattr(arduino, 'events'):
+        arduino_events_task = asyncio.create_task(forward_arduino_events())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if arduino_events_task:
+        arduino_events_task.cancel()
+    await programs.run_queue.stop()
+    programs.executor.cancel()
+    await motion.position_publisher.stop()
+    recorder.stop_recording()
+    programs.close_storage()
+    dry_run.shutdown_pool()
+    arduino.disconnect()
+    shutdown_logging()
+
+arduino_events_task = None
+
+async def forward_arduino_events():
+    """Route move_done events of an Arduino backend with an event stream (the simulator) to the motion module"""
+    async for event in arduino.events():
+        if event.get('status') == 'move_done':
+            arduino.broadcast_move_done(event)
+            try:
+                await motion.handle_move_done(event)
+            except Exception as e:
+                logger.exception("Error handling move done: %s", e)
+
+async def log_serial_stats(interval):
+    """Periodically log a summary of serial round-trip latencies"""
+    while True:
+        await asyncio.sleep(interval)
+        logger.info("%s", arduino.stats.summary())
@@ -8,12 +8,130 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from routers import motion
+from metrics import Histogram, MetricFamily
+from log import get_logger
+import recorder
+
+logger = get_logger(__name__)
+
+class SerialStats:
+    """
+    Per-command round-trip statistics for the serial link.
+
+    Latencies are recorded per command type ('setJointPositions', 'home', ...):
+        - write: time spent in write() + flush()
+        - first_byte: from the end of the write until the first response byte
+        - response: from the end of the write until the full response line
+    The fixed COMMAND_DELAY sleep before reading is included in first_byte and
+    response, and is reported alongside so it can be subtracted.
+    """
+    LATENCY_STAGES = ('write', 'first_byte', 'response')
+
+    def __init__(self, command_delay=0.0):
+        self.command_delay = command_delay
+        self.started = time.time()
+        self.latency = {}
+        self.counters = {}
+
+    def _command(self, command_type):
+        """Get (or lazily create) the histograms and counters for a command type"""
+        latency = self.latency.get(command_type)
+        if latency is None:
+            latency = {stage: Histogram() for stage in self.LATENCY_STAGES}
+            self.latency[command_type] = latency
+            self.counters[command_type] = {
+                'sent': 0,
+                'ok': 0,
+                'errors': 0,
+                'timeouts': 0,
+                'parse_failures': 0
+            }
+        return latency
+
+    def observe(self, command_type, stage, seconds):
+        """Record a latency observation for one stage of a command"""
+        self._command(command_type)[stage].observe(seconds)
+
+    def count(self, command_type, counter, amount=1):
+        """Increment an event counter for a command type"""
+        self._command(command_type)
+        self.counters[command_type][counter] += amount
+
+    def reset(self):
+        """Clear all recorded statistics"""
+        self.started = time.time()
+        self.latency = {}
+        self.counters = {}
+
+    def snapshot(self):
+        """
+        Summarize all recorded statistics
+
+        Returns:
+            Dictionary keyed by command type with counters and latency summaries
+        """
+        commands = {}
+        for command_type, latency in self.latency.items():
+            commands[command_type] = {
+                'counters': dict(self.counters[command_type]),
+                'latency': {stage: histogram.snapshot() for stage, histogram in latency.items()}
+            }
+        return {
+            'since': self.started,
+            'command_delay': self.command_delay,
+            'commands': commands
+        }
+
+    def summary(self):
+        """
+        Format a compact one-line-per-command summary for periodic logging
+
+        Returns:
+            Summary string
+        """
+        lines = [f"Serial stats over {time.time() - self.started:.0f}s:"]
+        for command_type, latency in self.latency.items():
+            counters = self.counters[command_type]
+            response = latency['response'].snapshot()
+            if response['count']:
+                timing = (f"response p50={response['p50'] * 1000:.1f}ms "
+                          f"p99={response['p99'] * 1000:.1f}ms max={response['max'] * 1000:.1f}ms")
+            else:
+                timing = "no responses"
+            lines.append(f"  {command_type}: sent={counters['sent']} ok={counters['ok']} "
+                         f"errors={counters['errors']} timeouts={counters['timeouts']} "
+                         f"parse_failures={counters['parse_failures']}, {timing}")
+        if len(lines) == 1:
+            lines.append("  no commands sent")
+        return "\n".join(lines)
+
+    def collect(self):
+        """
+        Export the statistics as Prometheus metric families (registered as a
+        collector, so nothing extra is recorded on the serial path)
+
+        Returns:
+            List of MetricFamily
+        """
+        latency = MetricFamily('pendant_serial_latency_seconds',
+                               'Serial command latency in seconds by command and stage', 'histogram')
+        events = MetricFamily('pendant_serial_events_total',
+                              'Serial command events (sent, ok, errors, timeouts, parse_failures)', 'counter')
+        for command_type, histograms in list(self.latency.items()):
+            for stage, histogram in histograms.items():
+                latency.add_histogram({'command': command_type, 'stage': stage}, histogram)
+            for event, value in self.counters[command_type].items():
+                events.add({'command': command_type, 'event': event}, value)
+        return [latency, events]
 
 class ArduinoCommunicator:
     """
     Handles communication with the Arduino that controls the stepper motors
     for the RRPRRR robotic arm.
     """
+    # Whether this drives a simulation rather than the robot (safe in simulation mode)
+    simulated = False
+
     def __init__(self, port=None, baud_rate=None, timeout=None):
         # Use values from config if not explicitly provided
         self.port = port if port is not None else ARDUINO_CONFIG['PORT']
@@ -23,6 +141,7 @@ class ArduinoCommunicator:
         self.serial = None
         self.connected = False
         self.lock = threading.Lock()  # Thread lock for serial communication
+        self.stats = SerialStats(self.command_delay)
         
         # Try to connect on initialization
         self.connect()
@@ -38,10 +157,10 @@ class ArduinoCommunicator:
             self.serial = serial.Serial(self.port, self.baud_rate, timeout=self.timeout)
             time.sleep(2)  # Wait for Arduino to reset
             self.connected = True
-            print(f"Connected to Arduino on {self.port}")
+            logger.info("Connected to Arduino on %s", self.port)
             return True
         except Exception as e:
-            print(f"Failed to connect to Arduino: {e}")
+            logger.error("Failed to connect to Arduino: %s", e, extra={'fields': {'port': self.port}})
             self.connected = False
             return False
     
@@ -50,7 +169,7 @@ class ArduinoCommunicator:
         if self.serial and self.serial.is_open:
             self.serial.close()
             self.connected = False
-            print("Disconnected from Arduino")
+            logger.info("Disconnected from Arduino")
     
     def send_command(self, command_dict):
         """
@@ -63,68 +182,109 @@ class ArduinoCommunicator:
             bool: True if command sent successfully, False otherwise
         """
         if not self.connected or not self.serial:
-            print("Not connected to Arduino")
+            logger.warning("Not connected to Arduino")
             return False
         
+        command_type = command_dict.get('cmd', 'unknown')
+        
         try:
             with self.lock:  # Ensure thread safety for serial communication
                 # Convert command to JSON string and add newline
                 command_json = json.dumps(command_dict) + '\n'
-                self.serial.write(command_json.encode())
-                self.serial.flush()
+                written_at = self._write(command_type, command_json)
                 time.sleep(self.command_delay)  # Small delay to ensure command is processed
                 
                 # Wait for and parse response
-                response = self.serial.readline().decode().strip()
+                response = self._read_response(command_type, written_at)
                 if response:
                     response_dict = self.process_response(response)
-                    if response_dict and response_dict.get('status') == 'ok':
+                    if response_dict is None:
+                        self.stats.count(command_type, 'parse_failures')
+                        logger.warning("Arduino error: Unparseable response", extra={'fields': {'cmd': command_type}})
+                        return False
+                    if response_dict.get('status') == 'ok':
+                        self.stats.count(command_type, 'ok')
                         return True
                     else:
-                        print(f"Arduino error: {response_dict.get('message', 'Unknown error')}")
+                        self.stats.count(command_type, 'errors')
+                        logger.warning("Arduino error: %s", response_dict.get('message', 'Unknown error'),
+                                       extra={'fields': {'cmd': command_type}})
                         return False
                 else:
-                    print("No response from Arduino")
+                    self.stats.count(command_type, 'timeouts')
+                    logger.warning("No response from Arduino", extra={'fields': {'cmd': command_type}})
                     return False
         except Exception as e:
-            print(f"Error sending command to Arduino: {e}")
+            self.stats.count(command_type, 'errors')
+            logger.error("Error sending command to Arduino: %s", e, extra={'fields': {'cmd': command_type}})
             return False
     
+    def _write(self, command_type, command_json):
+        """
+        Write a serialized command and record the write latency
+        
+        Returns:
+            float: perf_counter timestamp at which the write completed
+        """
+        start = time.perf_counter()
+        self.serial.write(command_json.encode())
+        self.serial.flush()
+        written_at = time.perf_counter()
+        self.stats.count(command_type, 'sent')
+        self.stats.observe(command_type, 'write', written_at - start)
+        recorder.record_serial(recorder.KIND_SERIAL_TX, command_type, command_json)
+        return written_at
+    
+    def _read_response(self, command_type, since):
+        """
+        Read one response line, recording first-byte and full-response latency
+        relative to `since` (a perf_counter timestamp)
+        
+        Returns:
+            str: Stripped response line, empty if the read timed out
+        """
+        first_byte = self.serial.read(1)
+        if not first_byte:
+            return ''
+        self.stats.observe(command_type, 'first_byte', time.perf_counter() - since)
+        
+        line = first_byte + self.serial.readline()
+        latency = time.perf_counter() - since
+        self.stats.observe(command_type, 'response', latency)
+        line = line.decode().strip()
+        recorder.record_serial(recorder.KIND_SERIAL_RX, command_type, line, latency)
+        return line
+    
     def process_response(self, response):
         """Process a response from the Arduino"""
         try:
             if isinstance(response, str):
-                print(f"Raw response from Arduino: {response}")
-                sys.stdout.flush()
+                logger.debug("Raw response from Arduino: %s", response)
                 
                 response_data = json.loads(response)
-                print(f"Parsed JSON from Arduino: {response_data}")
-                sys.stdout.flush()
                 
                 # Check if this is a move completion notification
                 if response_data.get('status') == 'move_done':
-                    print("MOVE DONE signal detected from Arduino!")
-                    sys.stdout.flush()
+                    logger.info("Move done signal received from Arduino")
                     # Notify the websocket clients
                     self.broadcast_move_done(response_data)
                 
                 return response_data
             return None
         except json.JSONDecodeError:
-            print(f"Invalid JSON response from Arduino: {response}")
-            sys.stdout.flush()
+            logger.warning("Invalid JSON response from Arduino: %s", response)
             return None
     
     def broadcast_move_done(self, data):
         """Broadcast move done to websocket clients"""
         # The message will be picked up by the WebSocket handler in app.py
-        # and routed to motion.handle_move_done
-        for connection in motion.active_connections:
-            asyncio.create_task(connection.send_json({
-                'type': 'move_done',
-                'data': data,
-                'timestamp': time.time()
-            }))
+        # and routed to motion.handle_move_done. Responses read while homing
+        # arrive on an executor thread, so the publish hops back to the event loop
+        motion.broadcaster.publish_threadsafe({
+            'type': 'move_done',
+            'data': data,
+            'timestamp': time.time()
+        })
     
     def send_joint_command(self, joint_positions):
         """
@@ -173,7 +333,7 @@ class ArduinoCommunicator:
         
         joint_number = joint_map.get(jog_data['joint'])
         if not joint_number:
-            print(f"Invalid joint name: {jog_data['joint']}")
+            logger.warning("Invalid joint name: %s", jog_data['joint'])
             return False
             
         # Increment is already converted in motion.py if needed
@@ -192,7 +352,7 @@ class ArduinoCommunicator:
             bool: True if homing completed successfully, False otherwise
         """
         if not self.connected or not self.serial:
-            print("Not connected to Arduino")
+            logger.warning("Not connected to Arduino")
             return False
         
         try:
@@ -200,24 +360,30 @@ class ArduinoCommunicator:
                 # Send home command
                 command = {'cmd': 'home'}
                 command_json = json.dumps(command) + '\n'
-                self.serial.write(command_json.encode())
-                self.serial.flush()
+                written_at = self._write('home', command_json)
                 
-                print("Home command sent to Arduino, waiting for completion...")
+                logger.info("Home command sent to Arduino, waiting for acknowledgment")
                 
                 # Wait for initial acknowledgment
-                response = self.serial.readline().decode().strip()
+                response = self._read_response('home', written_at)
                 if not response:
-                    print("No initial response from Arduino")
+                    self.stats.count('home', 'timeouts')
+                    logger.warning("No initial response from Arduino", extra={'fields': {'cmd': 'home'}})
                     return False
                 
                 try:
                     response_dict = self.process_response(response)
-                    if response_dict and response_dict.get('status') != 'ok':
-                        print(f"Arduino error: {response_dict.get('message', 'Unknown error')}")
+                    if response_dict is None:
+                        self.stats.count('home', 'parse_failures')
+                    elif response_dict.get('status') != 'ok':
+                        self.stats.count('home', 'errors')
+                        logger.warning("Arduino error: %s", response_dict.get('message', 'Unknown error'),
+                                       extra={'fields': {'cmd': 'home'}})
                         return False
+                    else:
+                        self.stats.count('home', 'ok')
                     
-                    print("Arduino acknowledged home command, waiting for completion...")
+                    logger.info("Arduino acknowledged home command, waiting for completion")
                     
                     # Now wait for the home completion message
                     # This could take some time as the Arduino performs the homing sequence
@@ -225,27 +391,36 @@ class ArduinoCommunicator:
                         completion_response = self.serial.readline().decode().strip()
                         if not completion_response:
                             # If we timeout waiting for a response
+                            self.stats.count('home_done', 'timeouts')
                             time.sleep(0.5)  # Small delay before trying again
                             continue
+                        recorder.record_serial(recorder.KIND_SERIAL_RX, 'home', completion_response,
+                                               time.perf_counter() - written_at)
                         
                         try:
                             completion_dict = self.process_response(completion_response)
+                            if completion_dict is None:
+                                self.stats.count('home_done', 'parse_failures')
                             if completion_dict and completion_dict.get('status') == 'home_done':
-                                print("Homing completed successfully")
+                                self.stats.count('home_done', 'ok')
+                                self.stats.observe('home_done', 'response', time.perf_counter() - written_at)
+                                logger.info("Homing completed successfully")
                                 return True
                             elif completion_dict and completion_dict.get('status') == 'error':
-                                print(f"Homing error: {completion_dict.get('message', 'Unknown error')}")
+                                self.stats.count('home_done', 'errors')
+                                logger.error("Homing error: %s", completion_dict.get('message', 'Unknown error'))
                                 return False
                         except json.JSONDecodeError:
-                            print(f"Invalid completion response from Arduino: {completion_response}")
+                            logger.warning("Invalid completion response from Arduino: %s", completion_response)
                             continue
                         
                 except json.JSONDecodeError:
-                    print(f"Invalid response from Arduino: {response}")
+                    logger.warning("Invalid response from Arduino: %s", response)
                     return False
                 
         except Exception as e:
-            print(f"Error during homing: {e}")
+            self.stats.count('home', 'errors')
+            logger.error("Error during homing: %s", e)
             return False
 
     def send_emergency_stop(self):
@@ -0,0 +1,352 @@
+"""
+Simulated Arduino.
+
+SimulatedArduino stands in for ArduinoCommunicator in SIMULATION_MODE (or with
+ARDUINO_CONFIG['BACKEND'] = 'simulated'), so the hardware code path - sending
+joint commands, waiting for move_done, blocking homing - runs and can be
+benchmarked without a board.
+
+It models the firmware in main/: every motor is a stepper moving in
+SIMULATED_ARDUINO_CONFIG['MICROSTEP_ANGLE'] steps, so targets are quantized to
+whole steps. Step timing follows Motor::update(): the step interval ramps
+linearly from SPEED_SLOW to SPEED_FAST over the first ACCEL_STEPS steps of a
+move and back over the last ACCEL_STEPS, and each motor moves at its own
+rate, so a move takes as long as its slowest motor. Simulated time runs
+time_scale x motion.simulation_speed (raised by recorder.replay) faster than
+real time. Jog increments
+(moveJoint) run at SPEED_FAST without ramps. Homing runs the firmware's
+sequence for one motor at a time: fast approach to the limit switch, pull
+off, slow approach, pull off again, and the pulled off position becomes 0.
+The limit switch is taken to be at the joint's lower limit.
+
+Like the firmware, commands run one at a time in the order they were sent, on
+a worker thread; an estop takes effect at once, stopping the motors where
+they are and dropping queued commands. Completed moves and homing are
+reported as {"status": "move_done"} / {"status": "home_done"} events, which
+async consumers read from events(); app.py routes move_done to
+motion.handle_move_done as the serial move_done would be.
+"""
+import asyncio
+import json
+import queue
+import threading
+import time
+
+import numpy as np
+
+from arduino_communication import ArduinoCommunicator
+from config import SIMULATED_ARDUINO_CONFIG
+from log import get_logger
+import recorder
+from routers import motion
+import trajectory
+
+logger = get_logger(__name__)
+
+# Firmware joint names, in the order of trajectory.JOINTS
+MOTORS = ('j1', 'j2', 'j3', 'j4', 'j5', 'j6')
+
+
+class Stepper:
+    """One simulated stepper motor, timed like the firmware's Motor::update()"""
+    def __init__(self, fast, slow, accel_steps):
+        """
+        Args:
+            fast: Microseconds per step at cruise speed
+            slow: Microseconds per step at the start and end of a move
+            accel_steps: Steps over which a move ramps between the two
+        """
+        self.fast = fast
+        self.slow = slow
+        self.accel_steps = accel_steps
+        self.position = 0            # Steps
+
+    def step_times(self, steps, interval=None):
+        """
+        Time of each step of a move
+
+        Args:
+            steps: Number of steps
+            interval: Fixed microseconds per step (no ramps), or None to ramp
+                      between the slow and fast speeds
+
+        Returns:
+            numpy array of the seconds from the start of the move to each step
+        """
+        if interval is not None:
+            return np.arange(1, steps + 1) * interval * 1e-6
+        taken = np.arange(steps)
+        remaining = steps - taken
+        span = self.slow - self.fast
+        # Intervals are whole microseconds, truncated as by the firmware's long
+        intervals = np.where(taken < self.accel_steps,
+                             np.trunc(self.slow - taken / self.accel_steps * span),
+                             np.where(remaining < self.accel_steps,
+                                      np.trunc(self.fast + (1.0 - remaining / self.accel_steps) * span),
+                                      self.fast))
+        return np.cumsum(intervals) * 1e-6
+
+
+class SimulatedArduino(ArduinoCommunicator):
+    """ArduinoCommunicator backed by a simulation of the firmware instead of a serial port"""
+    simulated = True
+
+    def __init__(self, time_scale=None):
+        """
+        Args:
+            time_scale: Simulated seconds per real second, defaults to SIMULATED_ARDUINO_CONFIG['TIME_SCALE']
+        """
+        config = SIMULATED_ARDUINO_CONFIG
+        self.microstep_angle = config['MICROSTEP_ANGLE']
+        self.time_scale = time_scale or config['TIME_SCALE']
+        self.motors = [Stepper(config['SPEED_FAST'][i], config['SPEED_SLOW'][i], config['ACCEL_STEPS'][i])
+                       for i in range(len(MOTORS))]
+        # Limit switch of each motor in motor steps; the firmware's step count starts where the motor powers up
+        limits = motion.fk.robot_params.joint_limits
+        self._switches = []
+        for joint in trajectory.JOINTS:
+            low = limits[joint][0]
+            if joint == 'prismatic_extension':
+                low = motion.extension_to_rotation(low)
+            self._switches.append(self.angle_to_steps(low))
+        self._commands = queue.Queue()
+        # Bumped by every estop; commands and moves from before it are abandoned
+        self._estops = 0
+        self._interrupt = threading.Event()
+        self._subscribers = []       # (event loop, asyncio.Queue) per events() consumer
+        self._thread = None
+        super().__init__(port='simulated')
+
+    def _scale(self):
+        """Simulated seconds per real second, including a replay's speed up"""
+        return self.time_scale * motion.simulation_speed
+
+    def angle_to_steps(self, angle):
+        return int(round(angle / self.microstep_angle))
+
+    def steps_to_angle(self, steps):
+        return steps * self.microstep_angle
+
+    def positions(self):
+        """
+        Returns:
+            Dictionary of each motor's position in degrees ('j1'...'j6'), in whole steps
+        """
+        return {motor: self.steps_to_angle(stepper.position) for motor, stepper in zip(MOTORS, self.motors)}
+
+    def connect(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="simulated-arduino", daemon=True)
+            self._thread.start()
+        self.connected = True
+        logger.info("Connected to simulated Arduino", extra={'fields': {'time_scale': self.time_scale}})
+        return True
+
+    def disconnect(self):
+        if self._thread is not None:
+            self._estop()
+            self._commands.put(None)
+            self._thread.join(5.0)
+            self._thread = None
+        if self.connected:
+            self.connected = False
+            logger.info("Disconnected from simulated Arduino")
+
+    def events(self):
+        """
+        Async iterator over the move_done and home_done events, from now on
+
+        Returns:
+            Async generator of event dictionaries
+        """
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+        subscriber = (loop, events)
+        self._subscribers.append(subscriber)
+
+        async def stream():
+            try:
+                while True:
+                    yield await events.get()
+            finally:
+                self._subscribers.remove(subscriber)
+        return stream()
+
+    def _emit(self, event):
+        line = json.dumps(event)
+        recorder.record_serial(recorder.KIND_SERIAL_RX, event['status'], line)
+        logger.debug("Simulated Arduino: %s", line)
+        for loop, events in list(self._subscribers):
+            loop.call_soon_threadsafe(events.put_nowait, event)
+
+    def send_command(self, command_dict):
+        """
+        Queue a command for the simulated firmware, or stop it at once for an estop
+
+        Returns:
+            bool: True if the command was accepted
+        """
+        if not self.connected:
+            logger.warning("Not connected to Arduino")
+            return False
+
+        command_type = command_dict.get('cmd', 'unknown')
+        start = time.perf_counter()
+        line = json.dumps(command_dict)
+        recorder.record_serial(recorder.KIND_SERIAL_TX, command_type, line)
+        self.stats.count(command_type, 'sent')
+        if command_type == 'estop':
+            self._estop()
+        elif command_type in ('setJointPositions', 'moveJoint', 'home', 'getPosition'):
+            self._commands.put((self._estops, command_dict, None))
+        else:
+            self.stats.count(command_type, 'errors')
+            logger.warning("Arduino error: Unknown command", extra={'fields': {'cmd': command_type}})
+            return False
+        self.stats.count(command_type, 'ok')
+        self.stats.observe(command_type, 'response', time.perf_counter() - start)
+        return True
+
+    def send_home_command(self):
+        """
+        Home every motor, blocking until done like the hardware
+
+        Returns:
+            bool: True if homing completed, False if it was stopped
+        """
+        if not self.connected:
+            logger.warning("Not connected to Arduino")
+            return False
+
+        recorder.record_serial(recorder.KIND_SERIAL_TX, 'home', json.dumps({'cmd': 'home'}))
+        self.stats.count('home', 'sent')
+        start = time.perf_counter()
+        done = threading.Event()
+        result = {}
+        self._commands.put((self._estops, {'cmd': 'home'}, (done, result)))
+        done.wait()
+        if result.get('success'):
+            self.stats.count('home_done', 'ok')
+            self.stats.observe('home_done', 'response', time.perf_counter() - start)
+            logger.info("Homing completed successfully")
+            return True
+        self.stats.count('home_done', 'errors')
+        logger.error("Homing error: stopped")
+        return False
+
+    def _estop(self):
+        self._estops += 1
+        self._interrupt.set()
+        # Drop queued commands, releasing anyone waiting for homing
+        while True:
+            try:
+                item = self._commands.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None and item[2] is not None:
+                item[2][0].set()
+            elif item is None:
+                self._commands.put(None)
+                break
+
+    def _run(self):
+        while True:
+            item = self._commands.get()
+            if item is None:
+                return
+            estops, command, waiter = item
+            try:
+                if estops == self._estops:
+                    self._execute(command, estops, waiter)
+            except Exception as e:
+                logger.exception("Simulated Arduino error running %s: %s", command.get('cmd'), e)
+            finally:
+                if waiter is not None:
+                    waiter[0].set()
+
+    def _execute(self, command, estops, waiter):
+        command_type = command['cmd']
+        if command_type == 'setJointPositions':
+            positions = command.get('positions', {})
+            targets = [self.angle_to_steps(float(positions[motor])) if motor in positions else stepper.position
+                       for motor, stepper in zip(MOTORS, self.motors)]
+            started = time.monotonic()
+            if self._move(list(zip(self.motors, targets, [None] * len(targets))), estops):
+                self._emit({'status': 'move_done', 'positions': self.positions(),
+                            'duration': (time.monotonic() - started) * self._scale()})
+
+        elif command_type == 'moveJoint':
+            joint = command.get('joint', '')
+            if joint not in MOTORS:
+                logger.warning("Simulated Arduino: Unknown joint %s", joint)
+                return
+            stepper = self.motors[MOTORS.index(joint)]
+            target = self.angle_to_steps(self.steps_to_angle(stepper.position) + float(command.get('increment', 0)))
+            self._move([(stepper, target, stepper.fast)], estops)
+
+        elif command_type == 'home':
+            # Homed one motor at a time, as by homeAll()
+            for index in range(len(self.motors)):
+                if not self._home(index, estops):
+                    return
+            if waiter is not None:
+                waiter[1]['success'] = True
+            self._emit({'status': 'home_done'})
+
+    def _home(self, index, estops):
+        """Run the firmware's homing sequence for one motor; False if stopped"""
+        config = SIMULATED_ARDUINO_CONFIG
+        stepper = self.motors[index]
+        seek = stepper.fast * config['HOMING_SEEK']
+        feed = stepper.fast * config['HOMING_FEED']
+        pull_off = self.angle_to_steps(config['HOMING_PULL_OFF'][index])
+
+        # Fast approach; the switch position becomes 0
+        if not self._move([(stepper, min(stepper.position, self._switches[index]), seek)], estops):
+            return False
+        stepper.position = 0
+        # Pull off, then approach slowly and zero on the switch again
+        if not self._move([(stepper, pull_off, seek)], estops):
+            return False
+        if not self._move([(stepper, 0, feed)], estops):
+            return False
+        if not self._move([(stepper, pull_off, feed)], estops):
+            return False
+        # The pulled off position is the new zero, so the switch is behind it
+        stepper.position = 0
+        self._switches[index] = -pull_off
+        return True
+
+    def _move(self, moves, estops):
+        """
+        Run motors to their targets, updating their positions as time passes
+
+        Args:
+            moves: List of (Stepper, target steps, fixed step interval or None to ramp)
+
+        Returns:
+            bool: False if an estop stopped the move
+        """
+        # A set interrupt from an earlier estop must not cut this move's waits short
+        self._interrupt.clear()
+        plans = []
+        for stepper, target, interval in moves:
+            steps = abs(target - stepper.position)
+            if steps:
+                plans.append((stepper, stepper.position, 1 if target > stepper.position else -1,
+                              stepper.step_times(steps, interval)))
+        if not plans:
+            return estops == self._estops
+        duration = max(times[-1] for _, _, _, times in plans)
+
+        scale = self._scale()
+        started = time.monotonic()
+        while True:
+            elapsed = (time.monotonic() - started) * scale
+            for stepper, start, direction, times in plans:
+                stepper.position = start + direction * int(np.searchsorted(times, elapsed, side='right'))
+            if estops != self._estops:
+                return False
+            if elapsed >= duration:
+                return True
+            self._interrupt.wait(min(SIMULATED_ARDUINO_CONFIG['UPDATE_INTERVAL'], (duration - elapsed) / scale))
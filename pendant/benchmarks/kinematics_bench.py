@@ -0,0 +1,233 @@
+"""
+Kinematics micro-benchmarks with stored regression baselines.
+
+Measures single-call and batched throughput of ForwardKinematics.calculate,
+calculate_jacobian, InverseKinematics.calculate and calculate_differential,
+plus IK convergence rate and iteration counts, on a fixed seeded set of
+random reachable poses (targets are FK of random joint positions within the
+joint limits, so every target is reachable).
+
+Results are compared against benchmarks/baselines/kinematics.json; the run
+fails (exit code 1) if any timing is slower than the baseline by more than
+--threshold, or if an IK success rate or mean iteration count got worse.
+Timings depend on the machine, so refresh the baseline with --save-baseline
+when benchmarking on different hardware.
+
+Usage:
+    python benchmarks/kinematics_bench.py
+    python benchmarks/kinematics_bench.py --threshold 0.25 --json
+    python benchmarks/kinematics_bench.py --save-baseline
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Keep the per-iteration debug logging out of the measurements
+os.environ.setdefault('PENDANT_LOG_LEVEL', 'WARNING')
+
+import numpy as np
+
+import kinematics
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines', 'kinematics.json')
+
+JOINTS = ['base_rotation', 'shoulder_rotation', 'prismatic_extension',
+          'elbow_rotation', 'elbow2_rotation', 'end_effector_rotation']
+
+# Joint offsets (degrees or mm) between the differential IK start and the solution
+DIFFERENTIAL_START_OFFSET = 2.0
+
+# Convergence is deterministic for a given seed, so any change is reported;
+# these tolerances only absorb floating point differences between platforms
+SUCCESS_RATE_TOLERANCE = 0.01
+ITERATIONS_TOLERANCE = 0.05
+
+
+def random_joint_sets(count, seed):
+    """Random joint positions within the joint limits"""
+    rng = random.Random(seed)
+    limits = kinematics.RobotParameters().joint_limits
+    joint_sets = []
+    for _ in range(count):
+        joint_sets.append({joint: rng.uniform(*limits[joint]) for joint in JOINTS})
+    return joint_sets
+
+
+def time_calls(func, args_list, repeat):
+    """
+    Time func over every argument tuple, best of `repeat` passes
+
+    Returns:
+        Best mean seconds per call
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for args in args_list:
+            func(*args)
+        best = min(best, (time.perf_counter() - start) / len(args_list))
+    return best
+
+
+def run(poses, batch, repeat, seed):
+    """
+    Run all benchmarks
+
+    Returns:
+        Dictionary with 'timings' (seconds per call) and 'convergence' results
+    """
+    fk = kinematics.ForwardKinematics()
+    ik = kinematics.InverseKinematics()
+
+    joint_sets = random_joint_sets(poses, seed)
+    targets = [fk.calculate(joints) for joints in joint_sets]
+    rng = random.Random(seed + 1)
+    starts = [{joint: value + rng.uniform(-DIFFERENTIAL_START_OFFSET, DIFFERENTIAL_START_OFFSET)
+               for joint, value in joints.items()} for joints in joint_sets]
+
+    single = [(joint_sets[0],)]
+    single_target = [(targets[0],)]
+    single_differential = [(starts[0], targets[0])]
+    batch_joints = [(joints,) for joints in joint_sets[:batch]]
+    batch_targets = [(target,) for target in targets[:batch]]
+    batch_differential = list(zip(starts[:batch], targets[:batch]))
+
+    timings = {
+        'fk_single': time_calls(fk.calculate, single * batch, repeat),
+        'fk_batch': time_calls(fk.calculate, batch_joints, repeat),
+        'jacobian_single': time_calls(fk.calculate_jacobian, single * batch, repeat),
+        'jacobian_batch': time_calls(fk.calculate_jacobian, batch_joints, repeat),
+        'ik_analytic_single': time_calls(ik.calculate, single_target * batch, repeat),
+        'ik_analytic_batch': time_calls(ik.calculate, batch_targets, repeat),
+        'ik_differential_single': time_calls(ik.calculate_differential, single_differential * batch, repeat),
+        'ik_differential_batch': time_calls(ik.calculate_differential, batch_differential, repeat)
+    }
+
+    analytic_successes = sum(1 for target in targets if ik.calculate(target) is not None)
+
+    iterations = []
+    differential_successes = 0
+    max_iterations = 10
+    for start, target in zip(starts, targets):
+        joints, used = ik._solve_differential(start, target, max_iterations, 0.001)
+        iterations.append(used)
+        if joints is not None:
+            differential_successes += 1
+
+    convergence = {
+        'poses': poses,
+        'ik_analytic_success_rate': analytic_successes / poses,
+        'ik_differential_success_rate': differential_successes / poses,
+        'ik_differential_mean_iterations': float(np.mean(iterations)),
+        'ik_differential_p90_iterations': float(np.percentile(iterations, 90))
+    }
+    return {'timings': timings, 'convergence': convergence}
+
+
+def compare(results, baseline, threshold, check_convergence=True):
+    """
+    Compare results against a baseline
+
+    Args:
+        check_convergence: Also compare IK convergence (only valid for the same pose set)
+
+    Returns:
+        List of regression descriptions (empty if none)
+    """
+    regressions = []
+    for name, seconds in results['timings'].items():
+        reference = baseline['timings'].get(name)
+        if reference and seconds > reference * (1 + threshold):
+            regressions.append(f"{name}: {seconds * 1e6:.1f}us vs baseline {reference * 1e6:.1f}us "
+                               f"(+{(seconds / reference - 1) * 100:.0f}%)")
+
+    if not check_convergence:
+        return regressions
+
+    convergence = results['convergence']
+    reference = baseline['convergence']
+    for name in ('ik_analytic_success_rate', 'ik_differential_success_rate'):
+        if name in reference and convergence[name] < reference[name] - SUCCESS_RATE_TOLERANCE:
+            regressions.append(f"{name}: {convergence[name]:.3f} vs baseline {reference[name]:.3f}")
+    name = 'ik_differential_mean_iterations'
+    if name in reference and convergence[name] > reference[name] * (1 + ITERATIONS_TOLERANCE):
+        regressions.append(f"{name}: {convergence[name]:.2f} vs baseline {reference[name]:.2f}")
+    return regressions
+
+
+def print_report(results, baseline):
+    print(f"{'benchmark':<26} {'us/call':>10} {'baseline':>10} {'change':>8}")
+    for name, seconds in results['timings'].items():
+        reference = baseline['timings'].get(name) if baseline else None
+        if reference:
+            print(f"{name:<26} {seconds * 1e6:>10.1f} {reference * 1e6:>10.1f} {(seconds / reference - 1) * 100:>7.0f}%")
+        else:
+            print(f"{name:<26} {seconds * 1e6:>10.1f} {'-':>10} {'-':>8}")
+    print()
+    for name, value in results['convergence'].items():
+        reference = baseline['convergence'].get(name) if baseline else None
+        suffix = f" (baseline {reference})" if reference is not None else ""
+        print(f"{name:<32} {value}{suffix}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the kinematics solvers against a stored baseline")
+    parser.add_argument('--poses', type=int, default=200, help="Number of seeded random reachable poses")
+    parser.add_argument('--batch', type=int, default=50, help="Calls per timed batch")
+    parser.add_argument('--repeat', type=int, default=15, help="Timed passes per benchmark (best is kept)")
+    parser.add_argument('--seed', type=int, default=42, help="Random seed for the pose set")
+    parser.add_argument('--threshold', type=float, default=0.25, help="Allowed slowdown before failing (0.25 = 25%%)")
+    parser.add_argument('--baseline', default=BASELINE_PATH, help="Baseline JSON file")
+    parser.add_argument('--save-baseline', action='store_true', help="Store this run as the new baseline")
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    args = parser.parse_args()
+
+    results = run(args.poses, min(args.batch, args.poses), args.repeat, args.seed)
+    results['parameters'] = {'poses': args.poses, 'batch': args.batch, 'repeat': args.repeat, 'seed': args.seed}
+    results['machine'] = {'python': platform.python_version(), 'numpy': np.__version__,
+                          'platform': platform.platform(), 'processor': platform.processor()}
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return
+
+    baseline = None
+    same_poses = True
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        parameters = baseline.get('parameters', {})
+        same_poses = parameters.get('seed') == args.seed and parameters.get('poses') == args.poses
+        if not same_poses:
+            print("Warning: baseline was recorded with a different pose set; convergence is not compared",
+                  file=sys.stderr)
+
+    regressions = compare(results, baseline, args.threshold, same_poses) if baseline else []
+
+    if args.json:
+        print(json.dumps({'results': results, 'regressions': regressions}, indent=2))
+    else:
+        print_report(results, baseline)
+        if baseline is None:
+            print(f"\nNo baseline at {args.baseline}; run with --save-baseline to create one")
+        elif regressions:
+            print("\nRegressions:")
+            for regression in regressions:
+                print(f"  {regression}")
+        else:
+            print("\nNo regressions")
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
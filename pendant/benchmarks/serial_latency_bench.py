@@ -0,0 +1,349 @@
+"""
+End-to-end jog command latency through a virtual serial device.
+
+Runs the real server stack in-process (app.py, routers/motion.py, kinematics,
+ArduinoCommunicator) with the communicator connected to a pty. A fake Arduino
+on the other end of the pty answers like the firmware's main loop and
+processCommand (main/main.ino, main/comms.cpp):
+    firmware - echo every command line, then print the move_done line once the
+               simulated move has finished (exactly what the sketch does)
+    status   - reply {"status": "ok"}, the acknowledgement send_command expects
+
+A WebSocket client sends jog_increment messages one at a time and every stage
+of the path is timed per message:
+    ws_to_handler   client send -> handle_jog_increment entered (WebSocket, JSON parsing, dispatch)
+    kinematics      FK/IK time inside the handler
+    serial_write    write() + flush() of each serial command
+    serial_ack      end of write -> full response line read (includes COMMAND_DELAY)
+    handler         handle_jog_increment total
+    ws_to_position  client send -> first position frame showing the new joint value
+
+The response lines the host read are classified (echo of the command just
+sent, stale echo of an earlier command, move_done, status ok, or something
+else) so protocol mismatches between the host and the firmware show up in the
+report.
+
+Usage:
+    python benchmarks/serial_latency_bench.py --messages 200
+    python benchmarks/serial_latency_bench.py --ack status --command-delay 0 --json
+"""
+import argparse
+import asyncio
+import json
+import os
+import pty
+import sys
+import threading
+import time
+import tty
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('PENDANT_LOG_LEVEL', 'ERROR')
+
+import uvicorn
+import websockets
+
+import app as server_app
+from arduino_communication import ArduinoCommunicator
+from routers import motion
+
+STAGES = ('ws_to_handler', 'kinematics', 'serial_write', 'serial_ack', 'handler', 'ws_to_position')
+
+
+class FakeArduino:
+    """
+    Firmware stand-in on the master side of a pty. Replies are delayed by the
+    time the bytes would take on a real UART at `baud_rate`.
+    """
+    def __init__(self, ack='firmware', move_time=0.0, baud_rate=115200):
+        self.ack = ack
+        self.move_time = move_time
+        self.baud_rate = baud_rate
+        self.master, slave = pty.openpty()
+        tty.setraw(slave)
+        self.port = os.ttyname(slave)
+        self._slave = slave
+        self.commands = 0
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="fake-arduino", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        os.close(self.master)
+        os.close(self._slave)
+
+    def _send(self, text):
+        data = text.encode()
+        if self.baud_rate:
+            # 10 bits per byte on the wire (start + 8 data + stop)
+            time.sleep(len(data) * 10.0 / self.baud_rate)
+        os.write(self.master, data)
+
+    def _run(self):
+        buffer = b''
+        while self._running:
+            try:
+                chunk = os.read(self.master, 4096)
+            except OSError:
+                return
+            buffer += chunk
+            while b'\n' in buffer:
+                line, buffer = buffer.split(b'\n', 1)
+                line = line.decode(errors='replace').strip()
+                if line:
+                    self._process(line)
+
+    def _process(self, line):
+        self.commands += 1
+        if self.ack == 'status':
+            self._send('{"status": "ok"}\r\n')
+            return
+
+        # main.ino echoes the command, then processCommand runs it
+        self._send(line + '\r\n')
+        try:
+            command = json.loads(line)
+        except json.JSONDecodeError:
+            self._send('Failed to parse JSON: InvalidInput\r\n')
+            return
+        if command.get('cmd') == 'setJointPositions':
+            # setJointPositions blocks until the motors arrive, then reports move_done
+            if self.move_time:
+                time.sleep(self.move_time)
+            self._send('{"status": "move_done"}\r\n')
+        elif command.get('cmd') == 'home':
+            self._send('{"status": "home_done"}\r\n')
+        elif command.get('cmd') not in ('moveJoint', 'estop', 'getPosition'):
+            self._send('Unknown command\r\n')
+
+
+class StageRecorder:
+    """Per-message stage timings collected by wrapping the real functions"""
+    def __init__(self):
+        self.current = None
+        self.messages = []
+        self.responses = {}
+
+    def begin(self, sent_at):
+        self.current = {'sent_at': sent_at, 'kinematics': 0.0, 'serial_write': [], 'serial_ack': [], 'commands': []}
+        self.messages.append(self.current)
+
+    def classify(self, command_json, response):
+        if not response:
+            kind = 'timeout'
+        elif response == command_json.strip():
+            kind = 'echo'
+        elif 'move_done' in response:
+            kind = 'move_done'
+        elif response.replace(' ', '') == '{"status":"ok"}':
+            kind = 'status_ok'
+        elif response.startswith('{"cmd"'):
+            # Echo of an earlier command left unread in the input buffer
+            kind = 'stale_echo'
+        else:
+            kind = 'other'
+        self.responses[kind] = self.responses.get(kind, 0) + 1
+        return kind
+
+
+def instrument(recorder, communicator):
+    """Wrap the handler, kinematics and serial calls to time each stage"""
+    handle_jog_increment = motion.handle_jog_increment
+
+    async def timed_handle_jog_increment(data):
+        entered = time.perf_counter()
+        message = recorder.current
+        if message is not None:
+            message['ws_to_handler'] = entered - message['sent_at']
+        try:
+            return await handle_jog_increment(data)
+        finally:
+            if message is not None:
+                message['handler'] = time.perf_counter() - entered
+
+    def timed(func):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                if recorder.current is not None:
+                    recorder.current['kinematics'] += time.perf_counter() - start
+        return wrapper
+
+    write = communicator._write
+    read_response = communicator._read_response
+
+    def timed_write(command_type, command_json):
+        start = time.perf_counter()
+        written_at = write(command_type, command_json)
+        if recorder.current is not None:
+            recorder.current['serial_write'].append(written_at - start)
+            recorder.current['commands'].append(command_json)
+        return written_at
+
+    def timed_read_response(command_type, since):
+        response = read_response(command_type, since)
+        if recorder.current is not None:
+            recorder.current['serial_ack'].append(time.perf_counter() - since)
+            recorder.classify(recorder.current['commands'][-1], response)
+        return response
+
+    motion.handle_jog_increment = timed_handle_jog_increment
+    motion.fk.calculate = timed(motion.fk.calculate)
+    motion.ik.calculate_differential = timed(motion.ik.calculate_differential)
+    communicator._write = timed_write
+    communicator._read_response = timed_read_response
+
+
+def summarize(values):
+    if not values:
+        return {'count': 0}
+    ordered = sorted(values)
+
+    def pick(q):
+        return ordered[min(len(ordered) - 1, int(q / 100.0 * len(ordered)))] * 1000
+
+    return {
+        'count': len(ordered),
+        'mean_ms': sum(ordered) / len(ordered) * 1000,
+        'p50_ms': pick(50),
+        'p90_ms': pick(90),
+        'p99_ms': pick(99),
+        'max_ms': ordered[-1] * 1000
+    }
+
+
+async def run_client(url, recorder, messages, joint, interval):
+    """Send jog_increment messages one at a time and wait for each position frame"""
+    async with websockets.connect(url, max_queue=None) as ws:
+        positions = asyncio.Queue()
+
+        async def receive():
+            async for raw in ws:
+                message = json.loads(raw)
+                if message.get('type') == 'position_update':
+                    positions.put_nowait((time.perf_counter(), message['joint_positions'][joint]))
+
+        receiver = asyncio.create_task(receive())
+        _, value = await positions.get()
+        direction = 1
+        try:
+            for _ in range(messages):
+                # Alternate direction so the joint stays well inside its limits
+                direction = -direction
+                sent_at = time.perf_counter()
+                recorder.begin(sent_at)
+                await ws.send(json.dumps({'type': 'jog_increment', 'mode': 'joint', 'joint': joint,
+                                          'increment': 1, 'direction': direction}))
+                expected = value + direction
+                while True:
+                    try:
+                        received_at, value = await asyncio.wait_for(positions.get(), 2.0)
+                    except asyncio.TimeoutError:
+                        break
+                    if abs(value - expected) < 1e-6:
+                        recorder.current['ws_to_position'] = received_at - sent_at
+                        break
+                await asyncio.sleep(interval)
+        finally:
+            receiver.cancel()
+
+
+async def run(args):
+    fake = FakeArduino(args.ack, args.move_time, args.baud_rate).start()
+    communicator = ArduinoCommunicator(port=fake.port)
+    if args.command_delay is not None:
+        communicator.command_delay = args.command_delay
+    if not communicator.connected:
+        sys.exit("Could not open the virtual serial port")
+
+    # Wire the communicator in the way app.py does for real hardware
+    motion.arduino_communicator = communicator
+    motion.SIMULATION_MODE = False
+
+    recorder = StageRecorder()
+    instrument(recorder, communicator)
+
+    config = uvicorn.Config(server_app.app, host='127.0.0.1', port=args.port, log_level='error', lifespan='on')
+    server = uvicorn.Server(config)
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    try:
+        await run_client(f"ws://127.0.0.1:{args.port}/ws", recorder, args.messages, args.joint, args.interval)
+    finally:
+        server.should_exit = True
+        await server_task
+        communicator.disconnect()
+        fake.stop()
+
+    per_stage = {stage: [] for stage in STAGES}
+    serial_commands = []
+    for message in recorder.messages:
+        for stage in ('ws_to_handler', 'handler', 'ws_to_position'):
+            if stage in message:
+                per_stage[stage].append(message[stage])
+        per_stage['kinematics'].append(message['kinematics'])
+        per_stage['serial_write'].extend(message['serial_write'])
+        per_stage['serial_ack'].extend(message['serial_ack'])
+        serial_commands.append(len(message['commands']))
+
+    return {
+        'messages': len(recorder.messages),
+        'ack': args.ack,
+        'command_delay_ms': communicator.command_delay * 1000,
+        'serial_commands_per_message': sum(serial_commands) / len(serial_commands) if serial_commands else 0,
+        'responses': recorder.responses,
+        'stages': {stage: summarize(values) for stage, values in per_stage.items()},
+        'serial_stats': communicator.stats.snapshot()['commands']
+    }
+
+
+def print_report(results):
+    print(f"{results['messages']} jog_increment messages, ack={results['ack']}, "
+          f"COMMAND_DELAY={results['command_delay_ms']:.0f}ms, "
+          f"{results['serial_commands_per_message']:.1f} serial commands per message")
+    print(f"\n{'stage':<16} {'count':>6} {'mean':>9} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}")
+    for stage, summary in results['stages'].items():
+        if not summary['count']:
+            print(f"{stage:<16} {0:>6}")
+            continue
+        print(f"{stage:<16} {summary['count']:>6} " + ' '.join(
+            f"{summary[key]:>7.2f}ms" for key in ('mean_ms', 'p50_ms', 'p90_ms', 'p99_ms', 'max_ms')))
+    print("\nResponse lines read as acknowledgements:")
+    for kind, count in sorted(results['responses'].items()):
+        print(f"  {kind:<10} {count}")
+    for command_type, stats in results['serial_stats'].items():
+        print(f"  host counters for {command_type}: {stats['counters']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark jog_increment latency through a virtual serial device")
+    parser.add_argument('--messages', type=int, default=100, help="Number of jog_increment messages")
+    parser.add_argument('--joint', default='base_rotation', help="Joint to jog")
+    parser.add_argument('--interval', type=float, default=0.05, help="Seconds between messages")
+    parser.add_argument('--ack', choices=['firmware', 'status'], default='firmware',
+                        help="Reply like the current firmware (echo + move_done) or with {\"status\": \"ok\"}")
+    parser.add_argument('--move-time', type=float, default=0.0, help="Simulated seconds per setJointPositions move")
+    parser.add_argument('--baud-rate', type=int, default=115200, help="Simulated UART speed (0 for no wire delay)")
+    parser.add_argument('--command-delay', type=float, default=None, help="Override ARDUINO_CONFIG['COMMAND_DELAY']")
+    parser.add_argument('--port', type=int, default=8765, help="Local port for the in-process server")
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_report(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,537 @@
+"""
+WebSocket fan-out with one bounded send queue and writer task per client.
+
+Publishing is O(1) for the caller: messages are appended to a single pending
+queue and distributed to the per-client queues by a dispatcher task, so a slow
+or dead client can never stall the control loop or the other clients.
+
+Clients receive only the topics they subscribe to (all topics by default),
+optionally with a per-topic rate cap.
+"""
+import asyncio
+import time
+from collections import deque
+
+from config import BROADCAST_CONFIG
+from message_encoding import OutgoingMessage, PositionFrame
+from log import get_logger
+from metrics import Counter, Gauge, HistogramMetric
+
+logger = get_logger(__name__)
+
+websocket_connections = Gauge('pendant_websocket_connections', 'Connected WebSocket clients')
+websocket_evictions = Counter('pendant_websocket_evictions_total', 'WebSocket clients evicted for falling behind or failing')
+websocket_send_latency = HistogramMetric('pendant_websocket_send_seconds', 'Time to send one message to one WebSocket client')
+broadcast_fanout = HistogramMetric('pendant_broadcast_fanout_seconds',
+                                   'Time to queue one published message for all subscribed clients', ['topic'])
+broadcast_messages = Counter('pendant_broadcast_messages_total', 'Messages published to subscribed clients', ['topic'])
+
+# Topic each broadcast message type belongs to; clients subscribe to topics
+MESSAGE_TOPICS = {
+    'position_update': 'position',
+    'program_execution': 'program',
+    'program_state': 'program',
+    'run_queue': 'program',
+    'homing_status': 'homing',
+    'jog_stop': 'jog',
+    'move_done': 'motion',
+    'emergency_stop': 'system'
+}
+TOPICS = ('position', 'program', 'homing', 'jog', 'motion', 'system')
+
+# Topics every client receives regardless of its subscriptions
+ALWAYS_SUBSCRIBED = {'system'}
+
+
+def message_topic(message_type):
+    """Get the topic of a message type; unknown types belong to 'system'"""
+    return MESSAGE_TOPICS.get(message_type, 'system')
+
+
+# Per-topic metric children, looked up once so dispatch does no label handling
+_fanout_latency = {topic: broadcast_fanout.labels(topic) for topic in TOPICS}
+_published = {topic: broadcast_messages.labels(topic) for topic in TOPICS}
+
+
+class ClientConnection:
+    """Send state for a single WebSocket client"""
+    def __init__(self, websocket, max_queue, encoding='json', delta=False, topics=None):
+        self.websocket = websocket
+        self.max_queue = max_queue
+        self.encoding = encoding   # Position frame encoding negotiated at connect time
+        self.delta = delta         # Send position deltas when the previous frame was delivered
+        self.last_position_seq = None
+        self.topics = set(topics if topics is not None else TOPICS) | ALWAYS_SUBSCRIBED
+        self.intervals = {}        # Minimum seconds between messages, keyed by rate-capped topic
+        self.last_sent = {}        # Loop time of the last message sent, keyed by rate-capped topic
+        self.queue = deque()       # Ordered event messages
+        self.latest = {}           # Conflated (topic, message) keyed by message type, newest wins
+        self.wake = asyncio.Event()
+        self.task = None
+        self.closed = False
+        self.connected_at = time.time()
+        self.sent = 0
+        self.superseded = 0        # Conflated frames replaced before they were sent
+
+    def offer(self, message, topic, conflate):
+        """
+        Queue a message for this client
+
+        Args:
+            message: OutgoingMessage to send
+            topic: Topic the message belongs to
+            conflate: If True, replace any unsent message of the same type.
+                Messages on rate-capped topics are always conflated.
+
+        Returns:
+            bool: False if the client has fallen too far behind and should be evicted
+        """
+        if conflate or topic in self.intervals:
+            if message.type in self.latest:
+                self.superseded += 1
+            self.latest[message.type] = (topic, message)
+        else:
+            if len(self.queue) >= self.max_queue:
+                return False
+            self.queue.append(message)
+        self.wake.set()
+        return True
+
+    def next_message(self, now):
+        """
+        Pop the next message that may be sent at loop time `now`, events first
+
+        Returns:
+            OutgoingMessage, or None if nothing is pending or due
+        """
+        if self.queue:
+            return self.queue.popleft()
+        for message_type, (topic, message) in self.latest.items():
+            interval = self.intervals.get(topic)
+            if interval:
+                if now - self.last_sent.get(topic, -interval) < interval:
+                    continue
+                self.last_sent[topic] = now
+            del self.latest[message_type]
+            return message
+        return None
+
+    def next_due(self, now):
+        """Seconds until a held rate-capped message may be sent, or None if none is held"""
+        delays = [
+            self.last_sent.get(topic, now) + self.intervals[topic] - now
+            for topic, _ in self.latest.values()
+            if topic in self.intervals
+        ]
+        return max(0.0, min(delays)) if delays else None
+
+    def subscription(self):
+        """Describe the current subscriptions"""
+        return {
+            'topics': sorted(self.topics),
+            'rates': {topic: 1.0 / interval for topic, interval in self.intervals.items()}
+        }
+
+
+class Broadcaster:
+    """
+    Fans messages out to all registered WebSocket clients.
+
+    Message types listed in `conflate_types` (position updates by default) are
+    state snapshots: a client only ever holds the newest unsent one. All other
+    messages are events and are delivered in order; a client whose event queue
+    fills up, or whose send takes longer than `send_timeout`, is evicted.
+    """
+    def __init__(self, queue_size=None, send_timeout=None, conflate_types=None):
+        self.queue_size = queue_size if queue_size is not None else BROADCAST_CONFIG['QUEUE_SIZE']
+        self.send_timeout = send_timeout if send_timeout is not None else BROADCAST_CONFIG['SEND_TIMEOUT']
+        self.conflate_types = set(conflate_types if conflate_types is not None else BROADCAST_CONFIG['CONFLATE_TYPES'])
+        self.clients = {}
+        self.subscribers = {topic: set() for topic in TOPICS}
+        self.evicted = 0
+        self._position_seq = 0
+        self._last_position_values = None
+        self._pending = deque()
+        self._wake = None
+        self._dispatcher = None
+        self.loop = None             # Event loop the dispatcher runs on
+
+    def _ensure_started(self):
+        """Start the dispatcher task on the running event loop if needed"""
+        if self._dispatcher is None or self._dispatcher.done():
+            self.loop = asyncio.get_running_loop()
+            self._wake = asyncio.Event()
+            self._dispatcher = asyncio.create_task(self._dispatch())
+            if self._pending:
+                self._wake.set()
+
+    async def register(self, websocket, encoding='json', delta=False, topics=None):
+        """
+        Register an accepted WebSocket and start its writer task
+
+        Args:
+            websocket: Accepted WebSocket
+            encoding: Position frame encoding (see message_encoding)
+            delta: Whether the client accepts delta position frames
+            topics: Initial topic subscriptions (all topics if None)
+
+        Returns:
+            ClientConnection: The send state for the new client
+        """
+        self._ensure_started()
+        client = ClientConnection(websocket, self.queue_size, encoding, delta, topics)
+        client.task = asyncio.create_task(self._writer(client))
+        self.clients[websocket] = client
+        for topic in client.topics:
+            self.subscribers[topic].add(client)
+        websocket_connections.inc()
+        return client
+
+    async def unregister(self, websocket):
+        """Stop the writer task for a WebSocket and forget about it"""
+        client = self.clients.pop(websocket, None)
+        if client:
+            client.closed = True
+            self._remove_subscriptions(client)
+            websocket_connections.dec()
+            if client.task and client.task is not asyncio.current_task():
+                client.task.cancel()
+
+    def _remove_subscriptions(self, client):
+        for subscribers in self.subscribers.values():
+            subscribers.discard(client)
+
+    def subscribe(self, websocket, topics, rates=None):
+        """
+        Subscribe a client to topics, optionally capping their message rates
+
+        Args:
+            websocket: Registered WebSocket
+            topics: Topic names to add
+            rates: Optional {topic: max messages per second}; 0 or None removes the cap
+
+        Returns:
+            Dictionary describing the client's subscriptions
+
+        Raises:
+            ValueError: If a topic is unknown or a rate is not a non-negative number;
+                        the subscriptions are then left unchanged
+        """
+        client = self.clients.get(websocket)
+        if client is None:
+            raise ValueError("Connection is not registered")
+
+        rates = rates or {}
+        unknown = [topic for topic in list(topics) + list(rates) if topic not in TOPICS]
+        if unknown:
+            raise ValueError(f"Unknown topic(s): {', '.join(unknown)}. Available topics: {', '.join(TOPICS)}")
+
+        # Validate everything before changing anything, so a rejected request leaves the subscriptions as they were
+        for topic, rate in rates.items():
+            if rate is not None and (isinstance(rate, bool) or not isinstance(rate, (int, float)) or rate < 0):
+                raise ValueError(f"Rate for topic {topic} must be a non-negative number")
+
+        for topic in topics:
+            client.topics.add(topic)
+            self.subscribers[topic].add(client)
+
+        for topic, rate in rates.items():
+            if rate:
+                client.intervals[topic] = 1.0 / rate
+            else:
+                client.intervals.pop(topic, None)
+                client.last_sent.pop(topic, None)
+        return client.subscription()
+
+    def unsubscribe(self, websocket, topics):
+        """
+        Unsubscribe a client from topics ('system' cannot be unsubscribed)
+
+        Returns:
+            Dictionary describing the client's subscriptions
+
+        Raises:
+            ValueError: If a topic is unknown
+        """
+        client = self.clients.get(websocket)
+        if client is None:
+            raise ValueError("Connection is not registered")
+
+        unknown = [topic for topic in topics if topic not in TOPICS]
+        if unknown:
+            raise ValueError(f"Unknown topic(s): {', '.join(unknown)}. Available topics: {', '.join(TOPICS)}")
+
+        for topic in topics:
+            if topic in ALWAYS_SUBSCRIBED:
+                continue
+            client.topics.discard(topic)
+            self.subscribers[topic].discard(client)
+            # Drop anything already held for the topic
+            for message_type in [t for t, (held_topic, _) in client.latest.items() if held_topic == topic]:
+                del client.latest[message_type]
+        return client.subscription()
+
+    def has_subscribers(self, topic):
+        """Check whether any client currently receives a topic"""
+        return bool(self.subscribers.get(topic))
+
+    def publish(self, message):
+        """
+        Publish a message to all clients subscribed to its topic. Constant time and
+        never blocks, so it is safe to call from the control loop. Must be called
+        on the event loop; other threads use publish_threadsafe().
+        """
+        if not self.subscribers[message_topic(message.get('type'))]:
+            return
+        self._pending.append(message)
+        if self._wake is not None:
+            self._wake.set()
+
+    def publish_threadsafe(self, message):
+        """Publish a message from any thread, on the event loop if called from another one"""
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is not None or self.loop is None:
+            # On the loop, or no client has ever connected so there is nobody to publish to
+            self.publish(message)
+        elif not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.publish, message)
+
+    def send_to(self, websocket, message):
+        """
+        Queue a message for a single client through its writer task
+
+        Returns:
+            bool: True if the message was queued
+        """
+        client = self.clients.get(websocket)
+        if client is None or client.closed:
+            return False
+        if message.get('type') == 'position_update':
+            # Outside the broadcast sequence, so never used as a delta base
+            outgoing = PositionFrame(message, 0)
+        else:
+            outgoing = OutgoingMessage(message)
+        if not client.offer(outgoing, message_topic(outgoing.type), outgoing.type in self.conflate_types):
+            self._evict(client, "send queue full")
+            return False
+        return True
+
+    async def _dispatch(self):
+        """Move published messages into each client's send queue"""
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+
+            while self._pending:
+                start = time.perf_counter()
+                try:
+                    message = self._wrap(self._pending.popleft())
+                except Exception as e:
+                    # A malformed message must not stop the dispatcher for everyone else
+                    logger.exception("Dropping a message that could not be encoded: %s", e)
+                    continue
+                topic = message_topic(message.type)
+                conflate = message.type in self.conflate_types
+                for client in list(self.subscribers[topic]):
+                    if client.closed:
+                        continue
+                    if not client.offer(message, topic, conflate):
+                        self._evict(client, "send queue full")
+                _fanout_latency[topic].observe(time.perf_counter() - start)
+                _published[topic].inc()
+
+    def _wrap(self, message):
+        """Wrap a published message so it is serialized once for all clients"""
+        if message.get('type') != 'position_update':
+            return OutgoingMessage(message)
+        self._position_seq += 1
+        frame = PositionFrame(message, self._position_seq, self._last_position_values)
+        self._last_position_values = frame.values
+        return frame
+
+    async def _writer(self, client):
+        """Send queued messages to one client until it closes or falls behind"""
+        loop = asyncio.get_running_loop()
+        try:
+            while not client.closed:
+                client.wake.clear()
+                message = client.next_message(loop.time())
+                if message is None:
+                    # Sleep until something is offered or a rate-capped message becomes due
+                    try:
+                        await asyncio.wait_for(client.wake.wait(), client.next_due(loop.time()))
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                if isinstance(message, PositionFrame):
+                    use_delta = client.delta and client.last_position_seq == message.seq - 1
+                    payload = message.payload(client.encoding, use_delta)
+                    client.last_position_seq = message.seq
+                else:
+                    payload = message.payload()
+
+                if isinstance(payload, bytes):
+                    send = client.websocket.send_bytes(payload)
+                else:
+                    send = client.websocket.send_text(payload)
+                start = time.perf_counter()
+                try:
+                    await asyncio.wait_for(send, self.send_timeout)
+                except asyncio.TimeoutError:
+                    self._evict(client, f"send took longer than {self.send_timeout}s")
+                    return
+                except Exception as e:
+                    self._evict(client, f"send failed: {e}")
+                    return
+                websocket_send_latency.observe(time.perf_counter() - start)
+                client.sent += 1
+        except asyncio.CancelledError:
+            pass
+
+    def _evict(self, client, reason):
+        """Drop a client that failed or fell behind and close its socket"""
+        if client.closed:
+            return
+        client.closed = True
+        self.clients.pop(client.websocket, None)
+        self._remove_subscriptions(client)
+        self.evicted += 1
+        websocket_connections.dec()
+        websocket_evictions.inc()
+
+        logger.info("Evicting WebSocket client: %s. Active connections: %s", reason, len(self.clients))
+
+        asyncio.create_task(self._close(client))
+
+    async def _close(self, client):
+        """Close an evicted client's socket without letting errors escape"""
+        if client.task and client.task is not asyncio.current_task():
+            client.task.cancel()
+        try:
+            await asyncio.wait_for(client.websocket.close(code=1013), self.send_timeout)
+        except Exception:
+            pass
+
+    def stats(self):
+        """
+        Summarize the broadcaster state
+
+        Returns:
+            Dictionary with per-client queue depths and totals
+        """
+        return {
+            'connections': len(self.clients),
+            'evicted': self.evicted,
+            'pending': len(self._pending),
+            'clients': [
+                {
+                    'connected_at': client.connected_at,
+                    'encoding': client.encoding,
+                    'delta': client.delta,
+                    **client.subscription(),
+                    'queued': len(client.queue),
+                    'sent': client.sent,
+                    'superseded': client.superseded
+                }
+                for client in self.clients.values()
+            ]
+        }
+
+
+class PositionPublisher:
+    """
+    Publishes the robot position at a fixed display rate, independent of how
+    often the control loop or serial layer changes it. A frame is only sent when
+    some value moved by more than `deadband` since the last published frame.
+    """
+    def __init__(self, broadcaster, sample, rate=None, deadband=None):
+        """
+        Args:
+            broadcaster: Broadcaster to publish position frames through
+            sample: Callable returning (joint_positions, ee_position) dictionaries
+            rate: Maximum frames per second
+            deadband: Minimum change in any value (degrees or mm) to publish a frame
+        """
+        self.broadcaster = broadcaster
+        self.sample = sample
+        self.rate = rate if rate is not None else BROADCAST_CONFIG['POSITION_RATE']
+        self.deadband = deadband if deadband is not None else BROADCAST_CONFIG['POSITION_DEADBAND']
+        self.published = 0
+        self.skipped = 0
+        self._last = None
+        self._force = False
+        self._task = None
+
+    def start(self):
+        """Start the publishing task on the running event loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the publishing task"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def request_update(self):
+        """Publish on the next tick even if nothing moved beyond the deadband"""
+        self._force = True
+
+    def _changed(self, values):
+        """Check whether any value moved beyond the deadband since the last frame"""
+        if self._last is None:
+            return True
+        deadband = self.deadband
+        last = self._last
+        for key, value in values.items():
+            if abs(value - last.get(key, value)) > deadband:
+                return True
+        return False
+
+    def publish_now(self):
+        """Sample the current state and publish it if it changed or an update was requested"""
+        joint_positions, ee_position = self.sample()
+        values = {**joint_positions, **ee_position}
+        if not self._force and not self._changed(values):
+            self.skipped += 1
+            return False
+
+        self._force = False
+        self._last = values
+        self.broadcaster.publish({
+            "type": "position_update",
+            "timestamp": time.time(),
+            "joint_positions": joint_positions,
+            "ee_position": ee_position
+        })
+        self.published += 1
+        return True
+
+    async def _run(self):
+        """Sample and publish at the configured rate"""
+        loop = asyncio.get_running_loop()
+        period = 1.0 / self.rate
+        next_tick = loop.time()
+        while True:
+            # Nothing to build when nobody is subscribed to positions
+            if self.broadcaster.has_subscribers('position'):
+                try:
+                    self.publish_now()
+                except Exception as e:
+                    logger.warning("Error publishing position update: %s", e)
+
+            next_tick += period
+            delay = next_tick - loop.time()
+            if delay < 0:
+                # Fell behind (e.g. a blocking serial call); skip missed ticks
+                next_tick = loop.time()
+                delay = 0
+            await asyncio.sleep(delay)
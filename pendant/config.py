@@ -12,7 +12,23 @@ ARDUINO_CONFIG = {
     'PORT': '/dev/ttyACM0',  # Default Arduino port on Raspberry Pi
     'BAUD_RATE': 115200,
     'TIMEOUT': 1.0,          # Serial timeout in seconds
-    'COMMAND_DELAY': 0.05    # Delay between commands in seconds
+    'COMMAND_DELAY': 0.05,   # Delay between commands in seconds
+    'STATS_INTERVAL': 60,    # Seconds between serial latency summaries in the log (0 disables)
+    'BACKEND': 'serial'      # 'serial' for the Arduino, 'simulated' for arduino_simulator.SimulatedArduino
+}
+
+# Simulated Arduino, driven in SIMULATION_MODE (or with ARDUINO_CONFIG['BACKEND'] = 'simulated').
+# Stepper settings mirror main/config.h; the firmware drives j1-j4, so j5 and j6 reuse j4's.
+SIMULATED_ARDUINO_CONFIG = {
+    'MICROSTEP_ANGLE': 0.05625,  # Degrees per microstep
+    'SPEED_FAST': [300, 200, 100, 300, 300, 300],  # Microseconds per step at cruise speed
+    'SPEED_SLOW': [500, 500, 500, 500, 500, 500],  # Microseconds per step at the start and end of a move
+    'ACCEL_STEPS': [400, 2000, 2000, 2000, 2000, 2000],  # Steps over which a move ramps between the two
+    'HOMING_SEEK': 1.5,          # Homing approach runs at SPEED_FAST x this
+    'HOMING_FEED': 5,            # Homing slow approach and pull off run at SPEED_FAST x this
+    'HOMING_PULL_OFF': [90, 90, 150, 90, 90, 90],  # Degrees backed off the limit switch
+    'TIME_SCALE': 1.0,           # Simulated seconds per real second (e.g. 10 for faster than real time)
+    'UPDATE_INTERVAL': 0.01      # Seconds between simulated position updates during a move
 }
 
 # Robot physical dimensions in mm
@@ -26,6 +42,10 @@ ROBOT_DIMENSIONS = {
     'END_EFFECTOR_LENGTH': 100  # Length of end effector
 }
 
+# Prismatic joint drive: the motor turns DEGREES_PER_MM per mm of extension
+MM_PER_ROTATION = 8.0
+DEGREES_PER_MM = 360.0 / MM_PER_ROTATION
+
 # Joint limits in degrees (min, max) or mm for prismatic joint
 JOINT_LIMITS = {
     'BASE_ROTATION': (-180, 180),         # Base rotation (degrees)
@@ -121,6 +141,16 @@ ROBOT_CONFIG = {
         'end_effector_rotation': 60
     },
 
+    # Joint accelerations (degrees/second^2 or mm/second^2), used to plan moves and estimate their duration
+    'MAX_ACCELERATIONS': {
+        'base_rotation': 50,
+        'shoulder_rotation': 40,
+        'prismatic_extension': 100,
+        'elbow_rotation': 50,
+        'elbow2_rotation': 80,
+        'end_effector_rotation': 120
+    },
+
     # Workspace limits (mm and degrees)
     'WORKSPACE_LIMITS': {
         'x': (-500, 500),
@@ -134,7 +164,7 @@ ROBOT_CONFIG = {
 
 # Movement parameters
 MOVEMENT_PARAMS = {
-    'MAX_ACCELERATION': 50,      # Maximum acceleration for smooth movements
+    'MAX_ACCELERATION': 50,      # Acceleration for joints without an entry in ROBOT_CONFIG['MAX_ACCELERATIONS']
     'INTERPOLATION_POINTS': 50,  # Number of points for trajectory interpolation
     'MIN_MOVEMENT_TIME': 0.5,    # Minimum time for any movement (seconds)
     'JOG_INCREMENT': {           # Default jog increments
@@ -143,6 +173,99 @@ MOVEMENT_PARAMS = {
     }
 }
 
+# WebSocket broadcast settings
+BROADCAST_CONFIG = {
+    'QUEUE_SIZE': 100,           # Max unsent event messages per client before it is evicted
+    'SEND_TIMEOUT': 2.0,         # Seconds a single send may take before the client is evicted
+    'CONFLATE_TYPES': ['position_update'],  # Snapshot messages where only the newest unsent one is kept
+    'POSITION_RATE': 30,         # Position updates per second sent to clients
+    'POSITION_DEADBAND': 0.01    # Minimum change (degrees or mm) before a new position frame is sent
+}
+
+# Logging settings
+LOGGING_CONFIG = {
+    'LEVEL': 'INFO',             # DEBUG, INFO, WARNING or ERROR (PENDANT_LOG_LEVEL env var overrides)
+    'FORMAT': 'text',            # 'text' for key=value lines, 'json' for one JSON object per line
+    'MODULE_LEVELS': {           # Per-module overrides, e.g. {'kinematics': 'DEBUG'}
+    }
+}
+
+# Metrics settings
+METRICS_CONFIG = {
+    'ENABLED': True,             # Serve Prometheus metrics on /metrics
+    'JOG_OVERRUN_FACTOR': 1.5    # A jog loop period longer than this x UPDATE_INTERVAL counts as an overrun
+}
+
+# On-demand profiling settings (/api/admin/profile)
+PROFILING_CONFIG = {
+    'ENABLED': True,             # Allow profiling sessions to be started over the API
+    'DEFAULT_DURATION': 10,      # Seconds a session runs when no duration is given
+    'MAX_DURATION': 60,          # Upper bound on a session's duration in seconds
+    'SAMPLE_INTERVAL': 0.005,    # Seconds between stack samples in sampling mode
+    'MIN_SAMPLE_INTERVAL': 0.001 # Smallest sample interval a client may request
+}
+
+# Motion session recorder settings (/api/admin/recording)
+RECORDER_CONFIG = {
+    'DIRECTORY': 'data/recordings', # Where recordings are written (relative to the working directory)
+    'FLUSH_INTERVAL': 1.0,       # Seconds between flushes of buffered records to disk
+    'MAX_REPLAY_SPEED': 100.0    # Fastest replay speed multiplier allowed over the API
+}
+
+# Program and saved position storage settings
+STORAGE_CONFIG = {
+    'DATABASE': 'data/pendant.db',  # SQLite database (relative to the working directory)
+    'JSON_DIRECTORY': 'data',    # Where the old programs.json / saved_positions.json are migrated from
+    'WRITE_DEBOUNCE': 0.5,       # Seconds changes are collected before being committed together
+    'RETRY_LIMIT': 5,            # Failed commits of a change before it is dropped
+    'RETRY_MAX_DELAY': 30.0      # Longest wait before retrying a failed commit, in seconds (doubles from WRITE_DEBOUNCE)
+}
+
+# Program compiler settings
+PROGRAM_COMPILER_CONFIG = {
+    'CACHE_SIZE': 128            # Compiled programs kept in memory
+}
+
+# Saved position index settings (nearest / radius / snap queries)
+POSITION_INDEX_CONFIG = {
+    'CELL_SIZE': 25.0,           # Grid cell edge in mm; about the typical query radius works best
+    'SNAP_RADIUS': 10.0,         # Largest end effector distance (mm) a snap moves the robot
+    'MAX_RESULTS': 100           # Most positions one nearest query may return
+}
+
+# Program run queue settings (/api/programs/queue)
+RUN_QUEUE_CONFIG = {
+    'MAX_JOBS': 1000,            # Most jobs waiting in the queue
+    'HISTORY': 50                # Finished jobs kept for the queue listing
+}
+
+# Program dry run settings (/api/programs/dry_run, tools/program_dry_run.py)
+DRY_RUN_CONFIG = {
+    'WORKERS': 0,                # Worker processes simulating programs (0 = one per CPU)
+    'SAMPLE_INTERVAL': 0.01,     # Seconds between simulated robot states when checking a move
+    'MAX_PROGRAMS': 100          # Most programs one API request may simulate
+}
+
+# Program and saved position listing settings
+LISTING_CONFIG = {
+    'PAGE_SIZE': 100,            # Items per page when the request gives no limit
+    'MAX_PAGE_SIZE': 1000        # Largest limit a request may ask for
+}
+
+# Program and saved position import/export settings
+TRANSFER_CONFIG = {
+    'BATCH_SIZE': 200,           # Imported records committed together in one transaction
+    'MAX_RECORD_BYTES': 16 * 1024 * 1024,  # Largest single line of an import
+    'MAX_ERRORS': 100            # Invalid records reported in an import's response
+}
+
+# Waypoint ordering settings (waypoint_order.py)
+WAYPOINT_ORDER_CONFIG = {
+    'MAX_WAYPOINTS': 500,        # Most waypoints ordered in one request
+    'MAX_PASSES': 50,            # Upper bound on 2-opt improvement passes
+    'MIN_GAIN': 1e-9             # Seconds a reversal must save to be applied
+}
+
 # Web server settings
 SERVER_CONFIG = {
     'HOST': '0.0.0.0',           # Listen on all interfaces
@@ -0,0 +1,204 @@
+"""
+Program dry runs.
+
+Runs programs through the compiler and trajectory planner and a simulated
+robot, without moving anything and without waiting: a program's cycle time is
+the sum of its planned move times and wait times. Each move is sampled every
+DRY_RUN_CONFIG['SAMPLE_INTERVAL'] seconds of robot time and the end effector
+checked against the workspace limits, since a straight joint space move
+between two valid poses can still leave the workspace on the way.
+
+The planner already keeps every move within the joint velocity and
+acceleration limits of config.py, so those are only reported as peaks. What
+it does not know about is the stepper drive: a joint cannot turn faster than
+one microstep (SIMULATED_ARDUINO_CONFIG['MICROSTEP_ANGLE'], mirrored from the
+firmware) per SPEED_FAST microseconds, so a planned peak above that rate is a
+violation the robot would not keep up with.
+
+Programs are simulated in a pool of worker processes, so a dry run of many
+programs uses every CPU and never holds up the server's event loop. The pool
+uses the spawn start method: forking the running server would copy its
+threads' locks into the workers.
+
+Result of one dry run:
+
+    {
+        'program_id', 'name',
+        'cycle_time': seconds,
+        'steps': [{'index', 'type', 'start', 'duration', 'error'}],
+        'peak_velocity': {joint: degrees or mm per second},
+        'peak_acceleration': {joint: degrees or mm per second^2},
+        'violations': [{'step', 'type', 'message', ...}],
+        'simulation_time': seconds of CPU time the dry run took
+    }
+"""
+import asyncio
+import concurrent.futures
+import multiprocessing
+import os
+import time
+
+from config import DEGREES_PER_MM, DRY_RUN_CONFIG, ROBOT_CONFIG, SIMULATED_ARDUINO_CONFIG
+import kinematics
+import program_compiler
+import trajectory
+from log import get_logger
+
+logger = get_logger(__name__)
+
+JOINTS = trajectory.JOINTS
+
+# Relative slack before a planned peak counts as over its limit
+_LIMIT_TOLERANCE = 1e-6
+
+_pool = None
+
+
+def step_rate_limits():
+    """
+    Fastest each joint can move at the firmware's step rate
+
+    Returns:
+        Dictionary of joint -> degrees per second (mm per second for the prismatic joint)
+    """
+    limits = {}
+    for joint, fast in zip(JOINTS, SIMULATED_ARDUINO_CONFIG['SPEED_FAST']):
+        rate = SIMULATED_ARDUINO_CONFIG['MICROSTEP_ANGLE'] / (fast * 1e-6)
+        limits[joint] = rate / DEGREES_PER_MM if joint == 'prismatic_extension' else rate
+    return limits
+
+
+def _check_workspace(step, segment, fk, sample_interval):
+    """First sampled point of a move outside the workspace, as a violation, or None"""
+    limits = ROBOT_CONFIG.get('WORKSPACE_LIMITS', {})
+    samples = max(1, int(segment.duration / sample_interval))
+    for sample in range(samples + 1):
+        t = segment.duration * sample / samples
+        ee = fk.calculate(segment.position(t))
+        for axis, (low, high) in limits.items():
+            if axis in ee and not low <= ee[axis] <= high:
+                return {'step': step.index, 'type': 'workspace', 'time': t, 'axis': axis, 'value': ee[axis],
+                        'message': f"End effector {axis} {ee[axis]:.2f} outside {low} to {high} "
+                                   f"{t:.2f}s into step {step.index}"}
+    return None
+
+
+def simulate_program(program, start_joint_positions=None, sample_interval=None):
+    """
+    Dry run one program
+
+    Args:
+        program: Program dictionary
+        start_joint_positions: Where the robot starts, defaults to the home position
+        sample_interval: Seconds between checked robot states, defaults to DRY_RUN_CONFIG['SAMPLE_INTERVAL']
+
+    Returns:
+        Dry run result (see the module docstring)
+    """
+    started = time.process_time()
+    sample_interval = sample_interval or DRY_RUN_CONFIG['SAMPLE_INTERVAL']
+    fk = kinematics.ForwardKinematics()
+    step_rates = step_rate_limits()
+
+    joints = dict(ROBOT_CONFIG['HOME_POSITION'])
+    joints.update(start_joint_positions or {})
+    compiled = program_compiler.compile_program(program)
+    plan = compiled.bind(joints, fk.calculate(joints))
+
+    clock = 0.0
+    steps = []
+    violations = []
+    peak_velocity = {joint: 0.0 for joint in JOINTS}
+    peak_acceleration = {joint: 0.0 for joint in JOINTS}
+    for step in plan:
+        if step.error:
+            violations.append({'step': step.index, 'type': 'invalid_step', 'message': step.error})
+        steps.append({'index': step.index, 'type': step.type, 'start': clock,
+                      'duration': 0.0 if step.error else step.duration, 'error': step.error})
+        if step.error:
+            continue
+        clock += step.duration
+
+        segment = step.segment
+        if segment is None:
+            continue
+        for joint in JOINTS:
+            peak_velocity[joint] = max(peak_velocity[joint], segment.peak_velocity[joint])
+            peak_acceleration[joint] = max(peak_acceleration[joint], segment.peak_acceleration[joint])
+            if segment.peak_velocity[joint] > step_rates[joint] * (1 + _LIMIT_TOLERANCE):
+                violations.append({'step': step.index, 'type': 'step_rate', 'joint': joint,
+                                   'value': segment.peak_velocity[joint], 'limit': step_rates[joint],
+                                   'message': f"{joint} velocity {segment.peak_velocity[joint]:.2f} "
+                                              f"over the stepper limit {step_rates[joint]:.2f}"})
+        violation = _check_workspace(step, segment, fk, sample_interval)
+        if violation:
+            violations.append(violation)
+
+    return {
+        'program_id': program.get('id'),
+        'name': program.get('name'),
+        'cycle_time': clock,
+        'steps': steps,
+        'peak_velocity': peak_velocity,
+        'peak_acceleration': peak_acceleration,
+        'violations': violations,
+        'simulation_time': time.process_time() - started
+    }
+
+
+def _workers(workers=None):
+    return workers or DRY_RUN_CONFIG['WORKERS'] or os.cpu_count() or 1
+
+
+def create_pool(workers=None):
+    """Process pool for dry runs (see the module docstring for the start method)"""
+    return concurrent.futures.ProcessPoolExecutor(max_workers=_workers(workers),
+                                                  mp_context=multiprocessing.get_context('spawn'))
+
+
+def run_dry_runs(programs, start_joint_positions=None, workers=None):
+    """
+    Dry run several programs in parallel, blocking until all are done (for tools)
+
+    Returns:
+        List of dry run results in the order of `programs`
+    """
+    programs = list(programs)
+    if len(programs) <= 1 or _workers(workers) == 1:
+        return [simulate_program(program, start_joint_positions) for program in programs]
+    with create_pool(min(_workers(workers), len(programs))) as pool:
+        futures = [pool.submit(simulate_program, program, start_joint_positions) for program in programs]
+        return [future.result() for future in futures]
+
+
+async def dry_run(programs, start_joint_positions=None):
+    """
+    Dry run several programs in parallel in the shared worker pool
+
+    Returns:
+        List of dry run results in the order of `programs`
+    """
+    global _pool
+
+    if _pool is None:
+        _pool = create_pool()
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    try:
+        results = await asyncio.gather(*(loop.run_in_executor(_pool, simulate_program, program, start_joint_positions)
+                                         for program in programs))
+    except concurrent.futures.process.BrokenProcessPool:
+        # A worker died; start a new pool for the next dry run
+        shutdown_pool()
+        raise
+    logger.info("Dry ran %s programs in %.2fs", len(results), time.perf_counter() - started)
+    return results
+
+
+def shutdown_pool():
+    """Stop the shared worker pool"""
+    global _pool
+
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
@@ -10,6 +10,9 @@ const ProgramEditor = ({ websocket }) => {
   const [selectedPosition, setSelectedPosition] = useState(null);
   const [isExecuting, setIsExecuting] = useState(false);
   const [currentStep, setCurrentStep] = useState(null);
+  // Planned durations reported by the executor, in seconds
+  const [progress, setProgress] = useState(null);
+  const [progressNow, setProgressNow] = useState(Date.now());
   const [newStepType, setNewStepType] = useState('moveJ');
   const [newWaitTime, setNewWaitTime] = useState(1);
   const [editingStep, setEditingStep] = useState(null);
@@ -36,11 +39,19 @@ const ProgramEditor = ({ websocket }) => {
         if (data.type === 'program_execution') {
           if (data.status === 'started') {
             setIsExecuting(true);
-          } else if (data.status === 'completed' || data.status === 'failed') {
+            setProgress({ cycle: data.cycle_estimate, completed: 0, step: 0, stepStartedAt: Date.now() });
+          } else if (data.status === 'completed' || data.status === 'failed' || data.status === 'stopped') {
             setIsExecuting(false);
             setCurrentStep(null);
+            setProgress(null);
           } else if (data.status === 'step_started') {
             setCurrentStep(data.step_index);
+            setProgress({
+              cycle: data.cycle_estimate,
+              completed: data.completed_estimate,
+              step: data.step_estimate,
+              stepStartedAt: Date.now()
+            });
           }
         }
       };
@@ -52,11 +63,37 @@ const ProgramEditor = ({ websocket }) => {
     }
   }, [websocket, backendBaseUrl]);
 
+  // Advance the progress bar between executor messages
+  useEffect(() => {
+    if (!progress) return;
+    const timer = setInterval(() => setProgressNow(Date.now()), 100);
+    return () => clearInterval(timer);
+  }, [progress]);
+
+  const progressFraction = () => {
+    if (!progress || !progress.cycle) return 0;
+    const stepElapsed = Math.min((progressNow - progress.stepStartedAt) / 1000, progress.step);
+    return Math.min(1, (progress.completed + Math.max(0, stepElapsed)) / progress.cycle);
+  };
+
+  // Follow the listing's cursor until every page is loaded; unchanged pages are
+  // revalidated with their ETag and come back from the browser cache
+  const fetchAllPages = async (path, key) => {
+    let items = [];
+    let cursor = null;
+    do {
+      const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : '';
+      const response = await fetch(`${backendBaseUrl}${path}${query}`);
+      const data = await response.json();
+      items = items.concat(data[key] || []);
+      cursor = data.next_cursor;
+    } while (cursor);
+    return items;
+  };
+
   const fetchPrograms = async () => {
     try {
-      const response = await fetch(`${backendBaseUrl}/api/programs/programs`);
-      const data = await response.json();
-      setPrograms(data.programs || []);
+      setPrograms(await fetchAllPages('/api/programs/programs', 'programs'));
     } catch (error) {
       console.error('Error fetching programs:', error);
     }
@@ -64,14 +101,25 @@ const ProgramEditor = ({ websocket }) => {
 
   const fetchSavedPositions = async () => {
     try {
-      const response = await fetch(`${backendBaseUrl}/api/programs/saved_positions`);
-      const data = await response.json();
-      setSavedPositions(data.positions || []);
+      setSavedPositions(await fetchAllPages('/api/programs/saved_positions', 'positions'));
     } catch (error) {
       console.error('Error fetching saved positions:', error);
     }
   };
 
+  // The program list only holds summaries, so load the steps of the selected program
+  const selectProgram = async (programId) => {
+    try {
+      const response = await fetch(`${backendBaseUrl}/api/programs/programs/${programId}`);
+      const data = await response.json();
+      if (data.id) {
+        setSelectedProgram(data);
+      }
+    } catch (error) {
+      console.error('Error loading program:', error);
+    }
+  };
+
   const createNewProgram = async () => {
     if (!programName) return;
 
@@ -374,10 +422,10 @@ const ProgramEditor = ({ websocket }) => {
               <div 
                 key={program.id} 
                 className={`program-item ${selectedProgram && selectedProgram.id === program.id ? 'selected' : ''}`}
-                onClick={() => setSelectedProgram(program)}
+                onClick={() => selectProgram(program.id)}
               >
                 <div className="program-name">{program.name}</div>
-                <div className="program-steps-count">{program.steps ? program.steps.length : 0} steps</div>
+                <div className="program-steps-count">{program.step_count} steps</div>
               </div>
             ))}
           </div>
@@ -429,6 +477,15 @@ const ProgramEditor = ({ websocket }) => {
                 </div>
               </div>
               
+              {progress && (
+                <div className="program-progress">
+                  <div className="program-progress-bar" style={{ width: `${progressFraction() * 100}%` }} />
+                  <span className="program-progress-label">
+                    {Math.round(progressFraction() * 100)}% of {progress.cycle.toFixed(1)}s
+                  </span>
+                </div>
+              )}
+              
               <div className="steps-list">
                 {selectedProgram.steps && selectedProgram.steps.length > 0 ? (
                   selectedProgram.steps.map((step, index) => (
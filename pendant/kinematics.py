@@ -1,9 +1,22 @@
 """
 we can set this file later when tata complete
 """
+import logging
+import time
 import numpy as np
 from math import sin, cos, atan2, sqrt, pi
 from config import ROBOT_DIMENSIONS, JOINT_LIMITS, ROBOT_CONFIG
+from log import get_logger
+from metrics import Counter, HistogramMetric
+from profiling import profile_scope
+
+logger = get_logger(__name__)
+
+fk_latency = HistogramMetric('pendant_fk_seconds', 'Forward kinematics calculation time in seconds')
+ik_latency = HistogramMetric('pendant_ik_seconds', 'Inverse kinematics calculation time in seconds', ['method'])
+ik_failures = Counter('pendant_ik_failures_total', 'Inverse kinematics calls that found no solution', ['method'])
+ik_iterations = HistogramMetric('pendant_ik_iterations', 'Iterations used by differential inverse kinematics',
+                                buckets=[1, 2, 3, 4, 5, 6, 8, 10, 15, 20, 50, 100])
 
 class RobotParameters:
     """Robot physical parameters for the RRPRRR configuration"""
@@ -34,7 +47,7 @@ class RobotParameters:
                 self.joint_limits[lowercase] = JOINT_LIMITS[uppercase]
             else:
                 # Fallback default limits if not found
-                print(f"Warning: Joint limit not found for {uppercase}")
+                logger.warning("Joint limit not found for %s", uppercase)
                 self.joint_limits[lowercase] = (-180, 180)
         
         # Workspace limits
@@ -69,6 +82,8 @@ class ForwardKinematics:
         Returns:
             Dictionary with end effector position (x, y, z, roll, pitch, yaw)
         """
+        start = time.perf_counter()
+        
         # Convert joint angles from degrees to radians
         q1 = np.radians(joint_positions['base_rotation'])
         q2 = np.radians(joint_positions['shoulder_rotation'])
@@ -153,6 +168,7 @@ class ForwardKinematics:
             roll = 0
             yaw = np.arctan2(-rotation_matrix[0, 1], rotation_matrix[1, 1])
         
+        fk_latency.observe(time.perf_counter() - start)
         return {
             'x': float(position[0]),
             'y': float(position[1]),
@@ -229,6 +245,16 @@ class InverseKinematics:
         Returns:
             Dictionary with joint positions or None if no solution found
         """
+        start = time.perf_counter()
+        with profile_scope('ik'):
+            joint_positions = self._solve(target_position)
+        ik_latency.labels('analytic').observe(time.perf_counter() - start)
+        if joint_positions is None:
+            ik_failures.labels('analytic').inc()
+        return joint_positions
+    
+    def _solve(self, target_position):
+        """Closed-form solution for calculate(); returns None if unreachable"""
         # Extract target position and orientation
         x = target_position['x']
         y = target_position['y']
@@ -321,8 +347,22 @@ class InverseKinematics:
         Returns:
             Dictionary with new joint positions or None if no solution found
         """
-        import sys  # For stdout.flush
+        start = time.perf_counter()
+        with profile_scope('ik'):
+            joints, iterations = self._solve_differential(current_joints, target_ee, max_iterations, tolerance)
+        ik_latency.labels('differential').observe(time.perf_counter() - start)
+        ik_iterations.observe(iterations)
+        if joints is None:
+            ik_failures.labels('differential').inc()
+        return joints
+    
+    def _solve_differential(self, current_joints, target_ee, max_iterations, tolerance):
+        """
+        Iterative solver for calculate_differential()
         
+        Returns:
+            Tuple of (joint positions or None, iterations used)
+        """
         # Get the Jacobian calculator
         fk = self.fk
         
@@ -333,9 +373,11 @@ class InverseKinematics:
         joint_names = ['base_rotation', 'shoulder_rotation', 'prismatic_extension', 
                       'elbow_rotation', 'elbow2_rotation', 'end_effector_rotation']
         
-        print(f"Starting differential IK with joint positions: {joints}")
-        print(f"Target end effector position: {target_ee}")
-        sys.stdout.flush()
+        # Per-iteration tracing is guarded so it costs nothing unless DEBUG is enabled
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            logger.debug("Starting differential IK with joint positions: %s", joints)
+            logger.debug("Target end effector position: %s", target_ee)
         
         # Convert joints to numpy array for calculations
         q = np.array([joints[j] for j in joint_names])
@@ -357,14 +399,13 @@ class InverseKinematics:
             
             # Check convergence
             error_magnitude = np.linalg.norm(error)
-            print(f"Iteration {i+1}, error magnitude: {error_magnitude}")
-            sys.stdout.flush()
+            if debug:
+                logger.debug("Iteration %d, error magnitude: %s", i + 1, error_magnitude)
             
             if error_magnitude < tolerance:
-                print(f"Converged after {i+1} iterations")
-                print(f"Final joint positions: {joints}")
-                sys.stdout.flush()
-                return joints
+                if debug:
+                    logger.debug("Converged after %d iterations, final joint positions: %s", i + 1, joints)
+                return joints, i + 1
             
             # Get Jacobian matrix
             J = fk.calculate_jacobian(joints)
@@ -386,16 +427,17 @@ class InverseKinematics:
                 # Apply joint limits
                 limits = self.robot_params.joint_limits[name]
                 if joints[name] < limits[0]:
-                    print(f"Joint {name} hit lower limit: {joints[name]} < {limits[0]}")
+                    if debug:
+                        logger.debug("Joint %s hit lower limit: %s < %s", name, joints[name], limits[0])
                     joints[name] = limits[0]
                 elif joints[name] > limits[1]:
-                    print(f"Joint {name} hit upper limit: {joints[name]} > {limits[1]}")
+                    if debug:
+                        logger.debug("Joint %s hit upper limit: %s > %s", name, joints[name], limits[1])
                     joints[name] = limits[1]
                 
-                print(f"Joint {name}: {old_value} -> {joints[name]}")
-                sys.stdout.flush()
+                if debug:
+                    logger.debug("Joint %s: %s -> %s", name, old_value, joints[name])
         
         # If we reach here, we didn't converge
-        print(f"Failed to converge after {max_iterations} iterations")
-        sys.stdout.flush()
-        return None
+        logger.debug("Failed to converge after %d iterations", max_iterations)
+        return None, max_iterations
@@ -0,0 +1,113 @@
+"""
+Paginated listings of programs and saved positions.
+
+A Listing keeps the summaries of one table sorted by name (case-insensitive,
+then id) and rebuilds them only when the table's version changes, so polling
+an unchanged list costs a lookup instead of serializing every program. Pages
+are read with an opaque cursor holding the sort key of the last entry
+returned, so a page stays correct when entries are added or deleted between
+requests. A name filter matches a case-insensitive substring.
+
+ETags are derived from the StorageWriter's version counter of the table and
+the request's query parameters. A request whose If-None-Match matches gets a
+304 before any summary is built.
+"""
+import base64
+import bisect
+import hashlib
+import json
+import threading
+
+
+def _sort_key(summary):
+    return (summary['name'].lower(), summary['id'])
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Raises:
+        ValueError: If the cursor was not made by encode_cursor
+    """
+    try:
+        name, item_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return (str(name), str(item_id))
+    except (TypeError, ValueError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def make_etag(epoch, version, *params):
+    """Strong ETag for a version of a table and the query parameters of a request"""
+    digest = hashlib.sha1(json.dumps([epoch, version, params]).encode()).hexdigest()[:20]
+    return f'"{digest}"'
+
+
+def etag_matches(if_none_match, etag):
+    """Whether an If-None-Match header value matches an ETag"""
+    if not if_none_match:
+        return False
+    # If-None-Match uses weak comparison, so W/"x" matches "x"
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or etag in [tag[2:] if tag.startswith('W/') else tag for tag in tags]
+
+
+class Listing:
+    """Sorted summaries of one table, rebuilt when the table's version changes"""
+    def __init__(self, summarize):
+        """
+        Args:
+            summarize: Function returning the listed form of an item
+        """
+        self.summarize = summarize
+        self._version = None
+        self._keys = []
+        self._summaries = []
+        self._lock = threading.Lock()
+
+    def _refresh(self, items, version):
+        """
+        The version must be read before `items`, so a change made meanwhile
+        is picked up by the next request rather than cached under its version.
+        """
+        with self._lock:
+            if self._version != version:
+                summaries = sorted((self.summarize(item) for item in list(items.values())), key=_sort_key)
+                self._keys = [_sort_key(summary) for summary in summaries]
+                self._summaries = summaries
+                self._version = version
+            return self._keys, self._summaries
+
+    def page(self, items, version, name=None, cursor=None, limit=100):
+        """
+        One page of the listing
+
+        Args:
+            items: Dictionary of the table's items by id
+            version: Version of `items`
+            name: Only list items whose name contains this
+            cursor: Cursor returned with the previous page
+            limit: Largest number of items returned
+
+        Returns:
+            (list of summaries, cursor of the next page or None)
+
+        Raises:
+            ValueError: If the cursor is invalid
+        """
+        keys, summaries = self._refresh(items, version)
+        start = bisect.bisect_right(keys, decode_cursor(cursor)) if cursor else 0
+        needle = name.lower() if name else None
+
+        page = []
+        for index in range(start, len(summaries)):
+            summary = summaries[index]
+            if needle and needle not in summary['name'].lower():
+                continue
+            if len(page) == limit:
+                return page, encode_cursor(keys[last])
+            page.append(summary)
+            last = index
+        return page, None
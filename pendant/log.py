@@ -0,0 +1,144 @@
+"""
+Structured, queue-based logging for the robotic arm control system.
+
+Log records are handed to a background thread through a queue, so hot paths
+never block on console I/O. Pass message arguments %-style
+(logger.debug("Joint %s -> %s", name, value)) so nothing is formatted unless
+the level is enabled, and attach structured fields with
+extra={'fields': {...}}.
+"""
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+from config import LOGGING_CONFIG
+
+ROOT_LOGGER = 'pendant'
+
+_listener = None
+_handler = None                  # Handler on the root logger: the queue's, or a direct one after shutdown
+_formatter = None
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    Formats records as a text line or a JSON object, including any structured
+    fields passed with extra={'fields': {...}}
+    """
+    def __init__(self, output_format='text'):
+        super().__init__()
+        self.output_format = output_format
+
+    def format(self, record):
+        fields = getattr(record, 'fields', None) or {}
+        timestamp = datetime.datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds')
+        name = record.name[len(ROOT_LOGGER) + 1:] if record.name.startswith(ROOT_LOGGER + '.') else record.name
+
+        if self.output_format == 'json':
+            entry = {
+                'ts': timestamp,
+                'level': record.levelname,
+                'logger': name,
+                'msg': record.getMessage()
+            }
+            entry.update(fields)
+            if record.exc_info:
+                entry['exc'] = self.formatException(record.exc_info)
+            return json.dumps(entry, default=str)
+
+        line = f"{timestamp} {record.levelname:<7} {name}: {record.getMessage()}"
+        if fields:
+            line += ' ' + ' '.join(f"{key}={value}" for key, value in fields.items())
+        if record.exc_info:
+            line += '\n' + self.formatException(record.exc_info)
+        return line
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that only resolves the message arguments in the calling thread
+    (so later mutation of a logged dict cannot change the record) and leaves
+    all formatting and I/O to the listener thread
+    """
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def setup_logging(level=None, output_format=None):
+    """
+    Configure the 'pendant' logger hierarchy with a queue-based background writer.
+    Safe to call more than once; later calls only update the level, or start
+    the background writer again after shutdown_logging().
+
+    Args:
+        level: Root level name (default LOGGING_CONFIG['LEVEL'], overridable with PENDANT_LOG_LEVEL)
+        output_format: 'text' or 'json' (default LOGGING_CONFIG['FORMAT'])
+    """
+    global _listener, _handler, _formatter
+
+    root = logging.getLogger(ROOT_LOGGER)
+    root.setLevel(level or os.environ.get('PENDANT_LOG_LEVEL', LOGGING_CONFIG['LEVEL']))
+    for name, module_level in LOGGING_CONFIG.get('MODULE_LEVELS', {}).items():
+        logging.getLogger(f"{ROOT_LOGGER}.{name}").setLevel(module_level)
+
+    if _listener is not None:
+        return
+
+    if _formatter is None or output_format:
+        _formatter = StructuredFormatter(output_format or LOGGING_CONFIG['FORMAT'])
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(_formatter)
+
+    # Every module logger propagates to the root, so swapping the root's handler
+    # moves loggers created before a shutdown over to the new writer too
+    log_queue = queue.SimpleQueue()
+    if _handler is not None:
+        root.removeHandler(_handler)
+    _handler = _DeferredQueueHandler(log_queue)
+    root.addHandler(_handler)
+    root.propagate = False
+
+    _listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging():
+    """
+    Flush all queued records and stop the background writer. Records logged
+    afterwards are written directly, until setup_logging() starts it again.
+    """
+    global _listener, _handler
+    if _listener is not None:
+        root = logging.getLogger(ROOT_LOGGER)
+        root.removeHandler(_handler)
+        _listener.stop()
+        _listener = None
+        _handler = logging.StreamHandler(sys.stdout)
+        _handler.setFormatter(_formatter)
+        root.addHandler(_handler)
+
+
+def get_logger(name):
+    """
+    Get a logger in the 'pendant' hierarchy, configuring logging on first use
+
+    Args:
+        name: Module name, e.g. 'motion' or __name__
+
+    Returns:
+        logging.Logger
+    """
+    if _handler is None:
+        setup_logging()
+    name = name.rsplit('.', 1)[-1]
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+atexit.register(shutdown_logging)
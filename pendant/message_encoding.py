@@ -0,0 +1,166 @@
+"""
+Wire encodings for outgoing WebSocket messages.
+
+Every outgoing message is wrapped once and serialized lazily, with the payload
+cached per encoding, so a message is encoded at most once per encoding no
+matter how many clients receive it.
+
+Position frames can use a compact encoding negotiated at connect time
+(`/ws?encoding=packed&delta=true`); all other messages are always JSON text:
+    json    - the position_update JSON message (default)
+    packed  - little-endian binary frame of float32 values
+    msgpack - MessagePack map (only if the optional `msgpack` package is installed)
+
+With delta enabled, a client that received the previous frame is sent only the
+values that changed; after a skipped frame it gets a full frame again.
+
+Packed frame layout:
+    header  '<BBId'  kind (1 = full, 2 = delta), version, seq (uint32), timestamp (float64)
+    full    12 x float32 in POSITION_FIELDS order
+    delta   uint16 bitmask of changed fields (bit i = POSITION_FIELDS[i]),
+            followed by one float32 per set bit, in field order
+"""
+import json
+import struct
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JOINT_FIELDS = ('base_rotation', 'shoulder_rotation', 'prismatic_extension',
+                'elbow_rotation', 'elbow2_rotation', 'end_effector_rotation')
+EE_FIELDS = ('x', 'y', 'z', 'roll', 'pitch', 'yaw')
+POSITION_FIELDS = JOINT_FIELDS + EE_FIELDS
+
+PACKED_VERSION = 1
+FRAME_FULL = 1
+FRAME_DELTA = 2
+
+_HEADER = struct.Struct('<BBId')
+_FULL_VALUES = struct.Struct('<%df' % len(POSITION_FIELDS))
+_MASK = struct.Struct('<H')
+
+
+def available_encodings():
+    """List the position encodings supported by this server"""
+    encodings = ['json', 'packed']
+    if msgpack is not None:
+        encodings.append('msgpack')
+    return encodings
+
+
+class OutgoingMessage:
+    """A message to be sent to one or more clients, serialized at most once"""
+    __slots__ = ('message', 'type', '_payload')
+
+    def __init__(self, message):
+        self.message = message
+        self.type = message.get('type')
+        self._payload = None
+
+    def payload(self, encoding='json', delta=False):
+        """Serialized JSON text for the message (events are always JSON)"""
+        if self._payload is None:
+            self._payload = json.dumps(self.message)
+        return self._payload
+
+
+class PositionFrame(OutgoingMessage):
+    """
+    A position_update message with a sequence number, encodable in every
+    supported position encoding and as a delta against the previous frame
+    """
+    __slots__ = ('seq', 'timestamp', 'values', 'changes', '_payloads')
+
+    def __init__(self, message, seq, previous_values=None):
+        """
+        Args:
+            message: position_update message dictionary
+            seq: Frame sequence number (0 for frames sent outside the broadcast stream)
+            previous_values: Values of frame seq - 1, used to compute the delta
+        """
+        super().__init__(message)
+        self.seq = seq
+        self.timestamp = message['timestamp']
+        joints = message['joint_positions']
+        ee = message['ee_position']
+        self.values = tuple([float(joints[f]) for f in JOINT_FIELDS] + [float(ee[f]) for f in EE_FIELDS])
+        if previous_values is None:
+            self.changes = None
+        else:
+            self.changes = [i for i, (new, old) in enumerate(zip(self.values, previous_values)) if new != old]
+        self._payloads = {}
+
+    def payload(self, encoding='json', delta=False):
+        """
+        Serialized frame in the requested encoding
+
+        Args:
+            encoding: 'json', 'packed' or 'msgpack'
+            delta: Encode only the values changed since the previous frame
+
+        Returns:
+            str for JSON, bytes for binary encodings
+        """
+        delta = delta and self.changes is not None
+        key = (encoding, delta)
+        payload = self._payloads.get(key)
+        if payload is None:
+            payload = self._encode(encoding, delta)
+            self._payloads[key] = payload
+        return payload
+
+    def _changes_dict(self):
+        """Changed values keyed by field name"""
+        return {POSITION_FIELDS[i]: self.values[i] for i in self.changes}
+
+    def _encode(self, encoding, delta):
+        if encoding == 'packed':
+            seq = self.seq & 0xFFFFFFFF
+            if not delta:
+                return _HEADER.pack(FRAME_FULL, PACKED_VERSION, seq, self.timestamp) + _FULL_VALUES.pack(*self.values)
+            mask = 0
+            for i in self.changes:
+                mask |= 1 << i
+            values = [self.values[i] for i in self.changes]
+            return (_HEADER.pack(FRAME_DELTA, PACKED_VERSION, seq, self.timestamp) + _MASK.pack(mask)
+                    + struct.pack('<%df' % len(values), *values))
+
+        if delta:
+            message = {
+                'type': 'position_delta',
+                'seq': self.seq,
+                'timestamp': self.timestamp,
+                'changes': self._changes_dict()
+            }
+        else:
+            message = dict(self.message, seq=self.seq)
+
+        if encoding == 'msgpack' and msgpack is not None:
+            return msgpack.packb(message)
+        return json.dumps(message)
+
+
+def decode_packed(payload):
+    """
+    Decode a packed position frame (reference implementation for clients and tools)
+
+    Returns:
+        Dictionary with kind ('full' or 'delta'), seq, timestamp and values keyed by field
+    """
+    kind, version, seq, timestamp = _HEADER.unpack_from(payload)
+    offset = _HEADER.size
+    if kind == FRAME_FULL:
+        values = dict(zip(POSITION_FIELDS, _FULL_VALUES.unpack_from(payload, offset)))
+    else:
+        mask, = _MASK.unpack_from(payload, offset)
+        offset += _MASK.size
+        fields = [field for i, field in enumerate(POSITION_FIELDS) if mask & (1 << i)]
+        values = dict(zip(fields, struct.unpack_from('<%df' % len(fields), payload, offset)))
+    return {
+        'kind': 'full' if kind == FRAME_FULL else 'delta',
+        'seq': seq,
+        'timestamp': timestamp,
+        'values': values
+    }
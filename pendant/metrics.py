@@ -0,0 +1,362 @@
+"""
+Lightweight in-process metrics primitives used to instrument the control stack.
+
+Modules register counters, gauges and histograms in REGISTRY at import time;
+app.py serves them in the Prometheus text format on /metrics.
+"""
+import bisect
+import math
+
+
+def exponential_buckets(start, factor, count):
+    """
+    Build a list of exponentially growing bucket upper bounds
+
+    Args:
+        start: Upper bound of the first bucket
+        factor: Growth factor between consecutive buckets
+        count: Number of buckets
+
+    Returns:
+        List of bucket upper bounds in ascending order
+    """
+    return [start * factor ** i for i in range(count)]
+
+
+# Latency buckets in seconds: 50 us up to ~65 s, each bucket 1.5x the previous
+DEFAULT_LATENCY_BUCKETS = exponential_buckets(0.00005, 1.5, 36)
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram with constant memory and O(log n) observations.
+    Percentiles are estimated from the bucket boundaries, which is accurate
+    to within one bucket width (50% for the default latency buckets).
+    """
+    def __init__(self, buckets=None):
+        self.buckets = list(buckets) if buckets is not None else DEFAULT_LATENCY_BUCKETS
+        # One extra slot for observations above the largest bound
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def observe(self, value):
+        """Record a single observation"""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q):
+        """
+        Estimate a percentile from the bucket counts
+
+        Args:
+            q: Percentile in the range 0-100
+
+        Returns:
+            Estimated value, or None if nothing has been observed
+        """
+        if self.count == 0:
+            return None
+
+        rank = q / 100.0 * self.count
+        cumulative = 0
+        for i, bucket_count in enumerate(self.counts):
+            cumulative += bucket_count
+            if cumulative >= rank and bucket_count:
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                # Never report beyond what was actually observed
+                return max(self.min, min(upper, self.max))
+        return self.max
+
+    def reset(self):
+        """Clear all observations"""
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def snapshot(self):
+        """
+        Summarize the histogram
+
+        Returns:
+            Dictionary with count, mean, min, max and p50/p90/p99 estimates
+        """
+        if self.count == 0:
+            return {'count': 0}
+
+        return {
+            'count': self.count,
+            'mean': self.sum / self.count,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99)
+        }
+
+
+def linear_buckets(start, width, count):
+    """
+    Build a list of evenly spaced bucket upper bounds
+
+    Args:
+        start: Upper bound of the first bucket
+        width: Distance between consecutive bounds
+        count: Number of buckets
+
+    Returns:
+        List of bucket upper bounds in ascending order
+    """
+    return [start + width * i for i in range(count)]
+
+
+def _format_value(value):
+    """Format a sample value for the Prometheus text format"""
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+def _format_labels(labels):
+    """Format a label set as {name="value",...} with Prometheus escaping"""
+    if not labels:
+        return ''
+    pairs = []
+    for name, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class MetricFamily:
+    """
+    A metric and its samples at scrape time. Registered metrics produce one of
+    these on collection; collectors build them directly from existing state.
+    """
+    def __init__(self, name, documentation, metric_type):
+        self.name = name
+        self.documentation = documentation
+        self.type = metric_type
+        self.samples = []
+
+    def add(self, labels, value, suffix=''):
+        """Add a single sample"""
+        self.samples.append((self.name + suffix, labels, value))
+
+    def add_histogram(self, labels, histogram):
+        """Add the cumulative bucket, sum and count samples of a Histogram"""
+        cumulative = 0
+        for bound, bucket_count in zip(histogram.buckets, histogram.counts):
+            cumulative += bucket_count
+            self.add(dict(labels, le='%.6g' % bound), cumulative, '_bucket')
+        self.add(dict(labels, le='+Inf'), histogram.count, '_bucket')
+        self.add(labels, histogram.sum, '_sum')
+        self.add(labels, histogram.count, '_count')
+
+    def render(self):
+        """Render the family in the Prometheus text exposition format"""
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}"
+        ]
+        for name, labels, value in self.samples:
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return '\n'.join(lines)
+
+
+class MetricsRegistry:
+    """Collection of metrics and scrape-time collectors rendered on /metrics"""
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = []
+
+    def register(self, metric):
+        """
+        Add a metric to the registry
+
+        Raises:
+            ValueError: If a metric with the same name is already registered
+        """
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+
+    def register_collector(self, collector):
+        """
+        Add a callable that returns a list of MetricFamily objects at scrape time.
+        Use this for values that already live elsewhere (queue depths, serial
+        statistics) so they cost nothing until they are scraped.
+        """
+        self.collectors.append(collector)
+
+    def collect(self):
+        """Collect every metric family, including those from collectors"""
+        families = []
+        for metric in list(self.metrics.values()):
+            families.extend(metric.collect())
+        for collector in list(self.collectors):
+            families.extend(collector())
+        return families
+
+    def render(self):
+        """
+        Render all metrics in the Prometheus text exposition format (version 0.0.4)
+
+        Returns:
+            Exposition text
+        """
+        return '\n'.join(family.render() for family in self.collect()) + '\n'
+
+
+# Default registry served on /metrics
+REGISTRY = MetricsRegistry()
+
+
+class _Metric:
+    """
+    Base for registered metrics. A metric without label names is used directly
+    (counter.inc()); a labelled metric hands out one child per label set
+    (counter.labels('moveJ').inc()). Children are plain objects with no locking,
+    so updating one costs a couple of attribute operations; hot paths should
+    look a labelled child up once and keep it.
+    """
+    metric_type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+        if not self.labelnames:
+            self.children[()] = self._new_child()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _add_child(self, family, labels, child):
+        family.add(labels, child.value)
+
+    def _default(self):
+        if self.labelnames:
+            raise ValueError(f"Metric {self.name} has labels; use labels() first")
+        return self.children[()]
+
+    def labels(self, *values, **labelvalues):
+        """
+        Get the child for a label set, creating it on first use
+
+        Args:
+            values: Label values in labelnames order, or labelvalues by name
+
+        Raises:
+            ValueError: If the label values do not match the label names
+        """
+        if labelvalues:
+            try:
+                values = tuple(str(labelvalues[name]) for name in self.labelnames)
+            except KeyError as e:
+                raise ValueError(f"Missing label {e} for metric {self.name}")
+        else:
+            values = tuple(str(value) for value in values)
+        child = self.children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"Metric {self.name} expects labels {self.labelnames}, got {values}")
+            child = self._new_child()
+            self.children[values] = child
+        return child
+
+    def collect(self):
+        """Build the metric family for all children"""
+        family = MetricFamily(self.name, self.documentation, self.metric_type)
+        for values, child in list(self.children.items()):
+            self._add_child(family, dict(zip(self.labelnames, values)), child)
+        return [family]
+
+
+class _CounterValue:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        """Increase the counter (amount must not be negative)"""
+        self.value += amount
+
+
+class _GaugeValue(_CounterValue):
+    __slots__ = ()
+
+    def dec(self, amount=1):
+        """Decrease the gauge"""
+        self.value -= amount
+
+    def set(self, value):
+        """Set the gauge to a value"""
+        self.value = value
+
+
+class Counter(_Metric):
+    """Monotonically increasing count of events"""
+    metric_type = 'counter'
+
+    def _new_child(self):
+        return _CounterValue()
+
+    def inc(self, amount=1):
+        """Increase the counter"""
+        self._default().value += amount
+
+
+class Gauge(_Metric):
+    """Value that can go up and down"""
+    metric_type = 'gauge'
+
+    def _new_child(self):
+        return _GaugeValue()
+
+    def inc(self, amount=1):
+        """Increase the gauge"""
+        self._default().value += amount
+
+    def dec(self, amount=1):
+        """Decrease the gauge"""
+        self._default().value -= amount
+
+    def set(self, value):
+        """Set the gauge to a value"""
+        self._default().value = value
+
+
+class HistogramMetric(_Metric):
+    """Distribution of observed values, one Histogram per label set"""
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=None, registry=None):
+        self.buckets = list(buckets) if buckets is not None else DEFAULT_LATENCY_BUCKETS
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return Histogram(self.buckets)
+
+    def _add_child(self, family, labels, child):
+        family.add_histogram(labels, child)
+
+    def observe(self, value):
+        """Record a single observation"""
+        self._default().observe(value)
@@ -0,0 +1,216 @@
+"""
+Spatial index over saved positions.
+
+End effector positions are bucketed in a uniform grid of cubic cells
+(POSITION_INDEX_CONFIG['CELL_SIZE'] mm): radius queries look only at the cells
+overlapping the sphere, and nearest neighbour queries search outwards one
+shell of cells at a time until no unvisited cell can hold anything closer.
+Adding or removing a position touches one cell, so the index is kept up to
+date as positions are saved and deleted instead of being rebuilt.
+
+Joint space queries use the time each joint needs to cover its difference at
+its configured speed, combined as a Euclidean norm, so a degree of a slow
+joint counts for more than a degree of a fast one. They scan a numpy array
+of all joint vectors, which takes well under a millisecond for thousands of
+positions; rows are removed by moving the last row into their place.
+
+Request handlers run both on the event loop and in FastAPI's thread pool, so
+every method holds the index's lock.
+"""
+import heapq
+import math
+import threading
+
+import numpy as np
+
+from config import POSITION_INDEX_CONFIG, ROBOT_CONFIG
+import trajectory
+
+JOINTS = trajectory.JOINTS
+AXES = ('x', 'y', 'z')
+
+
+class PositionIndex:
+    """Grid index over the end effector positions, plus a joint space table"""
+    def __init__(self, cell_size=None):
+        self.cell_size = float(cell_size or POSITION_INDEX_CONFIG['CELL_SIZE'])
+        self._cells = {}             # (i, j, k) -> set of position ids
+        self._points = {}            # id -> (x, y, z)
+        # Joint vectors scaled to seconds at the configured speeds, one row per position
+        self._joint_scale = np.array([1.0 / ROBOT_CONFIG['DEFAULT_SPEEDS'][joint] for joint in JOINTS])
+        self._joints = np.empty((0, len(JOINTS)))
+        self._rows = {}              # id -> row in self._joints
+        self._row_ids = []           # row -> id
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._points)
+
+    def __contains__(self, position_id):
+        return position_id in self._points
+
+    def _cell(self, point):
+        return tuple(int(math.floor(value / self.cell_size)) for value in point)
+
+    def add(self, position):
+        """Add or update a saved position (a dictionary with id, ee_position and joint_positions)"""
+        position_id = position['id']
+        point = tuple(float(position['ee_position'][axis]) for axis in AXES)
+        row = np.array([float(position['joint_positions'][joint]) for joint in JOINTS]) * self._joint_scale
+        with self._lock:
+            if position_id in self._points:
+                self.remove(position_id)
+
+            self._points[position_id] = point
+            self._cells.setdefault(self._cell(point), set()).add(position_id)
+
+            if len(self._row_ids) == len(self._joints):
+                # Grow the table geometrically so adds are amortized constant time
+                grown = np.empty((max(16, 2 * len(self._joints)), len(JOINTS)))
+                grown[:len(self._joints)] = self._joints
+                self._joints = grown
+            self._joints[len(self._row_ids)] = row
+            self._rows[position_id] = len(self._row_ids)
+            self._row_ids.append(position_id)
+
+    def remove(self, position_id):
+        """Remove a saved position; unknown ids are ignored"""
+        with self._lock:
+            point = self._points.pop(position_id, None)
+            if point is None:
+                return
+            cell = self._cell(point)
+            self._cells[cell].discard(position_id)
+            if not self._cells[cell]:
+                del self._cells[cell]
+
+            row = self._rows.pop(position_id)
+            last = len(self._row_ids) - 1
+            if row != last:
+                moved = self._row_ids[last]
+                self._joints[row] = self._joints[last]
+                self._row_ids[row] = moved
+                self._rows[moved] = row
+            self._row_ids.pop()
+
+    def rebuild(self, positions):
+        """Replace the contents with an iterable of saved positions"""
+        with self._lock:
+            self._cells = {}
+            self._points = {}
+            self._joints = np.empty((0, len(JOINTS)))
+            self._rows = {}
+            self._row_ids = []
+            for position in positions:
+                self.add(position)
+
+    def _distance(self, position_id, point):
+        return math.dist(self._points[position_id], point)
+
+    def within(self, ee_position, radius):
+        """
+        Saved positions whose end effector is within `radius` mm
+
+        Returns:
+            List of (distance, position id), closest first
+        """
+        with self._lock:
+            return self._within(ee_position, radius)
+
+    def _within(self, ee_position, radius):
+        point = tuple(float(ee_position[axis]) for axis in AXES)
+        low = self._cell(tuple(value - radius for value in point))
+        high = self._cell(tuple(value + radius for value in point))
+        cells = (high[0] - low[0] + 1) * (high[1] - low[1] + 1) * (high[2] - low[2] + 1)
+        if cells > len(self._cells):
+            # A large radius: checking every occupied cell is cheaper
+            candidates = (position_id for ids in self._cells.values() for position_id in ids)
+        else:
+            candidates = (position_id
+                          for i in range(low[0], high[0] + 1)
+                          for j in range(low[1], high[1] + 1)
+                          for k in range(low[2], high[2] + 1)
+                          for position_id in self._cells.get((i, j, k), ()))
+        found = []
+        for position_id in candidates:
+            distance = self._distance(position_id, point)
+            if distance <= radius:
+                found.append((distance, position_id))
+        found.sort()
+        return found
+
+    def nearest(self, ee_position, count=1):
+        """
+        The `count` saved positions whose end effector is closest
+
+        Returns:
+            List of (distance, position id), closest first
+        """
+        with self._lock:
+            return self._nearest(ee_position, count)
+
+    def _nearest(self, ee_position, count=1):
+        if not self._points or count <= 0:
+            return []
+        point = tuple(float(ee_position[axis]) for axis in AXES)
+        center = self._cell(point)
+        best = []                    # Max-heap of (-distance, id) holding the closest so far
+        seen = 0
+        shell = 0
+        while seen < len(self._points):
+            # Anything in this shell or beyond is at least this far away
+            if len(best) == count and -best[0][0] < (shell - 1) * self.cell_size:
+                break
+            if (2 * shell + 1) ** 3 - (2 * shell - 1) ** 3 > len(self._cells):
+                # Far from everything: visiting the rest of the occupied cells is cheaper
+                cells = [cell for cell in self._cells
+                         if max(abs(cell[axis] - center[axis]) for axis in range(3)) >= shell]
+                seen = len(self._points)
+            else:
+                cells = self._shell(center, shell)
+            for cell in cells:
+                for position_id in self._cells.get(cell, ()):
+                    seen += 1
+                    distance = self._distance(position_id, point)
+                    if len(best) < count:
+                        heapq.heappush(best, (-distance, position_id))
+                    elif distance < -best[0][0]:
+                        heapq.heapreplace(best, (-distance, position_id))
+            shell += 1
+        return sorted((-distance, position_id) for distance, position_id in best)
+
+    def _shell(self, center, shell):
+        """Cells at Chebyshev distance `shell` from the center cell"""
+        if shell == 0:
+            yield center
+            return
+        ci, cj, ck = center
+        for i in range(ci - shell, ci + shell + 1):
+            for j in range(cj - shell, cj + shell + 1):
+                if abs(i - ci) == shell or abs(j - cj) == shell:
+                    for k in range(ck - shell, ck + shell + 1):
+                        yield (i, j, k)
+                else:
+                    yield (i, j, ck - shell)
+                    yield (i, j, ck + shell)
+
+    def nearest_joints(self, joint_positions, count=1):
+        """
+        The `count` saved positions closest in joint space
+
+        Returns:
+            List of (distance in seconds at the configured joint speeds, position id), closest first
+        """
+        with self._lock:
+            return self._nearest_joints(joint_positions, count)
+
+    def _nearest_joints(self, joint_positions, count=1):
+        rows = len(self._row_ids)
+        if not rows or count <= 0:
+            return []
+        query = np.array([float(joint_positions[joint]) for joint in JOINTS]) * self._joint_scale
+        distances = np.sqrt(((self._joints[:rows] - query) ** 2).sum(axis=1))
+        count = min(count, rows)
+        closest = np.argpartition(distances, count - 1)[:count]
+        closest = closest[np.argsort(distances[closest])]
+        return [(float(distances[row]), self._row_ids[row]) for row in closest]
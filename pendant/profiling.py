@@ -0,0 +1,280 @@
+"""
+On-demand profiling of the running server.
+
+A profiling session is time-boxed and scoped to one part of the control stack:
+    jog     - the jog control loop iteration (routers/motion.py)
+    ik      - the inverse kinematics solvers (kinematics.py)
+    program - program execution (routers/programs.py)
+    all     - everything running on the event loop thread
+
+Two modes are available:
+    sampling - a background thread samples the scope's stack every `interval`
+               seconds and aggregates collapsed stacks (flamegraph input)
+    cprofile - cProfile is enabled only while the scope is running and the
+               result is returned as pstats text or a .prof dump
+
+The hooks are `with profile_scope(name):` blocks placed in the code. With no
+session running they only compare one module attribute against None, and a
+stopped session disables cProfile and ends its sampler thread, so nothing is
+left running afterwards. The 'program' scope spans awaits, so other coroutines
+running on the event loop meanwhile are attributed to it as well.
+"""
+import asyncio
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+from config import PROFILING_CONFIG
+from log import get_logger
+
+logger = get_logger(__name__)
+
+SCOPES = ('jog', 'ik', 'program', 'all')
+MODES = ('sampling', 'cprofile')
+
+# Session currently collecting data (None when idle)
+_active = None
+
+# Most recent session, kept so its results can be fetched after it stops
+last_session = None
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class ProfilingSession:
+    """One time-boxed profiling run"""
+    def __init__(self, mode, scope, duration, interval=None):
+        """
+        Args:
+            mode: 'sampling' or 'cprofile'
+            scope: One of SCOPES
+            duration: Seconds before the session stops itself
+            interval: Seconds between stack samples (sampling mode)
+        """
+        self.mode = mode
+        self.scope = scope
+        self.duration = duration
+        self.interval = interval if interval is not None else PROFILING_CONFIG['SAMPLE_INTERVAL']
+        self.started = None
+        self.stopped = None
+        self.samples = 0
+        self.stacks = Counter()
+        self.scope_entries = 0
+        self.profiler = cProfile.Profile() if mode == 'cprofile' else None
+        # Threads currently inside the scope, with their nesting depth
+        self._inside = {}
+        self._stop = threading.Event()
+        self._sampler = None
+
+    @property
+    def running(self):
+        return self.started is not None and self.stopped is None
+
+    def start(self):
+        """Start collecting (must be called from the event loop thread)"""
+        self.started = time.time()
+        if self.scope == 'all':
+            self._inside[threading.get_ident()] = 1
+            if self.profiler:
+                self.profiler.enable()
+        if self.mode == 'sampling':
+            self._sampler = threading.Thread(target=self._sample_loop, name="profiling-sampler", daemon=True)
+            self._sampler.start()
+
+    def stop(self):
+        """Stop collecting; safe to call more than once"""
+        if not self.running:
+            return
+        self.stopped = time.time()
+        self._stop.set()
+        if self.profiler and self._inside:
+            self.profiler.disable()
+        self._inside.clear()
+        if self._sampler and self._sampler is not threading.current_thread():
+            self._sampler.join(timeout=1.0)
+
+    def enter(self):
+        ident = threading.get_ident()
+        depth = self._inside.get(ident, 0)
+        self._inside[ident] = depth + 1
+        if depth == 0:
+            self.scope_entries += 1
+            if self.profiler:
+                self.profiler.enable()
+
+    def exit(self):
+        ident = threading.get_ident()
+        depth = self._inside.get(ident, 0) - 1
+        if depth > 0:
+            self._inside[ident] = depth
+            return
+        self._inside.pop(ident, None)
+        if self.profiler and self.running:
+            self.profiler.disable()
+
+    def _sample_loop(self):
+        """Sample the stacks of threads inside the scope until stopped"""
+        own_ident = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            inside = list(self._inside)
+            if not inside:
+                continue
+            frames = sys._current_frames()
+            for ident in inside:
+                frame = frames.get(ident)
+                if frame is None or ident == own_ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                self.stacks[';'.join(reversed(stack))] += 1
+                self.samples += 1
+
+    def collapsed(self):
+        """
+        Aggregated stacks in the collapsed format used by flamegraph.pl and speedscope
+
+        Returns:
+            One 'frame;frame;... count' line per distinct stack
+        """
+        return '\n'.join(f"{stack} {count}" for stack, count in self.stacks.most_common()) + '\n'
+
+    def pstats_text(self, sort='cumulative', limit=50):
+        """
+        cProfile statistics as text
+
+        Args:
+            sort: pstats sort key ('cumulative', 'tottime', 'calls', ...)
+            limit: Number of functions to list
+        """
+        out = io.StringIO()
+        stats = pstats.Stats(self.profiler, stream=out)
+        stats.sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+    def pstats_dump(self):
+        """cProfile statistics in the binary .prof format (for snakeviz, pstats.Stats, ...)"""
+        self.profiler.create_stats()
+        return marshal.dumps(self.profiler.stats)
+
+    def info(self):
+        """
+        Describe the session
+
+        Returns:
+            Dictionary with mode, scope, timing and collection counts
+        """
+        end = self.stopped if self.stopped is not None else time.time()
+        return {
+            'mode': self.mode,
+            'scope': self.scope,
+            'running': self.running,
+            'started': self.started,
+            'stopped': self.stopped,
+            'duration': self.duration,
+            'elapsed': end - self.started if self.started else 0,
+            'interval': self.interval if self.mode == 'sampling' else None,
+            'scope_entries': self.scope_entries,
+            'samples': self.samples,
+            'distinct_stacks': len(self.stacks)
+        }
+
+
+def start_session(mode='sampling', scope='all', duration=None, interval=None):
+    """
+    Start a profiling session; it stops itself after `duration` seconds when
+    called from a running event loop
+
+    Args:
+        mode: 'sampling' or 'cprofile'
+        scope: One of SCOPES
+        duration: Seconds to profile (capped at PROFILING_CONFIG['MAX_DURATION'])
+        interval: Seconds between samples in sampling mode
+
+    Returns:
+        ProfilingSession
+
+    Raises:
+        ValueError: If the arguments are invalid or a session is already running
+    """
+    global _active, last_session
+
+    if mode not in MODES:
+        raise ValueError(f"Unknown profiling mode {mode}. Available modes: {', '.join(MODES)}")
+    if scope not in SCOPES:
+        raise ValueError(f"Unknown profiling scope {scope}. Available scopes: {', '.join(SCOPES)}")
+    if _active is not None:
+        raise ValueError("A profiling session is already running")
+
+    duration = min(duration or PROFILING_CONFIG['DEFAULT_DURATION'], PROFILING_CONFIG['MAX_DURATION'])
+    if interval is not None and interval < PROFILING_CONFIG['MIN_SAMPLE_INTERVAL']:
+        raise ValueError(f"Sample interval must be at least {PROFILING_CONFIG['MIN_SAMPLE_INTERVAL']}s")
+
+    session = ProfilingSession(mode, scope, duration, interval)
+    session.start()
+    _active = session
+    last_session = session
+
+    try:
+        asyncio.get_running_loop().call_later(duration, stop_session, session)
+    except RuntimeError:
+        pass
+
+    logger.info("Profiling session started", extra={'fields': {'mode': mode, 'scope': scope, 'duration': duration}})
+    return session
+
+
+def stop_session(session=None):
+    """
+    Stop the running session (or `session`, if it is still the running one)
+
+    Returns:
+        The stopped ProfilingSession, or None if nothing was running
+    """
+    global _active
+
+    if _active is None or (session is not None and session is not _active):
+        return None
+    stopped = _active
+    _active = None
+    stopped.stop()
+    logger.info("Profiling session stopped",
+                extra={'fields': {'scope': stopped.scope, 'samples': stopped.samples,
+                                  'scope_entries': stopped.scope_entries}})
+    return stopped
+
+
+class profile_scope:
+    """
+    Context manager marking a block as belonging to a profiling scope, e.g.
+    `with profile_scope('ik'): ...`. Costs one attribute check on entry and
+    exit unless a session for this scope is running.
+    """
+    __slots__ = ('name', 'session')
+
+    def __init__(self, name):
+        self.name = name
+        self.session = None
+
+    def __enter__(self):
+        session = _active
+        if session is not None and session.scope == self.name:
+            self.session = session
+            session.enter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.session is not None:
+            self.session.exit()
+            self.session = None
+        return False
@@ -0,0 +1,302 @@
+"""
+Program compiler.
+
+Turns a stored program into an executable form: joint targets for every move
+step (moveL targets are solved with IK once), joint limit and workspace checks,
+a planned trajectory segment per move (trajectory.py) and estimated step
+durations. Compiled programs are cached keyed by the hash of the program's
+steps and the robot model version, so editing a program or changing the robot
+model in config.py invalidates them, and executing an unchanged program does
+no planning work.
+
+Only the moves before the robot's pose is fully determined by the program
+depend on where the robot actually is (the first move's segment, and moveL
+targets that inherit the current orientation). These steps are marked
+start_dependent and are planned again by CompiledProgram.bind() or
+plan_step() when the program is executed; everything after them is reused as
+compiled, unless the robot was moved away from the planned path (e.g.
+jogged while a program was paused).
+"""
+import collections
+import hashlib
+import json
+import threading
+import time
+
+from config import JOINT_LIMITS, MOVEMENT_PARAMS, PROGRAM_COMPILER_CONFIG, ROBOT_CONFIG, ROBOT_DIMENSIONS
+import kinematics
+import trajectory
+from log import get_logger
+from metrics import Counter, HistogramMetric
+
+logger = get_logger(__name__)
+
+compile_latency = HistogramMetric('pendant_program_compile_seconds', 'Program compilation time in seconds')
+compile_cache = Counter('pendant_program_compile_cache_total', 'Compiled program cache lookups by result', ['result'])
+
+# Bump when the compiled form or the planning changes, to invalidate cached programs
+COMPILER_VERSION = 2
+
+JOINTS = trajectory.JOINTS
+POSITION_AXES = ('x', 'y', 'z')
+ORIENTATION_AXES = ('roll', 'pitch', 'yaw')
+
+# Joint positions closer than this are treated as the same start pose
+START_TOLERANCE = 1e-6
+
+_fk = kinematics.ForwardKinematics()
+_ik = kinematics.InverseKinematics()
+
+# (content hash, model version) -> CompiledProgram, least recently used first
+_cache = collections.OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def content_hash(program):
+    """Hash of the parts of a program that affect execution (its steps)"""
+    canonical = json.dumps(program.get('steps', []), sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def model_version():
+    """Hash of the robot model and motion limits the compiled form depends on"""
+    model = {
+        'compiler': COMPILER_VERSION,
+        'dimensions': ROBOT_DIMENSIONS,
+        'joint_limits': JOINT_LIMITS,
+        'workspace_limits': ROBOT_CONFIG.get('WORKSPACE_LIMITS', {}),
+        'motion_limits': trajectory.joint_limits(),
+        'min_movement_time': MOVEMENT_PARAMS.get('MIN_MOVEMENT_TIME', 0.0)
+    }
+    canonical = json.dumps(model, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode()).hexdigest()[:16]
+
+
+class CompiledStep:
+    """One program step in executable form"""
+    def __init__(self, index, step_type, data):
+        self.index = index
+        self.type = step_type
+        self.data = data
+        self.joint_target = None     # Joint positions at the end of a move
+        self.ee_target = None        # End effector pose at the end of a move
+        self.segment = None          # trajectory.Segment from the previous move's target
+        self.duration = 0.0          # Estimated seconds (move time or wait time)
+        self.error = None            # Why the step cannot be executed
+        self.start_dependent = False # Needs the robot's actual pose to plan
+        self.start_joints = None     # Joint positions the move was planned from
+
+    def to_dict(self, include_segment=False):
+        result = {
+            'index': self.index,
+            'type': self.type,
+            'joint_target': self.joint_target,
+            'ee_target': self.ee_target,
+            'duration': self.duration,
+            'error': self.error,
+            'start_dependent': self.start_dependent
+        }
+        if include_segment:
+            result['segment'] = self.segment.to_dict() if self.segment else None
+        return result
+
+
+class CompiledProgram:
+    """A program's steps compiled for execution"""
+    def __init__(self, content_hash, model_version, steps, compile_time):
+        self.content_hash = content_hash
+        self.model_version = model_version
+        self.steps = steps
+        self.compile_time = compile_time
+
+    @property
+    def errors(self):
+        return [{'index': step.index, 'type': step.type, 'error': step.error} for step in self.steps if step.error]
+
+    @property
+    def estimated_duration(self):
+        """Sum of the known step durations (start dependent moves are only known after bind)"""
+        return sum(step.duration for step in self.steps if not step.error)
+
+    def plan_step(self, position, joint_positions, ee_position):
+        """
+        Plan one step to start from the given pose
+
+        Args:
+            position: Index of the step in self.steps
+            joint_positions: Joint positions the step starts from
+            ee_position: End effector pose the step starts from
+
+        Returns:
+            (CompiledStep, (joint positions, end effector pose) after the step);
+            the cached step when it was compiled from the same start pose
+        """
+        step = self.steps[position]
+        if step.type in ('moveJ', 'moveL'):
+            planned_from = step.start_joints
+            if step.start_dependent or planned_from is None or any(
+                    abs(planned_from[joint] - joint_positions[joint]) > START_TOLERANCE for joint in JOINTS):
+                return _compile_step(step.index, step.type, step.data, (dict(joint_positions), dict(ee_position)))
+            if not step.error:
+                return step, (step.joint_target, step.ee_target)
+        return step, (joint_positions, ee_position)
+
+    def bind(self, joint_positions, ee_position):
+        """
+        Plan the start dependent steps from the robot's actual pose
+
+        Args:
+            joint_positions: Current joint positions
+            ee_position: Current end effector pose
+
+        Returns:
+            List of CompiledStep, one per program step; steps that did not
+            depend on the start pose are the cached ones
+        """
+        state = (dict(joint_positions), dict(ee_position))
+        bound = []
+        for position in range(len(self.steps)):
+            step, state = self.plan_step(position, *state)
+            bound.append(step)
+        return bound
+
+    def to_dict(self, include_segments=False):
+        return {
+            'content_hash': self.content_hash,
+            'model_version': self.model_version,
+            'compile_time': self.compile_time,
+            'estimated_duration': self.estimated_duration,
+            'start_dependent_steps': sum(1 for step in self.steps if step.start_dependent),
+            'errors': self.errors,
+            'steps': [step.to_dict(include_segments) for step in self.steps]
+        }
+
+
+def _check_joint_limits(joint_positions):
+    """Same rule as motion.check_joint_limits; returns an error message or None"""
+    limits = _fk.robot_params.joint_limits
+    for joint, position in joint_positions.items():
+        if joint in limits:
+            low, high = limits[joint]
+            if position < low or position > high:
+                return f"Joint {joint} position {position} exceeds limits ({low}, {high})"
+    return None
+
+
+def _compile_step(index, step_type, data, state):
+    """
+    Compile one step
+
+    Args:
+        state: (joint positions, end effector pose) before the step; either
+               may be None when it depends on the robot's start pose
+
+    Returns:
+        (CompiledStep, state after the step)
+    """
+    step = CompiledStep(index, step_type, data)
+    joints, ee = state
+    step.start_joints = dict(joints) if joints is not None else None
+
+    if step_type == 'moveJ':
+        target = data.get('joint_positions', {})
+        missing = [joint for joint in JOINTS if joint not in target]
+        if missing:
+            step.error = f"Missing joint {missing[0]} in moveJ step"
+            return step, state
+        joint_target = {joint: float(target[joint]) for joint in JOINTS}
+        step.error = _check_joint_limits(joint_target)
+        if step.error:
+            return step, state
+        step.joint_target = joint_target
+        step.ee_target = _fk.calculate(joint_target)
+
+    elif step_type == 'moveL':
+        position = data.get('position', {})
+        missing = [axis for axis in POSITION_AXES if axis not in position]
+        if missing:
+            step.error = f"Missing coordinate {missing[0]} in moveL step"
+            return step, state
+        if ee is None and not all(axis in position for axis in ORIENTATION_AXES):
+            # The orientation is inherited from wherever the robot is
+            step.start_dependent = True
+            return step, (None, None)
+        full_target = dict(ee) if ee is not None else {}
+        full_target.update({axis: float(value) for axis, value in position.items()})
+
+        for axis, (low, high) in ROBOT_CONFIG.get('WORKSPACE_LIMITS', {}).items():
+            if axis in full_target and (full_target[axis] < low or full_target[axis] > high):
+                step.error = f"Target exceeds workspace limits for {axis}: {full_target[axis]} not in {low} to {high}"
+                return step, state
+        joint_target = _ik.calculate(full_target)
+        if not joint_target:
+            step.error = "No IK solution for the target position"
+            return step, state
+        step.error = _check_joint_limits(joint_target)
+        if step.error:
+            return step, state
+        step.joint_target = {joint: float(joint_target[joint]) for joint in JOINTS}
+        step.ee_target = full_target
+
+    elif step_type == 'wait':
+        step.duration = float(data.get('time', 1))
+        return step, state
+
+    elif step_type == 'io':
+        return step, state
+
+    else:
+        step.error = f"Unknown step type {step_type}"
+        return step, state
+
+    if joints is None:
+        step.start_dependent = True
+    else:
+        step.segment = trajectory.plan_move(joints, step.joint_target, data.get('velocity', 50))
+        step.duration = step.segment.duration
+    return step, (step.joint_target, step.ee_target)
+
+
+def compile_program(program):
+    """
+    Compile a program without using the cache
+
+    Returns:
+        CompiledProgram
+    """
+    start = time.perf_counter()
+    state = (None, None)
+    steps = []
+    for index, step in enumerate(program.get('steps', []), 1):
+        compiled, state = _compile_step(index, step.get('type'), step.get('data', {}), state)
+        steps.append(compiled)
+    elapsed = time.perf_counter() - start
+    compile_latency.observe(elapsed)
+    return CompiledProgram(content_hash(program), model_version(), steps, elapsed)
+
+
+def get_compiled(program):
+    """
+    Compiled form of a program, from the cache when its steps and the robot
+    model are unchanged
+
+    Returns:
+        CompiledProgram
+    """
+    key = (content_hash(program), model_version())
+    with _cache_lock:
+        compiled = _cache.get(key)
+        if compiled is not None:
+            _cache.move_to_end(key)
+            compile_cache.labels('hit').inc()
+            return compiled
+
+    compile_cache.labels('miss').inc()
+    compiled = compile_program(program)
+    with _cache_lock:
+        _cache[key] = compiled
+        while len(_cache) > PROGRAM_COMPILER_CONFIG['CACHE_SIZE']:
+            _cache.popitem(last=False)
+    if compiled.errors:
+        logger.info("Program %s compiled with %s invalid steps", program.get('id'), len(compiled.errors))
+    return compiled
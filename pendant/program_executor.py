@@ -0,0 +1,417 @@
+"""
+Program executor.
+
+Runs one program at a time as an explicit state machine:
+
+    idle -> running <-> paused          start / pause / resume / step
+    running, paused -> stopping -> idle stop
+    running, paused -> faulted -> idle  step failure or emergency stop / reset
+
+Controls take effect at a step boundary, except that a wait step can be
+paused or stopped part way through (a paused wait keeps its remaining time).
+Moves are not interrupted: the Arduino has no way to pause a move, so pause
+and stop wait for the current move to finish. Only an emergency stop ends a
+move early.
+
+While a move is in progress the next step is already planned from the move's
+target (CompiledProgram.plan_step), so the next command is sent as soon as the
+move completes. If the robot is somewhere else by then (e.g. it was jogged
+while the program was paused) the prepared step is planned again from where
+the robot actually is.
+
+Every transition is published as a program_state message; the existing
+program_execution messages report the progress of the run. Progress is
+measured against the planned step durations (trajectory.estimate_duration),
+which are also how long a move takes when there is no Arduino backend to
+report move_done (motion.controller()).
+"""
+import asyncio
+import time
+
+import program_compiler
+from log import get_logger
+from metrics import Counter, HistogramMetric, exponential_buckets
+from profiling import profile_scope
+import routers.motion as motion
+
+logger = get_logger(__name__)
+
+program_step_duration = HistogramMetric('pendant_program_step_seconds', 'Program step execution time in seconds',
+                                        ['step_type', 'result'], buckets=exponential_buckets(0.01, 2, 14))
+program_runs = Counter('pendant_program_runs_total', 'Program executions by result', ['result'])
+program_prefetch = Counter('pendant_program_prefetch_total',
+                           'Steps started from the plan prepared during the previous step, or planned again', ['result'])
+
+IDLE = 'idle'
+RUNNING = 'running'
+PAUSED = 'paused'
+STOPPING = 'stopping'
+FAULTED = 'faulted'
+STATES = (IDLE, RUNNING, PAUSED, STOPPING, FAULTED)
+
+# Seconds to wait for the Arduino to report a move as done
+MOVE_TIMEOUT = 60.0
+
+
+class ProgramExecutor:
+    """Executes programs one at a time; all methods must be called on the event loop"""
+    def __init__(self):
+        self.state = IDLE
+        self.program_id = None
+        self.program_name = None
+        self.step_index = 0          # 1-based index of the current (or next) step
+        self.step_count = 0
+        self.step_type = None
+        self.error = None
+        self.single_step = False     # Pause again after the current step
+        self.started = None
+        # Planned durations: the whole program, the steps done and the current step
+        self.cycle_estimate = 0.0
+        self.completed_estimate = 0.0
+        self.step_estimate = 0.0
+        self.step_started_at = None
+        self.last_result = None      # 'completed', 'stopped' or 'failed' once a run has ended
+        self.listeners = []          # Called with the status on every state change
+        self._task = None
+        # Set on every control, wakes interruptible waits and a paused run
+        self._interrupt = None
+        # Set by the Arduino's move_done, or by a fault to abandon a move
+        self._move_done = None
+
+    def open(self):
+        """Create the executor's events on the running event loop (called at startup)"""
+        self._interrupt = asyncio.Event()
+        self._move_done = asyncio.Event()
+
+    def status(self):
+        return {
+            'state': self.state,
+            'program_id': self.program_id,
+            'program_name': self.program_name,
+            'step_index': self.step_index,
+            'step_count': self.step_count,
+            'step_type': self.step_type,
+            'single_step': self.single_step,
+            'error': self.error,
+            'started': self.started,
+            'cycle_estimate': self.cycle_estimate,
+            'completed_estimate': self.completed_estimate,
+            'step_estimate': self.step_estimate,
+            'step_started_at': self.step_started_at
+        }
+
+    def _set_state(self, state, error=None):
+        logger.info("Program executor %s -> %s", self.state, state,
+                    extra={'fields': {'program_id': self.program_id, 'step': self.step_index}})
+        self.state = state
+        if error is not None:
+            self.error = error
+        if self._interrupt is not None:
+            self._interrupt.set()
+        status = self.status()
+        motion.broadcaster.publish({"type": "program_state", **status, "timestamp": time.time()})
+        for listener in self.listeners:
+            listener(status)
+
+    def _publish(self, status, **fields):
+        motion.broadcaster.publish({
+            "type": "program_execution",
+            "status": status,
+            "program_id": self.program_id,
+            **fields,
+            "timestamp": time.time()
+        })
+
+    def _require(self, action, *states):
+        if self.state not in states:
+            raise ValueError(f"Cannot {action} while {self.state}")
+
+    def start(self, program, paused=False):
+        """
+        Start executing a program
+
+        Args:
+            program: Program dictionary
+            paused: Stop before the first step, so the program can be single-stepped
+
+        Returns:
+            Executor status
+
+        Raises:
+            ValueError: If a program is already running, or the executor is faulted
+            RuntimeError: If the executor was not opened
+        """
+        self._require('start a program', IDLE)
+        if self._interrupt is None:
+            raise RuntimeError("Program executor is not open")
+        compiled = program_compiler.get_compiled(program)
+
+        self.program_id = program['id']
+        self.program_name = program['name']
+        self.step_index = 0
+        self.step_count = len(program.get('steps', []))
+        self.step_type = None
+        self.error = None
+        self.single_step = False
+        self.started = time.time()
+        self.last_result = None
+        plan = compiled.bind(motion.current_joint_positions, motion.current_ee_position)
+        self.cycle_estimate = sum(step.duration for step in plan if not step.error)
+        self.completed_estimate = 0.0
+        self.step_estimate = 0.0
+        self.step_started_at = None
+        self._set_state(PAUSED if paused else RUNNING)
+        self._task = asyncio.create_task(self._run(program, compiled))
+        return self.status()
+
+    def pause(self):
+        """Pause at the next step boundary (or part way through a wait step)"""
+        self._require('pause', RUNNING)
+        self.single_step = False
+        self._set_state(PAUSED)
+        self._publish("paused", step_index=self.step_index)
+        return self.status()
+
+    def resume(self):
+        self._require('resume', PAUSED)
+        self.single_step = False
+        self._set_state(RUNNING)
+        self._publish("resumed", step_index=self.step_index)
+        return self.status()
+
+    def step(self):
+        """Run the next step (or the rest of the current one) and pause again"""
+        self._require('step', PAUSED)
+        self.single_step = True
+        self._set_state(RUNNING)
+        return self.status()
+
+    def stop(self):
+        """End the program after the current move"""
+        self._require('stop', RUNNING, PAUSED)
+        self._set_state(STOPPING)
+        return self.status()
+
+    def fault(self, error):
+        """End the program immediately, leaving the executor faulted until reset"""
+        if self.state in (RUNNING, PAUSED, STOPPING):
+            logger.warning("Program %s faulted: %s", self.program_id, error)
+            self._set_state(FAULTED, error)
+            if self._move_done is not None:
+                self._move_done.set()
+
+    def reset(self):
+        """Clear a fault"""
+        self._require('reset', FAULTED)
+        self._set_state(IDLE)
+        return self.status()
+
+    async def handle_emergency_stop(self):
+        self.fault("Emergency stop")
+
+    async def handle_move_done(self):
+        if self._move_done is not None:
+            self._move_done.set()
+
+    async def wait(self):
+        """Wait until the current run has ended"""
+        if self._task is not None:
+            await asyncio.shield(self._task)
+
+    def cancel(self):
+        """Abandon the current run (used on shutdown)"""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+
+    async def _hold(self):
+        """
+        Wait while paused
+
+        Returns:
+            bool: True to carry on, False if the run was stopped or faulted
+        """
+        while self.state == PAUSED:
+            self._interrupt.clear()
+            await self._interrupt.wait()
+        return self.state == RUNNING
+
+    async def _sleep(self, seconds):
+        """
+        Sleep, waking early on a control
+
+        Returns:
+            Seconds of the sleep left when it was interrupted (0 if it was not)
+        """
+        if self.state == RUNNING:
+            # Anything set so far was handled by the transition to running
+            self._interrupt.clear()
+        deadline = time.monotonic() + seconds
+        try:
+            await asyncio.wait_for(self._interrupt.wait(), seconds)
+        except asyncio.TimeoutError:
+            return 0.0
+        return max(0.0, deadline - time.monotonic())
+
+    async def _run(self, program, compiled):
+        result = 'failed'
+        try:
+            with profile_scope('program'):
+                result = await self._execute(program, compiled)
+        except asyncio.CancelledError:
+            result = 'stopped'
+            raise
+        except Exception as e:
+            logger.exception("Error executing program %s: %s", self.program_id, e)
+            self.fault(f"Internal error: {e}")
+        finally:
+            self.last_result = result
+            program_runs.labels(result).inc()
+            if self.state == FAULTED:
+                self._publish("failed", failed_step=self.step_index, error=self.error)
+            elif result == 'stopped':
+                self._publish("stopped", step_index=self.step_index)
+                self._set_state(IDLE)
+            elif result == 'completed':
+                self._publish("completed")
+                self._set_state(IDLE)
+
+    async def _execute(self, program, compiled):
+        """
+        Returns:
+            'completed', 'stopped' or 'failed' (the executor is then faulted)
+        """
+        logger.info("Executing program: %s", program['name'])
+        self._publish("started", cycle_estimate=self.cycle_estimate)
+
+        prepared = None
+        for position, step in enumerate(program['steps']):
+            if self.single_step and self.step_index > 0:
+                self.single_step = False
+                self._set_state(PAUSED)
+                self._publish("paused", step_index=self.step_index)
+            if not await self._hold():
+                return 'stopped' if self.state == STOPPING else 'failed'
+
+            self.step_index = position + 1
+            self.step_type = step['type']
+            compiled_step = self._ready_step(compiled, position, prepared)
+
+            step_start = time.perf_counter()
+            self.step_estimate = 0.0 if compiled_step.error else compiled_step.duration
+            self.step_started_at = time.time()
+            self._publish("step_started", step_index=self.step_index, step_type=self.step_type,
+                          step_estimate=self.step_estimate, completed_estimate=self.completed_estimate,
+                          cycle_estimate=self.cycle_estimate)
+
+            success, prepared = await self._execute_step(compiled, position, step, compiled_step)
+
+            if success is None:
+                return 'stopped'
+
+            program_step_duration.labels(self.step_type, 'ok' if success else 'failed').observe(time.perf_counter() - step_start)
+            if success:
+                self.completed_estimate += self.step_estimate
+            self._publish("step_completed" if success else "step_failed",
+                          step_index=self.step_index, step_type=self.step_type)
+            if not success:
+                logger.warning("Program execution stopped due to failure in step %s: %s", self.step_index, self.step_type)
+                self.fault(self.error or f"Step {self.step_index} ({self.step_type}) failed")
+                return 'failed'
+
+        logger.info("Program %s executed successfully", self.program_id)
+        return 'completed'
+
+    def _ready_step(self, compiled, position, prepared):
+        """The step planned during the previous step, if it still starts from where the robot is"""
+        if prepared is not None:
+            start = prepared.start_joints
+            if start is None or all(abs(start[joint] - motion.current_joint_positions[joint]) <= program_compiler.START_TOLERANCE
+                                    for joint in program_compiler.JOINTS):
+                program_prefetch.labels('hit').inc()
+                return prepared
+        program_prefetch.labels('replanned').inc()
+        step, _ = compiled.plan_step(position, dict(motion.current_joint_positions), dict(motion.current_ee_position))
+        return step
+
+    def _prepare_next(self, compiled, position, state):
+        """Plan the step after `position` to start from `state`"""
+        if position + 1 >= len(compiled.steps):
+            return None
+        step, _ = compiled.plan_step(position + 1, *state)
+        return step
+
+    async def _execute_step(self, compiled, position, step, compiled_step):
+        """
+        Returns:
+            (True if the step succeeded, False if it failed, None if the run was
+            stopped part way through it; the next step planned in the meantime)
+        """
+        step_type = step['type']
+        step_data = step['data']
+        current_state = (dict(motion.current_joint_positions), dict(motion.current_ee_position))
+
+        if step_type in ("moveJ", "moveL"):
+            if compiled_step.error:
+                logger.warning("Step %s cannot be executed: %s", self.step_index, compiled_step.error)
+                self.error = f"Step {self.step_index}: {compiled_step.error}"
+                return False, None
+
+            hardware = motion.controller() is not None
+            self._move_done.clear()
+            if hardware:
+                motion.register_move_complete_callback(self.handle_move_done)
+            try:
+                # moveL targets were already solved with IK by the compiler
+                success = await motion.handle_planned_move(step_type, step_data, compiled_step.joint_target,
+                                                           compiled_step.ee_target if step_type == "moveL" else None)
+                if not success:
+                    return False, None
+
+                # Plan the next step while the robot moves
+                prepared = self._prepare_next(compiled, position, (compiled_step.joint_target, compiled_step.ee_target))
+
+                if hardware:
+                    logger.info("Waiting for Arduino to complete the move for step %s", self.step_index)
+                    try:
+                        await asyncio.wait_for(self._move_done.wait(), MOVE_TIMEOUT)
+                    except asyncio.TimeoutError:
+                        logger.warning("Timeout waiting for Arduino to complete move for step %s", self.step_index)
+                        self.error = f"Step {self.step_index}: timeout waiting for the move to complete"
+                        return False, None
+                else:
+                    # The move takes as long as its planned trajectory
+                    logger.info("No Arduino backend: Waiting %.2f seconds for simulated move completion", compiled_step.duration)
+                    try:
+                        await asyncio.wait_for(self._move_done.wait(), compiled_step.duration)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                motion.unregister_move_complete_callback(self.handle_move_done)
+
+            # Without a backend only a fault sets the event; otherwise it is the move_done
+            return self.state != FAULTED, prepared
+
+        prepared = self._prepare_next(compiled, position, current_state)
+
+        if step_type == "wait":
+            remaining = float(step_data.get("time", 1))
+            logger.info("Waiting for %s seconds", remaining)
+            while remaining > 0:
+                remaining = await self._sleep(remaining)
+                if remaining > 0 and not await self._hold():
+                    return (None if self.state == STOPPING else False), None
+            return True, prepared
+
+        if step_type == "io":
+            # Handle I/O operations (placeholder for future implementation)
+            logger.info("IO operation: %s on pin %s with value %s",
+                        step_data.get("action", ""), step_data.get("pin", 0), step_data.get("value", 0))
+            # TODO: Implement actual I/O operations with Arduino
+            return True, prepared
+
+        self.error = f"Step {self.step_index}: unknown step type {step_type}"
+        return False, None
+
+
+executor = ProgramExecutor()
+motion.register_emergency_stop_callback(executor.handle_emergency_stop)
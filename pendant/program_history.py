@@ -0,0 +1,111 @@
+"""
+Content addressed program revisions.
+
+Every saved version of a program is kept as a revision. A revision does not
+copy the program's steps: the steps are split into chunks, each chunk is
+stored once under the hash of its contents, and the revision lists the
+hashes of its chunks. Chunk boundaries are chosen by the content of the steps
+(after a step whose hash ends in CHUNK_BOUNDARY_BITS zero bits), not by
+position, so inserting or deleting a step changes only the chunk around it
+and every other chunk is shared with the previous revision. Storage therefore
+grows with the size of the edits, not with program size times revisions, and
+rolling back to a revision only saves a new revision of existing chunks.
+
+This module holds the chunking and diffing; storage.ProgramStore stores the
+chunks and revisions.
+"""
+import difflib
+import hashlib
+import json
+
+# A chunk ends after a step whose hash has this many low zero bits (about 8 steps on average)
+CHUNK_BOUNDARY_BITS = 3
+# Longest chunk, so a run of steps without a boundary still splits
+MAX_CHUNK_STEPS = 64
+
+_BOUNDARY_MASK = (1 << CHUNK_BOUNDARY_BITS) - 1
+
+
+def canonical(value):
+    return json.dumps(value, sort_keys=True, separators=(',', ':'))
+
+
+def step_hash(step):
+    return hashlib.sha256(canonical(step).encode()).hexdigest()
+
+
+def chunk_steps(steps):
+    """
+    Split steps into content defined chunks
+
+    Returns:
+        List of (chunk hash, chunk as JSON text, number of steps in the chunk)
+    """
+    chunks = []
+    current = []
+    for step in steps:
+        current.append(step)
+        if int(step_hash(step)[-8:], 16) & _BOUNDARY_MASK == 0 or len(current) >= MAX_CHUNK_STEPS:
+            chunks.append(current)
+            current = []
+    if current:
+        chunks.append(current)
+
+    result = []
+    for chunk in chunks:
+        text = canonical(chunk)
+        result.append((hashlib.sha256(text.encode()).hexdigest(), text, len(chunk)))
+    return result
+
+
+def revision_hash(name, description, chunk_hashes):
+    """Identity of a revision's contents, used to skip saving an unchanged program again"""
+    return hashlib.sha256(canonical([name, description, chunk_hashes]).encode()).hexdigest()
+
+
+def diff_steps(old_steps, new_steps):
+    """
+    Differences between two step lists
+
+    Returns:
+        List of {'op': 'insert' | 'delete' | 'replace', 'old_start', 'old_end',
+        'new_start', 'new_end', 'old_steps', 'new_steps'} with 0-based,
+        end-exclusive indices; unchanged runs are left out
+    """
+    matcher = difflib.SequenceMatcher(None, [step_hash(step) for step in old_steps],
+                                      [step_hash(step) for step in new_steps], autojunk=False)
+    changes = []
+    for op, old_start, old_end, new_start, new_end in matcher.get_opcodes():
+        if op == 'equal':
+            continue
+        changes.append({
+            'op': op,
+            'old_start': old_start,
+            'old_end': old_end,
+            'new_start': new_start,
+            'new_end': new_end,
+            'old_steps': old_steps[old_start:old_end],
+            'new_steps': new_steps[new_start:new_end]
+        })
+    return changes
+
+
+def diff_revisions(old, new):
+    """
+    Differences between two revisions (dictionaries with name, description and steps)
+
+    Returns:
+        Dictionary with the changed fields, the step changes and a summary
+    """
+    changes = diff_steps(old['steps'], new['steps'])
+    fields = {field: {'old': old[field], 'new': new[field]}
+              for field in ('name', 'description') if old[field] != new[field]}
+    return {
+        'fields': fields,
+        'steps': changes,
+        'summary': {
+            'inserted': sum(change['new_end'] - change['new_start'] for change in changes if change['op'] == 'insert'),
+            'deleted': sum(change['old_end'] - change['old_start'] for change in changes if change['op'] == 'delete'),
+            'replaced': sum(change['new_end'] - change['new_start'] for change in changes if change['op'] == 'replace')
+        }
+    }
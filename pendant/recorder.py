@@ -0,0 +1,540 @@
+"""
+Motion session recorder.
+
+A recording is an append-only binary file of fixed-size records that captures
+what the controller was told to do and what it did:
+    command   - motion commands as they reach the handlers in routers/motion.py
+                (from the WebSocket, the REST API or a running program)
+    state     - the commanded joint and end effector positions after each change
+    serial_tx - lines written to the Arduino
+    serial_rx - lines read back, with the latency since the write
+
+The file starts with a HEADER_SIZE byte header followed by RECORD_DTYPE
+records, so it can be read without parsing, e.g.
+    np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=HEADER_SIZE)
+(read_recording does this and drops a partially written last record).
+
+Record fields:
+    t          seconds since the recording started (monotonic clock)
+    seq        record number, so gaps show lost writes
+    kind       KIND_COMMAND, KIND_STATE, KIND_SERIAL_TX or KIND_SERIAL_RX
+    code       command (COMMANDS) or serial command type (SERIAL_COMMANDS), 1-based, 0 if unknown
+    target     jogged joint (index in JOINTS) or axis (6 + index in EE_AXES), -1 if none
+    direction  jog direction
+    value      jog velocity/increment, move velocity or serial response latency
+    joints     joint positions in JOINTS order (moveJ target for commands, NaN if absent)
+    ee         end effector pose in EE_AXES order (moveL target for commands, NaN if absent)
+    payload    serial line, truncated to PAYLOAD_SIZE bytes
+
+replay() feeds the command records back through the motion handlers in
+simulation, at real or accelerated speed, and reports how far the replayed
+state drifts from the recorded one and how long each handler took, so a
+recording of a real session can be reused as a benchmark workload.
+"""
+import asyncio
+import datetime
+import math
+import os
+import re
+import struct
+import threading
+import time
+
+import numpy as np
+
+from config import RECORDER_CONFIG
+from log import get_logger
+
+logger = get_logger(__name__)
+
+FORMAT_VERSION = 1
+MAGIC = b'PNDTREC\x00'
+
+JOINTS = ('base_rotation', 'shoulder_rotation', 'prismatic_extension',
+          'elbow_rotation', 'elbow2_rotation', 'end_effector_rotation')
+EE_AXES = ('x', 'y', 'z', 'roll', 'pitch', 'yaw')
+
+KIND_COMMAND = 1
+KIND_STATE = 2
+KIND_SERIAL_TX = 3
+KIND_SERIAL_RX = 4
+KIND_NAMES = {KIND_COMMAND: 'command', KIND_STATE: 'state', KIND_SERIAL_TX: 'serial_tx', KIND_SERIAL_RX: 'serial_rx'}
+
+COMMANDS = ('jog_start', 'jog_stop', 'jog_velocity', 'jog_increment', 'moveJ', 'moveL', 'emergency_stop', 'home')
+SERIAL_COMMANDS = ('setJointPositions', 'moveJoint', 'home', 'estop', 'getPosition')
+
+PAYLOAD_SIZE = 60
+
+RECORD = struct.Struct(f'<dIBBbbf6f6f{PAYLOAD_SIZE}s')
+RECORD_DTYPE = np.dtype([
+    ('t', '<f8'),
+    ('seq', '<u4'),
+    ('kind', 'u1'),
+    ('code', 'u1'),
+    ('target', 'i1'),
+    ('direction', 'i1'),
+    ('value', '<f4'),
+    ('joints', '<f4', (6,)),
+    ('ee', '<f4', (6,)),
+    ('payload', f'S{PAYLOAD_SIZE}')
+])
+
+# magic, format version, record size, wall clock start time; padded to HEADER_SIZE
+HEADER = struct.Struct('<8sHHd')
+HEADER_SIZE = 128
+
+_NAN6 = (math.nan,) * 6
+_COMMAND_CODES = {name: code for code, name in enumerate(COMMANDS, 1)}
+_SERIAL_CODES = {name: code for code, name in enumerate(SERIAL_COMMANDS, 1)}
+_NAME_PATTERN = re.compile(r'^[A-Za-z0-9_.-]+$')
+
+# Recording currently being written (None when idle)
+_active = None
+
+# Most recent recording, kept so its summary can be fetched after it stops
+last_recording = None
+
+# Whether a replay is running
+_replaying = False
+
+
+def _joint_values(positions):
+    return tuple(float(positions.get(joint, math.nan)) for joint in JOINTS)
+
+
+def _ee_values(pose):
+    return tuple(float(pose.get(axis, math.nan)) for axis in EE_AXES)
+
+
+def _target_index(data):
+    if data.get('mode', 'joint') == 'cartesian':
+        axis = data.get('axis')
+        return 6 + EE_AXES.index(axis) if axis in EE_AXES else -1
+    joint = data.get('joint')
+    return JOINTS.index(joint) if joint in JOINTS else -1
+
+
+def _direction(data):
+    direction = data.get('direction', 0)
+    return max(-1, min(1, int(direction))) if direction else 0
+
+
+class Recording:
+    """One recording file being written"""
+    def __init__(self, name, path, flush_interval=None):
+        self.name = name
+        self.path = path
+        self.flush_interval = flush_interval if flush_interval is not None else RECORDER_CONFIG['FLUSH_INTERVAL']
+        self.started = None
+        self.stopped = None
+        self.records = 0
+        self.counts = {kind: 0 for kind in KIND_NAMES.values()}
+        self._file = None
+        self._origin = 0.0
+        self._last_flush = 0.0
+        # Serial traffic may come from another thread than the event loop
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._file is not None
+
+    def open(self):
+        """Create the file and write the header; never overwrites an existing recording"""
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._file = open(self.path, 'xb')
+        self.started = time.time()
+        self._file.write(HEADER.pack(MAGIC, FORMAT_VERSION, RECORD.size, self.started).ljust(HEADER_SIZE, b'\0'))
+        self._origin = self._last_flush = time.perf_counter()
+
+    def close(self):
+        """Flush and close the file; safe to call more than once"""
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.close()
+            self._file = None
+            self.stopped = time.time()
+
+    def write(self, kind, code=0, target=-1, direction=0, value=0.0, joints=_NAN6, ee=_NAN6, payload=b''):
+        """Append one record (buffered, flushed every flush_interval seconds)"""
+        now = time.perf_counter()
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(RECORD.pack(now - self._origin, self.records, kind, code, target, direction,
+                                         value, *joints, *ee, payload))
+            self.records += 1
+            self.counts[KIND_NAMES[kind]] += 1
+            if now - self._last_flush >= self.flush_interval:
+                self._file.flush()
+                self._last_flush = now
+
+    def info(self):
+        """
+        Describe the recording
+
+        Returns:
+            Dictionary with name, path, timing and record counts
+        """
+        end = self.stopped if self.stopped is not None else time.time()
+        return {
+            'name': self.name,
+            'path': self.path,
+            'running': self.running,
+            'started': self.started,
+            'stopped': self.stopped,
+            'elapsed': end - self.started if self.started else 0,
+            'records': self.records,
+            'counts': dict(self.counts)
+        }
+
+
+def recording_path(name):
+    """
+    Path of the recording called `name` in RECORDER_CONFIG['DIRECTORY']
+
+    Raises:
+        ValueError: If the name contains anything but letters, digits, '_', '-' and '.'
+    """
+    if not _NAME_PATTERN.match(name) or name.startswith('.'):
+        raise ValueError(f"Invalid recording name {name}")
+    return os.path.join(RECORDER_CONFIG['DIRECTORY'], name + '.rec')
+
+
+def start_recording(name=None, joint_positions=None, ee_position=None):
+    """
+    Start a recording, optionally with an initial state record so a replay
+    can start from the same position
+
+    Args:
+        name: Recording name (defaults to the current date and time)
+        joint_positions: Current joint positions
+        ee_position: Current end effector pose
+
+    Returns:
+        Recording
+
+    Raises:
+        ValueError: If a recording or replay is running, or the name is invalid or already used
+    """
+    global _active, last_recording
+
+    if _active is not None:
+        raise ValueError("A recording is already running")
+    if _replaying:
+        # It would record the replayed commands as if they were new
+        raise ValueError("Cannot record while a replay is running")
+
+    name = name or datetime.datetime.now().strftime('session-%Y%m%d-%H%M%S')
+    path = recording_path(name)
+    recording = Recording(name, path)
+    try:
+        recording.open()
+    except FileExistsError:
+        raise ValueError(f"Recording {name} already exists")
+
+    _active = recording
+    last_recording = recording
+    if joint_positions is not None:
+        record_state(joint_positions, ee_position or {})
+
+    logger.info("Recording started", extra={'fields': {'name': name, 'path': path}})
+    return recording
+
+
+def stop_recording():
+    """
+    Stop the running recording
+
+    Returns:
+        The stopped Recording, or None if nothing was recording
+    """
+    global _active
+
+    if _active is None:
+        return None
+    stopped = _active
+    _active = None
+    stopped.close()
+    logger.info("Recording stopped", extra={'fields': {'name': stopped.name, 'records': stopped.records}})
+    return stopped
+
+
+def record_command(command, data=None):
+    """Record a motion command as received by its handler"""
+    recording = _active
+    if recording is None:
+        return
+    data = data or {}
+    code = _COMMAND_CODES.get(command, 0)
+    if command in ('jog_start', 'jog_increment'):
+        value = data.get('velocity', 50) if command == 'jog_start' else data.get('increment', 5)
+        recording.write(KIND_COMMAND, code, _target_index(data), _direction(data), float(value))
+    elif command == 'jog_velocity':
+        recording.write(KIND_COMMAND, code, value=float(data.get('velocity', 50)))
+    elif command == 'moveJ':
+        recording.write(KIND_COMMAND, code, value=float(data.get('velocity', 50)),
+                        joints=_joint_values(data.get('joint_positions', {})))
+    elif command == 'moveL':
+        recording.write(KIND_COMMAND, code, value=float(data.get('velocity', 50)),
+                        ee=_ee_values(data.get('position', {})))
+    else:
+        recording.write(KIND_COMMAND, code)
+
+
+def record_state(joint_positions, ee_position):
+    """Record the commanded joint positions and end effector pose"""
+    recording = _active
+    if recording is not None:
+        recording.write(KIND_STATE, joints=_joint_values(joint_positions), ee=_ee_values(ee_position))
+
+
+def record_serial(kind, command_type, line, latency=0.0):
+    """
+    Record a line written to (KIND_SERIAL_TX) or read from (KIND_SERIAL_RX) the Arduino
+
+    Args:
+        command_type: Serial command the line belongs to ('setJointPositions', ...)
+        line: Line as sent or received
+        latency: Seconds since the command was written (responses)
+    """
+    recording = _active
+    if recording is not None:
+        recording.write(kind, _SERIAL_CODES.get(command_type, 0), value=latency,
+                        payload=line.strip().encode('utf-8', 'replace'))
+
+
+def read_recording(path):
+    """
+    Map a recording file into memory
+
+    Returns:
+        (header, records): header dictionary and a read-only RECORD_DTYPE array
+
+    Raises:
+        ValueError: If the file is not a recording in a supported format
+    """
+    with open(path, 'rb') as f:
+        raw = f.read(HEADER_SIZE)
+    if len(raw) < HEADER_SIZE:
+        raise ValueError(f"{path} is not a recording")
+    magic, version, record_size, started = HEADER.unpack_from(raw)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a recording")
+    if version != FORMAT_VERSION or record_size != RECORD_DTYPE.itemsize:
+        raise ValueError(f"Unsupported recording format version {version} (record size {record_size})")
+
+    # A crash can leave a partial record at the end; it is ignored
+    count = (os.path.getsize(path) - HEADER_SIZE) // record_size
+    if count:
+        records = np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=HEADER_SIZE, shape=(count,))
+    else:
+        records = np.zeros(0, dtype=RECORD_DTYPE)
+    header = {'path': path, 'version': version, 'started': started, 'records': count,
+              'duration': float(records['t'][-1]) if count else 0.0}
+    return header, records
+
+
+def list_recordings():
+    """
+    List the recordings in RECORDER_CONFIG['DIRECTORY']
+
+    Returns:
+        List of dictionaries with name, size, record count, start time and duration
+    """
+    directory = RECORDER_CONFIG['DIRECTORY']
+    if not os.path.isdir(directory):
+        return []
+    recordings = []
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith('.rec'):
+            continue
+        path = os.path.join(directory, filename)
+        try:
+            header, _ = read_recording(path)
+        except (OSError, ValueError) as e:
+            logger.warning("Skipping unreadable recording %s: %s", path, e)
+            continue
+        recordings.append({'name': filename[:-len('.rec')], 'size': os.path.getsize(path),
+                           'records': header['records'], 'started': header['started'],
+                           'duration': header['duration']})
+    return recordings
+
+
+def decode_command(record):
+    """
+    Rebuild the handler arguments of a command record
+
+    Returns:
+        (command, data) with data in the form the motion handlers take
+    """
+    code = int(record['code'])
+    command = COMMANDS[code - 1] if 0 < code <= len(COMMANDS) else 'unknown'
+    data = {}
+    target = int(record['target'])
+    if command in ('jog_start', 'jog_increment'):
+        if target >= 6:
+            data['mode'] = 'cartesian'
+            data['axis'] = EE_AXES[target - 6]
+        else:
+            data['mode'] = 'joint'
+            data['joint'] = JOINTS[target] if target >= 0 else None
+        data['direction'] = int(record['direction'])
+        data['velocity' if command == 'jog_start' else 'increment'] = float(record['value'])
+    elif command == 'jog_velocity':
+        data['velocity'] = float(record['value'])
+    elif command == 'moveJ':
+        data['joint_positions'] = {joint: float(value) for joint, value in zip(JOINTS, record['joints'])
+                                   if not math.isnan(value)}
+        data['velocity'] = float(record['value'])
+    elif command == 'moveL':
+        data['position'] = {axis: float(value) for axis, value in zip(EE_AXES, record['ee'])
+                            if not math.isnan(value)}
+        data['velocity'] = float(record['value'])
+    return command, data
+
+
+def _state_after(records, commands, index):
+    """The first state record after command `index` and before the next command, or None"""
+    start = commands[index] + 1
+    end = commands[index + 1] if index + 1 < len(commands) else len(records)
+    for position in range(start, end):
+        if records[position]['kind'] == KIND_STATE:
+            return records[position]
+    return None
+
+
+async def replay(path, speed=1.0):
+    """
+    Feed the commands of a recording back through the motion handlers
+
+    Runs only in simulation: nothing is sent to the Arduino. The jog loop's
+    clock and the simulated homing time are scaled by `speed` while the replay
+    runs, so accelerated jogging covers the same distance as the recorded one,
+    to within one loop period (UPDATE_INTERVAL x speed of jog time) per jog,
+    and a home takes as long relative to the other commands as it did when
+    recorded. A replay cannot run while recording, as it would record the
+    replayed commands again. After each moveJ, moveL and
+    jog_increment the motion state is compared with the state recorded after
+    the original command.
+
+    Args:
+        path: Recording file
+        speed: Replay speed multiplier (1.0 = real time)
+
+    Returns:
+        Dictionary with replay timing, per-command handler latency and state divergence
+
+    Raises:
+        ValueError: If not in simulation mode, a replay or recording is running or the file is invalid
+    """
+    global _replaying
+
+    from routers import motion
+
+    if speed <= 0:
+        raise ValueError("Replay speed must be positive")
+    arduino = motion.controller()
+    if arduino is not None and not arduino.simulated:
+        raise ValueError("Recordings can only be replayed in simulation mode")
+    if _replaying:
+        raise ValueError("A replay is already running")
+    if _active is not None:
+        raise ValueError("Cannot replay while a recording is running")
+
+    header, records = read_recording(path)
+    commands = np.flatnonzero(records['kind'] == KIND_COMMAND)
+    states = np.flatnonzero(records['kind'] == KIND_STATE)
+
+    handlers = {
+        'jog_start': motion.handle_jog_start,
+        'jog_velocity': motion.handle_jog_velocity,
+        'jog_increment': motion.handle_jog_increment,
+        'moveJ': motion.handle_moveJ,
+        'moveL': motion.handle_moveL
+    }
+    no_argument_handlers = {
+        'jog_stop': motion.handle_jog_stop,
+        'emergency_stop': motion.handle_emergency_stop,
+        'home': motion.handle_home
+    }
+
+    _replaying = True
+    wall_clock = motion.jog_clock
+    origin = wall_clock()
+    motion.jog_clock = lambda: origin + (wall_clock() - origin) * speed
+    motion.simulation_speed = speed
+
+    latencies = {}
+    divergence = []
+    skipped = 0
+    started = time.perf_counter()
+    try:
+        if len(states) and (not len(commands) or states[0] < commands[0]):
+            # Start from the recorded initial position
+            initial = records[states[0]]
+            motion.current_joint_positions.update(
+                {joint: float(value) for joint, value in zip(JOINTS, initial['joints'])})
+            motion.current_ee_position = motion.fk.calculate(motion.current_joint_positions)
+
+        first_t = float(records['t'][commands[0]]) if len(commands) else 0.0
+        for index, position in enumerate(commands):
+            record = records[position]
+            delay = (float(record['t']) - first_t) / speed - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            command, data = decode_command(record)
+            call_start = time.perf_counter()
+            if command in handlers:
+                await handlers[command](data)
+                if command == 'jog_start' and motion.jog_state['active']:
+                    motion.start_jog_loop()
+            elif command in no_argument_handlers:
+                await no_argument_handlers[command]()
+            else:
+                skipped += 1
+                continue
+            latencies.setdefault(command, []).append(time.perf_counter() - call_start)
+
+            if command in ('moveJ', 'moveL', 'jog_increment'):
+                expected = _state_after(records, commands, index)
+                if expected is not None:
+                    actual = np.array(_joint_values(motion.current_joint_positions), dtype=np.float32)
+                    divergence.append(float(np.max(np.abs(actual - expected['joints']))))
+
+        await motion.handle_jog_stop()
+        if motion.jog_task is not None:
+            await motion.jog_task
+    finally:
+        motion.jog_clock = wall_clock
+        motion.simulation_speed = 1.0
+        _replaying = False
+
+    final_divergence = None
+    if len(states):
+        final = np.array(_joint_values(motion.current_joint_positions), dtype=np.float32)
+        final_divergence = float(np.max(np.abs(final - records[states[-1]]['joints'])))
+
+    elapsed = time.perf_counter() - started
+    result = {
+        'path': path,
+        'speed': speed,
+        'recorded_duration': header['duration'],
+        'elapsed': elapsed,
+        'commands': int(len(commands)) - skipped,
+        'skipped': skipped,
+        'handlers': {
+            command: {'count': len(values),
+                      'mean_ms': sum(values) / len(values) * 1000,
+                      'max_ms': max(values) * 1000}
+            for command, values in latencies.items()
+        },
+        'checked_states': len(divergence),
+        'max_divergence': max(divergence) if divergence else 0.0,
+        'final_divergence': final_divergence
+    }
+    logger.info("Replay finished", extra={'fields': {'path': path, 'speed': speed, 'commands': result['commands'],
+                                                     'max_divergence': result['max_divergence']}})
+    return result
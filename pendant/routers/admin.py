@@ -0,0 +1,140 @@
+from fastapi import APIRouter
+from fastapi.responses import FileResponse, PlainTextResponse, Response
+from pydantic import BaseModel
+from typing import Optional
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import PROFILING_CONFIG, RECORDER_CONFIG
+import profiling
+import recorder
+
+router = APIRouter(tags=["admin"])
+
+import routers.motion as motion
+
+class ProfileRequest(BaseModel):
+    mode: str = 'sampling'       # 'sampling' or 'cprofile'
+    scope: str = 'all'           # 'jog', 'ik', 'program' or 'all'
+    duration: Optional[float] = None
+    interval: Optional[float] = None
+
+class RecordingRequest(BaseModel):
+    name: Optional[str] = None   # Defaults to session-<date>-<time>
+
+class ReplayRequest(BaseModel):
+    speed: float = 1.0           # Replay speed multiplier (1.0 = real time)
+
+@router.post("/profile")
+async def api_start_profile(request: ProfileRequest):
+    """Start a time-boxed profiling session on the running server"""
+    if not PROFILING_CONFIG['ENABLED']:
+        return {"success": False, "error": "Profiling is disabled"}
+
+    try:
+        session = profiling.start_session(request.mode, request.scope, request.duration, request.interval)
+    except ValueError as e:
+        return {"success": False, "error": str(e)}
+
+    return {"success": True, "session": session.info()}
+
+@router.delete("/profile")
+async def api_stop_profile():
+    """Stop the running profiling session early"""
+    session = profiling.stop_session()
+    if session is None:
+        return {"success": False, "error": "No profiling session is running"}
+    return {"success": True, "session": session.info()}
+
+@router.get("/profile")
+def api_get_profile():
+    """Get the state of the current or most recent profiling session"""
+    session = profiling.last_session
+    if session is None:
+        return {"success": False, "error": "No profiling session has been run"}
+    return {"success": True, "session": session.info()}
+
+@router.get("/profile/result")
+def api_get_profile_result(format: Optional[str] = None, sort: str = 'cumulative', limit: int = 50):
+    """
+    Get the result of the most recent finished profiling session
+
+    format: 'collapsed' (sampling), 'pstats' or 'prof' (cprofile); defaults to the mode's natural format
+    """
+    session = profiling.last_session
+    if session is None:
+        return {"success": False, "error": "No profiling session has been run"}
+    if session.running:
+        return {"success": False, "error": "Profiling session is still running", "session": session.info()}
+
+    if session.mode == 'sampling':
+        if format not in (None, 'collapsed'):
+            return {"success": False, "error": "Sampling sessions only produce collapsed stacks"}
+        return PlainTextResponse(session.collapsed())
+
+    if session.scope_entries == 0 and session.scope != 'all':
+        return {"success": False, "error": f"Scope {session.scope} was not entered during the session"}
+    if format == 'prof':
+        return Response(session.pstats_dump(), media_type="application/octet-stream",
+                        headers={"Content-Disposition": 'attachment; filename="pendant.prof"'})
+    if format not in (None, 'pstats'):
+        return {"success": False, "error": "cProfile sessions produce 'pstats' or 'prof' output"}
+    return PlainTextResponse(session.pstats_text(sort, limit))
+
+@router.post("/recording")
+async def api_start_recording(request: RecordingRequest):
+    """Start recording motion commands, commanded states and serial traffic"""
+    try:
+        recording = recorder.start_recording(request.name, motion.current_joint_positions, motion.current_ee_position)
+    except (ValueError, OSError) as e:
+        return {"success": False, "error": str(e)}
+    
+    return {"success": True, "recording": recording.info()}
+
+@router.delete("/recording")
+async def api_stop_recording():
+    """Stop the running recording"""
+    recording = recorder.stop_recording()
+    if recording is None:
+        return {"success": False, "error": "No recording is running"}
+    return {"success": True, "recording": recording.info()}
+
+@router.get("/recording")
+def api_get_recording():
+    """Get the state of the current or most recent recording"""
+    recording = recorder.last_recording
+    if recording is None:
+        return {"success": False, "error": "No recording has been made"}
+    return {"success": True, "recording": recording.info()}
+
+@router.get("/recordings")
+def api_list_recordings():
+    """List the stored recordings"""
+    return {"recordings": recorder.list_recordings()}
+
+@router.get("/recordings/{name}")
+def api_download_recording(name: str):
+    """Download a recording file"""
+    try:
+        path = recorder.recording_path(name)
+    except ValueError as e:
+        return {"success": False, "error": str(e)}
+    if not os.path.exists(path):
+        return {"success": False, "error": "Recording not found"}
+    return FileResponse(path, media_type="application/octet-stream", filename=f"{name}.rec")
+
+@router.post("/recordings/{name}/replay")
+async def api_replay_recording(name: str, request: ReplayRequest):
+    """Replay a recording through the motion layer (simulation mode only); returns when it has finished"""
+    if request.speed <= 0 or request.speed > RECORDER_CONFIG['MAX_REPLAY_SPEED']:
+        return {"success": False, "error": f"Speed must be between 0 and {RECORDER_CONFIG['MAX_REPLAY_SPEED']}"}
+    try:
+        path = recorder.recording_path(name)
+        if not os.path.exists(path):
+            return {"success": False, "error": "Recording not found"}
+        result = await recorder.replay(path, request.speed)
+    except ValueError as e:
+        return {"success": False, "error": str(e)}
+    
+    return {"success": True, "replay": result}
@@ -8,16 +8,37 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from config import JOG_CONFIG, JOG_INCREMENTS, JOINT_LIMITS, ROBOT_CONFIG, SIMULATION_MODE
+from config import DEGREES_PER_MM, JOG_CONFIG, JOG_INCREMENTS, JOINT_LIMITS, ROBOT_CONFIG, SIMULATION_MODE, METRICS_CONFIG
 import kinematics
+from broadcaster import Broadcaster, PositionPublisher
+from log import get_logger
+from metrics import Counter, Gauge, HistogramMetric
+from profiling import profile_scope
+import recorder
+import trajectory
 
-# prismitic conversion
-MM_PER_ROTATION = 8.0
-DEGREES_PER_MM = 360.0 / MM_PER_ROTATION
+logger = get_logger(__name__)
+
+jog_loop_period = HistogramMetric('pendant_jog_loop_period_seconds', 'Time between jog control loop iterations in seconds')
+jog_loop_work = HistogramMetric('pendant_jog_loop_work_seconds', 'Time spent computing one jog control loop iteration in seconds')
+jog_loop_overruns = Counter('pendant_jog_loop_overruns_total', 'Jog control loop iterations that started late')
+jog_active = Gauge('pendant_jog_active', 'Whether a jog motion is in progress (1) or not (0)')
 
 # Will be set by app.py
 arduino_communicator = None
 
+def controller():
+    """
+    The Arduino backend commands are sent to: the Arduino outside simulation
+    mode, only the simulated Arduino in it
+
+    Returns:
+        The ArduinoCommunicator, or None to simulate motion without one
+    """
+    if arduino_communicator is None or (SIMULATION_MODE and not arduino_communicator.simulated):
+        return None
+    return arduino_communicator
+
 router = APIRouter(tags=["motion"])
 
 fk = kinematics.ForwardKinematics()
@@ -45,6 +66,22 @@ jog_state = {
     'last_update_time': 0  # Time of last position update
 }
 
+# Task running the jog control loop (see start_jog_loop)
+jog_task = None
+
+# Clock the jog loop integrates velocity over (scaled by recorder.replay)
+jog_clock = time.time
+
+# How much faster than real time simulated motion runs (set by recorder.replay)
+simulation_speed = 1.0
+
+# Seconds a simulated homing takes
+SIMULATED_HOME_TIME = 2.0
+
+# Move in progress towards the commanded joint positions, as
+# (trajectory.Segment, jog_clock() at its start); see sample_positions
+active_move = None
+
 # Add global variables for move completion callbacks
 move_complete_callbacks = []
 
@@ -60,17 +97,28 @@ def unregister_move_complete_callback(callback):
     if callback in move_complete_callbacks:
         move_complete_callbacks.remove(callback)
 
+# Called on an emergency stop, e.g. to fault a running program
+emergency_stop_callbacks = []
+
+def register_emergency_stop_callback(callback):
+    """Register a callback to be called when the emergency stop is activated"""
+    if callback not in emergency_stop_callbacks:
+        emergency_stop_callbacks.append(callback)
+
+def unregister_emergency_stop_callback(callback):
+    """Unregister an emergency stop callback"""
+    if callback in emergency_stop_callbacks:
+        emergency_stop_callbacks.remove(callback)
+
 async def handle_move_done(data):
     """Handle Arduino's move done notification"""
-    print("Received move done notification from Arduino")
-    print(f"Move done data: {data}")
-    print(f"Number of registered callbacks: {len(move_complete_callbacks)}")
-    sys.stdout.flush()
+    logger.info("Received move done notification from Arduino",
+                extra={'fields': {'callbacks': len(move_complete_callbacks)}})
+    logger.debug("Move done data: %s", data)
     
     # Call all registered callbacks
     for callback in move_complete_callbacks:
-        print(f"Calling callback: {callback}")
-        sys.stdout.flush()
+        logger.debug("Calling callback: %s", callback)
         if asyncio.iscoroutinefunction(callback):
             await callback()
         else:
@@ -146,8 +194,7 @@ def update_joint_position(joint, increment):
         joint_limits = JOINT_LIMITS[limit_key]
     else:
         # Fallback to default limits
-        print(f"Warning: No limits found for joint {joint}, using default limits")
-        sys.stdout.flush()
+        logger.warning("No limits found for joint %s, using default limits", joint)
         joint_limits = (-180, 180)
     
     # Calculate new position with limit enforcement
@@ -157,8 +204,7 @@ def update_joint_position(joint, increment):
     # Update position
     current_joint_positions[joint] = new_position
     
-    print(f"Updated joint {joint}: {current_position} -> {new_position} (limits: {joint_limits})")
-    sys.stdout.flush()
+    logger.debug("Updated joint %s: %s -> %s (limits: %s)", joint, current_position, new_position, joint_limits)
     
     return new_position
 
@@ -198,11 +244,9 @@ def update_cartesian_position(axis, increment):
                 # Default values
                 defaults = {'x': 0, 'y': 0, 'z': 0, 'roll': 0, 'pitch': 0, 'yaw': 0}
                 new_ee_position[param] = defaults[param]
-                print(f"Warning: Missing required cartesian parameter '{param}', using default value {defaults[param]}")
-                sys.stdout.flush()
+                logger.warning("Missing required cartesian parameter '%s', using default value %s", param, defaults[param])
     
-    print(f"Attempting IK for target position: {new_ee_position}")
-    sys.stdout.flush()
+    logger.debug("Attempting IK for target position: %s", new_ee_position)
     
     try:
         # Calculate new joint positions using inverse kinematics
@@ -227,20 +271,16 @@ def update_cartesian_position(axis, increment):
             
             # Recalculate end effector position using forward kinematics to ensure consistency
             current_ee_position = fk.calculate(current_joint_positions)
-            print(f"Updated cartesian position. New joint positions: {current_joint_positions}")
-            print(f"New cartesian position: {current_ee_position}")
-            sys.stdout.flush()
+            recorder.record_state(current_joint_positions, current_ee_position)
+            logger.debug("Updated cartesian position. New joint positions: %s, new cartesian position: %s",
+                         current_joint_positions, current_ee_position)
             return True
         else:
             # If no solution found, keep current positions
-            print(f"No IK solution found for target position: {new_ee_position}")
-            sys.stdout.flush()
+            logger.debug("No IK solution found for target position: %s", new_ee_position)
             return False
     except Exception as e:
-        print(f"Error during inverse kinematics calculation: {e}")
-        import traceback
-        traceback.print_exc()
-        sys.stdout.flush()
+        logger.exception("Error during inverse kinematics calculation: %s", e)
         return False
 
 def extension_to_rotation(extension_mm):
@@ -249,108 +289,142 @@ def extension_to_rotation(extension_mm):
 def rotation_to_extension(rotation_deg):
     return rotation_deg / DEGREES_PER_MM  # 1/45 mm per degree
 
-active_connections = []
+# Fans WebSocket messages out to all connected clients (registered by app.py)
+broadcaster = Broadcaster()
 
-async def broadcast_position_update():
-    """Broadcast current positions to all connected clients"""
-    # Create a copy of the current joint positions to avoid modifying the original
-    display_joint_positions = current_joint_positions.copy()
-    
+def sample_positions():
+    """
+    Snapshot the joint and end effector positions for publishing: part way
+    along the planned trajectory while a move is in progress, otherwise the
+    commanded positions
+    """
+    global active_move
     # The joint positions are always stored in actual mm for the extension
     # We don't need to convert anything here as the Arduino communication layer
     # will handle the conversion when sending commands
-    
-    message = {
-        "type": "position_update",
-        "timestamp": time.time(),
-        "joint_positions": display_joint_positions,
-        "ee_position": current_ee_position
-    }
-    
-    print(f"Position update sent to {len(active_connections)} connection(s)")
-    sys.stdout.flush()
-    
-    for i, connection in enumerate(active_connections):
-        try:
-            await connection.send_json(message)
-            print(f"Position update sent to connection {i}")
-            sys.stdout.flush()
-        except:
-            print(f"Failed to send position update to connection {i}")
-            sys.stdout.flush()
+    if active_move is not None:
+        segment, started = active_move
+        elapsed = jog_clock() - started
+        if elapsed < segment.duration:
+            joint_positions = segment.position(elapsed)
+            return joint_positions, fk.calculate(joint_positions)
+        active_move = None
+    return current_joint_positions.copy(), current_ee_position.copy()
+
+def begin_move(start, velocity=50):
+    """
+    Follow a move from `start` to the commanded joint positions in sample_positions
+
+    Args:
+        start: Joint positions the robot moves from (sample_positions() before the command)
+        velocity: Percentage of each joint's maximum velocity (1-100)
+    """
+    global active_move
+    active_move = (trajectory.plan_move(start, current_joint_positions, velocity), jog_clock())
+
+# Publishes position updates at the display rate (started by app.py)
+position_publisher = PositionPublisher(broadcaster, sample_positions)
+
+async def broadcast_position_update():
+    """Request a position update on the next publisher tick, even if nothing moved"""
+    position_publisher.request_update()
 
 
 async def jog_motion_control(background_tasks: BackgroundTasks):
     global current_joint_positions, current_ee_position, jog_state
     
-    print("Starting jog motion control background task")
-    sys.stdout.flush()
+    logger.info("Starting jog motion control background task")
+    
+    overrun_period = JOG_CONFIG['UPDATE_INTERVAL'] * METRICS_CONFIG['JOG_OVERRUN_FACTOR']
+    previous_start = None
+    jog_active.set(1)
     
     try:
         while jog_state['active']:
-            # Calculate elapsed time since last update
-            current_time = time.time()
-            elapsed_time = current_time - jog_state['last_update_time']
-            jog_state['last_update_time'] = current_time
+            iteration_start = time.perf_counter()
+            if previous_start is not None:
+                period = iteration_start - previous_start
+                jog_loop_period.observe(period)
+                if period > overrun_period:
+                    jog_loop_overruns.inc()
+            previous_start = iteration_start
             
-            # Apply jogging based on mode
-            if jog_state['mode'] == 'joint' and jog_state['joint']:
-                # Joint jogging
-                joint = jog_state['joint']
-                
-                # Apply jogging in joint space
-                velocity = jog_state['target_velocity']  # degrees per second or mm per second
-                increment = velocity * elapsed_time       # Calculate increment based on elapsed time
+            with profile_scope('jog'):
+                # Calculate elapsed time since last update
+                current_time = jog_clock()
+                elapsed_time = current_time - jog_state['last_update_time']
+                jog_state['last_update_time'] = current_time
                 
-                if abs(increment) > 0.001:  # Only update if increment is significant
-                    update_joint_position(joint, increment)
+                # Apply jogging based on mode
+                if jog_state['mode'] == 'joint' and jog_state['joint']:
+                    # Joint jogging
+                    joint = jog_state['joint']
                     
-                    # Update end effector position using forward kinematics
-                    current_ee_position = fk.calculate(current_joint_positions)
+                    # Apply jogging in joint space
+                    velocity = jog_state['target_velocity']  # degrees per second or mm per second
+                    increment = velocity * elapsed_time       # Calculate increment based on elapsed time
                     
-                    # Broadcast updated positions to all clients
-                    await broadcast_position_update()
-            
-            elif jog_state['mode'] == 'cartesian' and jog_state['axis']:
-                # Cartesian jogging
-                axis = jog_state['axis']
+                    if abs(increment) > 0.001:  # Only update if increment is significant
+                        update_joint_position(joint, increment)
+                        
+                        # Update end effector position using forward kinematics
+                        # (published to clients by the position publisher)
+                        current_ee_position = fk.calculate(current_joint_positions)
+                        recorder.record_state(current_joint_positions, current_ee_position)
                 
-                # Apply jogging in cartesian space
-                velocity = jog_state['target_velocity']  # mm per second or degrees per second for orientation
-                increment = velocity * elapsed_time       # Calculate increment based on elapsed time
-                
-                if abs(increment) > 0.001:  # Only update if increment is significant
-                    # Update cartesian position (this will also update joint positions through IK)
-                    position_updated = update_cartesian_position(axis, increment)
+                elif jog_state['mode'] == 'cartesian' and jog_state['axis']:
+                    # Cartesian jogging
+                    axis = jog_state['axis']
+                    
+                    # Apply jogging in cartesian space
+                    velocity = jog_state['target_velocity']  # mm per second or degrees per second for orientation
+                    increment = velocity * elapsed_time       # Calculate increment based on elapsed time
                     
-                    if position_updated:
-                        # Broadcast updated positions to all clients
-                        await broadcast_position_update()
-                    else:
-                        print(f"Failed to update cartesian position for axis {axis}")
-                        sys.stdout.flush()
+                    if abs(increment) > 0.001:  # Only update if increment is significant
+                        # Update cartesian position (this will also update joint positions through IK)
+                        position_updated = update_cartesian_position(axis, increment)
+                        
+                        if not position_updated:
+                            logger.warning("Failed to update cartesian position for axis %s", axis)
+            
+            jog_loop_work.observe(time.perf_counter() - iteration_start)
             
             # Wait for next update
             await asyncio.sleep(JOG_CONFIG['UPDATE_INTERVAL'])
     
     except Exception as e:
-        print(f"Error in jog motion control: {e}")
-        sys.stdout.flush()
+        logger.exception("Error in jog motion control: %s", e)
     
     finally:
-        print("Jog motion control background task ended")
-        sys.stdout.flush()
+        logger.info("Jog motion control background task ended")
         jog_state['active'] = False
+        jog_active.set(0)
+
+def start_jog_loop():
+    """
+    Start the jog control loop unless it is already running, so repeated
+    jog_start commands never run more than one loop
+    
+    Returns:
+        asyncio.Task running jog_motion_control
+    """
+    global jog_task
+    
+    if jog_task is None or jog_task.done():
+        jog_task = asyncio.create_task(jog_motion_control(None))
+    return jog_task
 
 async def handle_jog_start(data):
     """Handle start of jogging motion"""
     global jog_state
     
+    recorder.record_command('jog_start', data)
+    
     jog_state['active'] = True
     jog_state['mode'] = data.get('mode', 'joint')
     jog_state['direction'] = data.get('direction', 0)
     jog_state['velocity'] = data.get('velocity', 50)
-    jog_state['last_update_time'] = time.time()
+    jog_state['last_update_time'] = jog_clock()
     
     # Set target velocity based on the mode
     if jog_state['mode'] == 'joint':
@@ -370,39 +444,37 @@ async def handle_jog_start(data):
         max_velocity = JOG_CONFIG['MAX_VELOCITY']['cartesian'].get(jog_state['axis'], 30)
         jog_state['target_velocity'] = (jog_state['direction'] * jog_state['velocity'] / 100.0) * max_velocity
     
-    print(f"Starting jogging: mode={jog_state['mode']}, "
-          f"{'joint=' + jog_state['joint'] if jog_state['joint'] else 'axis=' + jog_state['axis']}, "
-          f"direction={jog_state['direction']}, velocity={jog_state['velocity']}%, "
-          f"target_velocity={jog_state['target_velocity']}")
-    sys.stdout.flush()
+    logger.info("Starting jogging: mode=%s, %s, direction=%s, velocity=%s%%, target_velocity=%s",
+                jog_state['mode'],
+                'joint=' + str(jog_state['joint']) if jog_state['joint'] else 'axis=' + str(jog_state['axis']),
+                jog_state['direction'], jog_state['velocity'], jog_state['target_velocity'])
 
 async def handle_jog_stop():
     """Handle stop of jogging motion"""
     global jog_state
     
+    recorder.record_command('jog_stop')
+    
     # Update jog state
     jog_state['active'] = False
     jog_state['direction'] = 0
     jog_state['target_velocity'] = 0
     
-    print("Stopping jogging")
-    sys.stdout.flush()
+    logger.info("Stopping jogging")
     
     # Send jog stop message to all clients
     message = {
         "type": "jog_stop",
         "timestamp": time.time()
     }
-    for connection in active_connections:
-        try:
-            await connection.send_json(message)
-        except:
-            pass
+    broadcaster.publish(message)
 
 async def handle_jog_velocity(data):
     """Handle change of jogging velocity"""
     global jog_state
     
+    recorder.record_command('jog_velocity', data)
+    
     velocity = data.get('velocity', 50)
     jog_state['velocity'] = max(1, min(100, velocity))
     
@@ -416,19 +488,19 @@ async def handle_jog_velocity(data):
         max_velocity = JOG_CONFIG['MAX_VELOCITY']['cartesian'].get(jog_state['axis'], 30)
         jog_state['target_velocity'] = (jog_state['direction'] * jog_state['velocity'] / 100.0) * max_velocity
     
-    print(f"Changing jogging velocity to {jog_state['velocity']}%, target_velocity: {jog_state['target_velocity']}")
-    sys.stdout.flush()
+    logger.info("Changing jogging velocity to %s%%, target_velocity: %s", jog_state['velocity'], jog_state['target_velocity'])
 
 async def handle_jog_increment(data):
     """Handle a discrete jogging increment"""
     global current_joint_positions, current_ee_position
     
+    recorder.record_command('jog_increment', data)
+    
     mode = data.get('mode', 'joint')
     increment_size = data.get('increment', 5)  # Default 5 units (degrees or mm)
     direction = data.get('direction', 0)
     
-    print(f"Received jog increment: mode={mode}, increment={increment_size}, direction={direction}")
-    sys.stdout.flush()
+    logger.debug("Received jog increment: mode=%s, increment=%s, direction=%s", mode, increment_size, direction)
     
     # Validate increment size against config
     # If the increment is not one of our standard increments, find the closest one
@@ -436,13 +508,15 @@ async def handle_jog_increment(data):
     if increment_size not in standard_increments:
         # Find the closest standard increment
         closest_increment = min(standard_increments, key=lambda x: abs(x - increment_size))
-        print(f"Non-standard increment {increment_size} received, using closest standard increment {closest_increment}")
+        logger.info("Non-standard increment %s received, using closest standard increment %s", increment_size, closest_increment)
         increment_size = closest_increment
     
     # Calculate the actual increment based on direction
     actual_increment = increment_size * direction
     position_updated = False
     
+    start = sample_positions()[0]
+    
     if mode == 'joint':
         joint = data.get('joint')
         if joint in current_joint_positions:
@@ -453,28 +527,11 @@ async def handle_jog_increment(data):
             
             # Update end effector position
             current_ee_position = fk.calculate(current_joint_positions)
+            recorder.record_state(current_joint_positions, current_ee_position)
             position_updated = True
             
-            print(f"Jogged joint {joint} by {actual_increment} {'mm' if joint == 'prismatic_extension' else 'degrees'}: {old_position} -> {new_position}")
-            sys.stdout.flush()
-            
-            # Send command to Arduino if connected and not in simulation mode
-            if arduino_communicator and not SIMULATION_MODE:
-                # Create a copy of joint positions for Arduino with converted prismatic extension
-                arduino_joint_positions = current_joint_positions.copy()
-                
-                if joint == 'prismatic_extension':
-                    # Convert mm to rotation degrees for the stepper motor
-                    arduino_joint_positions['prismatic_extension'] = extension_to_rotation(arduino_joint_positions['prismatic_extension'])
-                    print(f"Converting {current_joint_positions['prismatic_extension']}mm to {arduino_joint_positions['prismatic_extension']} degrees rotation")
-                    sys.stdout.flush()
-                
-                success = arduino_communicator.send_joint_command(arduino_joint_positions)
-                if success:
-                    print(f"Jog command sent to Arduino: {arduino_joint_positions}")
-                else:
-                    print("Failed to send jog command to Arduino")
-                sys.stdout.flush()
+            logger.debug("Jogged joint %s by %s %s: %s -> %s", joint, actual_increment,
+                         'mm' if joint == 'prismatic_extension' else 'degrees', old_position, new_position)
             
     elif mode == 'cartesian':
         axis = data.get('axis')
@@ -485,103 +542,62 @@ async def handle_jog_increment(data):
             
             if position_updated:
                 new_position = current_ee_position[axis]
-                print(f"Jogged axis {axis} by {actual_increment} {'mm' if axis in ['x', 'y', 'z'] else 'degrees'}: {old_position} -> {new_position}")
-                sys.stdout.flush()
-                
-                # Send command to Arduino if connected and not in simulation mode
-                if arduino_communicator and not SIMULATION_MODE:
-                    success = arduino_communicator.send_cartesian_command(current_ee_position)
-                    if success:
-                        print(f"Jog command sent to Arduino: {current_ee_position}")
-                    else:
-                        print("Failed to send jog command to Arduino")
-                    sys.stdout.flush()
-    
-    # Broadcast updated positions if changed
+                logger.debug("Jogged axis %s by %s %s: %s -> %s", axis, actual_increment,
+                             'mm' if axis in ['x', 'y', 'z'] else 'degrees', old_position, new_position)
+    
+    # Send the updated positions if changed (clients are updated by the position publisher);
+    # cartesian jogs already solved them with inverse kinematics
     if position_updated:
-        # Send command to Arduino if connected and not in simulation mode
-        if arduino_communicator and not SIMULATION_MODE:
-            if mode == 'joint':
-                arduino_communicator.send_joint_command(current_joint_positions)
-            else:  # cartesian mode requires inverse kinematics which is already calculated
-                arduino_communicator.send_joint_command(current_joint_positions)
-            print(f"Joint command sent to Arduino: {current_joint_positions}")
-            sys.stdout.flush()
-        
-        await broadcast_position_update()
+        begin_move(start, data.get('velocity', 50))
+        send_joint_positions('jog')
 
 
 async def handle_moveJ(data):
     """Handle moveJ command (joint space motion)"""
     global current_joint_positions, current_ee_position
     
+    recorder.record_command('moveJ', data)
+    
     target_positions = data.get('joint_positions', {})
     velocity_percentage = data.get('velocity', 50)
     
-    print(f"Received moveJ command to positions: {target_positions}, velocity: {velocity_percentage}%")
-    sys.stdout.flush()
+    logger.info("Received moveJ command to positions: %s, velocity: %s%%", target_positions, velocity_percentage)
     
     # Check if all required joints are present
     for joint in current_joint_positions.keys():
         if joint not in target_positions:
-            print(f"Missing joint {joint} in moveJ command")
-            sys.stdout.flush()
+            logger.warning("Missing joint %s in moveJ command", joint)
             return False
     
     # Check joint limits
     valid, message = check_joint_limits(target_positions)
     if not valid:
-        print(f"Joint limits check failed: {message}")
-        sys.stdout.flush()
+        logger.warning("Joint limits check failed: %s", message)
         return False
     
     # TODO: Implement trajectory planning for smooth motion
     # For now, just update positions directly (this is not how a real robot would move)
-    current_joint_positions.update(target_positions)
-    
-    # Update end effector position
-    current_ee_position = fk.calculate(current_joint_positions)
-    
-    # Send command to Arduino if connected and not in simulation mode
-    if arduino_communicator and not SIMULATION_MODE:
-        # Create a copy of joint positions for Arduino with converted prismatic extension
-        arduino_joint_positions = current_joint_positions.copy()
-        
-        # Convert prismatic extension from mm to rotation degrees
-        arduino_joint_positions['prismatic_extension'] = extension_to_rotation(arduino_joint_positions['prismatic_extension'])
-        print(f"Converting prismatic extension {current_joint_positions['prismatic_extension']}mm to {arduino_joint_positions['prismatic_extension']} degrees rotation")
-        sys.stdout.flush()
-        
-        success = arduino_communicator.send_joint_command(arduino_joint_positions)
-        if success:
-            print(f"MoveJ command sent to Arduino: {arduino_joint_positions}")
-        else:
-            print("Failed to send moveJ command to Arduino")
-        sys.stdout.flush()
-    
-    # Broadcast updated positions
-    await broadcast_position_update()
+    apply_joint_move(target_positions, label='moveJ', velocity=velocity_percentage)
     
-    print(f"Completed moveJ to: {target_positions}")
-    sys.stdout.flush()
+    logger.info("Completed moveJ to: %s", target_positions)
     return True
 
 async def handle_moveL(data):
     """Handle moveL command (linear Cartesian motion)"""
     global current_joint_positions, current_ee_position
     
+    recorder.record_command('moveL', data)
+    
     target_position = data.get('position', {})
     velocity_percentage = data.get('velocity', 50)
     
-    print(f"Received moveL command to position: {target_position}, velocity: {velocity_percentage}%")
-    sys.stdout.flush()
+    logger.info("Received moveL command to position: %s, velocity: %s%%", target_position, velocity_percentage)
     
     # Check if all required cartesian coordinates are present
     required_coords = ['x', 'y', 'z']
     for coord in required_coords:
         if coord not in target_position:
-            print(f"Missing coordinate {coord} in moveL command")
-            sys.stdout.flush()
+            logger.warning("Missing coordinate %s in moveL command", coord)
             return False
     
     # Create full target position (including orientation)
@@ -593,100 +609,145 @@ async def handle_moveL(data):
     workspace_limits = ROBOT_CONFIG.get('WORKSPACE_LIMITS', {})
     for coord, (min_val, max_val) in workspace_limits.items():
         if coord in full_target and (full_target[coord] < min_val or full_target[coord] > max_val):
-            print(f"Target position exceeds workspace limits for {coord}: {full_target[coord]} not in {min_val} to {max_val}")
-            sys.stdout.flush()
+            logger.warning("Target position exceeds workspace limits for %s: %s not in %s to %s",
+                           coord, full_target[coord], min_val, max_val)
             return False
     
     # Calculate inverse kinematics
     target_joint_positions = ik.calculate(full_target)
     
     if not target_joint_positions:
-        print(f"No IK solution found for target position: {full_target}")
-        sys.stdout.flush()
+        logger.warning("No IK solution found for target position: %s", full_target)
         return False
     
     # Check joint limits
     valid, message = check_joint_limits(target_joint_positions)
     if not valid:
-        print(f"Joint limits check failed: {message}")
-        sys.stdout.flush()
+        logger.warning("Joint limits check failed: %s", message)
         return False
     
     # TODO: Implement linear trajectory planning
     # For now, just update positions directly (this is not a true linear motion)
-    current_joint_positions.update(target_joint_positions)
-    current_ee_position = full_target
+    apply_joint_move(target_joint_positions, full_target, label='moveL', velocity=velocity_percentage)
+    
+    logger.info("Completed moveL to: %s", full_target)
+    return True
+
+async def handle_planned_move(step_type, data, joint_target, ee_target=None):
+    """
+    Handle a moveJ or moveL whose targets were already validated and solved
+    (by program_compiler), skipping the checks and IK of handle_moveJ/handle_moveL
+    
+    Args:
+        step_type: 'moveJ' or 'moveL'
+        data: The original command data (recorded for replay)
+        joint_target: Joint positions to move to
+        ee_target: End effector pose of a moveL target (FK of joint_target if None)
+    """
+    recorder.record_command(step_type, data)
+    
+    apply_joint_move(joint_target, ee_target, label=step_type, velocity=data.get('velocity', 50))
     
-    # Send command to Arduino if connected and not in simulation mode
-    if arduino_communicator and not SIMULATION_MODE:
+    logger.info("Completed planned %s to: %s", step_type, joint_target)
+    return True
+
+def apply_joint_move(target_joint_positions, ee_position=None, label='move', velocity=50):
+    """
+    Set the commanded joint positions and send them to the Arduino
+    
+    Args:
+        target_joint_positions: Joint positions to move to
+        ee_position: End effector pose at the target (FK of the joint positions if None)
+        label: Command name used in log messages
+        velocity: Percentage of each joint's maximum velocity the move is published at (1-100)
+    """
+    global current_ee_position
+    
+    start = sample_positions()[0]
+    current_joint_positions.update(target_joint_positions)
+    current_ee_position = dict(ee_position) if ee_position is not None else fk.calculate(current_joint_positions)
+    recorder.record_state(current_joint_positions, current_ee_position)
+    begin_move(start, velocity)
+    send_joint_positions(label)
+
+def send_joint_positions(label='move'):
+    """
+    Send the commanded joint positions to the Arduino (or the simulated Arduino in simulation mode), if connected
+    
+    Args:
+        label: Command name used in log messages
+    """
+    arduino = controller()
+    if arduino:
         # Create a copy of joint positions for Arduino with converted prismatic extension
         arduino_joint_positions = current_joint_positions.copy()
         
         # Convert prismatic extension from mm to rotation degrees
         arduino_joint_positions['prismatic_extension'] = extension_to_rotation(arduino_joint_positions['prismatic_extension'])
-        print(f"Converting prismatic extension {current_joint_positions['prismatic_extension']}mm to {arduino_joint_positions['prismatic_extension']} degrees rotation")
-        sys.stdout.flush()
+        logger.debug("Converting prismatic extension %smm to %s degrees rotation",
+                     current_joint_positions['prismatic_extension'], arduino_joint_positions['prismatic_extension'])
         
-        success = arduino_communicator.send_joint_command(arduino_joint_positions)
+        success = arduino.send_joint_command(arduino_joint_positions)
         if success:
-            print(f"MoveL command sent to Arduino: {arduino_joint_positions}")
+            logger.debug("%s command sent to Arduino: %s", label, arduino_joint_positions)
         else:
-            print("Failed to send moveL command to Arduino")
-        sys.stdout.flush()
-    
-    # Broadcast updated positions
-    await broadcast_position_update()
-    
-    print(f"Completed moveL to: {full_target}")
-    sys.stdout.flush()
-    return True
+            logger.warning("Failed to send %s command to Arduino", label)
 
 async def handle_emergency_stop():
     """Handle emergency stop"""
-    global jog_state
+    global jog_state, current_ee_position, active_move
+    
+    recorder.record_command('emergency_stop')
     
-    print("EMERGENCY STOP ACTIVATED")
-    sys.stdout.flush()
+    logger.warning("EMERGENCY STOP ACTIVATED")
+    
+    # The robot stops where it is, part way through a move in progress
+    if active_move is not None:
+        stopped_joints, stopped_ee = sample_positions()
+        current_joint_positions.update(stopped_joints)
+        current_ee_position = stopped_ee
+        active_move = None
     
     # Stop any active jogging
     jog_state['active'] = False
     jog_state['direction'] = 0
     jog_state['target_velocity'] = 0
+    
+    for callback in list(emergency_stop_callbacks):
+        if asyncio.iscoroutinefunction(callback):
+            await callback()
+        else:
+            callback()
 
     # Send emergency stop message to all clients
     message = {
         "type": "emergency_stop",
         "timestamp": time.time()
     }
-    for connection in active_connections:
-        try:
-            await connection.send_json(message)
-        except:
-            pass
+    broadcaster.publish(message)
     
     return True
 
 async def handle_home():
     """Handle home command - send home command to Arduino and wait for completion"""
-    print(f"Sending home command to Arduino")
-    sys.stdout.flush()
+    recorder.record_command('home')
+    
+    logger.info("Sending home command to Arduino")
     
-    # Send direct home command to Arduino if connected and not in simulation mode
-    if arduino_communicator and not SIMULATION_MODE:
+    # Send direct home command to the Arduino, or the simulated Arduino in simulation mode
+    arduino = controller()
+    if arduino:
         # Use WebSocket to inform clients that homing has started
         message = {
             "type": "homing_status",
             "status": "started",
             "timestamp": time.time()
         }
-        for connection in active_connections:
-            try:
-                await connection.send_json(message)
-            except:
-                pass
+        broadcaster.publish(message)
         
-        # Send the home command and wait for completion
-        success = arduino_communicator.send_home_command()
+        # Send the home command and wait for completion, off the event loop as it blocks until homing is done
+        loop = asyncio.get_running_loop()
+        success = await loop.run_in_executor(None, arduino.send_home_command)
         
         # Notify clients about the homing result
         result_message = {
@@ -694,27 +755,20 @@ async def handle_home():
             "status": "completed" if success else "failed",
             "timestamp": time.time()
         }
-        for connection in active_connections:
-            try:
-                await connection.send_json(result_message)
-            except:
-                pass
+        broadcaster.publish(result_message)
         
         if success:
-            print(f"Homing completed successfully")
-            sys.stdout.flush()
+            logger.info("Homing completed successfully")
             return True
         else:
-            print("Failed to complete homing")
-            sys.stdout.flush()
+            logger.warning("Failed to complete homing")
             return False
     else:
         # If in simulation mode, we still consider it a success
-        print("Simulation mode: Home command simulated")
-        sys.stdout.flush()
+        logger.info("Simulation mode: Home command simulated")
         
         # Simulate a brief delay for homing
-        await asyncio.sleep(2)
+        await asyncio.sleep(SIMULATED_HOME_TIME / simulation_speed)
         
         # Notify clients that homing is complete
         message = {
@@ -722,11 +776,7 @@ async def handle_home():
             "status": "completed",
             "timestamp": time.time()
         }
-        for connection in active_connections:
-            try:
-                await connection.send_json(message)
-            except:
-                pass
+        broadcaster.publish(message)
         
         return True
 
@@ -746,9 +796,9 @@ async def api_jog_start(command: JogCommand, background_tasks: BackgroundTasks):
     """Start jogging motion"""
     await handle_jog_start(command.dict())
     
-    # Start background task if not already running
+    # Start the control loop if not already running
     if jog_state['active']:
-        background_tasks.add_task(jog_motion_control, background_tasks)
+        start_jog_loop()
     
     return {"success": True}
 
@@ -786,4 +836,21 @@ async def api_moveL(command: MoveLCommand):
 async def api_home():
     """Home the robot to its predefined home position"""
     success = await handle_home()
-    return {"success": success}
\ No newline at end of file
+    return {"success": success}
+
+@router.get("/serial_stats")
+def api_serial_stats():
+    """Get per-command serial round-trip latency statistics"""
+    if not arduino_communicator:
+        return {"connected": False, "commands": {}}
+    
+    stats = arduino_communicator.stats.snapshot()
+    stats["connected"] = arduino_communicator.connected
+    return stats
+
+@router.delete("/serial_stats")
+def api_reset_serial_stats():
+    """Reset serial round-trip latency statistics"""
+    if arduino_communicator:
+        arduino_communicator.stats.reset()
+    return {"success": True}
\ No newline at end of file
@@ -1,9 +1,10 @@
-from fastapi import APIRouter, BackgroundTasks
-from pydantic import BaseModel
+from fastapi import APIRouter, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ValidationError
 from typing import Dict, List, Optional, Union, Any
 import asyncio
 import copy
-import json
+import functools
 import time
 import sys
 import uuid
@@ -11,20 +12,55 @@ import datetime
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from config import ROBOT_CONFIG
+from config import DRY_RUN_CONFIG, LISTING_CONFIG, POSITION_INDEX_CONFIG, ROBOT_CONFIG, STORAGE_CONFIG, TRANSFER_CONFIG
 import kinematics
+from log import get_logger
+from storage import ProgramStore, StorageWriter
+import program_compiler
+import program_history
+import dry_run
+import listing
+import transfer
+import waypoint_order
+
+logger = get_logger(__name__)
 
 router = APIRouter(tags=["programs"])
 
 import routers.motion as motion
+import program_executor
+from program_executor import executor
+from run_queue import RunQueue
+from position_index import PositionIndex
 
 saved_positions = {}
 
+# Spatial index over saved_positions, updated with every save and delete
+position_index = PositionIndex()
+
 programs = {}
 
+# Sorted listings, rebuilt when the writer's version of their table changes
+program_listing = listing.Listing(lambda program: {
+    "id": program["id"],
+    "name": program["name"],
+    "description": program.get("description", ""),
+    "step_count": len(program.get("steps", [])),
+    "created": program.get("created"),
+    "modified": program.get("modified")
+})
+position_listing = listing.Listing(lambda position: position)
+
 class SavePositionRequest(BaseModel):
     name: str
 
+class SavedPosition(BaseModel):
+    id: str
+    name: str
+    timestamp: Optional[str] = None
+    joint_positions: Dict[str, float]
+    ee_position: Dict[str, float]
+
 class ProgramStep(BaseModel):
     type: str  # 'moveJ', 'moveL', 'wait', 'io'
     data: Dict[str, Any]
@@ -46,254 +82,82 @@ class UpdateProgramRequest(BaseModel):
     description: Optional[str] = None
     steps: Optional[List[ProgramStep]] = None
 
+class SnapRequest(BaseModel):
+    radius: Optional[float] = None           # mm, defaults to POSITION_INDEX_CONFIG['SNAP_RADIUS']
 
-def save_data_to_file(filename, data):
-    """Save data to a JSON file"""
-    try:
+class DryRunRequest(BaseModel):
+    program_ids: Optional[List[str]] = None  # All programs if omitted
+    start_joint_positions: Optional[Dict[str, float]] = None  # Home position if omitted
+    from_current_position: bool = False      # Start from where the robot is now
 
-        os.makedirs("data", exist_ok=True)
-        
+class OptimizeOrderRequest(BaseModel):
+    ranges: Optional[List[List[int]]] = None # [first, last] step numbers free to reorder; every run of moves if omitted
+    keep_ends: bool = True                   # Keep the first and last waypoint of each segment in place
+    start_joint_positions: Optional[Dict[str, float]] = None  # Home position if omitted
+    from_current_position: bool = False      # Start from where the robot is now
 
-        filepath = os.path.join("data", filename)
-        with open(filepath, 'w') as f:
-            json.dump(data, f, indent=2)
-        
-        print(f"Data saved to {filepath}")
-        sys.stdout.flush()
-        return True
-    except Exception as e:
-        print(f"Error saving data to file {filename}: {e}")
-        sys.stdout.flush()
-        return False
+class OptimizePositionsRequest(BaseModel):
+    position_ids: List[str]
+    velocity: int = 50                       # Percentage of max velocity of the moves
+    return_to_start: bool = False            # End with a move back to the start pose
+    start_joint_positions: Optional[Dict[str, float]] = None  # Home position if omitted
+    from_current_position: bool = False      # Start from where the robot is now
 
-def load_data_from_file(filename, default=None):
-    """Load data from a JSON file"""
-    try:
-        filepath = os.path.join("data", filename)
-        if os.path.exists(filepath):
-            with open(filepath, 'r') as f:
-                data = json.load(f)
-            
-            print(f"Data loaded from {filepath}")
-            sys.stdout.flush()
-            return data
-        else:
-            print(f"File {filepath} not found, returning default value")
-            sys.stdout.flush()
-            return default if default is not None else {}
-    except Exception as e:
-        print(f"Error loading data from file {filename}: {e}")
-        sys.stdout.flush()
-        return default if default is not None else {}
+class QueueRunRequest(BaseModel):
+    program_id: str
+    repeat: int = 1                          # Times to run the program
+    priority: int = 0                        # Higher priorities run first
+    paused: bool = False                     # Start paused before the first step
 
-# Add a new event to track move completion
-move_complete_event = asyncio.Event()
 
-async def move_completed_callback():
-    """Callback when a move is completed by the Arduino"""
-    print("Move completed callback triggered, setting event")
-    sys.stdout.flush()
-    move_complete_event.set()
+# The only way programs are started: jobs run one at a time on the executor
+run_queue = RunQueue(executor, lambda program_id: programs.get(program_id), motion.broadcaster.publish)
 
-# Program execution
-async def execute_program(program_id, background_tasks: BackgroundTasks):
-    """Execute a program by ID"""
-    global move_complete_event
+# Opened by load_storage; handlers write through `writer` so they never wait for the disk
+store = None
+writer = None
+
+def load_storage():
+    """Open the program database (migrating the old JSON files once) and load its contents"""
+    global store, writer, saved_positions, programs
     
-    if program_id not in programs:
-        print(f"Program {program_id} not found")
-        sys.stdout.flush()
-        return False
-    
-    program = programs[program_id]
-    print(f"Executing program: {program['name']}")
-    sys.stdout.flush()
-    
-    # Send program start notification
-    message = {
-        "type": "program_execution",
-        "status": "started",
-        "program_id": program_id,
-        "timestamp": time.time()
-    }
-    for connection in motion.active_connections:
-        try:
-            await connection.send_json(message)
-        except:
-            pass
-    
-    # Execute each step
-    step_index = 0
-    for step in program["steps"]:
-        step_index += 1
-        step_type = step["type"]
-        step_data = step["data"]
-        
-        # Send step start notification
-        message = {
-            "type": "program_execution",
-            "status": "step_started",
-            "program_id": program_id,
-            "step_index": step_index,
-            "step_type": step_type,
-            "timestamp": time.time()
-        }
-        for connection in motion.active_connections:
-            try:
-                await connection.send_json(message)
-            except:
-                pass
-        
-        # Execute step based on type
-        success = False
-        if step_type == "moveJ" or step_type == "moveL":
-            # Clear the move complete event before sending the command
-            move_complete_event.clear()
-            print(f"Move complete event cleared for step {step_index}")
-            sys.stdout.flush()
-            
-            # Register the callback with motion module
-            motion.register_move_complete_callback(move_completed_callback)
-            print(f"Move complete callback registered for step {step_index}")
-            sys.stdout.flush()
-            
-            # Execute the move command
-            if step_type == "moveJ":
-                success = await motion.handle_moveJ(step_data)
-            else:  # moveL
-                success = await motion.handle_moveL(step_data)
-            
-            if success:
-                # Only wait for Arduino response if in real hardware mode
-                if not motion.SIMULATION_MODE and motion.arduino_communicator:
-                    print(f"Waiting for Arduino to complete the move for step {step_index}")
-                    sys.stdout.flush()
-                    
-                    # Wait for Arduino to signal move completion
-                    try:
-                        # Wait with a timeout of 60 seconds
-                        await asyncio.wait_for(move_complete_event.wait(), 60.0)
-                        print(f"Move completed for step {step_index}")
-                        sys.stdout.flush()
-                    except asyncio.TimeoutError:
-                        print(f"Timeout waiting for Arduino to complete move for step {step_index}")
-                        sys.stdout.flush()
-                        success = False
-                    finally:
-                        # Unregister the callback
-                        motion.unregister_move_complete_callback(move_completed_callback)
-                else:
-                    # Add a simulated delay even in simulation mode
-                    # Calculate a realistic delay based on the movement distance and complexity
-                    if step_type == "moveJ":
-                        # Estimate some time for joint movement (more complex calculation could be added)
-                        joint_positions = step_data.get("joint_positions", {})
-                        # Get a rough estimate of movement magnitude
-                        position_changes = []
-                        for joint, value in joint_positions.items():
-                            if joint in motion.current_joint_positions:
-                                change = abs(value - motion.current_joint_positions[joint])
-                                position_changes.append(change)
-                        
-                        # Base delay on the largest joint movement (at least 0.5 seconds)
-                        delay = max(0.5, max(position_changes) / 30.0) if position_changes else 1.0
-                    else:  # moveL
-                        # Estimate time for linear movement
-                        position = step_data.get("position", {})
-                        # Calculate Euclidean distance for position change
-                        distance = 0
-                        for axis in ['x', 'y', 'z']:
-                            if axis in position and axis in motion.current_ee_position:
-                                distance += (position[axis] - motion.current_ee_position[axis])**2
-                        distance = distance**0.5
-                        
-                        # Base delay on distance (at least 0.5 seconds)
-                        delay = max(0.5, distance / 100.0) if distance > 0 else 1.0
-                    
-                    # Cap the delay at a reasonable maximum
-                    delay = min(delay, 5.0)
-                    
-                    print(f"Simulation mode: Waiting {delay:.2f} seconds for simulated move completion")
-                    sys.stdout.flush()
-                    await asyncio.sleep(delay)
-                    print(f"Simulation mode: Move completed for step {step_index}")
-                    sys.stdout.flush()
-        elif step_type == "wait":
-            # Wait for specified time in seconds
-            wait_time = step_data.get("time", 1)
-            print(f"Waiting for {wait_time} seconds")
-            sys.stdout.flush()
-            await asyncio.sleep(wait_time)
-            success = True
-        elif step_type == "io":
-            # Handle I/O operations (placeholder for future implementation)
-            io_action = step_data.get("action", "")
-            io_pin = step_data.get("pin", 0)
-            io_value = step_data.get("value", 0)
-            print(f"IO operation: {io_action} on pin {io_pin} with value {io_value}")
-            sys.stdout.flush()
-            # TODO: Implement actual I/O operations with Arduino
-            success = True
-        
-        # Send step completion notification
-        message = {
-            "type": "program_execution",
-            "status": "step_completed" if success else "step_failed",
-            "program_id": program_id,
-            "step_index": step_index,
-            "step_type": step_type,
-            "timestamp": time.time()
-        }
-        for connection in motion.active_connections:
-            try:
-                await connection.send_json(message)
-            except:
-                pass
-        
-        # Stop execution if step failed
-        if not success:
-            print(f"Program execution stopped due to failure in step {step_index}: {step_type}")
-            sys.stdout.flush()
-            
-            # Send program failure notification
-            message = {
-                "type": "program_execution",
-                "status": "failed",
-                "program_id": program_id,
-                "failed_step": step_index,
-                "timestamp": time.time()
-            }
-            for connection in motion.active_connections:
-                try:
-                    await connection.send_json(message)
-                except:
-                    pass
-            
-            return False
+    if store is None:
+        store = ProgramStore(STORAGE_CONFIG['DATABASE'])
+        store.migrate_json(STORAGE_CONFIG['JSON_DIRECTORY'])
+        writer = StorageWriter(store)
+        writer.start()
     
-    # Send program completion notification
-    message = {
-        "type": "program_execution",
-        "status": "completed",
-        "program_id": program_id,
-        "timestamp": time.time()
-    }
-    for connection in motion.active_connections:
-        try:
-            await connection.send_json(message)
-        except:
-            pass
+    saved_positions = store.load_positions()
+    programs = store.load_programs()
+    position_index.rebuild(saved_positions.values())
+    logger.info("Loaded %s programs and %s saved positions from %s", len(programs), len(saved_positions), store.path)
+
+def close_storage():
+    """Commit queued changes and close the program database"""
+    global store, writer
     
-    print(f"Program {program_id} executed successfully")
-    sys.stdout.flush()
-    return True
+    if writer is not None:
+        if not writer.stop():
+            logger.error("Program database closed with uncommitted changes",
+                         extra={'fields': {'error': writer.error}})
+        writer = None
+    if store is not None:
+        store.close()
+        store = None
 
+def compile_on_save(program):
+    """Compile a saved program so its first execution starts without planning"""
+    try:
+        compiled = program_compiler.get_compiled(program)
+        logger.debug("Compiled program %s in %.1fms", program["id"], compiled.compile_time * 1000)
+    except Exception as e:
+        logger.exception("Error compiling program %s: %s", program["id"], e)
 
 @router.post("/programs/save_position")
 async def api_save_position(request: SavePositionRequest):
     """Save the current position with a name"""
     position_id = str(uuid.uuid4())
-    saved_positions[position_id] = {
+    position = {
         "id": position_id,
         "name": request.name,
         "timestamp": datetime.datetime.now().isoformat(),
@@ -301,8 +165,9 @@ async def api_save_position(request: SavePositionRequest):
         "ee_position": copy.deepcopy(motion.current_ee_position)
     }
     
-    # Save to file
-    save_data_to_file("saved_positions.json", saved_positions)
+    saved_positions[position_id] = position
+    writer.save_position(position)
+    position_index.add(position)
     
     return {
         "success": True,
@@ -310,17 +175,107 @@ async def api_save_position(request: SavePositionRequest):
         "position": saved_positions[position_id]
     }
 
+def _list(table, items, item_listing, key, request, response, name, cursor, limit):
+    """
+    One page of a listing, or a 304 response if the client's copy is current
+    """
+    limit = max(1, min(limit or LISTING_CONFIG['PAGE_SIZE'], LISTING_CONFIG['MAX_PAGE_SIZE']))
+    # Read the version before the items (see listing.Listing._refresh)
+    version = writer.version(table)
+    etag = listing.make_etag(writer.epoch, version, name, cursor, limit)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if listing.etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    
+    try:
+        page, next_cursor = item_listing.page(items, version, name, cursor, limit)
+    except ValueError as e:
+        return {"success": False, "error": str(e)}
+    
+    response.headers.update(headers)
+    return {"success": True, key: page, "next_cursor": next_cursor}
+
 @router.get("/programs/saved_positions")
-def api_get_saved_positions():
-    """Get all saved positions"""
-    return {"positions": list(saved_positions.values())}
+def api_get_saved_positions(request: Request, response: Response, name: Optional[str] = None,
+                            cursor: Optional[str] = None, limit: Optional[int] = None):
+    """List saved positions by name, a page at a time, optionally only those whose name contains `name`"""
+    return _list("saved_positions", saved_positions, position_listing, "positions",
+                 request, response, name, cursor, limit)
+
+def _with_distances(found):
+    """Saved positions for (distance, id) index results, skipping any deleted meanwhile"""
+    return [{**saved_positions[position_id], "distance": distance}
+            for distance, position_id in found if position_id in saved_positions]
+
+def _query_point(x, y, z):
+    """End effector point of a query: the given coordinates, or where the robot is"""
+    point = dict(motion.current_ee_position)
+    point.update({axis: value for axis, value in (('x', x), ('y', y), ('z', z)) if value is not None})
+    return point
+
+@router.get("/programs/saved_positions/nearest")
+def api_nearest_positions(count: int = 5, space: str = "cartesian",
+                          x: Optional[float] = None, y: Optional[float] = None, z: Optional[float] = None):
+    """
+    Saved positions closest to a point (the current end effector position by default),
+    or to the current joint positions with space=joint (distance in seconds at the joint speeds)
+    """
+    count = max(1, min(count, POSITION_INDEX_CONFIG['MAX_RESULTS']))
+    if space == "joint":
+        found = position_index.nearest_joints(motion.current_joint_positions, count)
+    elif space == "cartesian":
+        found = position_index.nearest(_query_point(x, y, z), count)
+    else:
+        return {"success": False, "error": f"Unknown space {space}"}
+    return {"success": True, "positions": _with_distances(found)}
+
+@router.get("/programs/saved_positions/within")
+def api_positions_within(radius: float, x: Optional[float] = None, y: Optional[float] = None, z: Optional[float] = None):
+    """Saved positions whose end effector is within radius mm of a point (the current position by default)"""
+    found = position_index.within(_query_point(x, y, z), radius)
+    return {"success": True, "positions": _with_distances(found[:POSITION_INDEX_CONFIG['MAX_RESULTS']])}
+
+async def snap_to_position(radius=None):
+    """
+    Stop jogging and move to the closest saved position, if one is close enough
+    
+    Args:
+        radius: Largest end effector distance in mm (POSITION_INDEX_CONFIG['SNAP_RADIUS'] by default)
+    
+    Returns:
+        Dictionary with success, and the position snapped to and its distance
+    """
+    # A stopping program is still finishing its move
+    if executor.state in (program_executor.RUNNING, program_executor.STOPPING):
+        return {"success": False, "error": f"Cannot snap while a program is {executor.state}"}
+    
+    radius = POSITION_INDEX_CONFIG['SNAP_RADIUS'] if radius is None else radius
+    found = position_index.nearest(motion.current_ee_position, 1)
+    if not found or found[0][0] > radius or found[0][1] not in saved_positions:
+        return {"success": False, "error": f"No saved position within {radius}mm"}
+    
+    distance, position_id = found[0]
+    position = saved_positions[position_id]
+    if motion.jog_state['active']:
+        await motion.handle_jog_stop()
+    if not await motion.handle_moveJ({"joint_positions": position["joint_positions"]}):
+        return {"success": False, "error": "Could not move to the saved position"}
+    
+    logger.info("Snapped to saved position %s (%.2fmm away)", position["name"], distance)
+    return {"success": True, "position": position, "distance": distance}
+
+@router.post("/programs/saved_positions/snap")
+async def api_snap_to_position(request: SnapRequest):
+    """Move to the closest saved position if it is within the snap radius (stops jogging)"""
+    return await snap_to_position(request.radius)
 
 @router.delete("/programs/saved_positions/{position_id}")
 def api_delete_position(position_id: str):
     """Delete a saved position"""
     if position_id in saved_positions:
         del saved_positions[position_id]
-        save_data_to_file("saved_positions.json", saved_positions)
+        writer.delete_position(position_id)
+        position_index.remove(position_id)
         return {"success": True}
     else:
         return {"success": False, "error": "Position not found"}
@@ -331,7 +286,7 @@ def api_create_program(request: CreateProgramRequest):
     program_id = str(uuid.uuid4())
     timestamp = datetime.datetime.now().isoformat()
     
-    programs[program_id] = {
+    program = {
         "id": program_id,
         "name": request.name,
         "description": request.description,
@@ -340,7 +295,8 @@ def api_create_program(request: CreateProgramRequest):
         "modified": timestamp
     }
     
-    save_data_to_file("programs.json", programs)
+    programs[program_id] = program
+    writer.save_program(program)
     
     return {
         "success": True,
@@ -349,9 +305,13 @@ def api_create_program(request: CreateProgramRequest):
     }
 
 @router.get("/programs/programs")
-def api_get_programs():
-    """Get all programs"""
-    return {"programs": list(programs.values())}
+def api_get_programs(request: Request, response: Response, name: Optional[str] = None,
+                     cursor: Optional[str] = None, limit: Optional[int] = None):
+    """
+    List program summaries (without steps) by name, a page at a time,
+    optionally only those whose name contains `name`
+    """
+    return _list("programs", programs, program_listing, "programs", request, response, name, cursor, limit)
 
 @router.get("/programs/programs/{program_id}")
 def api_get_program(program_id: str):
@@ -367,18 +327,23 @@ def api_update_program(program_id: str, request: UpdateProgramRequest):
     if program_id not in programs:
         return {"success": False, "error": "Program not found"}
     
+    program = dict(programs[program_id])
+    
     if request.name is not None:
-        programs[program_id]["name"] = request.name
+        program["name"] = request.name
     
     if request.description is not None:
-        programs[program_id]["description"] = request.description
+        program["description"] = request.description
     
     if request.steps is not None:
-        programs[program_id]["steps"] = [step.dict() for step in request.steps]
+        program["steps"] = [step.dict() for step in request.steps]
     
-    programs[program_id]["modified"] = datetime.datetime.now().isoformat()
+    program["modified"] = datetime.datetime.now().isoformat()
     
-    save_data_to_file("programs.json", programs)
+    programs[program_id] = program
+    writer.save_program(program)
+    
+    compile_on_save(program)
     
     return {
         "success": True,
@@ -390,21 +355,321 @@ def api_delete_program(program_id: str):
     """Delete a program"""
     if program_id in programs:
         del programs[program_id]
-        save_data_to_file("programs.json", programs)
+        writer.delete_program(program_id)
         return {"success": True}
     else:
         return {"success": False, "error": "Program not found"}
 
-@router.post("/programs/programs/{program_id}/execute")
-async def api_execute_program(program_id: str, background_tasks: BackgroundTasks):
-    """Execute a program"""
+def _load_revisions(program_id, *revisions):
+    """Load revisions of a program once the queued edits are committed; None for a missing revision"""
+    writer.flush(5.0)
+    return [store.load_revision(program_id, revision) for revision in revisions]
+
+@router.get("/programs/programs/{program_id}/revisions")
+def api_get_revisions(program_id: str):
+    """List the saved revisions of a program, newest first"""
+    if program_id not in programs:
+        return {"success": False, "error": "Program not found"}
+    
+    writer.flush(5.0)
+    return {"success": True, "revisions": store.list_revisions(program_id)}
+
+@router.get("/programs/programs/{program_id}/revisions/{revision}")
+def api_get_revision(program_id: str, revision: int):
+    """Get one revision of a program"""
+    found, = _load_revisions(program_id, revision)
+    if found is None:
+        return {"success": False, "error": "Revision not found"}
+    return {"success": True, "revision": found}
+
+@router.get("/programs/programs/{program_id}/revisions/{revision}/diff")
+def api_diff_revisions(program_id: str, revision: int, against: Optional[int] = None):
+    """
+    Differences from revision `against` (defaults to the previous revision) to `revision`
+    """
+    if against is None:
+        against = revision - 1
+    old, new = _load_revisions(program_id, against, revision)
+    if old is None or new is None:
+        return {"success": False, "error": "Revision not found"}
+    return {"success": True, "from": against, "to": revision, "diff": program_history.diff_revisions(old, new)}
+
+@router.post("/programs/programs/{program_id}/revisions/{revision}/restore")
+def api_restore_revision(program_id: str, revision: int):
+    """Roll a program back to a revision, saved as a new revision"""
     if program_id not in programs:
         return {"success": False, "error": "Program not found"}
     
-    background_tasks.add_task(execute_program, program_id, background_tasks)
+    found, = _load_revisions(program_id, revision)
+    if found is None:
+        return {"success": False, "error": "Revision not found"}
+    
+    program = dict(programs[program_id])
+    program["name"] = found["name"]
+    program["description"] = found["description"]
+    program["steps"] = found["steps"]
+    program["modified"] = datetime.datetime.now().isoformat()
+    
+    programs[program_id] = program
+    writer.save_program(program)
+    
+    compile_on_save(program)
+    
+    logger.info("Restored program %s to revision %s", program_id, revision)
+    return {
+        "success": True,
+        "program": program
+    }
+
+@router.get("/programs/export")
+def api_export_library(compress: bool = False, include_positions: bool = True, include_programs: bool = True):
+    """Stream saved positions and programs as NDJSON (see transfer.py), gzip compressed with compress=true"""
+    filename = f"pendant-library-{datetime.datetime.now():%Y%m%d-%H%M%S}.ndjson" + (".gz" if compress else "")
+    lines = transfer.export_lines(saved_positions if include_positions else {}, programs if include_programs else {})
+    return StreamingResponse(
+        transfer.chunked(lines, compress),
+        media_type="application/gzip" if compress else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+def _validate_record(kind, data):
+    """
+    Returns:
+        The program or saved position of an import record
+
+    Raises:
+        ValueError: If the record is not a valid program or saved position
+    """
+    try:
+        if kind == "program":
+            return Program(**data).dict()
+        position = SavedPosition(**data).dict()
+    except ValidationError as e:
+        raise ValueError("; ".join(f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}"
+                                   for error in e.errors())) from e
+    missing = [joint for joint in ROBOT_CONFIG['HOME_POSITION'] if joint not in position["joint_positions"]]
+    missing += [axis for axis in ('x', 'y', 'z') if axis not in position["ee_position"]]
+    if missing:
+        raise ValueError(f"Missing {', '.join(missing)}")
+    return position
+
+@router.post("/programs/import")
+async def api_import_library(request: Request, replace: bool = True):
+    """
+    Import saved positions and programs from an NDJSON body (see transfer.py), gzip compressed or not
+    
+    Records are validated one at a time and committed every TRANSFER_CONFIG['BATCH_SIZE']
+    records; invalid records are skipped and reported. Items with an existing id
+    replace it, or are skipped with replace=false.
+    """
+    counts = {"positions": 0, "programs": 0, "skipped": 0, "invalid": 0}
+    errors = []
+    batch = {"position": [], "program": []}
+    loop = asyncio.get_running_loop()
+    
+    async def commit():
+        if batch["position"] or batch["program"]:
+            positions, new_programs = batch["position"], batch["program"]
+            batch["position"], batch["program"] = [], []
+            await loop.run_in_executor(None, functools.partial(writer.write_batch, positions, new_programs))
+    
+    def invalid(line, message):
+        counts["invalid"] += 1
+        if len(errors) < TRANSFER_CONFIG['MAX_ERRORS']:
+            errors.append({"line": line, "error": message})
+    
+    error = None
+    try:
+        async for line, kind, data in transfer.read_records(request.stream()):
+            if kind is None:
+                invalid(line, data.message)
+                continue
+            try:
+                item = _validate_record(kind, data)
+            except ValueError as e:
+                invalid(line, str(e))
+                continue
+            
+            items = programs if kind == "program" else saved_positions
+            if not replace and item["id"] in items:
+                counts["skipped"] += 1
+                continue
+            items[item["id"]] = item
+            # Change the listing version with the items, not when the batch is committed
+            writer.touch("programs" if kind == "program" else "saved_positions")
+            if kind == "position":
+                position_index.add(item)
+            counts[kind + "s"] += 1
+            batch[kind].append(item)
+            if len(batch[kind]) >= TRANSFER_CONFIG['BATCH_SIZE']:
+                await commit()
+    except transfer.RecordError as e:
+        error = str(e)
+    finally:
+        # Records already added to memory are committed even if the import stopped early
+        await commit()
+    
+    logger.info("Imported %s programs and %s saved positions", counts["programs"], counts["positions"],
+                extra={'fields': {**counts, 'error': error}})
+    result = {"success": error is None, "imported": counts, "errors": errors}
+    if error:
+        result["error"] = error
+    return result
+
+@router.get("/programs/programs/{program_id}/compiled")
+def api_get_compiled_program(program_id: str, segments: bool = False):
+    """Get the compiled form of a program: joint targets, estimated durations and invalid steps"""
+    if program_id not in programs:
+        return {"success": False, "error": "Program not found"}
+    
+    compiled = program_compiler.get_compiled(programs[program_id])
+    return {"success": True, "compiled": compiled.to_dict(segments)}
+
+@router.get("/programs/programs/{program_id}/estimate")
+def api_estimate_program(program_id: str):
+    """Estimated duration of every step and the cycle time of a program run from the current position"""
+    if program_id not in programs:
+        return {"success": False, "error": "Program not found"}
+    
+    compiled = program_compiler.get_compiled(programs[program_id])
+    plan = compiled.bind(motion.current_joint_positions, motion.current_ee_position)
+    return {
+        "success": True,
+        "steps": [{"index": step.index, "type": step.type, "duration": step.duration, "error": step.error} for step in plan],
+        "cycle_time": sum(step.duration for step in plan if not step.error)
+    }
+
+@router.post("/programs/dry_run")
+async def api_dry_run(request: DryRunRequest):
+    """Simulate programs without moving the robot: per-step timing, cycle time, peak joint velocity/acceleration and limit violations"""
+    program_ids = request.program_ids if request.program_ids is not None else list(programs)
+    missing = [program_id for program_id in program_ids if program_id not in programs]
+    if missing:
+        return {"success": False, "error": f"Program not found: {missing[0]}"}
+    if len(program_ids) > DRY_RUN_CONFIG['MAX_PROGRAMS']:
+        return {"success": False, "error": f"At most {DRY_RUN_CONFIG['MAX_PROGRAMS']} programs can be dry run at once"}
+    
+    start = request.start_joint_positions
+    if request.from_current_position:
+        start = dict(motion.current_joint_positions)
+    
+    results = await dry_run.dry_run([programs[program_id] for program_id in program_ids], start)
+    return {"success": True, "results": results}
+
+@router.post("/programs/programs/{program_id}/optimize_order")
+def api_optimize_program_order(program_id: str, request: OptimizeOrderRequest):
+    """
+    Reorder a program's free-order waypoints to shorten its cycle time (see waypoint_order.py)
+    
+    The reordered program is returned, not saved.
+    """
+    if program_id not in programs:
+        return {"success": False, "error": "Program not found"}
+    if request.ranges is not None and any(len(step_range) != 2 for step_range in request.ranges):
+        return {"success": False, "error": "Ranges must be [first, last] step numbers"}
+    
+    start = request.start_joint_positions
+    if request.from_current_position:
+        start = dict(motion.current_joint_positions)
+    
+    try:
+        result = waypoint_order.optimize_program(programs[program_id], start, request.ranges, request.keep_ends)
+    except ValueError as e:
+        return {"success": False, "error": str(e)}
+    return {"success": True, **result}
+
+@router.post("/programs/saved_positions/optimize_order")
+def api_optimize_position_order(request: OptimizePositionsRequest):
+    """Order in which to visit saved positions for the shortest travel time, with moveJ steps visiting them"""
+    missing = [position_id for position_id in request.position_ids if position_id not in saved_positions]
+    if missing:
+        return {"success": False, "error": f"Saved position not found: {missing[0]}"}
+    
+    start = request.start_joint_positions
+    if request.from_current_position:
+        start = dict(motion.current_joint_positions)
+    
+    try:
+        result = waypoint_order.optimize_positions([saved_positions[position_id] for position_id in request.position_ids],
+                                                   start, request.velocity, request.return_to_start)
+    except ValueError as e:
+        return {"success": False, "error": str(e)}
+    return {"success": True, **result}
+
+@router.post("/programs/programs/{program_id}/execute")
+async def api_execute_program(program_id: str, paused: bool = False, repeat: int = 1, priority: int = 0):
+    """Queue a program run (paused=true waits before the first step, for single-stepping)"""
+    try:
+        job = run_queue.enqueue(program_id, repeat, priority, paused)
+    except ValueError as e:
+        return {"success": False, "error": str(e)}
+    
+    return {"success": True, "message": f"Program {program_id} queued", "job": job.to_dict()}
+
+@router.get("/programs/queue")
+async def api_get_queue():
+    """Get the running job, the queued jobs in run order and recently finished jobs"""
+    return {**run_queue.status(), "executor": executor.status()}
+
+@router.post("/programs/queue")
+async def api_queue_program(request: QueueRunRequest):
+    """Queue a program run with a repeat count and priority"""
+    return await api_execute_program(request.program_id, request.paused, request.repeat, request.priority)
+
+@router.delete("/programs/queue/{job_id}")
+async def api_cancel_job(job_id: str):
+    """Cancel a queued job, or stop the running one after its current move"""
+    try:
+        job = run_queue.cancel(job_id)
+    except ValueError as e:
+        return {"success": False, "error": str(e)}
+    return {"success": True, "job": job.to_dict()}
+
+# Executor controls; these are async so they run on the event loop with the executor
+EXECUTOR_ACTIONS = {
+    'pause': executor.pause,
+    'resume': executor.resume,
+    'step': executor.step,
+    'stop': executor.stop,
+    'reset': executor.reset
+}
+
+def control_executor(action, data=None):
+    """
+    Apply one run queue or executor control
+    
+    Args:
+        action: 'start' (queue a program), 'cancel' (a job) or one of EXECUTOR_ACTIONS
+        data: program_id, repeat, priority and paused for 'start'; job_id for 'cancel'
+    
+    Returns:
+        Dictionary with success, the executor status and an error message on failure
+    """
+    data = data or {}
+    result = {}
+    try:
+        if action == 'start':
+            result['job'] = run_queue.enqueue(data.get('program_id'), int(data.get('repeat', 1)),
+                                              int(data.get('priority', 0)), bool(data.get('paused', False))).to_dict()
+        elif action == 'cancel':
+            result['job'] = run_queue.cancel(data.get('job_id')).to_dict()
+        elif action in EXECUTOR_ACTIONS:
+            EXECUTOR_ACTIONS[action]()
+        else:
+            return {"success": False, "error": f"Unknown executor action {action}", "executor": executor.status()}
+    except ValueError as e:
+        return {"success": False, "error": str(e), "executor": executor.status()}
     
-    return {"success": True, "message": f"Program {program_id} execution started"}
+    return {"success": True, **result, "executor": executor.status()}
 
+@router.get("/programs/executor")
+async def api_get_executor():
+    """Get the program executor's state and progress"""
+    return executor.status()
 
-saved_positions = load_data_from_file("saved_positions.json", {})
-programs = load_data_from_file("programs.json", {})
+@router.post("/programs/executor/{action}")
+async def api_control_executor(action: str):
+    """Pause, resume, single-step, stop or reset the program executor"""
+    if action not in EXECUTOR_ACTIONS:
+        return {"success": False, "error": f"Unknown executor action {action}"}
+    return control_executor(action)
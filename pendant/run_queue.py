@@ -0,0 +1,243 @@
+"""
+Program run queue.
+
+Every program run goes through the queue: jobs are queued with a priority and
+a repeat count, and a single consumer task starts them one at a time on the
+ProgramExecutor, so requests from the UI and from an upstream PLC or MES never
+race for the arm. Higher priorities run first, jobs of equal priority in the
+order they were queued.
+
+The consumer only starts a job when the executor is idle. After a fault the
+failed job is ended and the queue holds until the executor is reset.
+Cancelling a queued job removes it; cancelling the running job stops the
+executor after the current move and drops its remaining repeats.
+
+Queue changes are published as run_queue messages on the program topic.
+"""
+import asyncio
+import heapq
+import itertools
+import time
+import uuid
+
+from config import RUN_QUEUE_CONFIG
+from log import get_logger
+from metrics import Counter, Gauge
+import program_executor
+
+logger = get_logger(__name__)
+
+run_queue_depth = Gauge('pendant_run_queue_depth', 'Jobs waiting in the program run queue')
+run_queue_jobs = Counter('pendant_run_queue_jobs_total', 'Program run queue jobs by final state', ['state'])
+
+QUEUED = 'queued'
+RUNNING = 'running'
+COMPLETED = 'completed'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+class Job:
+    """One queued program, run `repeat` times"""
+    def __init__(self, program_id, repeat=1, priority=0, paused=False):
+        self.id = str(uuid.uuid4())
+        self.program_id = program_id
+        self.repeat = repeat
+        self.priority = priority
+        self.paused = paused         # Start the first run paused before its first step
+        self.runs = 0                # Completed runs
+        self.state = QUEUED
+        self.error = None
+        self.queued = time.time()
+        self.started = None
+        self.finished = None
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'program_id': self.program_id,
+            'repeat': self.repeat,
+            'priority': self.priority,
+            'paused': self.paused,
+            'runs': self.runs,
+            'state': self.state,
+            'error': self.error,
+            'queued': self.queued,
+            'started': self.started,
+            'finished': self.finished
+        }
+
+
+class RunQueue:
+    """Priority queue of program runs with a single consumer"""
+    def __init__(self, executor, get_program, publish=None):
+        """
+        Args:
+            executor: ProgramExecutor that runs the jobs
+            get_program: Function returning the program with an id, or None
+            publish: Function called with each run_queue message
+        """
+        self.executor = executor
+        self.get_program = get_program
+        self.publish = publish
+        # (-priority, sequence, job); cancelled jobs are skipped when popped
+        self._heap = []
+        self._sequence = itertools.count()
+        self._jobs = {}
+        self._history = []
+        self.current = None
+        self._wake = None            # Created by start(), on the event loop the consumer runs on
+        self._task = None
+        executor.listeners.append(self._on_executor_state)
+
+    def start(self):
+        if self._task is None:
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._consume())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _on_executor_state(self, status):
+        if self._wake is not None:
+            self._wake.set()
+
+    def waiting(self):
+        """Number of queued jobs, not counting the running one"""
+        return sum(1 for job in self._jobs.values() if job.state == QUEUED)
+
+    def _changed(self):
+        run_queue_depth.set(self.waiting())
+        if self._wake is not None:
+            self._wake.set()
+        if self.publish:
+            self.publish({"type": "run_queue", **self.status(), "timestamp": time.time()})
+
+    def status(self):
+        """
+        Returns:
+            Dictionary with the running job, queued jobs in the order they
+            will run and the most recently finished jobs
+        """
+        queued = sorted((entry for entry in self._heap if entry[2].state == QUEUED), key=lambda entry: entry[:2])
+        return {
+            'current': self.current.to_dict() if self.current else None,
+            'queued': [job.to_dict() for _, _, job in queued],
+            'history': [job.to_dict() for job in reversed(self._history)]
+        }
+
+    def enqueue(self, program_id, repeat=1, priority=0, paused=False):
+        """
+        Queue a program
+
+        Returns:
+            Job
+
+        Raises:
+            ValueError: If the program does not exist, the repeat count is not
+                        positive or the queue is full
+        """
+        if self.get_program(program_id) is None:
+            raise ValueError("Program not found")
+        if repeat < 1:
+            raise ValueError("Repeat count must be at least 1")
+        if self.waiting() >= RUN_QUEUE_CONFIG['MAX_JOBS']:
+            raise ValueError(f"Run queue is full ({RUN_QUEUE_CONFIG['MAX_JOBS']} jobs)")
+
+        job = Job(program_id, repeat, priority, paused)
+        self._jobs[job.id] = job
+        heapq.heappush(self._heap, (-priority, next(self._sequence), job))
+        logger.info("Queued program %s", program_id, extra={'fields': {'job': job.id, 'repeat': repeat, 'priority': priority}})
+        self._changed()
+        return job
+
+    def cancel(self, job_id):
+        """
+        Cancel a queued or running job
+
+        Returns:
+            Job
+
+        Raises:
+            ValueError: If there is no such queued or running job
+        """
+        if self.current is not None and self.current.id == job_id:
+            job = self.current
+            job.state = CANCELLED
+            if self.executor.state in (program_executor.RUNNING, program_executor.PAUSED):
+                self.executor.stop()
+            self._changed()
+            return job
+
+        job = self._jobs.get(job_id)
+        if job is None:
+            raise ValueError("Job not found")
+        self._finish(job, CANCELLED)
+        return job
+
+    def _finish(self, job, state, error=None):
+        job.state = state
+        job.error = error
+        job.finished = time.time()
+        self._jobs.pop(job.id, None)
+        self._history.append(job)
+        del self._history[:-RUN_QUEUE_CONFIG['HISTORY']]
+        run_queue_jobs.labels(state).inc()
+        logger.info("Job %s %s after %s of %s runs", job.id, state, job.runs, job.repeat,
+                    extra={'fields': {'program_id': job.program_id, 'error': error}})
+        self._changed()
+
+    async def _next_job(self):
+        """Wait for a queued job and an idle executor"""
+        while True:
+            while self._heap and self._heap[0][2].state != QUEUED:
+                heapq.heappop(self._heap)
+            if self._heap and self.executor.state == program_executor.IDLE:
+                return heapq.heappop(self._heap)[2]
+            self._wake.clear()
+            await self._wake.wait()
+
+    async def _consume(self):
+        while True:
+            job = await self._next_job()
+            self.current = job
+            job.state = RUNNING
+            job.started = time.time()
+            self._changed()
+            try:
+                state, error = await self._run(job)
+            except Exception as e:
+                logger.exception("Error running job %s: %s", job.id, e)
+                state, error = FAILED, str(e)
+            finally:
+                self.current = None
+            self._finish(job, state, error)
+
+    async def _run(self, job):
+        """
+        Returns:
+            (final job state, error message or None)
+        """
+        while job.runs < job.repeat:
+            if job.state == CANCELLED:
+                return CANCELLED, None
+            program = self.get_program(job.program_id)
+            if program is None:
+                return FAILED, "Program not found"
+            self.executor.start(program, paused=job.paused and job.runs == 0)
+            await self.executor.wait()
+
+            result = self.executor.last_result
+            if result == 'failed':
+                return FAILED, self.executor.error
+            if result != 'completed':
+                return CANCELLED, None
+            job.runs += 1
+            self._changed()
+        return COMPLETED, None
@@ -0,0 +1,581 @@
+"""
+SQLite storage for programs and saved positions.
+
+Every create, update and delete changes one row, so an edit costs the same
+however many programs are stored, and writes are transactional, so a crash
+leaves the database at the last committed change. Both tables are indexed
+on id (primary key) and name. Steps and positions are stored as JSON text
+in the row.
+
+On first open, programs.json and saved_positions.json from the previous
+file-based storage are imported once and renamed to *.json.migrated.
+
+Request handlers write through a StorageWriter: changes are queued and
+committed by a worker thread, with all changes made within the debounce
+window committed together in one transaction and repeated edits of the same
+row collapsed into the last one. Request handlers therefore never wait for
+the disk, and a crash loses at most the changes of the current window.
+
+Every committed program change is also recorded as a revision (see
+program_history.py): steps are stored as content addressed chunks shared
+between revisions, with a reference count so the chunks of deleted programs
+are removed. Edits collapsed by the StorageWriter make one revision.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from config import STORAGE_CONFIG
+from log import get_logger
+from metrics import Counter, Gauge, HistogramMetric
+import program_history
+
+logger = get_logger(__name__)
+
+storage_batch_duration = HistogramMetric('pendant_storage_batch_seconds', 'Time to commit one batch of storage writes in seconds')
+storage_writes = Counter('pendant_storage_writes_total', 'Storage row writes by result', ['result'])
+storage_failing = Gauge('pendant_storage_failing', 'Whether the last storage commit failed (1) or not (0)')
+
+SCHEMA_VERSION = 2
+
+# Largest number of chunk hashes looked up in one query
+_CHUNK_QUERY_SIZE = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS saved_positions (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    timestamp TEXT,
+    joint_positions TEXT NOT NULL,
+    ee_position TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS saved_positions_name ON saved_positions (name);
+CREATE TABLE IF NOT EXISTS programs (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    description TEXT,
+    steps TEXT NOT NULL,
+    created TEXT,
+    modified TEXT
+);
+CREATE INDEX IF NOT EXISTS programs_name ON programs (name);
+CREATE TABLE IF NOT EXISTS program_chunks (
+    hash TEXT PRIMARY KEY,
+    steps TEXT NOT NULL,
+    refs INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS program_revisions (
+    program_id TEXT NOT NULL,
+    revision INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    description TEXT,
+    chunks TEXT NOT NULL,
+    step_count INTEGER NOT NULL,
+    content_hash TEXT NOT NULL,
+    created TEXT,
+    PRIMARY KEY (program_id, revision)
+);
+"""
+
+_ADD_CHUNK = """
+INSERT INTO program_chunks (hash, steps, refs) VALUES (?, ?, 1)
+ON CONFLICT (hash) DO UPDATE SET refs = refs + 1
+"""
+
+_UPSERT_POSITION = """
+INSERT INTO saved_positions (id, name, timestamp, joint_positions, ee_position)
+VALUES (:id, :name, :timestamp, :joint_positions, :ee_position)
+ON CONFLICT (id) DO UPDATE SET
+    name = excluded.name, timestamp = excluded.timestamp,
+    joint_positions = excluded.joint_positions, ee_position = excluded.ee_position
+"""
+
+_UPSERT_PROGRAM = """
+INSERT INTO programs (id, name, description, steps, created, modified)
+VALUES (:id, :name, :description, :steps, :created, :modified)
+ON CONFLICT (id) DO UPDATE SET
+    name = excluded.name, description = excluded.description, steps = excluded.steps,
+    created = excluded.created, modified = excluded.modified
+"""
+
+
+def _position_row(position):
+    return {
+        'id': position['id'],
+        'name': position['name'],
+        'timestamp': position.get('timestamp'),
+        'joint_positions': json.dumps(position.get('joint_positions', {})),
+        'ee_position': json.dumps(position.get('ee_position', {}))
+    }
+
+
+def _program_row(program):
+    return {
+        'id': program['id'],
+        'name': program['name'],
+        'description': program.get('description', ''),
+        'steps': json.dumps(program.get('steps', [])),
+        'created': program.get('created'),
+        'modified': program.get('modified')
+    }
+
+
+class ProgramStore:
+    """Programs and saved positions in an SQLite database"""
+    def __init__(self, path):
+        """
+        Args:
+            path: Database file (created if missing), or ':memory:'
+        """
+        self.path = path
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # Handlers run both on the event loop and in FastAPI's thread pool
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(_SCHEMA)
+            version = int(self._meta('schema_version') or SCHEMA_VERSION)
+            if version < 2:
+                # Programs saved before revisions were kept start with their current state
+                for row in self._conn.execute("SELECT * FROM programs").fetchall():
+                    self._record_revision(dict(row))
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('schema_version', ?)",
+                               (str(SCHEMA_VERSION),))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _meta(self, key):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row['value'] if row else None
+
+    def load_positions(self):
+        """
+        Returns:
+            Dictionary of saved positions by id, in creation order
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM saved_positions ORDER BY rowid").fetchall()
+        return {row['id']: {
+            'id': row['id'],
+            'name': row['name'],
+            'timestamp': row['timestamp'],
+            'joint_positions': json.loads(row['joint_positions']),
+            'ee_position': json.loads(row['ee_position'])
+        } for row in rows}
+
+    def load_programs(self):
+        """
+        Returns:
+            Dictionary of programs by id, in creation order
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM programs ORDER BY rowid").fetchall()
+        return {row['id']: {
+            'id': row['id'],
+            'name': row['name'],
+            'description': row['description'],
+            'steps': json.loads(row['steps']),
+            'created': row['created'],
+            'modified': row['modified']
+        } for row in rows}
+
+    def save_position(self, position):
+        """Insert or update one saved position"""
+        row = _position_row(position)
+        with self._lock, self._conn:
+            self._conn.execute(_UPSERT_POSITION, row)
+
+    def delete_position(self, position_id):
+        """
+        Returns:
+            bool: True if the position existed
+        """
+        with self._lock, self._conn:
+            return self._conn.execute("DELETE FROM saved_positions WHERE id = ?", (position_id,)).rowcount > 0
+
+    def save_program(self, program):
+        """Insert or update one program"""
+        row = _program_row(program)
+        with self._lock, self._conn:
+            self._save_program(row)
+
+    def delete_program(self, program_id):
+        """
+        Returns:
+            bool: True if the program existed
+        """
+        with self._lock, self._conn:
+            return self._delete_program(program_id)
+
+    def _save_program(self, row):
+        self._conn.execute(_UPSERT_PROGRAM, row)
+        self._record_revision(row)
+
+    def _record_revision(self, row):
+        """Add a revision for a program row, unless it matches the latest revision"""
+        chunks = program_history.chunk_steps(json.loads(row['steps']))
+        hashes = [chunk_hash for chunk_hash, _, _ in chunks]
+        content_hash = program_history.revision_hash(row['name'], row['description'], hashes)
+        latest = self._conn.execute(
+            "SELECT revision, content_hash FROM program_revisions WHERE program_id = ? "
+            "ORDER BY revision DESC LIMIT 1", (row['id'],)).fetchone()
+        if latest is not None and latest['content_hash'] == content_hash:
+            return
+
+        # Only new chunks are stored; existing ones just gain a reference
+        self._conn.executemany(_ADD_CHUNK, [(chunk_hash, text) for chunk_hash, text, _ in chunks])
+        self._conn.execute(
+            "INSERT INTO program_revisions (program_id, revision, name, description, chunks, step_count, "
+            "content_hash, created) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (row['id'], (latest['revision'] if latest else 0) + 1, row['name'], row['description'],
+             json.dumps(hashes), sum(count for _, _, count in chunks), content_hash, row['modified']))
+
+    def _delete_program(self, program_id):
+        """Delete a program with its revisions and the chunks no other revision uses"""
+        hashes = []
+        for row in self._conn.execute("SELECT chunks FROM program_revisions WHERE program_id = ?", (program_id,)):
+            hashes.extend(json.loads(row['chunks']))
+        self._conn.executemany("UPDATE program_chunks SET refs = refs - 1 WHERE hash = ?",
+                               [(chunk_hash,) for chunk_hash in hashes])
+        self._conn.executemany("DELETE FROM program_chunks WHERE hash = ? AND refs <= 0",
+                               [(chunk_hash,) for chunk_hash in set(hashes)])
+        self._conn.execute("DELETE FROM program_revisions WHERE program_id = ?", (program_id,))
+        return self._conn.execute("DELETE FROM programs WHERE id = ?", (program_id,)).rowcount > 0
+
+    def list_revisions(self, program_id):
+        """
+        Returns:
+            List of revision summaries (without steps), newest first
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT revision, name, description, step_count, content_hash, created FROM program_revisions "
+                "WHERE program_id = ? ORDER BY revision DESC", (program_id,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def load_revision(self, program_id, revision):
+        """
+        Returns:
+            Dictionary with the revision's name, description and steps, or None
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM program_revisions WHERE program_id = ? AND revision = ?",
+                                     (program_id, revision)).fetchone()
+            if row is None:
+                return None
+            hashes = json.loads(row['chunks'])
+            chunks = {}
+            unique = list(set(hashes))
+            for start in range(0, len(unique), _CHUNK_QUERY_SIZE):
+                batch = unique[start:start + _CHUNK_QUERY_SIZE]
+                chunks.update(self._conn.execute(
+                    f"SELECT hash, steps FROM program_chunks WHERE hash IN ({','.join('?' * len(batch))})",
+                    batch).fetchall())
+
+        steps = []
+        for chunk_hash in hashes:
+            steps.extend(json.loads(chunks[chunk_hash]))
+        return {
+            'program_id': row['program_id'],
+            'revision': row['revision'],
+            'name': row['name'],
+            'description': row['description'],
+            'steps': steps,
+            'content_hash': row['content_hash'],
+            'created': row['created']
+        }
+
+    def apply(self, changes):
+        """
+        Apply several row changes in one transaction
+
+        Args:
+            changes: Iterable of ((table, id), row) where table is 'programs' or
+                     'saved_positions' and row is None to delete the row
+        """
+        with self._lock, self._conn:
+            for (table, row_id), row in changes:
+                if table == 'programs':
+                    if row is None:
+                        self._delete_program(row_id)
+                    else:
+                        self._save_program(row)
+                elif row is None:
+                    self._conn.execute(f"DELETE FROM {table} WHERE id = ?", (row_id,))
+                else:
+                    self._conn.execute(_UPSERT_POSITION, row)
+
+    def migrate_json(self, directory):
+        """
+        Import programs.json and saved_positions.json once
+
+        The import is one transaction and is recorded in the meta table, so it
+        never runs twice; the JSON files are then renamed to *.json.migrated.
+
+        Args:
+            directory: Directory holding the JSON files
+
+        Returns:
+            Dictionary with the number of programs and positions imported
+        """
+        imported = {'programs': 0, 'positions': 0}
+        with self._lock:
+            if self._meta('json_migrated'):
+                return imported
+
+            sources = {}
+            for key, filename in (('positions', 'saved_positions.json'), ('programs', 'programs.json')):
+                filepath = os.path.join(directory, filename)
+                if os.path.exists(filepath):
+                    try:
+                        with open(filepath, 'r') as f:
+                            sources[key] = (filepath, json.load(f))
+                    except (OSError, json.JSONDecodeError) as e:
+                        # Leave the file in place and retry on the next start
+                        logger.error("Could not read %s for migration: %s", filepath, e)
+                        return imported
+
+            with self._conn:
+                if 'positions' in sources:
+                    for position in sources['positions'][1].values():
+                        self._conn.execute(_UPSERT_POSITION, _position_row(position))
+                        imported['positions'] += 1
+                if 'programs' in sources:
+                    for program in sources['programs'][1].values():
+                        self._save_program(_program_row(program))
+                        imported['programs'] += 1
+                self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrated', '1')")
+
+        for filepath, _ in sources.values():
+            os.replace(filepath, filepath + '.migrated')
+        if sources:
+            logger.info("Migrated JSON storage to %s", self.path, extra={'fields': imported})
+        return imported
+
+
+class StorageWriter:
+    """
+    Commits ProgramStore changes on a worker thread, coalescing bursts
+
+    Rows are converted when a change is queued, so later edits of the caller's
+    dictionaries do not leak into a queued write. Callers change their
+    in-memory copy before queuing the change, so a table's version never
+    moves past the state it describes.
+
+    A batch that fails to commit is queued again, behind any newer changes to
+    the same rows, and retried after a delay that doubles with every failure
+    in a row, up to STORAGE_CONFIG['RETRY_MAX_DELAY']. After
+    STORAGE_CONFIG['RETRY_LIMIT'] failures in a row the changes that kept
+    failing are dropped and counted in `dropped`. `error` holds the failure
+    until a commit succeeds.
+    """
+    def __init__(self, store, debounce=None):
+        """
+        Args:
+            store: ProgramStore to write to
+            debounce: Seconds changes are collected before they are committed
+        """
+        self.store = store
+        self.debounce = debounce if debounce is not None else STORAGE_CONFIG['WRITE_DEBOUNCE']
+        # (table, id) -> row, or None for a delete; newest change per row wins
+        self._pending = {}
+        # Changes queued per table, for ETags; the epoch tells apart counters of different runs
+        self.epoch = uuid.uuid4().hex
+        self._versions = {}
+        # Message of the last failed commit, None once a commit succeeds
+        self.error = None
+        self._failures = 0           # Failed commits since the writer started
+        self._retries = 0            # Failed commits in a row
+        self.dropped = 0             # Changes given up on after RETRY_LIMIT failures
+        self._writing = False
+        self._stopping = False
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="storage-writer", daemon=True)
+            self._thread.start()
+
+    def version(self, table):
+        """Number of changes queued for a table ('programs' or 'saved_positions') since the writer started"""
+        return self._versions.get(table, 0)
+
+    def touch(self, table):
+        """Count a change to a table's in-memory copy that is committed by write_batch()"""
+        with self._condition:
+            self._versions[table] = self._versions.get(table, 0) + 1
+
+    def _queue(self, key, row):
+        with self._condition:
+            self._versions[key[0]] = self._versions.get(key[0], 0) + 1
+            if key in self._pending:
+                storage_writes.labels('coalesced').inc()
+            self._pending[key] = row
+            self._condition.notify_all()
+
+    def save_position(self, position):
+        self._queue(('saved_positions', position['id']), _position_row(position))
+
+    def delete_position(self, position_id):
+        self._queue(('saved_positions', position_id), None)
+
+    def save_program(self, program):
+        self._queue(('programs', program['id']), _program_row(program))
+
+    def delete_program(self, program_id):
+        self._queue(('programs', program_id), None)
+
+    def write_batch(self, positions=(), programs=()):
+        """
+        Commit saved positions and programs now, in one transaction on the
+        caller's thread, for bulk imports that should not pile up in the queue
+
+        Queued changes to the same rows are dropped, since the batch is newer.
+        The caller counts its changes with touch() as it makes them in memory,
+        so listings never hold a version older than the items they describe.
+        """
+        changes = [(('saved_positions', position['id']), _position_row(position)) for position in positions]
+        changes += [(('programs', program['id']), _program_row(program)) for program in programs]
+        with self._condition:
+            # Never commit alongside the worker, which may hold older versions of these rows
+            self._condition.wait_for(lambda: not self._writing)
+            for key, _ in changes:
+                self._pending.pop(key, None)
+            self._writing = True
+
+        start = time.perf_counter()
+        try:
+            self.store.apply(changes)
+            storage_writes.labels('committed').inc(len(changes))
+        except sqlite3.Error:
+            storage_writes.labels('failed').inc(len(changes))
+            raise
+        finally:
+            storage_batch_duration.observe(time.perf_counter() - start)
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+    def flush(self, timeout=None):
+        """
+        Wait until every queued change has been committed
+
+        Returns:
+            bool: False if the timeout expired or a commit failed first
+        """
+        with self._condition:
+            failures = self._failures
+            self._condition.notify_all()
+            self._condition.wait_for(lambda: (not self._pending and not self._writing) or self._failures != failures,
+                                     timeout)
+            return not self._pending and not self._writing and self._failures == failures
+
+    def stop(self, timeout=10.0):
+        """
+        Commit the remaining changes without waiting for the debounce window and end the thread
+
+        Returns:
+            bool: False if changes were left uncommitted
+        """
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        with self._condition:
+            return not self._pending and not self._writing
+
+    def _retry_delay(self):
+        """Seconds to collect changes before the next commit, longer after failures"""
+        if not self._retries:
+            return self.debounce
+        return min(self.debounce * 2 ** self._retries, STORAGE_CONFIG['RETRY_MAX_DELAY'])
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending or self._stopping)
+                if not self._pending:
+                    return
+                # Let the burst finish (or back off after a failure), unless we are shutting down
+                deadline = time.monotonic() + self._retry_delay()
+                while not self._stopping and time.monotonic() < deadline:
+                    self._condition.wait(deadline - time.monotonic())
+                self._condition.wait_for(lambda: not self._writing)
+                if not self._pending:
+                    continue
+                batch, self._pending = self._pending, {}
+                self._writing = True
+
+            start = time.perf_counter()
+            error = None
+            try:
+                self.store.apply(batch.items())
+                storage_writes.labels('committed').inc(len(batch))
+            except Exception as e:
+                error = e
+                storage_writes.labels('failed').inc(len(batch))
+                logger.exception("Error committing %s storage changes: %s", len(batch), e)
+            finally:
+                storage_batch_duration.observe(time.perf_counter() - start)
+                with self._condition:
+                    self._writing = False
+                    dropped = self._settle(batch, error)
+                    self._condition.notify_all()
+                    stopping = self._stopping
+                    pending = len(self._pending)
+
+            if error is not None:
+                if stopping:
+                    logger.error("Storage changes not committed at shutdown, %s are lost", pending)
+                    return
+                if dropped:
+                    logger.error("Dropped %s storage changes after %s failed commits: %s", len(dropped),
+                                 STORAGE_CONFIG['RETRY_LIMIT'], ', '.join(f"{table} {row_id}" for table, row_id in dropped))
+                else:
+                    logger.warning("Retrying %s storage changes in %.1fs", pending, self._retry_delay())
+
+    def _settle(self, batch, error):
+        """
+        Record the result of a commit; called with the condition held
+
+        Returns:
+            List of the (table, id) changes dropped after too many failures
+        """
+        if error is None:
+            self.error = None
+            self._retries = 0
+            storage_failing.set(0)
+            return []
+
+        self.error = str(error) or type(error).__name__
+        self._failures += 1
+        self._retries += 1
+        storage_failing.set(1)
+        if self._retries < STORAGE_CONFIG['RETRY_LIMIT']:
+            # Queue the batch again; changes queued meanwhile are newer and win
+            for key, row in batch.items():
+                self._pending.setdefault(key, row)
+            return []
+
+        # Give up on the batch; newer changes to its rows still get their own attempts
+        self._retries = 0
+        dropped = [key for key in batch if key not in self._pending]
+        self.dropped += len(dropped)
+        storage_writes.labels('dropped').inc(len(dropped))
+        return dropped
@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+
+# Modules import each other as top-level modules, run from pendant/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+
+
+@pytest.fixture
+def client(tmp_path_factory):
+    """TestClient for the app, started on its own event loop with an empty program database"""
+    from fastapi.testclient import TestClient
+
+    directory = tmp_path_factory.mktemp('app')
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setitem(config.STORAGE_CONFIG, 'DATABASE', str(directory / 'pendant.db'))
+        monkeypatch.setitem(config.STORAGE_CONFIG, 'JSON_DIRECTORY', str(directory))
+        monkeypatch.setitem(config.STORAGE_CONFIG, 'WRITE_DEBOUNCE', 0.01)
+        import app
+
+        with TestClient(app.app) as test_client:
+            yield test_client
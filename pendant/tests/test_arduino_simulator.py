@@ -0,0 +1,148 @@
+import asyncio
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from arduino_simulator import SimulatedArduino, Stepper
+from broadcaster import Broadcaster
+import config
+from routers import motion
+
+
+class SilentWebSocket:
+    async def send_text(self, payload):
+        pass
+
+    async def send_bytes(self, payload):
+        pass
+
+    async def close(self, code=1000):
+        pass
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+@pytest.fixture
+def arduino():
+    # Far faster than real time, so homing takes milliseconds
+    simulated = SimulatedArduino(time_scale=1000)
+    yield simulated
+    simulated.disconnect()
+
+
+async def next_event(events, timeout=5.0):
+    return await asyncio.wait_for(events.__anext__(), timeout)
+
+
+def test_step_times_ramp_and_fixed_interval():
+    stepper = Stepper(fast=100, slow=500, accel_steps=4)
+    intervals = np.diff(np.concatenate(([0.0], stepper.step_times(10)))) * 1e6
+    # Down from slow to fast over the first accel_steps, back up over the last (from remaining steps, as by the firmware)
+    assert intervals == pytest.approx([500, 400, 300, 200, 100, 100, 100, 200, 300, 400])
+    assert stepper.step_times(3, interval=250) == pytest.approx([250e-6, 500e-6, 750e-6])
+
+
+def test_move_is_quantized_to_whole_steps(arduino):
+    async def scenario():
+        events = arduino.events()
+        assert arduino.send_joint_command({'base_rotation': 10.0, 'shoulder_rotation': 0.0,
+                                           'prismatic_extension': 0.0, 'elbow_rotation': -5.0,
+                                           'elbow2_rotation': 0.0, 'end_effector_rotation': 0.0})
+        event = await next_event(events)
+        await events.aclose()
+        return event
+
+    event = run(scenario())
+    assert event['status'] == 'move_done'
+    step = arduino.microstep_angle
+    assert event['positions']['j1'] == pytest.approx(round(10.0 / step) * step)
+    assert event['positions']['j4'] == pytest.approx(round(-5.0 / step) * step)
+    assert event['positions']['j1'] != 10.0
+    assert event['duration'] > 0
+
+
+def test_homing_zeroes_every_motor(arduino):
+    arduino.send_command({'cmd': 'moveJoint', 'joint': 'j2', 'increment': 30})
+    assert arduino.send_home_command()
+    assert all(position == 0 for position in arduino.positions().values())
+    counters = arduino.stats.snapshot()['commands']['home_done']['counters']
+    assert counters['ok'] == 1
+
+
+def test_home_command_without_a_waiter(arduino):
+    async def scenario():
+        events = arduino.events()
+        assert arduino.send_command({'cmd': 'home'})
+        event = await next_event(events)
+        await events.aclose()
+        return event
+
+    assert run(scenario()) == {'status': 'home_done'}
+    assert not arduino.send_command({'cmd': 'bogus'})
+
+
+def test_estop_stops_the_move_and_drops_queued_commands():
+    arduino = SimulatedArduino(time_scale=1)
+    try:
+        # About 14 s of simulated motion for j1
+        arduino.send_command({'cmd': 'moveJoint', 'joint': 'j1', 'increment': 180})
+        arduino.send_command({'cmd': 'moveJoint', 'joint': 'j2', 'increment': 10})
+        time.sleep(0.1)
+        assert arduino.send_command({'cmd': 'estop'})
+        # Let the worker see the estop and take its last position update
+        time.sleep(0.1)
+        stopped = arduino.positions()
+        time.sleep(0.2)
+        assert arduino.positions() == stopped
+        assert 0 < stopped['j1'] < 180
+        assert stopped['j2'] == 0
+        assert arduino._commands.empty()
+    finally:
+        arduino.disconnect()
+
+
+def test_move_done_from_another_thread_is_published_on_the_loop(arduino, monkeypatch):
+    async def scenario():
+        broadcaster = Broadcaster(queue_size=10, send_timeout=1.0, conflate_types=[])
+        monkeypatch.setattr(motion, 'broadcaster', broadcaster)
+        publish_threads = []
+        publish = broadcaster.publish
+
+        def recording_publish(message):
+            publish_threads.append(threading.get_ident())
+            publish(message)
+
+        broadcaster.publish = recording_publish
+        await broadcaster.register(SilentWebSocket())
+        # As when a move_done is read while homing runs in an executor
+        await asyncio.to_thread(arduino.broadcast_move_done, {'status': 'move_done'})
+        await asyncio.sleep(0.01)
+        return publish_threads
+
+    assert run(scenario()) == [threading.get_ident()]
+
+
+def test_simulation_mode_moves_report_move_done(client, monkeypatch):
+    import app
+
+    # Where the simulated motors power up
+    start = {joint: 0.0 for joint in config.ROBOT_CONFIG['HOME_POSITION']}
+    monkeypatch.setattr(motion, 'current_joint_positions', dict(start))
+    monkeypatch.setattr(motion, 'current_ee_position', motion.fk.calculate(start))
+    assert config.SIMULATION_MODE
+    assert motion.controller() is app.arduino and isinstance(app.arduino, SimulatedArduino)
+
+    done = threading.Event()
+    motion.register_move_complete_callback(done.set)
+    try:
+        target = dict(start, base_rotation=2.0)
+        assert client.post('/api/motion/moveJ', json={'joint_positions': target}).json()['success']
+        # Routed from the simulator's event stream by the app
+        assert done.wait(5.0)
+    finally:
+        motion.unregister_move_complete_callback(done.set)
+    assert app.arduino.positions()['j1'] == pytest.approx(2.0, abs=app.arduino.microstep_angle)
@@ -0,0 +1,199 @@
+import asyncio
+import json
+import threading
+
+import pytest
+
+from broadcaster import Broadcaster, PositionPublisher
+from message_encoding import EE_FIELDS, JOINT_FIELDS
+
+
+class FakeWebSocket:
+    def __init__(self, block=False):
+        self.sent = []
+        self.block = block
+        self.closed = False
+
+    async def send_text(self, payload):
+        if self.block:
+            await asyncio.Event().wait()
+        self.sent.append(json.loads(payload))
+
+    async def send_bytes(self, payload):
+        self.sent.append(payload)
+
+    async def close(self, code=1000):
+        self.closed = True
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_messages_reach_only_subscribed_clients():
+    async def scenario():
+        broadcaster = Broadcaster(queue_size=10, send_timeout=1.0, conflate_types=[])
+        everything, homing_only = FakeWebSocket(), FakeWebSocket()
+        await broadcaster.register(everything)
+        await broadcaster.register(homing_only, topics=['homing'])
+        broadcaster.publish({'type': 'homing_status', 'status': 'started'})
+        broadcaster.publish({'type': 'jog_stop'})
+        broadcaster.publish({'type': 'emergency_stop'})
+        await asyncio.sleep(0.05)
+        return [m['type'] for m in everything.sent], [m['type'] for m in homing_only.sent]
+
+    everything, homing_only = run(scenario())
+    assert everything == ['homing_status', 'jog_stop', 'emergency_stop']
+    # 'system' messages are always delivered
+    assert homing_only == ['homing_status', 'emergency_stop']
+
+
+def test_rejected_subscribe_changes_nothing():
+    async def scenario():
+        broadcaster = Broadcaster(queue_size=10, send_timeout=1.0)
+        websocket = FakeWebSocket()
+        await broadcaster.register(websocket, topics=['homing'])
+        before = broadcaster.clients[websocket].subscription()
+        for rates in ({'position': -1}, {'position': 'fast'}):
+            with pytest.raises(ValueError):
+                broadcaster.subscribe(websocket, ['program', 'position'], rates)
+        with pytest.raises(ValueError):
+            broadcaster.subscribe(websocket, ['program', 'nonsense'])
+        after = broadcaster.clients[websocket].subscription()
+        return before, after, broadcaster.has_subscribers('program')
+
+    before, after, program_subscribers = run(scenario())
+    assert after == before
+    assert not program_subscribers
+
+
+def test_subscribe_applies_topics_and_rates():
+    async def scenario():
+        broadcaster = Broadcaster(queue_size=10, send_timeout=1.0)
+        websocket = FakeWebSocket()
+        await broadcaster.register(websocket, topics=[])
+        return broadcaster.subscribe(websocket, ['position'], {'position': 5})
+
+    subscription = run(scenario())
+    assert subscription['topics'] == ['position', 'system']
+    assert subscription['rates'] == {'position': 5.0}
+
+
+def test_client_that_falls_behind_is_evicted():
+    async def scenario():
+        broadcaster = Broadcaster(queue_size=2, send_timeout=10.0, conflate_types=[])
+        stuck, healthy = FakeWebSocket(block=True), FakeWebSocket()
+        await broadcaster.register(stuck)
+        await broadcaster.register(healthy)
+        for _ in range(5):
+            broadcaster.publish({'type': 'jog_stop'})
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.05)
+        return broadcaster, stuck, healthy
+
+    broadcaster, stuck, healthy = run(scenario())
+    assert broadcaster.evicted == 1
+    assert stuck not in broadcaster.clients
+    assert stuck.closed
+    assert len(healthy.sent) == 5
+
+
+def position_update(base_rotation):
+    joints = dict.fromkeys(JOINT_FIELDS, 0.0)
+    joints['base_rotation'] = base_rotation
+    return {'type': 'position_update', 'timestamp': 0.0, 'joint_positions': joints,
+            'ee_position': dict.fromkeys(EE_FIELDS, 0.0)}
+
+
+def test_slow_client_gets_only_the_newest_position():
+    async def scenario():
+        broadcaster = Broadcaster(queue_size=10, send_timeout=10.0, conflate_types=['position_update'])
+        slow, fast = FakeWebSocket(), FakeWebSocket()
+        gate = asyncio.Event()
+        send_text = slow.send_text
+
+        async def gated_send_text(payload):
+            await gate.wait()
+            await send_text(payload)
+
+        slow.send_text = gated_send_text
+        await broadcaster.register(slow)
+        await broadcaster.register(fast)
+        for i in range(20):
+            broadcaster.publish(position_update(float(i)))
+            if i == 10:
+                broadcaster.publish({'type': 'jog_stop'})
+            await asyncio.sleep(0.001)
+        await asyncio.sleep(0.02)
+        gate.set()
+        await asyncio.sleep(0.05)
+        return broadcaster, slow, fast
+
+    def received(websocket):
+        return [message['joint_positions']['base_rotation'] if message['type'] == 'position_update' else message['type']
+                for message in websocket.sent]
+
+    broadcaster, slow, fast = run(scenario())
+    # Events are sent ahead of a position frame published in the same tick
+    assert received(fast) == [float(i) for i in range(10)] + ['jog_stop'] + [float(i) for i in range(10, 20)]
+    # The frame being sent when the client stalled, then other messages in order and the newest frame
+    assert received(slow) == [0.0, 'jog_stop', 19.0]
+    assert broadcaster.stats()['clients'][0]['superseded'] == 18
+    assert broadcaster.evicted == 0
+
+
+def test_malformed_message_is_dropped_without_stopping_delivery():
+    async def scenario():
+        broadcaster = Broadcaster(queue_size=10, send_timeout=1.0, conflate_types=[])
+        websocket = FakeWebSocket()
+        await broadcaster.register(websocket)
+        broadcaster.publish({'type': 'position_update'})
+        broadcaster.publish({'type': 'jog_stop'})
+        await asyncio.sleep(0.05)
+        return [m['type'] for m in websocket.sent]
+
+    assert run(scenario()) == ['jog_stop']
+
+
+def test_publish_threadsafe_hops_back_to_the_loop():
+    async def scenario():
+        broadcaster = Broadcaster(queue_size=10, send_timeout=1.0, conflate_types=[])
+        websocket = FakeWebSocket()
+        await broadcaster.register(websocket)
+        publish_threads = []
+        publish = broadcaster.publish
+
+        def recording_publish(message):
+            publish_threads.append(threading.get_ident())
+            publish(message)
+
+        broadcaster.publish = recording_publish
+        await asyncio.to_thread(broadcaster.publish_threadsafe, {'type': 'move_done'})
+        broadcaster.publish_threadsafe({'type': 'jog_stop'})
+        await asyncio.sleep(0.05)
+        return publish_threads, [m['type'] for m in websocket.sent]
+
+    publish_threads, sent = run(scenario())
+    assert publish_threads == [threading.get_ident()] * 2
+    assert sent == ['move_done', 'jog_stop']
+
+
+def test_position_publisher_skips_changes_within_the_deadband():
+    published = []
+    broadcaster = Broadcaster(queue_size=10, send_timeout=1.0, conflate_types=[])
+    broadcaster.publish = published.append
+    joints = {'base_rotation': 0.0}
+    publisher = PositionPublisher(broadcaster, lambda: (dict(joints), {'x': 0.0}), rate=30, deadband=0.5)
+
+    assert publisher.publish_now()
+    joints['base_rotation'] = 0.4
+    assert not publisher.publish_now()
+    # Measured against the last published frame, so small changes still add up
+    joints['base_rotation'] = 0.6
+    assert publisher.publish_now()
+    assert not publisher.publish_now()
+    publisher.request_update()
+    assert publisher.publish_now()
+
+    assert [frame['joint_positions']['base_rotation'] for frame in published] == [0.0, 0.6, 0.6]
+    assert (publisher.published, publisher.skipped) == (3, 2)
@@ -0,0 +1,78 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from config import ROBOT_CONFIG
+import dry_run
+
+# Inside the workspace, unlike the home position
+START = dict(ROBOT_CONFIG['HOME_POSITION'], elbow_rotation=90.0, prismatic_extension=0.0)
+
+
+def move(velocity=50, **joints):
+    return {'type': 'moveJ', 'data': {'joint_positions': dict(START, **joints), 'velocity': velocity}}
+
+
+def program(*steps, program_id='p'):
+    return {'id': program_id, 'name': program_id, 'steps': list(steps)}
+
+
+def simulate(*steps):
+    return dry_run.simulate_program(program(*steps), START)
+
+
+def test_cycle_time_is_moves_plus_waits():
+    result = simulate(move(base_rotation=20), {'type': 'wait', 'data': {'time': 1.5}}, move())
+    steps = result['steps']
+    assert [step['type'] for step in steps] == ['moveJ', 'wait', 'moveJ']
+    assert steps[1]['start'] == pytest.approx(steps[0]['duration'])
+    assert result['cycle_time'] == pytest.approx(sum(step['duration'] for step in steps))
+    assert result['violations'] == []
+    assert result['peak_velocity']['base_rotation'] > 0
+
+
+def test_step_rate_violation_for_a_fast_prismatic_move():
+    limit = dry_run.step_rate_limits()['prismatic_extension']
+    # At full speed the planner allows more than the stepper can do
+    assert ROBOT_CONFIG['DEFAULT_SPEEDS']['prismatic_extension'] > limit
+
+    fast = simulate(move(100, prismatic_extension=150))
+    assert [violation['type'] for violation in fast['violations']] == ['step_rate']
+    assert fast['violations'][0]['joint'] == 'prismatic_extension'
+    assert fast['violations'][0]['value'] > limit
+
+    slow = simulate(move(10, prismatic_extension=150))
+    assert slow['violations'] == []
+
+
+def test_invalid_steps_are_reported():
+    result = simulate(move(base_rotation=500), {'type': 'bogus', 'data': {}})
+    assert [violation['type'] for violation in result['violations']] == ['invalid_step', 'invalid_step']
+    assert result['cycle_time'] == 0.0
+
+
+def test_workspace_violation_between_valid_poses():
+    # Both ends are inside the workspace, but the arm sweeps out past x = 500 on the way
+    result = simulate(move(10, prismatic_extension=150), move(10, prismatic_extension=150, elbow_rotation=-90))
+    assert [violation['type'] for violation in result['violations']] == ['workspace']
+    assert result['violations'][0]['step'] == 2
+    assert result['violations'][0]['axis'] == 'x'
+
+
+def test_parallel_dry_runs_keep_program_order():
+    programs = [program(move(base_rotation=angle), program_id=str(angle)) for angle in (10, 20, 30)]
+    results = dry_run.run_dry_runs(programs, START, workers=2)
+    assert [result['program_id'] for result in results] == ['10', '20', '30']
+    for each, result in zip(programs, results):
+        expected = dry_run.simulate_program(each, START)
+        assert result == dict(expected, simulation_time=result['simulation_time'])
+
+
+def test_workers_do_not_import_the_server():
+    # What a spawned worker imports to unpickle simulate_program
+    code = "import sys, dry_run; print(sorted(m for m in ('routers.motion', 'broadcaster', 'app') if m in sys.modules))"
+    imported = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(dry_run.__file__)),
+                              capture_output=True, text=True, check=True).stdout
+    assert imported.strip() == '[]'
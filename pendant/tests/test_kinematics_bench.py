@@ -0,0 +1,41 @@
+import json
+import os
+
+import pytest
+
+from config import LOGGING_CONFIG
+
+with pytest.MonkeyPatch.context() as monkeypatch:
+    # The benchmark quiets logging by default; keep that out of the test session
+    monkeypatch.setenv('PENDANT_LOG_LEVEL', os.environ.get('PENDANT_LOG_LEVEL', LOGGING_CONFIG['LEVEL']))
+    from benchmarks.kinematics_bench import BASELINE_PATH, compare, run
+
+
+@pytest.fixture
+def baseline():
+    with open(BASELINE_PATH) as f:
+        return json.load(f)
+
+
+def test_convergence_matches_the_stored_baseline(baseline):
+    parameters = baseline['parameters']
+    # Convergence only depends on the pose set, so skip most of the timing work
+    results = run(parameters['poses'], 1, 1, parameters['seed'])
+    assert results['convergence'] == pytest.approx(baseline['convergence'], abs=1e-9)
+    assert set(results['timings']) == set(baseline['timings'])
+
+
+def test_compare_reports_regressions(baseline):
+    results = {'timings': dict(baseline['timings']), 'convergence': dict(baseline['convergence'])}
+    assert compare(results, baseline, 0.25) == []
+
+    results['timings']['fk_single'] *= 1.2
+    results['timings']['ik_analytic_batch'] *= 1.5
+    results['convergence']['ik_differential_success_rate'] -= 0.05
+    results['convergence']['ik_differential_mean_iterations'] *= 1.1
+    regressions = compare(results, baseline, 0.25)
+    assert [regression.split(':')[0] for regression in regressions] == [
+        'ik_analytic_batch', 'ik_differential_success_rate', 'ik_differential_mean_iterations']
+
+    # A different pose set only compares timings
+    assert compare(results, baseline, 0.25, check_convergence=False) == regressions[:1]
@@ -0,0 +1,100 @@
+import pytest
+
+import listing
+from listing import Listing
+
+
+def items(*names):
+    return {f'id{i}': {'id': f'id{i}', 'name': name} for i, name in enumerate(names)}
+
+
+def test_cursor_round_trip_and_invalid_cursor():
+    key = ('pick', 'abc')
+    assert listing.decode_cursor(listing.encode_cursor(key)) == key
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        listing.decode_cursor('not a cursor')
+
+
+def test_etag_matching():
+    etag = listing.make_etag('epoch', 3, 'name', None, 100)
+    assert etag == listing.make_etag('epoch', 3, 'name', None, 100)
+    assert etag != listing.make_etag('epoch', 4, 'name', None, 100)
+    assert etag != listing.make_etag('other', 3, 'name', None, 100)
+    assert listing.etag_matches(etag, etag)
+    assert listing.etag_matches(f'"x", W/{etag}', etag)
+    assert listing.etag_matches('*', etag)
+    assert not listing.etag_matches(None, etag)
+    assert not listing.etag_matches('"x"', etag)
+
+
+def test_pages_by_name_with_filter():
+    table = items('beta', 'Alpha', 'gamma', 'alphabet', 'delta')
+    pager = Listing(dict)
+    page, cursor = pager.page(table, 1, limit=2)
+    assert [item['name'] for item in page] == ['Alpha', 'alphabet']
+    page, cursor = pager.page(table, 1, cursor=cursor, limit=2)
+    assert [item['name'] for item in page] == ['beta', 'delta']
+    page, cursor = pager.page(table, 1, cursor=cursor, limit=2)
+    assert [item['name'] for item in page] == ['gamma'] and cursor is None
+
+    page, cursor = pager.page(table, 1, name='ALPHA', limit=1)
+    assert [item['name'] for item in page] == ['Alpha']
+    page, cursor = pager.page(table, 1, name='ALPHA', cursor=cursor, limit=1)
+    assert [item['name'] for item in page] == ['alphabet'] and cursor is None
+
+
+def test_cursor_survives_inserts_and_deletes():
+    table = items('a', 'b', 'c', 'd')
+    pager = Listing(dict)
+    page, cursor = pager.page(table, 1, limit=2)
+    del table['id0']
+    table['new'] = {'id': 'new', 'name': 'aa'}
+    page, _ = pager.page(table, 2, cursor=cursor, limit=10)
+    assert [item['name'] for item in page] == ['c', 'd']
+
+
+def test_summaries_are_rebuilt_only_when_the_version_changes():
+    built = []
+    pager = Listing(lambda item: built.append(item['id']) or item)
+    table = items('a', 'b')
+    pager.page(table, 1)
+    pager.page(table, 1)
+    assert len(built) == 2
+    pager.page(table, 2)
+    assert len(built) == 4
+
+
+@pytest.mark.parametrize('path', ['/api/saved_positions', '/api/programs/saved_positions'])
+def test_saved_position_listing_endpoints(client, path):
+    # A prefix of its own, as the app is shared with other tests
+    prefix = 'listing' + path.replace('/', '-')
+    for name in ('pick', 'place', 'home'):
+        assert client.post('/api/save_position', json={'name': f'{prefix} {name}'}).json()['success']
+
+    params = {'name': prefix, 'limit': 2}
+    response = client.get(path, params=params)
+    assert response.status_code == 200
+    body = response.json()
+    assert [position['name'] for position in body['positions']] == [f'{prefix} home', f'{prefix} pick']
+    rest = client.get(path, params={**params, 'cursor': body['next_cursor']}).json()
+    assert [position['name'] for position in rest['positions']] == [f'{prefix} place']
+    assert rest['next_cursor'] is None
+
+    etag = response.headers['etag']
+    assert client.get(path, params=params, headers={'If-None-Match': etag}).status_code == 304
+    client.post('/api/save_position', json={'name': 'another'})
+    changed = client.get(path, params=params, headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['etag'] != etag
+
+    assert client.get(path, params={'cursor': 'bogus'}).json() == {'success': False, 'error': 'Invalid cursor'}
+
+
+def test_program_listing_has_summaries_only(client):
+    created = client.post('/api/programs/programs', json={'name': 'Listing weld', 'description': 'seam'}).json()
+    client.put(f"/api/programs/programs/{created['program_id']}", json={'steps': [{'type': 'wait', 'data': {'time': 1}}]})
+    listed, = client.get('/api/programs/programs', params={'name': 'listing WELD'}).json()['programs']
+    assert 'steps' not in listed
+    assert listed['id'] == created['program_id']
+    assert listed['description'] == 'seam'
+    assert listed['step_count'] == 1
@@ -0,0 +1,73 @@
+import contextlib
+import io
+import json
+import logging
+import sys
+
+import log
+
+
+@contextlib.contextmanager
+def captured():
+    """
+    Restart logging to write to a StringIO, and back to stdout afterwards (in
+    the test itself, as pytest replaces sys.stdout between fixture setup and the test)
+    """
+    stdout = sys.stdout
+    sys.stdout = io.StringIO()
+    log.shutdown_logging()
+    log.setup_logging()
+    try:
+        yield sys.stdout
+    finally:
+        log.shutdown_logging()
+        sys.stdout = stdout
+        log.setup_logging()
+
+
+def lines(output):
+    return output.getvalue().splitlines()
+
+
+def test_queued_records_are_flushed_on_shutdown():
+    with captured() as output:
+        logger = log.get_logger('test_log')
+        for i in range(500):
+            logger.info("record %s", i)
+        log.shutdown_logging()
+        assert [line.split(': ', 1)[1] for line in lines(output)] == [f"record {i}" for i in range(500)]
+
+
+def test_loggers_keep_logging_across_a_restart():
+    with captured() as output:
+        logger = log.get_logger('test_log')
+        log.shutdown_logging()
+        # Written directly while the background writer is stopped
+        logger.warning("after shutdown")
+        assert lines(output)[-1].endswith("test_log: after shutdown")
+
+        log.setup_logging()
+        assert any(isinstance(handler, logging.handlers.QueueHandler)
+                   for handler in logging.getLogger(log.ROOT_LOGGER).handlers)
+        logger.warning("after restart")
+        log.shutdown_logging()
+        assert lines(output)[-1].endswith("test_log: after restart")
+
+
+def test_arguments_are_resolved_when_logged():
+    with captured() as output:
+        logger = log.get_logger('test_log')
+        joints = {'base_rotation': 1.0}
+        logger.info("joints %s", joints, extra={'fields': {'step': 3}})
+        joints['base_rotation'] = 2.0
+        log.shutdown_logging()
+        assert lines(output)[-1].endswith("test_log: joints {'base_rotation': 1.0} step=3")
+
+
+def test_json_format():
+    record = logging.LogRecord('pendant.motion', logging.INFO, __file__, 1, "moved %s", ('j1',), None)
+    record.fields = {'duration': 0.5}
+    entry = json.loads(log.StructuredFormatter('json').format(record))
+    assert entry['logger'] == 'motion'
+    assert entry['msg'] == 'moved j1'
+    assert entry['duration'] == 0.5
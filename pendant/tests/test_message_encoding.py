@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+from message_encoding import (EE_FIELDS, JOINT_FIELDS, OutgoingMessage, PositionFrame,
+                              available_encodings, decode_packed)
+
+
+def position_message(timestamp=1.5, **changes):
+    joints = {field: float(i) for i, field in enumerate(JOINT_FIELDS)}
+    ee = {field: 10.0 + i for i, field in enumerate(EE_FIELDS)}
+    for field, value in changes.items():
+        (joints if field in joints else ee)[field] = value
+    return {'type': 'position_update', 'joint_positions': joints, 'ee_position': ee, 'timestamp': timestamp}
+
+
+def test_packed_full_frame_round_trip():
+    frame = PositionFrame(position_message(), seq=7)
+    decoded = decode_packed(frame.payload('packed'))
+    assert decoded['kind'] == 'full'
+    assert decoded['seq'] == 7
+    assert decoded['timestamp'] == 1.5
+    assert decoded['values']['elbow_rotation'] == 3.0
+    assert decoded['values']['yaw'] == 15.0
+
+
+def test_packed_delta_holds_only_changed_values():
+    first = PositionFrame(position_message(), seq=1)
+    second = PositionFrame(position_message(2.0, base_rotation=4.5, z=-3.0), seq=2, previous_values=first.values)
+    decoded = decode_packed(second.payload('packed', delta=True))
+    assert decoded['kind'] == 'delta'
+    assert decoded['values'] == {'base_rotation': 4.5, 'z': -3.0}
+
+
+def test_delta_without_previous_frame_is_full():
+    frame = PositionFrame(position_message(), seq=3)
+    message = json.loads(frame.payload('json', delta=True))
+    assert message['type'] == 'position_update'
+    assert message['seq'] == 3
+
+
+def test_json_delta():
+    first = PositionFrame(position_message(), seq=1)
+    second = PositionFrame(position_message(base_rotation=9.0), seq=2, previous_values=first.values)
+    message = json.loads(second.payload('json', delta=True))
+    assert message == {'type': 'position_delta', 'seq': 2, 'timestamp': 1.5, 'changes': {'base_rotation': 9.0}}
+
+
+def test_payloads_are_encoded_once():
+    frame = PositionFrame(position_message(), seq=1)
+    assert frame.payload('packed') is frame.payload('packed')
+    event = OutgoingMessage({'type': 'move_done'})
+    assert event.payload('packed') is event.payload()
+
+
+@pytest.mark.skipif('msgpack' not in available_encodings(), reason="msgpack is not installed")
+def test_msgpack_frame():
+    import msgpack
+    frame = PositionFrame(position_message(), seq=5)
+    assert msgpack.unpackb(frame.payload('msgpack'))['seq'] == 5
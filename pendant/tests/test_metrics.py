@@ -0,0 +1,82 @@
+import pytest
+
+from metrics import Counter, Gauge, Histogram, HistogramMetric, MetricFamily, MetricsRegistry
+
+
+def test_registry_renders_the_prometheus_text_format():
+    registry = MetricsRegistry()
+    moves = Counter('test_moves_total', 'Moves by type', ['type'], registry=registry)
+    active = Gauge('test_active', 'Whether something is active', registry=registry)
+    latency = HistogramMetric('test_seconds', 'Latency', buckets=[0.1, 1.0], registry=registry)
+
+    moves.labels('moveJ').inc()
+    moves.labels(type='moveJ').inc(2)
+    moves.labels('say "hi"\n').inc()
+    active.set(1)
+    active.dec()
+    for value in (0.05, 0.5, 5.0):
+        latency.observe(value)
+
+    def collector():
+        family = MetricFamily('test_queue_depth', 'Collected at scrape time', 'gauge')
+        family.add({}, 3)
+        return [family]
+    registry.register_collector(collector)
+
+    assert registry.render() == '\n'.join([
+        '# HELP test_moves_total Moves by type',
+        '# TYPE test_moves_total counter',
+        'test_moves_total{type="moveJ"} 3',
+        'test_moves_total{type="say \\"hi\\"\\n"} 1',
+        '# HELP test_active Whether something is active',
+        '# TYPE test_active gauge',
+        'test_active 0',
+        '# HELP test_seconds Latency',
+        '# TYPE test_seconds histogram',
+        'test_seconds_bucket{le="0.1"} 1',
+        'test_seconds_bucket{le="1"} 2',
+        'test_seconds_bucket{le="+Inf"} 3',
+        'test_seconds_sum 5.55',
+        'test_seconds_count 3',
+        '# HELP test_queue_depth Collected at scrape time',
+        '# TYPE test_queue_depth gauge',
+        'test_queue_depth 3',
+    ]) + '\n'
+
+
+def test_invalid_registrations_and_labels():
+    registry = MetricsRegistry()
+    moves = Counter('test_moves_total', 'Moves by type', ['type'], registry=registry)
+    with pytest.raises(ValueError, match="already registered"):
+        Counter('test_moves_total', 'Again', registry=registry)
+    with pytest.raises(ValueError, match="has labels"):
+        moves.inc()
+    with pytest.raises(ValueError, match="expects labels"):
+        moves.labels('moveJ', 'extra')
+    with pytest.raises(ValueError, match="Missing label"):
+        moves.labels(kind='moveJ')
+
+
+def test_histogram_percentiles_stay_within_a_bucket():
+    histogram = Histogram([1, 2, 4, 8])
+    for value in (0.5, 1.5, 1.5, 3.0, 7.0):
+        histogram.observe(value)
+    # The upper bound of the bucket holding the percentile, within what was observed
+    assert histogram.percentile(20) == 1
+    assert histogram.percentile(50) == 2
+    assert histogram.percentile(100) == 7.0
+    snapshot = histogram.snapshot()
+    assert (snapshot['count'], snapshot['min'], snapshot['max']) == (5, 0.5, 7.0)
+    histogram.reset()
+    assert histogram.snapshot() == {'count': 0}
+
+
+def test_metrics_endpoint(client):
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/plain; version=0.0.4')
+    names = {line.split()[2] for line in response.text.splitlines() if line.startswith('# TYPE')}
+    # One from each instrumented layer: jog loop, kinematics, broadcaster, programs, storage and serial
+    assert {'pendant_jog_loop_period_seconds', 'pendant_fk_seconds', 'pendant_ik_iterations',
+            'pendant_websocket_connections', 'pendant_program_step_seconds', 'pendant_storage_writes_total',
+            'pendant_serial_latency_seconds'} <= names
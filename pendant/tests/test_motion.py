@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+from config import ROBOT_CONFIG
+from routers import motion
+
+HOME = dict(ROBOT_CONFIG['HOME_POSITION'])
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Motion at the home position without an Arduino backend, on a clock the test advances"""
+    clock = Clock()
+    monkeypatch.setattr(motion, 'jog_clock', clock)
+    monkeypatch.setattr(motion, 'arduino_communicator', None)
+    monkeypatch.setattr(motion, 'active_move', None)
+    monkeypatch.setattr(motion, 'current_joint_positions', dict(HOME))
+    monkeypatch.setattr(motion, 'current_ee_position', motion.fk.calculate(HOME))
+    return clock
+
+
+def move_to(target, velocity=50):
+    assert asyncio.run(motion.handle_moveJ({'joint_positions': target, 'velocity': velocity}))
+    return motion.active_move[0]
+
+
+def test_published_position_follows_the_planned_move(clock):
+    target = dict(HOME, base_rotation=90.0, prismatic_extension=100.0)
+    segment = move_to(target)
+    assert segment.duration > 0.5
+
+    # The commanded position is the target at once; the published one travels there
+    assert motion.current_joint_positions == target
+    assert motion.sample_positions()[0] == pytest.approx(HOME)
+    clock.now += segment.duration / 2
+    joints, ee = motion.sample_positions()
+    assert joints['base_rotation'] == pytest.approx(45.0)
+    assert joints['prismatic_extension'] == pytest.approx(75.0)
+    assert ee == pytest.approx(motion.fk.calculate(joints))
+    clock.now += segment.duration
+    assert motion.sample_positions() == (target, motion.current_ee_position)
+    assert motion.active_move is None
+
+
+def test_move_starts_where_the_previous_one_is(clock):
+    first = move_to(dict(HOME, base_rotation=90.0))
+    clock.now += first.duration / 2
+    second = move_to(dict(HOME, base_rotation=0.0))
+    assert second.start['base_rotation'] == pytest.approx(45.0)
+
+
+def test_emergency_stop_holds_the_position_part_way(clock):
+    segment = move_to(dict(HOME, base_rotation=90.0))
+    clock.now += segment.duration / 2
+    asyncio.run(motion.handle_emergency_stop())
+    assert motion.active_move is None
+    assert motion.current_joint_positions['base_rotation'] == pytest.approx(45.0)
+    clock.now += segment.duration
+    assert motion.sample_positions()[0]['base_rotation'] == pytest.approx(45.0)
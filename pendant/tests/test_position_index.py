@@ -0,0 +1,86 @@
+import math
+import random
+
+import pytest
+
+from config import ROBOT_CONFIG
+from position_index import JOINTS, PositionIndex
+import program_executor
+from program_executor import executor
+
+
+def position(position_id, x, y, z, joints=None):
+    return {'id': position_id, 'ee_position': {'x': x, 'y': y, 'z': z},
+            'joint_positions': joints or {joint: 0.0 for joint in JOINTS}}
+
+
+def random_positions(count, seed=3):
+    rng = random.Random(seed)
+    return [position(str(i), rng.uniform(-400, 400), rng.uniform(-400, 400), rng.uniform(0, 400),
+                     {joint: rng.uniform(-90, 90) for joint in JOINTS}) for i in range(count)]
+
+
+def brute_force(positions, point, count=None, radius=None):
+    found = sorted((math.dist((p['ee_position']['x'], p['ee_position']['y'], p['ee_position']['z']), point), p['id'])
+                   for p in positions)
+    if radius is not None:
+        found = [entry for entry in found if entry[0] <= radius]
+    return found[:count] if count else found
+
+
+@pytest.mark.parametrize('cell_size', [5.0, 25.0, 1000.0])
+def test_nearest_and_within_match_brute_force(cell_size):
+    positions = random_positions(500)
+    index = PositionIndex(cell_size)
+    index.rebuild(positions)
+    rng = random.Random(4)
+    for _ in range(50):
+        point = (rng.uniform(-600, 600), rng.uniform(-600, 600), rng.uniform(-200, 600))
+        query = dict(zip('xyz', point))
+        assert index.nearest(query, 7) == brute_force(positions, point, count=7)
+        radius = rng.choice([1.0, 30.0, 200.0])
+        assert index.within(query, radius) == brute_force(positions, point, radius=radius)
+
+
+def test_updates_and_removals_are_indexed():
+    index = PositionIndex(25.0)
+    index.add(position('a', 0, 0, 0))
+    index.add(position('b', 100, 0, 0))
+    index.add(position('a', 200, 0, 0))
+    assert len(index) == 2
+    assert index.nearest({'x': 190, 'y': 0, 'z': 0}) == [(10.0, 'a')]
+    index.remove('a')
+    assert 'a' not in index
+    assert index.nearest({'x': 190, 'y': 0, 'z': 0}) == [(90.0, 'b')]
+    assert PositionIndex().nearest({'x': 0, 'y': 0, 'z': 0}) == []
+
+
+def test_nearest_joints_weights_joints_by_speed():
+    speeds = ROBOT_CONFIG['DEFAULT_SPEEDS']
+    home = {joint: 0.0 for joint in JOINTS}
+    slow = min(JOINTS, key=speeds.get)
+    fast = max(JOINTS, key=speeds.get)
+    index = PositionIndex()
+    # The same number of degrees, but the slow joint takes longer to cover them
+    index.add(position('slow', 0, 0, 0, dict(home, **{slow: 10.0})))
+    index.add(position('fast', 0, 0, 0, dict(home, **{fast: 10.0})))
+    found = index.nearest_joints(home, 2)
+    assert [position_id for _, position_id in found] == ['fast', 'slow']
+    assert found[0][0] == pytest.approx(10.0 / speeds[fast])
+
+    positions = random_positions(200)
+    index.rebuild(positions)
+    query = positions[17]['joint_positions']
+    assert index.nearest_joints(query, 1) == [(0.0, '17')]
+
+
+@pytest.mark.parametrize('state', [program_executor.RUNNING, program_executor.STOPPING])
+def test_snap_refuses_while_a_program_moves_the_arm(client, monkeypatch, state):
+    assert client.post('/api/save_position', json={'name': 'snap here'}).json()['success']
+    monkeypatch.setattr(executor, 'state', state)
+    result = client.post('/api/programs/saved_positions/snap', json={}).json()
+    assert result == {'success': False, 'error': f"Cannot snap while a program is {state}"}
+
+    monkeypatch.setattr(executor, 'state', program_executor.PAUSED)
+    result = client.post('/api/programs/saved_positions/snap', json={}).json()
+    assert result['success'] and result['position']['name'] == 'snap here'
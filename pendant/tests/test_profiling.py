@@ -0,0 +1,83 @@
+import sys
+import threading
+import time
+
+import pytest
+
+import profiling
+from profiling import profile_scope
+from routers import motion
+
+
+@pytest.fixture(autouse=True)
+def no_session():
+    yield
+    profiling.stop_session()
+
+
+def outside_the_scope():
+    return sum(range(100))
+
+
+def busy_in_ik_scope(seconds):
+    deadline = time.perf_counter() + seconds
+    with profile_scope('ik'):
+        while time.perf_counter() < deadline:
+            pass
+
+
+def test_cprofile_session_covers_only_its_scope():
+    session = profiling.start_session('cprofile', 'ik')
+    motion.ik.calculate(motion.current_ee_position)
+    outside_the_scope()
+    profiling.stop_session()
+
+    assert session.scope_entries >= 1
+    text = session.pstats_text(limit=100)
+    assert 'kinematics.py' in text
+    assert 'outside_the_scope' not in text
+    # Nothing is left hooked into the interpreter once stopped
+    assert sys.getprofile() is None
+
+
+def test_sampling_session_collects_collapsed_stacks():
+    session = profiling.start_session('sampling', 'ik', interval=0.001)
+    worker = threading.Thread(target=busy_in_ik_scope, args=(0.2,))
+    worker.start()
+    worker.join()
+    profiling.stop_session()
+
+    assert session.samples > 10
+    stack, count = session.collapsed().splitlines()[0].rsplit(' ', 1)
+    assert stack.split(';')[-1].startswith('busy_in_ik_scope')
+    assert int(count) > 0
+    assert not session._sampler.is_alive()
+    assert [thread for thread in threading.enumerate() if thread.name == 'profiling-sampler'] == []
+
+
+def test_invalid_sessions():
+    with pytest.raises(ValueError, match="Unknown profiling mode"):
+        profiling.start_session('perf')
+    with pytest.raises(ValueError, match="Unknown profiling scope"):
+        profiling.start_session(scope='serial')
+    with pytest.raises(ValueError, match="Sample interval must be at least"):
+        profiling.start_session(interval=0.0)
+    profiling.start_session()
+    with pytest.raises(ValueError, match="already running"):
+        profiling.start_session()
+
+
+def test_session_over_the_api_stops_itself(client):
+    started = client.post('/api/admin/profile', json={'mode': 'cprofile', 'scope': 'all', 'duration': 0.2}).json()
+    assert started['success'] and started['session']['running']
+    assert client.get('/api/admin/profile/result').json()['error'] == "Profiling session is still running"
+
+    deadline = time.monotonic() + 5.0
+    while client.get('/api/admin/profile').json()['session']['running']:
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    result = client.get('/api/admin/profile/result')
+    assert result.headers['content-type'].startswith('text/plain')
+    assert 'function calls' in result.text
+    assert client.get('/api/admin/profile/result', params={'format': 'collapsed'}).json()['success'] is False
+    assert client.delete('/api/admin/profile').json()['error'] == "No profiling session is running"
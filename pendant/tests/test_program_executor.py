@@ -0,0 +1,155 @@
+import asyncio
+
+import pytest
+
+import config
+from config import ROBOT_CONFIG
+import program_executor
+from program_executor import ProgramExecutor, IDLE, RUNNING, PAUSED, STOPPING, FAULTED
+from routers import motion
+
+# Inside the workspace, unlike the home position
+START = dict(ROBOT_CONFIG['HOME_POSITION'], elbow_rotation=90.0, prismatic_extension=0.0)
+
+
+def move(**joints):
+    return {'type': 'moveJ', 'data': {'joint_positions': dict(START, **joints), 'velocity': 100}}
+
+
+def wait(seconds):
+    return {'type': 'wait', 'data': {'time': seconds}}
+
+
+def program(*steps, program_id='p'):
+    return {'id': program_id, 'name': program_id, 'steps': list(steps)}
+
+
+def prefetch(result):
+    return program_executor.program_prefetch.labels(result).value
+
+
+@pytest.fixture
+def executor(monkeypatch):
+    """
+    An executor recording its state changes, with motion at START, no Arduino
+    backend and short simulated moves
+    """
+    monkeypatch.setitem(config.MOVEMENT_PARAMS, 'MIN_MOVEMENT_TIME', 0.02)
+    monkeypatch.setattr(motion, 'arduino_communicator', None)
+    monkeypatch.setattr(motion, 'active_move', None)
+    monkeypatch.setattr(motion, 'current_joint_positions', dict(START))
+    monkeypatch.setattr(motion, 'current_ee_position', motion.fk.calculate(START))
+    executor = ProgramExecutor()
+    executor.states = []
+    executor.listeners.append(lambda status: executor.states.append(status['state']))
+    return executor
+
+
+async def until(condition, timeout=2.0):
+    """Wait until condition() is true"""
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.005)
+
+
+def test_start_requires_open(executor):
+    with pytest.raises(RuntimeError, match="not open"):
+        executor.start(program(move()))
+
+
+def test_pause_resume_and_stop_part_way_through_a_wait(executor):
+    async def scenario():
+        executor.open()
+        executor.start(program(move(base_rotation=0.1), wait(5), move(base_rotation=0.2)))
+        await until(lambda: executor.step_index == 2)
+        executor.pause()
+        await asyncio.sleep(0.05)
+        assert (executor.state, executor.step_index) == (PAUSED, 2)
+        with pytest.raises(ValueError, match="Cannot pause while paused"):
+            executor.pause()
+        executor.resume()
+        executor.stop()
+        await executor.wait()
+
+    asyncio.run(scenario())
+    assert executor.states == [RUNNING, PAUSED, RUNNING, STOPPING, IDLE]
+    assert executor.last_result == 'stopped'
+    # Stopped before the last move
+    assert motion.current_joint_positions['base_rotation'] == pytest.approx(0.1)
+
+
+def test_single_step_from_a_paused_start(executor):
+    async def scenario():
+        executor.open()
+        executor.start(program(move(base_rotation=0.1), move(base_rotation=0.2), move(base_rotation=0.3)),
+                       paused=True)
+        await asyncio.sleep(0.05)
+        assert (executor.state, executor.step_index) == (PAUSED, 0)
+
+        executor.step()
+        await until(lambda: executor.state == PAUSED)
+        assert executor.step_index == 1
+        assert motion.current_joint_positions['base_rotation'] == pytest.approx(0.1)
+
+        executor.step()
+        await until(lambda: executor.state == PAUSED)
+        assert executor.step_index == 2
+        executor.resume()
+        await executor.wait()
+
+    asyncio.run(scenario())
+    assert executor.states == [PAUSED, RUNNING, PAUSED, RUNNING, PAUSED, RUNNING, IDLE]
+    assert executor.last_result == 'completed'
+    assert motion.current_joint_positions['base_rotation'] == pytest.approx(0.3)
+
+
+def test_next_step_is_prefetched_unless_the_robot_moved(executor):
+    steps = [move(base_rotation=0.1), move(base_rotation=0.2), move(base_rotation=0.3)]
+
+    async def run(paused=False, jog=False):
+        executor.open()
+        executor.start(program(*steps), paused=paused)
+        if paused:
+            executor.step()
+            await until(lambda: executor.state == PAUSED)
+            if jog:
+                # Jogged while paused: the prepared second step starts somewhere else
+                motion.current_joint_positions['base_rotation'] = 0.5
+            executor.resume()
+        await executor.wait()
+
+    hits, replanned = prefetch('hit'), prefetch('replanned')
+    asyncio.run(run())
+    assert executor.last_result == 'completed'
+    # Only the first step has nothing prepared
+    assert (prefetch('hit') - hits, prefetch('replanned') - replanned) == (2, 1)
+
+    motion.current_joint_positions.update(START)
+    hits, replanned = prefetch('hit'), prefetch('replanned')
+    asyncio.run(run(paused=True, jog=True))
+    assert executor.last_result == 'completed'
+    assert (prefetch('hit') - hits, prefetch('replanned') - replanned) == (1, 2)
+
+
+def test_fault_abandons_the_move_until_reset(executor, monkeypatch):
+    # A move long enough to fault part way through
+    monkeypatch.setitem(config.MOVEMENT_PARAMS, 'MIN_MOVEMENT_TIME', 5.0)
+
+    async def scenario():
+        executor.open()
+        executor.start(program(move(base_rotation=0.1), move(base_rotation=0.2)))
+        await until(lambda: executor.step_index == 1)
+        await asyncio.sleep(0.02)
+        await executor.handle_emergency_stop()
+        await executor.wait()
+        assert executor.state == FAULTED
+        with pytest.raises(ValueError, match="Cannot start a program while faulted"):
+            executor.start(program(move()))
+        executor.reset()
+
+    asyncio.run(scenario())
+    assert executor.states == [RUNNING, FAULTED, IDLE]
+    assert executor.last_result == 'failed'
+    assert executor.error == "Emergency stop"
+    assert motion.current_joint_positions['base_rotation'] == pytest.approx(0.1)
@@ -0,0 +1,71 @@
+import program_history
+from routers import programs
+
+
+def steps(count, offset=0):
+    return [{'type': 'wait', 'data': {'time': i + offset}} for i in range(count)]
+
+
+def chunk_hashes(step_list):
+    return [chunk_hash for chunk_hash, _, _ in program_history.chunk_steps(step_list)]
+
+
+def test_chunks_cover_the_steps_in_order():
+    original = steps(300)
+    chunks = program_history.chunk_steps(original)
+    assert sum(count for _, _, count in chunks) == 300
+    assert all(count <= program_history.MAX_CHUNK_STEPS for _, _, count in chunks)
+
+
+def test_an_insert_changes_only_nearby_chunks():
+    original = steps(300)
+    edited = original[:150] + [{'type': 'io', 'data': {'pin': 3}}] + original[150:]
+    before, after = set(chunk_hashes(original)), set(chunk_hashes(edited))
+    assert len(after - before) <= 2
+    assert len(before & after) >= len(before) - 2
+
+
+def test_diff_steps():
+    old = steps(5)
+    new = old[:1] + old[2:4] + [{'type': 'io', 'data': {}}] + old[4:]
+    changes = program_history.diff_steps(old, new)
+    assert [(change['op'], change['old_start'], change['old_end']) for change in changes] == \
+        [('delete', 1, 2), ('insert', 4, 4)]
+    diff = program_history.diff_revisions({'name': 'a', 'description': '', 'steps': old},
+                                          {'name': 'b', 'description': '', 'steps': new})
+    assert diff['fields'] == {'name': {'old': 'a', 'new': 'b'}}
+    assert diff['summary'] == {'inserted': 1, 'deleted': 1, 'replaced': 0}
+
+
+def test_revisions_diff_and_restore(client):
+    def save(**changes):
+        client.put(f'/api/programs/programs/{program_id}', json=changes)
+        # Edits within one debounce window are committed, and kept, as one revision
+        assert programs.writer.flush(5.0)
+
+    program_id = client.post('/api/programs/programs', json={'name': 'p', 'description': ''}).json()['program_id']
+    assert programs.writer.flush(5.0)
+    first = [{'type': 'wait', 'data': {'time': 1}}, {'type': 'wait', 'data': {'time': 2}}]
+    save(steps=first)
+    save(steps=first[:1], name='renamed')
+    # Saving the same contents again adds no revision
+    save(steps=first[:1])
+
+    revisions = client.get(f'/api/programs/programs/{program_id}/revisions').json()['revisions']
+    assert [revision['revision'] for revision in revisions] == [3, 2, 1]
+    assert [revision['step_count'] for revision in revisions] == [1, 2, 0]
+
+    diff = client.get(f'/api/programs/programs/{program_id}/revisions/3/diff').json()
+    assert diff['from'] == 2
+    assert diff['diff']['summary'] == {'inserted': 0, 'deleted': 1, 'replaced': 0}
+    assert diff['diff']['fields']['name'] == {'old': 'p', 'new': 'renamed'}
+
+    restored = client.post(f'/api/programs/programs/{program_id}/revisions/2/restore').json()
+    assert restored['program']['steps'] == first
+    assert restored['program']['name'] == 'p'
+    revisions = client.get(f'/api/programs/programs/{program_id}/revisions').json()['revisions']
+    assert revisions[0]['revision'] == 4
+    assert revisions[0]['content_hash'] == revisions[2]['content_hash']
+
+    missing = client.get(f'/api/programs/programs/{program_id}/revisions/9').json()
+    assert missing == {'success': False, 'error': 'Revision not found'}
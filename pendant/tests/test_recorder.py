@@ -0,0 +1,124 @@
+import asyncio
+import math
+
+import numpy as np
+import pytest
+
+import config
+from config import ROBOT_CONFIG
+import recorder
+from arduino_simulator import SimulatedArduino
+from routers import motion
+
+HOME = dict(ROBOT_CONFIG['HOME_POSITION'])
+
+
+@pytest.fixture
+def recordings(tmp_path, monkeypatch):
+    """
+    Recordings in a temporary directory, with the motion state restored
+    afterwards, and no Arduino backend unless a test sets one
+    """
+    monkeypatch.setitem(config.RECORDER_CONFIG, 'DIRECTORY', str(tmp_path))
+    monkeypatch.setattr(motion, 'arduino_communicator', None)
+    monkeypatch.setattr(motion, 'current_joint_positions', dict(HOME))
+    monkeypatch.setattr(motion, 'current_ee_position', motion.fk.calculate(HOME))
+    yield tmp_path
+    recorder.stop_recording()
+
+
+def record_session(name, commands):
+    """Record the handlers' own records of running `commands` (coroutine functions)"""
+    recorder.start_recording(name, motion.current_joint_positions, motion.current_ee_position)
+
+    async def run():
+        for command in commands:
+            await command()
+    asyncio.run(run())
+    return recorder.stop_recording()
+
+
+def test_records_round_trip_through_the_memmap(recordings):
+    recording = recorder.start_recording('round-trip', HOME, {'x': 1.0, 'y': 2.0, 'z': 3.0})
+    recorder.record_command('jog_start', {'mode': 'cartesian', 'axis': 'z', 'direction': -1, 'velocity': 30})
+    recorder.record_command('moveJ', {'joint_positions': dict(HOME, base_rotation=45.0), 'velocity': 80})
+    recorder.record_serial(recorder.KIND_SERIAL_RX, 'home', '{"status": "home_done"}\n', 0.25)
+    recorder.stop_recording()
+    assert recording.info()['counts'] == {'command': 2, 'state': 1, 'serial_tx': 0, 'serial_rx': 1}
+
+    header, records = recorder.read_recording(recording.path)
+    assert isinstance(records, np.memmap)
+    assert header['records'] == 4
+    assert list(records['seq']) == [0, 1, 2, 3]
+    assert list(records['kind']) == [recorder.KIND_STATE, recorder.KIND_COMMAND,
+                                     recorder.KIND_COMMAND, recorder.KIND_SERIAL_RX]
+    assert np.all(np.diff(records['t']) >= 0)
+    assert list(records[0]['ee'][:3]) == [1.0, 2.0, 3.0] and math.isnan(records[0]['ee'][3])
+
+    assert recorder.decode_command(records[1]) == ('jog_start', {'mode': 'cartesian', 'axis': 'z',
+                                                                 'direction': -1, 'velocity': 30.0})
+    command, data = recorder.decode_command(records[2])
+    assert command == 'moveJ' and data['velocity'] == 80.0
+    assert data['joint_positions'] == pytest.approx(dict(HOME, base_rotation=45.0))
+    assert records[3]['payload'] == b'{"status": "home_done"}'
+    assert records[3]['value'] == pytest.approx(0.25)
+
+    # A partly written last record is ignored
+    with open(recording.path, 'ab') as f:
+        f.write(b'\0' * 10)
+    assert recorder.read_recording(recording.path)[0]['records'] == 4
+
+
+def test_invalid_names_and_files(recordings):
+    with pytest.raises(ValueError, match="Invalid recording name"):
+        recorder.recording_path('../escape')
+    (recordings / 'junk.rec').write_bytes(b'not a recording')
+    with pytest.raises(ValueError, match="is not a recording"):
+        recorder.read_recording(str(recordings / 'junk.rec'))
+    assert recorder.list_recordings() == []
+
+
+def test_replay_reproduces_the_session(recordings):
+    target = dict(HOME, base_rotation=30.0, elbow_rotation=45.0)
+    recording = record_session('moves', [
+        lambda: motion.handle_moveJ({'joint_positions': target, 'velocity': 50}),
+        lambda: motion.handle_jog_increment({'mode': 'joint', 'joint': 'base_rotation', 'direction': 1,
+                                             'increment': 5})])
+
+    motion.current_joint_positions.update(HOME)
+    result = asyncio.run(recorder.replay(recording.path, speed=10))
+    assert result['commands'] == 2
+    assert result['checked_states'] == 2
+    assert result['max_divergence'] == pytest.approx(0.0, abs=1e-3)
+    assert motion.current_joint_positions['base_rotation'] == pytest.approx(35.0)
+
+
+def test_accelerated_replay_scales_homing(recordings, monkeypatch):
+    monkeypatch.setattr(motion, 'SIMULATED_HOME_TIME', 0.5)
+    recording = record_session('home', [motion.handle_home])
+    result = asyncio.run(recorder.replay(recording.path, speed=20))
+    assert result['handlers']['home']['count'] == 1
+    assert result['elapsed'] < motion.SIMULATED_HOME_TIME / 2
+    assert motion.simulation_speed == 1.0
+
+
+def test_accelerated_replay_speeds_up_the_simulated_arduino(recordings, monkeypatch):
+    # Homing takes about 0.35 s at this time scale
+    arduino = SimulatedArduino(time_scale=100)
+    monkeypatch.setattr(motion, 'arduino_communicator', arduino)
+    try:
+        recording = record_session('simulated-home', [motion.handle_home])
+        result = asyncio.run(recorder.replay(recording.path, speed=20))
+    finally:
+        arduino.disconnect()
+    assert result['handlers']['home']['count'] == 1
+    assert result['elapsed'] < recording.info()['elapsed'] / 4
+    assert arduino.stats.snapshot()['commands']['home_done']['counters']['ok'] == 2
+
+
+def test_no_replay_while_recording(recordings):
+    recording = record_session('idle', [motion.handle_jog_stop])
+    recorder.start_recording('active')
+    with pytest.raises(ValueError, match="Cannot replay while a recording is running"):
+        asyncio.run(recorder.replay(recording.path))
+    assert recorder.stop_recording().records == 0
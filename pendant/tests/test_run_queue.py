@@ -0,0 +1,148 @@
+import asyncio
+
+import pytest
+
+import program_executor
+import run_queue
+from run_queue import RunQueue
+
+
+class FakeExecutor:
+    """Stands in for ProgramExecutor: each run completes (or fails) when released"""
+    def __init__(self, fail=()):
+        self.state = program_executor.IDLE
+        self.listeners = []
+        self.last_result = None
+        self.error = None
+        self.fail = set(fail)
+        self.started = []
+        self._done = None
+
+    def start(self, program, paused=False):
+        self.started.append((program['id'], paused))
+        self.state = program_executor.RUNNING
+        self._done = asyncio.Event()
+
+    def stop(self):
+        self.finish('stopped')
+
+    def finish(self, result=None):
+        program_id = self.started[-1][0]
+        self.last_result = result or ('failed' if program_id in self.fail else 'completed')
+        self.error = "fault" if self.last_result == 'failed' else None
+        self.state = program_executor.IDLE
+        self._done.set()
+        for listener in self.listeners:
+            listener({'state': self.state})
+
+    async def wait(self):
+        await self._done.wait()
+
+
+PROGRAMS = {name: {'id': name, 'steps': []} for name in ('a', 'b', 'c', 'bad')}
+
+
+def depth():
+    """Current value of the run queue depth gauge"""
+    _, _, value = run_queue.run_queue_depth.collect()[0].samples[0]
+    return value
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+async def run_all(queue, executor):
+    """Complete runs until the queue is empty"""
+    await settle()
+    while queue.current is not None:
+        executor.finish()
+        await settle()
+
+
+def test_priority_then_queue_order_and_repeat():
+    async def scenario():
+        executor = FakeExecutor()
+        queue = RunQueue(executor, PROGRAMS.get)
+        queue.enqueue('a')
+        queue.enqueue('b', repeat=2)
+        queue.enqueue('c', priority=5)
+        queue.start()
+        await run_all(queue, executor)
+        await queue.stop()
+        return executor.started, queue.status()
+
+    started, status = asyncio.run(scenario())
+    # Queued before the consumer started, so 'c' goes first on priority alone
+    assert [program_id for program_id, _ in started] == ['c', 'a', 'b', 'b']
+    assert [job['state'] for job in status['history']] == ['completed'] * 3
+    assert status['history'][0]['runs'] == 2
+
+
+def test_depth_counts_only_waiting_jobs():
+    async def scenario():
+        executor = FakeExecutor()
+        queue = RunQueue(executor, PROGRAMS.get)
+        queue.start()
+        queue.enqueue('a')
+        queue.enqueue('b')
+        await settle()
+        depths = [queue.waiting(), depth()]
+        await run_all(queue, executor)
+        depths += [queue.waiting(), depth()]
+        await queue.stop()
+        return depths
+
+    # 'a' is running and 'b' is waiting, then nothing is left
+    assert asyncio.run(scenario()) == [1, 1, 0, 0]
+
+
+def test_cancel_queued_and_running_jobs():
+    async def scenario():
+        executor = FakeExecutor()
+        queue = RunQueue(executor, PROGRAMS.get)
+        running = queue.enqueue('a', repeat=3)
+        waiting = queue.enqueue('b')
+        queue.start()
+        await settle()
+        queue.cancel(waiting.id)
+        queue.cancel(running.id)
+        await settle()
+        await queue.stop()
+        return executor.started, running, waiting
+
+    started, running, waiting = asyncio.run(scenario())
+    assert started == [('a', False)]
+    assert running.state == run_queue.CANCELLED and running.runs == 0
+    assert waiting.state == run_queue.CANCELLED
+
+
+def test_failed_run_ends_the_job():
+    async def scenario():
+        executor = FakeExecutor(fail={'bad'})
+        queue = RunQueue(executor, PROGRAMS.get)
+        job = queue.enqueue('bad', repeat=3, paused=True)
+        queue.start()
+        await run_all(queue, executor)
+        await queue.stop()
+        return executor.started, job
+
+    started, job = asyncio.run(scenario())
+    assert started == [('bad', True)]
+    assert job.state == run_queue.FAILED and job.error == "fault"
+
+
+def test_enqueue_validation(monkeypatch):
+    async def scenario():
+        queue = RunQueue(FakeExecutor(), PROGRAMS.get)
+        with pytest.raises(ValueError, match="Program not found"):
+            queue.enqueue('missing')
+        with pytest.raises(ValueError, match="Repeat"):
+            queue.enqueue('a', repeat=0)
+        monkeypatch.setitem(run_queue.RUN_QUEUE_CONFIG, 'MAX_JOBS', 1)
+        queue.enqueue('a')
+        with pytest.raises(ValueError, match="full"):
+            queue.enqueue('b')
+
+    asyncio.run(scenario())
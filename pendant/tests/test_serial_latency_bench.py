@@ -0,0 +1,60 @@
+import json
+import os
+import select
+
+import pytest
+
+from config import LOGGING_CONFIG
+
+with pytest.MonkeyPatch.context() as monkeypatch:
+    # The benchmark quiets logging by default; keep that out of the test session
+    monkeypatch.setenv('PENDANT_LOG_LEVEL', os.environ.get('PENDANT_LOG_LEVEL', LOGGING_CONFIG['LEVEL']))
+    from benchmarks.serial_latency_bench import FakeArduino, StageRecorder, summarize
+
+
+@pytest.fixture
+def port():
+    """Host side of a FakeArduino's pty"""
+    fake = FakeArduino(baud_rate=0).start()
+    fd = os.open(fake.port, os.O_RDWR | os.O_NOCTTY)
+    yield fd
+    os.close(fd)
+    fake.stop()
+
+
+def exchange(fd, command, lines):
+    """Send one command line and read `lines` response lines"""
+    os.write(fd, command.encode() + b'\n')
+    buffer = b''
+    while buffer.count(b'\r\n') < lines:
+        ready, _, _ = select.select([fd], [], [], 2.0)
+        assert ready, f"no reply to {command}"
+        buffer += os.read(fd, 4096)
+    return buffer.decode().split('\r\n')[:lines]
+
+
+def test_fake_arduino_echoes_then_reports_like_the_firmware(port):
+    command = json.dumps({'cmd': 'setJointPositions', 'positions': {'j1': 10.0}})
+    echo, done = exchange(port, command, 2)
+    assert echo == command
+    # Parsed by the host, so it must be valid JSON as main/motorControl.cpp prints it
+    assert json.loads(done) == {'status': 'move_done'}
+    assert json.loads(exchange(port, '{"cmd": "home"}', 2)[1]) == {'status': 'home_done'}
+    assert exchange(port, 'nonsense', 2)[1] == 'Failed to parse JSON: InvalidInput'
+
+
+def test_responses_are_classified_and_summarized():
+    recorder = StageRecorder()
+    recorder.begin(0.0)
+    command = '{"cmd": "setJointPositions"}\n'
+    for response in ('{"cmd": "setJointPositions"}', '{"status": "move_done"}', '{"status":"ok"}',
+                     '{"cmd": "moveJoint"}', None, 'Unknown command'):
+        recorder.classify(command, response)
+    assert recorder.responses == {'echo': 1, 'move_done': 1, 'status_ok': 1, 'stale_echo': 1,
+                                  'timeout': 1, 'other': 1}
+
+    summary = summarize([i / 1000.0 for i in range(1, 101)])
+    assert summary['count'] == 100
+    assert summary['p50_ms'] == pytest.approx(51.0)
+    assert summary['max_ms'] == pytest.approx(100.0)
+    assert summarize([]) == {'count': 0}
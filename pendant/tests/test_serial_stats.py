@@ -0,0 +1,27 @@
+from arduino_communication import SerialStats
+
+
+def test_counters_and_latency_by_command():
+    stats = SerialStats(command_delay=0.05)
+    stats.count('home', 'sent')
+    stats.count('home_done', 'timeouts', 3)
+    stats.observe('home', 'response', 0.2)
+
+    snapshot = stats.snapshot()
+    assert snapshot['command_delay'] == 0.05
+    assert snapshot['commands']['home']['counters']['sent'] == 1
+    assert snapshot['commands']['home_done']['counters']['timeouts'] == 3
+    assert 'retries' not in snapshot['commands']['home_done']['counters']
+    assert snapshot['commands']['home']['latency']['response']['count'] == 1
+    assert 'timeouts=3' in stats.summary()
+
+
+def test_collect_exports_every_counter():
+    stats = SerialStats()
+    stats.count('setJointPositions', 'ok')
+    latency, events = stats.collect()
+    rendered = events.render()
+    assert latency.name == 'pendant_serial_latency_seconds'
+    for event in ('sent', 'ok', 'errors', 'timeouts', 'parse_failures'):
+        assert f'event="{event}"' in rendered
+    assert 'retries' not in rendered
@@ -0,0 +1,212 @@
+import json
+import sqlite3
+
+import pytest
+
+import config
+from storage import ProgramStore, StorageWriter
+
+
+def position(position_id, name='p', x=0.0):
+    return {'id': position_id, 'name': name, 'timestamp': 't',
+            'joint_positions': {'base_rotation': x}, 'ee_position': {'x': x, 'y': 0.0, 'z': 0.0}}
+
+
+def program(program_id, name='prog', steps=()):
+    return {'id': program_id, 'name': name, 'description': '', 'steps': list(steps),
+            'created': 'c', 'modified': 'm'}
+
+
+class FlakyStore:
+    """Store whose commits fail until `failures` reaches 0"""
+    def __init__(self, store, failures, during_failure=None, error=None):
+        self.store = store
+        self.failures = failures
+        self.during_failure = during_failure
+        self.error = error or sqlite3.OperationalError("database is locked")
+        self.attempts = 0
+
+    def apply(self, changes):
+        self.attempts += 1
+        if self.failures:
+            self.failures -= 1
+            if self.during_failure:
+                self.during_failure()
+            raise self.error
+        self.store.apply(list(changes))
+
+
+def test_store_round_trip(tmp_path):
+    store = ProgramStore(str(tmp_path / 'pendant.db'))
+    store.save_position(position('a', 'home', 1.5))
+    store.save_program(program('p1', steps=[{'type': 'wait', 'duration': 1}]))
+    store.close()
+
+    store = ProgramStore(str(tmp_path / 'pendant.db'))
+    assert store.load_positions()['a']['joint_positions'] == {'base_rotation': 1.5}
+    assert store.load_programs()['p1']['steps'] == [{'type': 'wait', 'duration': 1}]
+    assert store.delete_program('p1')
+    assert not store.delete_program('p1')
+    store.close()
+
+
+def test_migrate_json_runs_once(tmp_path):
+    (tmp_path / 'saved_positions.json').write_text(json.dumps({'a': position('a')}))
+    (tmp_path / 'programs.json').write_text(json.dumps({'p1': program('p1')}))
+    store = ProgramStore(':memory:')
+    store.migrate_json(str(tmp_path))
+    store.migrate_json(str(tmp_path))
+    assert list(store.load_positions()) == ['a']
+    assert list(store.load_programs()) == ['p1']
+    assert (tmp_path / 'programs.json.migrated').exists()
+
+
+def test_migration_keeps_the_data_and_survives_a_restart(tmp_path):
+    steps = [{'type': 'wait', 'data': {'time': 1}}, {'type': 'moveJ', 'data': {'joint_positions': {'base_rotation': 5}}}]
+    positions = {key: position(key, f'pos {key}', x) for key, x in (('a', 1.0), ('b', 2.0))}
+    (tmp_path / 'saved_positions.json').write_text(json.dumps(positions))
+    (tmp_path / 'programs.json').write_text(json.dumps({'p1': program('p1', 'pick', steps)}))
+    database = str(tmp_path / 'pendant.db')
+
+    store = ProgramStore(database)
+    assert store.migrate_json(str(tmp_path)) == {'programs': 1, 'positions': 2}
+    store.close()
+    assert sorted(path.name for path in tmp_path.glob('*.json*')) == ['programs.json.migrated',
+                                                                       'saved_positions.json.migrated']
+
+    # A JSON file turning up again later is not imported over the database
+    (tmp_path / 'programs.json').write_text(json.dumps({'p2': program('p2')}))
+    store = ProgramStore(database)
+    assert store.migrate_json(str(tmp_path)) == {'programs': 0, 'positions': 0}
+    assert store.load_positions() == positions
+    assert store.load_programs() == {'p1': program('p1', 'pick', steps)}
+    assert [revision['revision'] for revision in store.list_revisions('p1')] == [1]
+    store.close()
+
+
+def test_unreadable_json_is_left_for_the_next_start(tmp_path):
+    (tmp_path / 'saved_positions.json').write_text(json.dumps({'a': position('a')}))
+    (tmp_path / 'programs.json').write_text('{"p1": ')
+    store = ProgramStore(':memory:')
+    assert store.migrate_json(str(tmp_path)) == {'programs': 0, 'positions': 0}
+    assert store.load_positions() == {}
+    assert (tmp_path / 'programs.json').exists() and (tmp_path / 'saved_positions.json').exists()
+
+    (tmp_path / 'programs.json').write_text(json.dumps({'p1': program('p1')}))
+    assert store.migrate_json(str(tmp_path)) == {'programs': 1, 'positions': 1}
+
+
+def test_each_change_writes_only_its_row():
+    def rows_changed(store, change):
+        before = store._conn.total_changes
+        change()
+        return store._conn.total_changes - before
+
+    changed = []
+    for count in (1, 200):
+        store = ProgramStore(':memory:')
+        for i in range(count):
+            store.save_position(position(f'pos{i}'))
+            store.save_program(program(f'prog{i}', steps=[{'type': 'wait', 'data': {'time': i}}]))
+        changed.append((
+            rows_changed(store, lambda: store.save_position(position('pos0', 'renamed'))),
+            rows_changed(store, lambda: store.delete_position('pos0')),
+            rows_changed(store, lambda: store.save_program(program('prog0', 'renamed')))
+        ))
+        store.close()
+    assert changed[0][:2] == (1, 1)
+    # The same work however many rows are stored
+    assert changed[0] == changed[1]
+
+
+def test_writer_coalesces_and_versions():
+    store = ProgramStore(':memory:')
+    writer = StorageWriter(store, debounce=0.01)
+    writer.start()
+    writer.save_position(position('a', 'first'))
+    writer.save_position(position('a', 'second'))
+    writer.save_program(program('p1'))
+    writer.delete_program('p1')
+    assert writer.flush(5.0)
+    assert store.load_positions()['a']['name'] == 'second'
+    assert store.load_programs() == {}
+    assert writer.version('saved_positions') == 2
+    assert writer.version('programs') == 2
+    assert writer.stop()
+
+
+def test_failed_commit_is_retried_and_newer_edits_win():
+    store = ProgramStore(':memory:')
+    # 'a' is edited again while its first commit is failing
+    flaky = FlakyStore(store, failures=1, during_failure=lambda: writer.save_position(position('a', 'new')))
+    writer = StorageWriter(flaky, debounce=0.01)
+    writer.save_position(position('a', 'old'))
+    writer.save_position(position('b', 'kept'))
+    writer.start()
+
+    # The failed commit is reported to flush and surfaced on the writer
+    assert not writer.flush(5.0)
+    assert writer.error == "database is locked"
+
+    assert writer.flush(5.0)
+    assert writer.error is None
+    assert flaky.attempts == 2
+    positions = store.load_positions()
+    assert positions['a']['name'] == 'new'
+    assert positions['b']['name'] == 'kept'
+    assert writer.stop()
+
+
+def test_stop_reports_changes_it_could_not_commit():
+    flaky = FlakyStore(ProgramStore(':memory:'), failures=100)
+    writer = StorageWriter(flaky, debounce=0.01)
+    writer.start()
+    writer.save_position(position('a'))
+    assert not writer.stop()
+    assert writer.error == "database is locked"
+
+
+def test_unexpected_errors_do_not_stop_the_writer():
+    store = ProgramStore(':memory:')
+    flaky = FlakyStore(store, failures=1, error=TypeError("Object of type set is not JSON serializable"))
+    writer = StorageWriter(flaky, debounce=0.01)
+    writer.start()
+    writer.save_position(position('a'))
+    assert not writer.flush(5.0)
+    assert writer.error == "Object of type set is not JSON serializable"
+    # Still running: the batch is retried and later edits are committed
+    writer.save_position(position('b'))
+    assert writer.flush(5.0)
+    assert sorted(store.load_positions()) == ['a', 'b']
+    assert writer.stop()
+
+
+def test_retries_back_off_and_give_up(monkeypatch):
+    monkeypatch.setitem(config.STORAGE_CONFIG, 'RETRY_LIMIT', 3)
+    monkeypatch.setitem(config.STORAGE_CONFIG, 'RETRY_MAX_DELAY', 0.03)
+    store = ProgramStore(':memory:')
+    flaky = FlakyStore(store, failures=3)
+    writer = StorageWriter(flaky, debounce=0.01)
+    writer._retries = 1
+    assert writer._retry_delay() == pytest.approx(0.02)
+    writer._retries = 5
+    assert writer._retry_delay() == pytest.approx(0.03)
+    writer._retries = 0
+
+    writer.save_position(position('a'))
+    writer.start()
+    for _ in range(3):
+        assert not writer.flush(5.0)
+    # Dropped after the third failure in a row, so nothing is left to retry
+    assert flaky.attempts == 3
+    assert writer.dropped == 1
+    assert writer.error == "database is locked"
+    assert writer.flush(5.0)
+    assert store.load_positions() == {}
+
+    # Later changes are committed as usual
+    writer.save_position(position('b'))
+    assert writer.flush(5.0)
+    assert writer.error is None
+    assert list(store.load_positions()) == ['b']
+    assert writer.stop()
@@ -0,0 +1,153 @@
+import random
+
+import numpy as np
+import pytest
+
+import config
+import program_compiler
+import trajectory
+from trajectory import JOINTS
+
+LIMITS = {
+    'base_rotation': (30.0, 50.0),
+    'shoulder_rotation': (20.0, 40.0),
+    'prismatic_extension': (50.0, 100.0),
+    'elbow_rotation': (30.0, 50.0),
+    'elbow2_rotation': (45.0, 80.0),
+    'end_effector_rotation': (60.0, 120.0)
+}
+
+
+def random_pose(rng, spread=90.0):
+    return {joint: rng.uniform(-spread, spread) for joint in JOINTS}
+
+
+def moves(count=300, seed=1):
+    rng = random.Random(seed)
+    for _ in range(count):
+        # Mix long moves (trapezoids) and short ones (triangles)
+        spread = rng.choice([0.5, 5.0, 90.0])
+        yield random_pose(rng, spread), random_pose(rng, spread), rng.choice([1, 25, 50, 100])
+
+
+def test_profile_stays_within_limits_and_one_limit_is_reached():
+    for start, target, velocity in moves():
+        segment = trajectory.plan_move(start, target, velocity, LIMITS, min_duration=0.0)
+        scale = velocity / 100.0
+        tight = 0.0
+        for joint in JOINTS:
+            max_velocity, max_acceleration = LIMITS[joint]
+            assert segment.peak_velocity[joint] <= max_velocity * scale * (1 + 1e-9)
+            assert segment.peak_acceleration[joint] <= max_acceleration * (1 + 1e-9)
+            tight = max(tight, segment.peak_velocity[joint] / (max_velocity * scale),
+                        segment.peak_acceleration[joint] / max_acceleration)
+        # The shortest profile is held back by some limit
+        assert tight == pytest.approx(1.0)
+
+
+def test_sampled_path_matches_profile():
+    start, target = {joint: 0.0 for joint in JOINTS}, {joint: 0.0 for joint in JOINTS}
+    target['base_rotation'] = 90.0
+    target['elbow_rotation'] = -30.0
+    segment = trajectory.plan_move(start, target, 100, LIMITS, min_duration=0.0)
+    times = np.linspace(0.0, segment.duration, 2001)
+    base = np.array([segment.position(t)['base_rotation'] for t in times])
+    velocity = np.diff(base) / np.diff(times)
+
+    assert base[0] == 0.0 and base[-1] == pytest.approx(90.0)
+    assert np.all(np.diff(base) >= -1e-12)
+    assert velocity.max() <= LIMITS['base_rotation'][0] * (1 + 1e-3)
+    # Both joints arrive together on a straight joint space line
+    assert segment.position(segment.duration / 3)['elbow_rotation'] == pytest.approx(
+        -segment.position(segment.duration / 3)['base_rotation'] / 3)
+
+
+def test_estimate_matches_plan_and_min_duration():
+    for start, target, velocity in moves(50):
+        assert trajectory.estimate_duration(start, target, velocity, LIMITS, 0.0) == \
+            trajectory.plan_move(start, target, velocity, LIMITS, 0.0).duration
+    pose = {joint: 0.0 for joint in JOINTS}
+    assert trajectory.estimate_duration(pose, pose, 100, LIMITS, 0.5) == 0.5
+
+
+def test_duration_matrix_matches_estimate():
+    rng = random.Random(2)
+    points = [random_pose(rng) for _ in range(12)]
+    velocities = [rng.choice([10, 50, 100]) for _ in points]
+    matrix = trajectory.duration_matrix(points, velocities, LIMITS, 0.5)
+    for i, start in enumerate(points):
+        for j, target in enumerate(points):
+            # The move to a point runs at that point's velocity
+            expected = trajectory.estimate_duration(start, target, velocities[j], LIMITS, 0.5)
+            assert matrix[i, j] == pytest.approx(expected, rel=1e-12)
+
+
+def test_compiled_program_plans_moves_from_the_previous_target():
+    home = {joint: 0.0 for joint in JOINTS}
+    away = dict(home, base_rotation=45.0)
+    program = {'id': 'p', 'name': 'p', 'steps': [
+        {'type': 'moveJ', 'data': {'joint_positions': home, 'velocity': 50}},
+        {'type': 'wait', 'data': {'time': 2}},
+        {'type': 'moveJ', 'data': {'joint_positions': away, 'velocity': 50}},
+        {'type': 'bogus', 'data': {}}
+    ]}
+    compiled = program_compiler.compile_program(program)
+    first, wait, move, bogus = compiled.steps
+    assert first.start_dependent
+    assert wait.duration == 2.0
+    assert move.segment.start == home
+    assert move.duration == trajectory.estimate_duration(home, away, 50)
+    assert bogus.error == "Unknown step type bogus"
+    assert program_compiler.get_compiled(program) is program_compiler.get_compiled(program)
+
+
+@pytest.mark.parametrize('distance, velocity', [(40.0, 100), (5.0, 100), (40.0, 50)])
+def test_single_joint_move_takes_the_shortest_trapezoid(distance, velocity):
+    start = {joint: 0.0 for joint in JOINTS}
+    max_velocity, acceleration = LIMITS['base_rotation']
+    max_velocity *= velocity / 100.0
+    if distance >= max_velocity ** 2 / acceleration:
+        expected = distance / max_velocity + max_velocity / acceleration
+    else:
+        # Too short to reach cruise speed
+        expected = 2 * (distance / acceleration) ** 0.5
+    estimate = trajectory.estimate_duration(start, dict(start, base_rotation=distance), velocity, LIMITS, 0.0)
+    assert estimate == pytest.approx(expected, rel=1e-12)
+
+
+def test_limits_and_min_duration_default_to_config(monkeypatch):
+    start = {joint: 0.0 for joint in JOINTS}
+    target = dict(start, shoulder_rotation=60.0)
+    config_limits = trajectory.joint_limits()
+    assert trajectory.estimate_duration(start, target, 50) == \
+        trajectory.estimate_duration(start, target, 50, config_limits, config.MOVEMENT_PARAMS['MIN_MOVEMENT_TIME'])
+
+    # Joints without their own acceleration use MOVEMENT_PARAMS['MAX_ACCELERATION']
+    accelerations = dict(config.ROBOT_CONFIG['MAX_ACCELERATIONS'])
+    del accelerations['shoulder_rotation']
+    monkeypatch.setitem(config.ROBOT_CONFIG, 'MAX_ACCELERATIONS', accelerations)
+    monkeypatch.setitem(config.MOVEMENT_PARAMS, 'MAX_ACCELERATION', 5.0)
+    assert trajectory.joint_limits()['shoulder_rotation'] == (config.ROBOT_CONFIG['DEFAULT_SPEEDS']['shoulder_rotation'], 5.0)
+    assert trajectory.estimate_duration(start, target, 50) > \
+        trajectory.estimate_duration(start, target, 50, config_limits)
+
+    monkeypatch.setitem(config.MOVEMENT_PARAMS, 'MIN_MOVEMENT_TIME', 2.5)
+    assert trajectory.estimate_duration(start, start) == 2.5
+
+
+def test_estimate_endpoint_plans_from_the_current_position(client, monkeypatch):
+    from routers import motion
+
+    start = dict(config.ROBOT_CONFIG['HOME_POSITION'], elbow_rotation=90.0, prismatic_extension=0.0)
+    target = dict(start, base_rotation=45.0)
+    monkeypatch.setattr(motion, 'current_joint_positions', dict(start))
+    monkeypatch.setattr(motion, 'current_ee_position', motion.fk.calculate(start))
+    program_id = client.post('/api/programs/programs', json={'name': 'estimate', 'description': ''}).json()['program_id']
+    client.put(f'/api/programs/programs/{program_id}', json={'steps': [
+        {'type': 'moveJ', 'data': {'joint_positions': target, 'velocity': 40}},
+        {'type': 'wait', 'data': {'time': 1.5}}]})
+
+    body = client.get(f'/api/programs/programs/{program_id}/estimate').json()
+    assert [step['duration'] for step in body['steps']] == pytest.approx(
+        [trajectory.estimate_duration(start, target, 40), 1.5])
+    assert body['cycle_time'] == pytest.approx(sum(step['duration'] for step in body['steps']))
@@ -0,0 +1,124 @@
+import asyncio
+import gzip
+import json
+
+import pytest
+
+from config import ROBOT_CONFIG
+import transfer
+from transfer import RecordError
+
+POSITIONS = {'a': {'id': 'a', 'name': 'pick', 'timestamp': 't', 'joint_positions': {'base_rotation': 1.0},
+                   'ee_position': {'x': 1.0, 'y': 2.0, 'z': 3.0}}}
+PROGRAMS = {'p': {'id': 'p', 'name': 'cycle', 'description': '', 'created': 'c', 'modified': 'm',
+                  'steps': [{'type': 'wait', 'data': {'time': 1}}]}}
+
+
+def read(data, piece=7):
+    """All results of read_records over `data` delivered in `piece` byte chunks"""
+    async def chunks():
+        for start in range(0, len(data), piece):
+            yield data[start:start + piece]
+
+    async def collect():
+        return [result async for result in transfer.read_records(chunks())]
+    return asyncio.run(collect())
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_export_import_round_trip(compress):
+    data = b''.join(transfer.chunked(transfer.export_lines(POSITIONS, PROGRAMS), compress))
+    assert (data[:2] == b'\x1f\x8b') == compress
+    records = read(data)
+    assert records == [(2, 'position', POSITIONS['a']), (3, 'program', PROGRAMS['p'])]
+
+
+def test_large_export_is_chunked():
+    positions = {str(i): dict(POSITIONS['a'], id=str(i)) for i in range(2000)}
+    chunks = list(transfer.chunked(transfer.export_lines(positions, {}), compress=True))
+    assert len(chunks) > 1
+    lines = gzip.decompress(b''.join(chunks)).splitlines()
+    assert len(lines) == 2001
+    assert json.loads(lines[0])['format'] == transfer.FORMAT
+
+
+def test_invalid_lines_are_reported_and_skipped():
+    data = b'\n'.join([
+        b'{"kind": "header", "format": "pendant-library", "version": 1}',
+        b'not json',
+        b'[1, 2]',
+        b'{"kind": "robot", "data": {}}',
+        b'',
+        json.dumps({'kind': 'position', 'data': POSITIONS['a']}).encode()
+    ])
+    results = read(data)
+    assert [(line, kind) for line, kind, _ in results] == [(2, None), (3, None), (4, None), (6, 'position')]
+    assert all(isinstance(error, RecordError) for _, kind, error in results if kind is None)
+
+
+def test_unsupported_header_stops_the_import():
+    with pytest.raises(RecordError, match="Unsupported file format"):
+        read(b'{"kind": "header", "format": "pendant-library", "version": 99}\n')
+
+
+def test_truncated_gzip_stops_the_import():
+    data = b''.join(transfer.chunked(transfer.export_lines(POSITIONS, PROGRAMS), compress=True))
+    with pytest.raises(RecordError, match="Truncated gzip"):
+        read(data[:-10])
+
+
+def test_oversized_record_stops_the_import(monkeypatch):
+    monkeypatch.setitem(transfer.TRANSFER_CONFIG, 'MAX_RECORD_BYTES', 100)
+    with pytest.raises(RecordError, match="larger than 100 bytes"):
+        read(b'{"kind": "position", "data": {"name": "' + b'x' * 200 + b'"}}\n')
+
+
+def test_library_round_trip_through_the_api(client):
+    client.post('/api/save_position', json={'name': 'transfer'})
+    created = client.post('/api/programs/programs', json={'name': 'transfer', 'description': ''}).json()
+    client.put(f"/api/programs/programs/{created['program_id']}", json={'steps': [{'type': 'wait', 'data': {'time': 2}}]})
+
+    exported = client.get('/api/programs/export', params={'compress': True})
+    assert exported.headers['content-disposition'].endswith('.ndjson.gz"')
+    lines = gzip.decompress(exported.content).splitlines()[1:]
+    kinds = [json.loads(line)['kind'] for line in lines]
+    assert kinds.count('program') >= 1 and kinds.count('position') >= 1
+
+    skipped = client.post('/api/programs/import', params={'replace': False}, content=exported.content).json()
+    assert skipped['success']
+    assert skipped['imported'] == {'positions': 0, 'programs': 0, 'skipped': len(lines), 'invalid': 0}
+
+    body = b'\n'.join(lines + [b'{"kind": "position", "data": {"id": "broken", "name": "x"}}'])
+    replaced = client.post('/api/programs/import', content=body).json()
+    assert replaced['imported'] == {'positions': kinds.count('position'), 'programs': kinds.count('program'),
+                                    'skipped': 0, 'invalid': 1}
+    assert replaced['errors'][0]['line'] == len(lines) + 1
+
+    # Validation may turn whole numbers into floats, which compare equal
+    again = client.get('/api/programs/export').content.splitlines()[1:]
+    assert [json.loads(line) for line in again] == [json.loads(line) for line in lines]
+
+
+def test_import_changes_the_listing_version_before_committing(client, monkeypatch):
+    from routers import programs
+
+    listed = client.get('/api/programs/saved_positions')
+    start = programs.writer.version('saved_positions')
+    versions = []
+    write_batch = programs.writer.write_batch
+
+    def checked_write_batch(positions=(), new_programs=()):
+        # Listings made while the batch commits must already see a new version
+        versions.append((programs.writer.version('saved_positions'), len(positions)))
+        write_batch(positions, new_programs)
+
+    monkeypatch.setattr(programs.writer, 'write_batch', checked_write_batch)
+    monkeypatch.setitem(transfer.TRANSFER_CONFIG, 'BATCH_SIZE', 2)
+    position = dict(POSITIONS['a'], joint_positions=ROBOT_CONFIG['HOME_POSITION'])
+    body = b'\n'.join(json.dumps({'kind': 'position', 'data': dict(position, id=f'v{i}')}).encode() for i in range(3))
+    assert client.post('/api/programs/import', content=body).json()['imported']['positions'] == 3
+
+    assert versions == [(start + 2, 2), (start + 3, 1)]
+    stale = client.get('/api/programs/saved_positions', headers={'If-None-Match': listed.headers['etag']})
+    assert stale.status_code == 200
+    assert len(stale.json()['positions']) == 3
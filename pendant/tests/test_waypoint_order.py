@@ -0,0 +1,139 @@
+import itertools
+
+import numpy as np
+import pytest
+
+import config
+from config import ROBOT_CONFIG
+import waypoint_order
+
+START = dict(ROBOT_CONFIG['HOME_POSITION'], elbow_rotation=90.0, prismatic_extension=0.0)
+
+# Base rotations visited out of order, so there is time to save
+SCATTERED = [60, -40, 30, -60, 0, 45, -20]
+
+
+def move(**joints):
+    return {'type': 'moveJ', 'data': {'joint_positions': dict(START, **joints), 'velocity': 50}}
+
+
+def scattered_program():
+    steps = [move(base_rotation=angle) for angle in SCATTERED]
+    # The wait stays with the move before it
+    steps.insert(2, {'type': 'wait', 'data': {'time': 0.5}})
+    return {'id': 'p', 'name': 'p', 'steps': steps}
+
+
+def instances(symmetric, fixed_end, count=20):
+    """Random move time matrices: distances between points, at the speed of the point moved to"""
+    rng = np.random.default_rng(1)
+    for _ in range(count):
+        n = int(rng.integers(2, 7))
+        points = rng.uniform(0.0, 1.0, (n + 2, 2))
+        speeds = np.ones(n + 2) if symmetric else rng.uniform(0.5, 2.0, n + 2)
+        times = np.linalg.norm(points[:, None] - points[None], axis=2) / speeds[None, :]
+        yield times[:n, :n], times[n, :n], times[:n, n + 1] if fixed_end else None
+
+
+@pytest.mark.parametrize('symmetric', [True, False])
+@pytest.mark.parametrize('fixed_end', [True, False])
+def test_order_is_a_local_optimum_close_to_brute_force(symmetric, fixed_end):
+    ratios = []
+    for cost, start, end in instances(symmetric, fixed_end):
+        n = len(cost)
+        order = waypoint_order.order_waypoints(cost, start, end)
+        assert sorted(order) == list(range(n))
+        found = waypoint_order.path_cost(cost, start, end, order)
+
+        # No reversal or single move improves it
+        for i in range(n):
+            for j in range(i + 1, n):
+                reversed_order = order[:i] + order[i:j + 1][::-1] + order[j + 1:]
+                assert waypoint_order.path_cost(cost, start, end, reversed_order) >= found - 1e-9
+            for k in range(n):
+                moved = order[:i] + order[i + 1:]
+                moved.insert(k, order[i])
+                assert waypoint_order.path_cost(cost, start, end, moved) >= found - 1e-9
+
+        best = min(waypoint_order.path_cost(cost, start, end, list(permutation))
+                   for permutation in itertools.permutations(range(n)))
+        ratios.append(found / best)
+    # A heuristic, so not always optimal, but close on average
+    assert np.mean(ratios) <= 1.02
+
+
+def test_path_cost_of_trivial_orders():
+    cost = np.array([[0.0, 1.0], [2.0, 0.0]])
+    assert waypoint_order.path_cost(cost, None, None, []) == 0.0
+    assert waypoint_order.order_waypoints(cost[:1, :1]) == [0]
+    assert waypoint_order.path_cost(cost, np.array([5.0, 1.0]), None, [1, 0]) == 3.0
+
+
+def test_optimize_program_keeps_ends_and_waits():
+    program = scattered_program()
+    result = waypoint_order.optimize_program(program, START)
+    assert result['saving'] > 0
+    assert result['cycle_time_after'] == pytest.approx(result['cycle_time_before'] - result['saving'])
+
+    order = result['order']
+    assert sorted(order) == list(range(1, len(program['steps']) + 1))
+    assert order[0] == 1 and order[-1] == len(program['steps'])
+    assert order[order.index(2) + 1] == 3
+    assert result['program']['steps'] == [program['steps'][number - 1] for number in order]
+
+    again = waypoint_order.optimize_program(result['program'], START)
+    assert again['saving'] == pytest.approx(0.0, abs=1e-9)
+
+
+def test_optimize_program_ranges_and_unmovable_steps():
+    program = scattered_program()
+    # Only steps 4 to 7 may move
+    result = waypoint_order.optimize_program(program, START, ranges=[(4, 7)], keep_ends=False)
+    assert result['order'][:3] == [1, 2, 3] and result['order'][7:] == [8]
+    assert sorted(result['order'][3:7]) == [4, 5, 6, 7]
+    assert result['saving'] >= 0
+
+    # A moveL that inherits its orientation splits the program and stays put
+    program['steps'][4] = {'type': 'moveL', 'data': {'position': {'x': 300, 'y': 0, 'z': 300}}}
+    result = waypoint_order.optimize_program(program, START, keep_ends=False)
+    assert result['order'][4] == 5
+
+
+def test_optimize_positions():
+    positions = [{'id': f'p{i}', 'joint_positions': dict(START, base_rotation=angle)}
+                 for i, angle in enumerate(SCATTERED)]
+    result = waypoint_order.optimize_positions(positions, START)
+    assert sorted(result['order']) == sorted(position['id'] for position in positions)
+    assert result['saving'] > 0
+    assert result['travel_time_after'] == pytest.approx(result['travel_time_before'] - result['saving'])
+    assert [step['data']['joint_positions']['base_rotation'] for step in result['steps']] == \
+        [SCATTERED[int(position_id[1:])] for position_id in result['order']]
+
+    round_trip = waypoint_order.optimize_positions(positions, START, return_to_start=True)
+    assert round_trip['steps'][-1]['data']['joint_positions'] == START
+    assert len(round_trip['steps']) == len(positions) + 1
+
+
+def test_too_many_waypoints(monkeypatch):
+    monkeypatch.setitem(config.WAYPOINT_ORDER_CONFIG, 'MAX_WAYPOINTS', 3)
+    with pytest.raises(ValueError, match="More than 3 waypoints"):
+        waypoint_order.optimize_program(scattered_program(), START)
+    with pytest.raises(ValueError, match="More than 3 waypoints"):
+        waypoint_order.optimize_positions([{'id': str(i), 'joint_positions': START} for i in range(4)], START)
+
+
+def test_optimize_order_api(client):
+    program_id = client.post('/api/programs/programs', json={'name': 'Order pick', 'description': ''}).json()['program_id']
+    client.put(f'/api/programs/programs/{program_id}', json={'steps': scattered_program()['steps']})
+
+    result = client.post(f'/api/programs/programs/{program_id}/optimize_order',
+                         json={'start_joint_positions': START}).json()
+    assert result['success'] and result['saving'] > 0
+    # Returned, not saved
+    saved = client.get(f'/api/programs/programs/{program_id}').json()
+    assert saved['steps'] == scattered_program()['steps']
+
+    bad = client.post(f'/api/programs/programs/{program_id}/optimize_order', json={'ranges': [[1]]}).json()
+    assert bad == {'success': False, 'error': 'Ranges must be [first, last] step numbers'}
+    missing = client.post('/api/programs/saved_positions/optimize_order', json={'position_ids': ['nowhere']}).json()
+    assert missing == {'success': False, 'error': 'Saved position not found: nowhere'}
@@ -0,0 +1,78 @@
+import asyncio
+import json
+import random
+
+import pytest
+
+from tools.ws_load_test import FRAME_PERIOD, PendantClient, loop_stats, percentiles
+
+
+class FakeSocket:
+    """Replays messages as if received on /ws, advancing perf_counter between them"""
+    def __init__(self, monkeypatch, frames):
+        self.frames = frames
+        self.now = 100.0
+        monkeypatch.setattr('tools.ws_load_test.time.perf_counter', lambda: self.now)
+
+    async def __aiter__(self):
+        for delay, message in self.frames:
+            self.now += delay
+            yield json.dumps(message)
+
+
+def frame(seq, base_rotation=0.0):
+    return {'type': 'position_update', 'seq': seq, 'joint_positions': {'base_rotation': base_rotation},
+            'ee_position': {'x': 0.0, 'y': 0.0, 'z': 0.0}}
+
+
+def test_percentiles_in_milliseconds():
+    summary = percentiles([i / 1000.0 for i in range(100, 0, -1)])
+    assert summary == {'count': 100, 'p50_ms': pytest.approx(51.0), 'p90_ms': pytest.approx(91.0),
+                       'p99_ms': pytest.approx(100.0), 'max_ms': pytest.approx(100.0)}
+    assert percentiles([]) == {'count': 0}
+
+
+def test_loop_stats_from_two_scrapes():
+    before = {
+        'pendant_jog_loop_period_seconds_bucket{le="0.01"}': 5,
+        'pendant_jog_loop_period_seconds_bucket{le="0.02"}': 10,
+        'pendant_jog_loop_period_seconds_bucket{le="+Inf"}': 10,
+        'pendant_jog_loop_period_seconds_sum': 0.1,
+        'pendant_jog_loop_period_seconds_count': 10,
+        'pendant_jog_loop_overruns_total': 1,
+    }
+    after = {
+        'pendant_jog_loop_period_seconds_bucket{le="0.01"}': 100,
+        'pendant_jog_loop_period_seconds_bucket{le="0.02"}': 110,
+        'pendant_jog_loop_period_seconds_bucket{le="+Inf"}': 110,
+        'pendant_jog_loop_period_seconds_sum': 1.1,
+        'pendant_jog_loop_period_seconds_count': 110,
+        'pendant_jog_loop_overruns_total': 3,
+    }
+    stats = loop_stats(before, after)
+    assert stats == {'iterations': 100, 'overruns': 2, 'mean_period_ms': pytest.approx(10.0),
+                     'p99_period_ms': pytest.approx(20.0)}
+    # No /metrics on the server
+    assert loop_stats({}, {}) == {'iterations': 0, 'overruns': 0}
+
+
+def test_client_counts_latency_jitter_and_dropped_frames(monkeypatch):
+    client = PendantClient('ws://pendant/ws', 0.1, random.Random(0))
+    socket = FakeSocket(monkeypatch, [
+        (0.0, frame(1)),
+        (FRAME_PERIOD, frame(2, 1.0)),
+        # Frames 3 and 4 never arrive
+        (3 * FRAME_PERIOD, frame(5, 2.0)),
+        (FRAME_PERIOD, {'type': 'error', 'message': 'Out of reach'}),
+        (FRAME_PERIOD, frame(6, 3.0)),
+    ])
+    client.pending = [socket.now]
+    client.move_target = (socket.now, {'base_rotation': 2.0})
+
+    asyncio.run(client._receive(socket))
+    assert (client.frames, client.dropped, client.errors) == (4, 2, 1)
+    # Only the frames arriving in sequence, with the one after the error two periods late
+    assert client.intervals == [pytest.approx(FRAME_PERIOD), pytest.approx(2 * FRAME_PERIOD)]
+    assert client.command_latency == [0.0]
+    assert client.move_latency == [pytest.approx(4 * FRAME_PERIOD)]
+    assert client.joints == {'base_rotation': 3.0}
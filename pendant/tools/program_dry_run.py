@@ -0,0 +1,93 @@
+"""
+Dry run programs without a robot or server (see dry_run.py): per-step timing,
+cycle time, peak joint velocity/acceleration and limit violations.
+
+Programs are read from the pendant database, or from a JSON file in the old
+programs.json format (a dictionary of programs by id). Programs are simulated
+in parallel, one worker process per CPU unless --workers is given.
+
+Usage:
+    python tools/program_dry_run.py
+    python tools/program_dry_run.py "Pick and place" --steps
+    python tools/program_dry_run.py --json-file backup/programs.json --workers 4 --json
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('PENDANT_LOG_LEVEL', 'WARNING')
+
+from config import STORAGE_CONFIG
+import dry_run
+from storage import ProgramStore
+
+
+def load_programs(database=None, json_file=None):
+    """
+    Returns:
+        Dictionary of programs by id
+    """
+    if json_file:
+        with open(json_file, 'r') as f:
+            return json.load(f)
+    store = ProgramStore(database or STORAGE_CONFIG['DATABASE'])
+    try:
+        return store.load_programs()
+    finally:
+        store.close()
+
+
+def print_result(result, show_steps=False):
+    print(f"{result['name']} ({result['program_id']}): cycle time {result['cycle_time']:.2f}s, "
+          f"{len(result['steps'])} steps, {len(result['violations'])} violations")
+    if show_steps:
+        for step in result['steps']:
+            error = f"  {step['error']}" if step['error'] else ''
+            print(f"  {step['index']:>4} {step['type']:<6} start {step['start']:8.2f}s "
+                  f"duration {step['duration']:7.2f}s{error}")
+    print(f"  {'joint':<22} {'peak velocity':>14} {'peak accel':>11}")
+    for joint in dry_run.JOINTS:
+        print(f"  {joint:<22} {result['peak_velocity'][joint]:>14.2f} {result['peak_acceleration'][joint]:>11.2f}")
+    for violation in result['violations']:
+        print(f"  ! step {violation['step']} {violation['type']}: {violation['message']}")
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dry run programs and report cycle times and limit violations")
+    parser.add_argument('programs', nargs='*', help="Program ids or names (all programs if omitted)")
+    parser.add_argument('--database', help="Pendant database (defaults to STORAGE_CONFIG['DATABASE'])")
+    parser.add_argument('--json-file', help="Read programs from a programs.json file instead of the database")
+    parser.add_argument('--start', help="Start joint positions as JSON (defaults to the home position)")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (defaults to one per CPU)")
+    parser.add_argument('--steps', action='store_true', help="Print the timing of every step")
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    args = parser.parse_args()
+
+    programs = load_programs(args.database, args.json_file)
+    if args.programs:
+        selected = [program for program in programs.values()
+                    if program['id'] in args.programs or program['name'] in args.programs]
+        if not selected:
+            parser.error("No matching programs")
+    else:
+        selected = list(programs.values())
+
+    start = json.loads(args.start) if args.start else None
+    results = dry_run.run_dry_runs(selected, start, args.workers)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for result in results:
+        print_result(result, args.steps)
+    if len(results) > 1:
+        print(f"{len(results)} programs, total cycle time {sum(result['cycle_time'] for result in results):.2f}s, "
+              f"{sum(len(result['violations']) for result in results)} violations")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""
+Inspect and replay motion session recordings (see recorder.py).
+
+    info    - record counts per kind and command, duration, serial latency
+    dump    - print records as text, optionally only one kind
+    replay  - run the recorded commands through routers/motion.py in
+              simulation (no server, no Arduino) and report handler latency and
+              how far the replayed state diverges from the recorded one
+
+Replays run the same handlers, kinematics and jog loop as the server, so a
+recording of a real session is a realistic benchmark workload; use a high
+--speed to shorten it (jog motion is scaled with it).
+
+Usage:
+    python tools/session_replay.py info data/recordings/session-20250101-120000.rec
+    python tools/session_replay.py dump data/recordings/demo.rec --kind serial_rx
+    python tools/session_replay.py replay data/recordings/demo.rec --speed 10 --json
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('PENDANT_LOG_LEVEL', 'WARNING')
+
+import numpy as np
+
+import recorder
+
+
+def info(path):
+    header, records = recorder.read_recording(path)
+    kinds = {name: int(np.count_nonzero(records['kind'] == kind)) for kind, name in recorder.KIND_NAMES.items()}
+    commands = records[records['kind'] == recorder.KIND_COMMAND]
+    command_counts = {}
+    for code in np.unique(commands['code']):
+        name = recorder.COMMANDS[code - 1] if 0 < code <= len(recorder.COMMANDS) else 'unknown'
+        command_counts[name] = int(np.count_nonzero(commands['code'] == code))
+
+    responses = records[records['kind'] == recorder.KIND_SERIAL_RX]['value']
+    serial = None
+    if len(responses):
+        serial = {'count': int(len(responses)),
+                  'mean_ms': float(responses.mean() * 1000),
+                  'p99_ms': float(np.percentile(responses, 99) * 1000),
+                  'max_ms': float(responses.max() * 1000)}
+
+    # Gaps in the sequence numbers mean records were lost
+    gaps = int(np.count_nonzero(np.diff(records['seq'].astype(np.int64)) != 1)) if len(records) > 1 else 0
+    return {**header, 'kinds': kinds, 'commands': command_counts, 'serial_response_latency': serial,
+            'sequence_gaps': gaps}
+
+
+def format_record(record):
+    kind = recorder.KIND_NAMES.get(int(record['kind']), 'unknown')
+    prefix = f"{record['t']:10.4f} {record['seq']:>7} {kind:<9}"
+    if kind == 'command':
+        command, data = recorder.decode_command(record)
+        return f"{prefix} {command} {json.dumps(data)}"
+    if kind == 'state':
+        joints = ' '.join(f"{value:8.3f}" for value in record['joints'])
+        ee = ' '.join(f"{value:8.2f}" for value in record['ee'])
+        return f"{prefix} joints [{joints}] ee [{ee}]"
+    code = int(record['code'])
+    command = recorder.SERIAL_COMMANDS[code - 1] if 0 < code <= len(recorder.SERIAL_COMMANDS) else 'unknown'
+    line = record['payload'].decode('utf-8', 'replace')
+    if kind == 'serial_rx':
+        return f"{prefix} {command} {record['value'] * 1000:7.2f}ms {line}"
+    return f"{prefix} {command} {line}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and replay motion session recordings")
+    subparsers = parser.add_subparsers(dest='action', required=True)
+
+    info_parser = subparsers.add_parser('info', help="Summarize a recording")
+    info_parser.add_argument('path')
+
+    dump_parser = subparsers.add_parser('dump', help="Print records as text")
+    dump_parser.add_argument('path')
+    dump_parser.add_argument('--kind', choices=list(recorder.KIND_NAMES.values()), help="Only this kind of record")
+    dump_parser.add_argument('--limit', type=int, default=None, help="Print at most this many records")
+
+    replay_parser = subparsers.add_parser('replay', help="Replay the commands in simulation")
+    replay_parser.add_argument('path')
+    replay_parser.add_argument('--speed', type=float, default=1.0, help="Replay speed multiplier")
+    replay_parser.add_argument('--json', action='store_true', help="Print results as JSON")
+
+    args = parser.parse_args()
+
+    if args.action == 'info':
+        print(json.dumps(info(args.path), indent=2))
+
+    elif args.action == 'dump':
+        _, records = recorder.read_recording(args.path)
+        if args.kind:
+            kind = next(code for code, name in recorder.KIND_NAMES.items() if name == args.kind)
+            records = records[records['kind'] == kind]
+        for record in records[:args.limit]:
+            print(format_record(record))
+
+    else:
+        from routers import motion
+
+        # Replays never drive hardware
+        motion.arduino_communicator = None
+        result = asyncio.run(recorder.replay(args.path, args.speed))
+        if args.json:
+            print(json.dumps(result, indent=2))
+            return
+        print(f"Replayed {result['commands']} commands at {args.speed}x in {result['elapsed']:.2f}s "
+              f"(recorded {result['recorded_duration']:.2f}s)")
+        print(f"\n{'command':<16} {'count':>6} {'mean':>9} {'max':>9}")
+        for command, stats in result['handlers'].items():
+            print(f"{command:<16} {stats['count']:>6} {stats['mean_ms']:>7.2f}ms {stats['max_ms']:>7.2f}ms")
+        print(f"\nState divergence: max {result['max_divergence']:.6f} over {result['checked_states']} checked "
+              f"commands, final {result['final_divergence']}")
+
+
+if __name__ == '__main__':
+    main()
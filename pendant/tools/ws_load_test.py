@@ -0,0 +1,342 @@
+"""
+WebSocket load test for the pendant server.
+
+Runs N simulated pendant clients against /ws for each client count in a
+sweep. Every client sends a mix of jog sessions (jog_start ... jog_stop),
+jog_increment, moveJ and moveL commands and reports:
+    - command latency: from sending a command until the first position frame after it
+    - moveJ latency: from sending a moveJ until a frame shows the target joints
+      (targets overwritten by another client before being published are not counted)
+    - frame jitter: spread of position frame inter-arrival times while the arm is
+      moving (consecutive frames less than 3 publish periods apart)
+    - dropped frames: gaps in the position frame sequence numbers
+    - server jog loop period and overruns, scraped from /metrics
+
+Only run it against a server in SIMULATION_MODE; with --spawn the server is
+started here (from this checkout) and the run refuses unless SIMULATION_MODE
+is set in config.py.
+
+Usage:
+    python tools/ws_load_test.py --spawn --clients 1,5,10,25 --duration 10
+    python tools/ws_load_test.py --url ws://127.0.0.1:8000/ws --clients 50 --json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+import websockets
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import SIMULATION_MODE, JOINT_LIMITS, JOG_INCREMENTS, BROADCAST_CONFIG, ROBOT_CONFIG
+
+JOINTS = ['base_rotation', 'shoulder_rotation', 'prismatic_extension',
+          'elbow_rotation', 'elbow2_rotation', 'end_effector_rotation']
+AXES = ['x', 'y', 'z']
+
+# Relative frequency of each client action
+ACTION_WEIGHTS = {
+    'jog_session': 2,
+    'jog_increment': 4,
+    'moveJ': 2,
+    'moveL': 2
+}
+
+TARGET_TOLERANCE = 1e-3
+FRAME_PERIOD = 1.0 / BROADCAST_CONFIG['POSITION_RATE']
+
+
+def percentiles(values):
+    """Summarize a list of seconds as milliseconds"""
+    if not values:
+        return {'count': 0}
+    ordered = sorted(values)
+
+    def pick(q):
+        return ordered[min(len(ordered) - 1, int(q / 100.0 * len(ordered)))] * 1000
+
+    return {
+        'count': len(ordered),
+        'p50_ms': pick(50),
+        'p90_ms': pick(90),
+        'p99_ms': pick(99),
+        'max_ms': ordered[-1] * 1000
+    }
+
+
+def scrape_metrics(base_url):
+    """
+    Read the jog loop metrics from the server's /metrics endpoint
+
+    Returns:
+        Dictionary of sample name (with labels) -> value, or {} if unavailable
+    """
+    try:
+        with urllib.request.urlopen(base_url + '/metrics', timeout=5) as response:
+            text = response.read().decode()
+    except Exception:
+        return {}
+    samples = {}
+    for line in text.splitlines():
+        if line.startswith('pendant_jog_loop'):
+            name, value = line.rsplit(' ', 1)
+            samples[name] = float(value)
+    return samples
+
+
+def loop_stats(before, after):
+    """
+    Jog loop period and overruns during a step, from two /metrics scrapes
+
+    Returns:
+        Dictionary with iteration count, overruns, mean period and an upper bound for p99
+    """
+    def delta(name):
+        return after.get(name, 0) - before.get(name, 0)
+
+    count = delta('pendant_jog_loop_period_seconds_count')
+    result = {
+        'iterations': int(count),
+        'overruns': int(delta('pendant_jog_loop_overruns_total'))
+    }
+    if count:
+        result['mean_period_ms'] = delta('pendant_jog_loop_period_seconds_sum') / count * 1000
+        buckets = sorted(
+            (float(name.split('le="')[1].rstrip('"}')), delta(name))
+            for name in after if name.startswith('pendant_jog_loop_period_seconds_bucket') and '+Inf' not in name
+        )
+        for bound, cumulative in buckets:
+            if cumulative >= 0.99 * count:
+                result['p99_period_ms'] = bound * 1000
+                break
+    return result
+
+
+class PendantClient:
+    """One simulated pendant connected to /ws"""
+    def __init__(self, url, think_time, rng):
+        self.url = url
+        self.think_time = think_time
+        self.rng = rng
+        self.joints = None
+        self.ee = None
+        self.last_seq = None
+        self.last_frame_time = None
+        self.pending = []          # send times of commands waiting for a frame
+        self.move_target = None    # (send time, target joints) of the last moveJ
+        self.command_latency = []
+        self.move_latency = []
+        self.intervals = []
+        self.frames = 0
+        self.dropped = 0
+        self.commands = 0
+        self.errors = 0
+
+    async def run(self, duration):
+        async with websockets.connect(self.url, max_queue=None) as ws:
+            receiver = asyncio.create_task(self._receive(ws))
+            try:
+                # Wait for the initial position before sending commands
+                while self.joints is None:
+                    await asyncio.sleep(0.01)
+                deadline = time.perf_counter() + duration
+                while time.perf_counter() < deadline:
+                    await self._act(ws)
+                    await asyncio.sleep(self.rng.expovariate(1.0 / self.think_time))
+            finally:
+                receiver.cancel()
+
+    async def _send(self, ws, message):
+        self.pending.append(time.perf_counter())
+        self.commands += 1
+        await ws.send(json.dumps(message))
+
+    async def _act(self, ws):
+        action = self.rng.choices(list(ACTION_WEIGHTS), weights=list(ACTION_WEIGHTS.values()))[0]
+
+        if action == 'jog_session':
+            joint = self.rng.choice(JOINTS)
+            await self._send(ws, {'type': 'jog_start', 'mode': 'joint', 'joint': joint,
+                                  'direction': self.rng.choice([-1, 1]), 'velocity': self.rng.randint(10, 100)})
+            await asyncio.sleep(self.rng.uniform(0.2, 1.0))
+            await ws.send(json.dumps({'type': 'jog_stop'}))
+
+        elif action == 'jog_increment':
+            await self._send(ws, {'type': 'jog_increment', 'mode': 'joint', 'joint': self.rng.choice(JOINTS),
+                                  'increment': self.rng.choice(list(JOG_INCREMENTS['joint'].values())[:3]),
+                                  'direction': self.rng.choice([-1, 1])})
+
+        elif action == 'moveJ':
+            target = {}
+            for joint in JOINTS:
+                low, high = JOINT_LIMITS[joint.upper()]
+                target[joint] = round(min(high, max(low, self.joints[joint] + self.rng.uniform(-5, 5))), 3)
+            self.move_target = (time.perf_counter(), target)
+            await self._send(ws, {'type': 'moveJ', 'joint_positions': target, 'velocity': 50})
+
+        else:
+            # Small linear move, pulled back inside the workspace when the arm is near its edge
+            target = dict(self.ee)
+            for axis in AXES:
+                low, high = ROBOT_CONFIG['WORKSPACE_LIMITS'][axis]
+                target[axis] = min(high - 10, max(low + 10, self.ee[axis] + self.rng.uniform(-5, 5)))
+            await self._send(ws, {'type': 'moveL', 'position': target, 'velocity': 50})
+
+    async def _receive(self, ws):
+        async for raw in ws:
+            message = json.loads(raw)
+            message_type = message.get('type')
+            if message_type == 'error':
+                self.errors += 1
+            if message_type != 'position_update':
+                continue
+
+            now = time.perf_counter()
+            self.frames += 1
+            self.joints = message['joint_positions']
+            self.ee = message['ee_position']
+
+            seq = message.get('seq', 0)
+            if seq:
+                if self.last_seq is not None and seq > self.last_seq + 1:
+                    self.dropped += seq - self.last_seq - 1
+                # Frames are only published while something moves, so idle gaps are not jitter
+                if self.last_seq == seq - 1 and now - self.last_frame_time < 3 * FRAME_PERIOD:
+                    self.intervals.append(now - self.last_frame_time)
+                self.last_seq = seq
+                self.last_frame_time = now
+
+            for sent in self.pending:
+                self.command_latency.append(now - sent)
+            self.pending.clear()
+
+            if self.move_target is not None:
+                sent, target = self.move_target
+                if all(abs(self.joints[joint] - value) < TARGET_TOLERANCE for joint, value in target.items()):
+                    self.move_latency.append(now - sent)
+                    self.move_target = None
+
+
+async def run_step(url, base_url, clients, duration, think_time, seed):
+    """Run one step of the sweep with a fixed number of clients"""
+    pendants = [PendantClient(url, think_time, random.Random(seed + i)) for i in range(clients)]
+    before = scrape_metrics(base_url)
+    results = await asyncio.gather(*(p.run(duration) for p in pendants), return_exceptions=True)
+    after = scrape_metrics(base_url)
+
+    failures = [r for r in results if isinstance(r, Exception)]
+    intervals = [i for p in pendants for i in p.intervals]
+    frames = sum(p.frames for p in pendants)
+    dropped = sum(p.dropped for p in pendants)
+
+    return {
+        'clients': clients,
+        'failed_clients': len(failures),
+        'commands': sum(p.commands for p in pendants),
+        'errors': sum(p.errors for p in pendants),
+        'command_latency': percentiles([l for p in pendants for l in p.command_latency]),
+        'movej_latency': percentiles([l for p in pendants for l in p.move_latency]),
+        'frames': frames,
+        'dropped_frames': dropped,
+        'drop_rate': dropped / (frames + dropped) if frames + dropped else 0.0,
+        'frame_jitter_ms': statistics.pstdev(intervals) * 1000 if len(intervals) > 1 else None,
+        'frame_interval_p99_ms': percentiles(intervals).get('p99_ms'),
+        'expected_interval_ms': FRAME_PERIOD * 1000,
+        'server_jog_loop': loop_stats(before, after)
+    }
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def spawn_server(port):
+    """Start the app with uvicorn in a child process and wait until it accepts connections"""
+    if not SIMULATION_MODE:
+        sys.exit("Refusing to spawn the server: SIMULATION_MODE is off in config.py")
+
+    pendant_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PENDANT_LOG_LEVEL=os.environ.get('PENDANT_LOG_LEVEL', 'WARNING'))
+    # Server logs go to stderr so --json output stays parseable
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'app:app', '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning'],
+        cwd=pendant_dir, env=env, stdout=sys.stderr)
+
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return server
+        except OSError:
+            if server.poll() is not None:
+                sys.exit("Server exited during startup")
+            time.sleep(0.2)
+    server.terminate()
+    sys.exit("Server did not start within 30 seconds")
+
+
+def print_header():
+    print(f"{'clients':>7} {'cmds':>6} {'cmd p50':>8} {'cmd p99':>8} {'moveJ p99':>9} "
+          f"{'jitter':>7} {'dropped':>8} {'loop p99':>8} {'overruns':>8}")
+
+
+def _ms(value, width):
+    return f"{value:>{width - 2}.1f}ms" if value is not None else f"{'-':>{width}}"
+
+
+def print_row(r):
+    loop = r['server_jog_loop']
+    print(f"{r['clients']:>7} {r['commands']:>6} "
+          f"{_ms(r['command_latency'].get('p50_ms'), 8)} {_ms(r['command_latency'].get('p99_ms'), 8)} "
+          f"{_ms(r['movej_latency'].get('p99_ms'), 9)} {_ms(r['frame_jitter_ms'], 7)} {r['dropped_frames']:>8} "
+          f"{_ms(loop.get('p99_period_ms'), 8)} {loop.get('overruns', 0):>8}", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the pendant WebSocket server with simulated clients")
+    parser.add_argument('--url', default='ws://127.0.0.1:8000/ws', help="WebSocket URL of a running server")
+    parser.add_argument('--spawn', action='store_true', help="Start a simulation-mode server for the test")
+    parser.add_argument('--clients', default='1,5,10,25', help="Comma-separated client counts to sweep")
+    parser.add_argument('--duration', type=float, default=10.0, help="Seconds per step")
+    parser.add_argument('--think-time', type=float, default=0.5, help="Mean seconds between client actions")
+    parser.add_argument('--seed', type=int, default=1, help="Random seed for the action mix")
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if args.spawn:
+        port = free_port()
+        server = spawn_server(port)
+        url = f"ws://127.0.0.1:{port}/ws"
+    base_url = url.replace('ws://', 'http://', 1).replace('wss://', 'https://', 1).rsplit('/ws', 1)[0]
+
+    try:
+        results = []
+        if not args.json:
+            print_header()
+        for clients in [int(c) for c in args.clients.split(',')]:
+            results.append(asyncio.run(run_step(url, base_url, clients, args.duration, args.think_time, args.seed)))
+            if not args.json:
+                print_row(results[-1])
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
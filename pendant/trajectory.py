@@ -0,0 +1,209 @@
+"""
+Joint space trajectory planning.
+
+A move is planned as a synchronized trapezoidal velocity profile: all joints
+accelerate, cruise and decelerate over the same phase times, so they start
+and arrive together and the path is a straight line in joint space. Each
+joint stays within its own velocity and acceleration limit; moves too short
+to reach cruise speed get a triangular profile.
+
+The shortest such profile has a closed form (see _synchronized_profile), so
+planning a move, or only estimating its duration, costs a few operations per
+joint. estimate_duration() is the one duration model used for simulated
+moves, progress reporting and cycle time reports; duration_matrix() is the
+same formula over arrays, for waypoint ordering's all-pairs move times.
+"""
+import math
+
+import numpy as np
+
+from config import MOVEMENT_PARAMS, ROBOT_CONFIG
+
+JOINTS = ('base_rotation', 'shoulder_rotation', 'prismatic_extension',
+          'elbow_rotation', 'elbow2_rotation', 'end_effector_rotation')
+
+
+def joint_limits():
+    """
+    Per-joint motion limits from config.py
+
+    Returns:
+        Dictionary of joint -> (max velocity, max acceleration) in degrees or mm per s / s^2
+    """
+    accelerations = ROBOT_CONFIG.get('MAX_ACCELERATIONS', {})
+    return {joint: (ROBOT_CONFIG['DEFAULT_SPEEDS'][joint],
+                    accelerations.get(joint, MOVEMENT_PARAMS['MAX_ACCELERATION']))
+            for joint in JOINTS}
+
+
+def _moving_joints(start, target, velocity, limits):
+    """(distance, max velocity, max acceleration) of every joint that moves"""
+    scale = max(1.0, min(100.0, velocity)) / 100.0
+    moving = []
+    for joint in JOINTS:
+        distance = abs(target[joint] - start[joint])
+        if distance > 0:
+            moving.append((distance, limits[joint][0] * scale, limits[joint][1]))
+    return moving
+
+
+def _synchronized_profile(moving, min_duration):
+    """
+    Shortest profile all moving joints can follow together
+
+    With a shared acceleration time ta and duration T, a joint moving d
+    cruises at d / (T - ta) and accelerates at d / (ta * (T - ta)). So the
+    velocity limits need T - ta >= c = max(d / v) and the acceleration limits
+    ta * (T - ta) >= m = max(d / a). The shortest T is a trapezoid with
+    T - ta = c when m <= c^2, otherwise a triangle with ta = T / 2.
+
+    Args:
+        moving: List of (distance, max velocity, max acceleration)
+        min_duration: Shortest allowed move time
+
+    Returns:
+        (duration, accel_time)
+    """
+    cruise = max(distance / max_velocity for distance, max_velocity, _ in moving)
+    ramp = max(distance / max_acceleration for distance, _, max_acceleration in moving)
+    if ramp <= cruise * cruise:
+        duration = cruise + ramp / cruise
+    else:
+        duration = 2.0 * math.sqrt(ramp)
+    # A longer move keeps the longest acceleration phase that still fits
+    duration = max(duration, min_duration)
+    return duration, min(duration / 2.0, duration - cruise)
+
+
+def estimate_duration(start, target, velocity=100, limits=None, min_duration=None):
+    """
+    Duration of the move plan_move() would plan, without planning it
+
+    Args:
+        start: Joint positions at the start
+        target: Joint positions to reach
+        velocity: Percentage of each joint's maximum velocity (1-100)
+        limits: Per-joint (max velocity, max acceleration), defaults to joint_limits()
+        min_duration: Shortest allowed move time, defaults to MOVEMENT_PARAMS['MIN_MOVEMENT_TIME']
+
+    Returns:
+        Move time in seconds
+    """
+    if min_duration is None:
+        min_duration = MOVEMENT_PARAMS.get('MIN_MOVEMENT_TIME', 0.0)
+    moving = _moving_joints(start, target, velocity, limits or joint_limits())
+    if not moving:
+        return min_duration
+    return _synchronized_profile(moving, min_duration)[0]
+
+
+def duration_matrix(points, velocities, limits=None, min_duration=None):
+    """
+    estimate_duration() between every pair of joint positions at once
+
+    Args:
+        points: Sequence of joint position dictionaries
+        velocities: Velocity percentage of the move to each point
+        limits: Per-joint (max velocity, max acceleration), defaults to joint_limits()
+        min_duration: Shortest allowed move time, defaults to MOVEMENT_PARAMS['MIN_MOVEMENT_TIME']
+
+    Returns:
+        numpy array where [i, j] is the time to move from points[i] to points[j]
+    """
+    if min_duration is None:
+        min_duration = MOVEMENT_PARAMS.get('MIN_MOVEMENT_TIME', 0.0)
+    limits = limits or joint_limits()
+    positions = np.array([[float(point[joint]) for joint in JOINTS] for point in points]).reshape(-1, len(JOINTS))
+    max_velocity = np.array([limits[joint][0] for joint in JOINTS])
+    max_acceleration = np.array([limits[joint][1] for joint in JOINTS])
+    scale = np.clip(np.asarray(velocities, dtype=float), 1.0, 100.0) / 100.0
+
+    distance = np.abs(positions[np.newaxis, :, :] - positions[:, np.newaxis, :])
+    # The velocity percentage is the target's, as in the move to it
+    cruise = (distance / (max_velocity[np.newaxis, :] * scale[:, np.newaxis])[np.newaxis, :, :]).max(axis=2)
+    ramp = (distance / max_acceleration).max(axis=2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        trapezoid = cruise + ramp / cruise
+    duration = np.where(ramp <= cruise * cruise, trapezoid, 2.0 * np.sqrt(ramp))
+    # Pairs with no motion have cruise == ramp == 0 and take min_duration
+    duration = np.where(cruise > 0, duration, 0.0)
+    return np.maximum(duration, min_duration)
+
+
+class Segment:
+    """One planned rest-to-rest move between two joint positions"""
+    def __init__(self, start, target, duration, accel_time):
+        """
+        Args:
+            start: Joint positions at the start of the move
+            target: Joint positions at the end of the move
+            duration: Move time in seconds
+            accel_time: Length of the acceleration (and deceleration) phase in seconds
+        """
+        self.start = dict(start)
+        self.target = dict(target)
+        self.duration = duration
+        self.accel_time = accel_time
+        cruise = duration - accel_time
+        self.peak_velocity = {}
+        self.peak_acceleration = {}
+        for joint in JOINTS:
+            distance = abs(self.target[joint] - self.start[joint])
+            velocity = distance / cruise if cruise > 0 else 0.0
+            self.peak_velocity[joint] = velocity
+            self.peak_acceleration[joint] = velocity / accel_time if accel_time > 0 else 0.0
+
+    def progress(self, t):
+        """Fraction of the move completed at time t (0 to 1)"""
+        duration, accel_time = self.duration, self.accel_time
+        if duration <= 0 or t >= duration:
+            return 1.0
+        if t <= 0:
+            return 0.0
+        if accel_time <= 0:
+            return t / duration
+        velocity = 1.0 / (duration - accel_time)
+        if t < accel_time:
+            return 0.5 * velocity / accel_time * t * t
+        if t <= duration - accel_time:
+            return velocity * (t - 0.5 * accel_time)
+        remaining = duration - t
+        return 1.0 - 0.5 * velocity / accel_time * remaining * remaining
+
+    def position(self, t):
+        """Joint positions at time t seconds into the move"""
+        fraction = self.progress(t)
+        return {joint: self.start[joint] + (self.target[joint] - self.start[joint]) * fraction for joint in JOINTS}
+
+    def to_dict(self):
+        return {
+            'duration': self.duration,
+            'accel_time': self.accel_time,
+            'start': self.start,
+            'target': self.target,
+            'peak_velocity': self.peak_velocity,
+            'peak_acceleration': self.peak_acceleration
+        }
+
+
+def plan_move(start, target, velocity=100, limits=None, min_duration=None):
+    """
+    Plan a synchronized move from start to target
+
+    Args:
+        start: Joint positions at the start
+        target: Joint positions to reach
+        velocity: Percentage of each joint's maximum velocity (1-100)
+        limits: Per-joint (max velocity, max acceleration), defaults to joint_limits()
+        min_duration: Shortest allowed move time, defaults to MOVEMENT_PARAMS['MIN_MOVEMENT_TIME']
+
+    Returns:
+        Segment
+    """
+    if min_duration is None:
+        min_duration = MOVEMENT_PARAMS.get('MIN_MOVEMENT_TIME', 0.0)
+    moving = _moving_joints(start, target, velocity, limits or joint_limits())
+    if not moving:
+        return Segment(start, target, min_duration, 0.0)
+    duration, accel_time = _synchronized_profile(moving, min_duration)
+    return Segment(start, target, duration, accel_time)
@@ -0,0 +1,171 @@
+"""
+NDJSON import and export of programs and saved positions.
+
+A library file has one JSON object per line: a header, then one record per
+saved position and per program:
+
+    {"kind": "header", "format": "pendant-library", "version": 1, "exported": "..."}
+    {"kind": "position", "data": {...saved position...}}
+    {"kind": "program", "data": {...program with its steps...}}
+
+Positions come first, so a file imported from the start never holds a
+program ahead of the positions it was built from. Files may be gzip
+compressed; imports detect this from the first bytes.
+
+Both directions work one record at a time: exports serialize and compress a
+record only when the client reads it, and imports decompress and split the
+request body as it arrives, so memory use does not grow with the size of the
+library, only with the largest single record (TRANSFER_CONFIG['MAX_RECORD_BYTES']).
+"""
+import datetime
+import json
+import zlib
+
+from config import TRANSFER_CONFIG
+
+FORMAT = 'pendant-library'
+FORMAT_VERSION = 1
+
+# Bytes of output collected before a chunk is sent or compressed
+_CHUNK_SIZE = 64 * 1024
+
+_GZIP_MAGIC = b'\x1f\x8b'
+
+
+class RecordError(ValueError):
+    """A line of an import that is not a valid record"""
+    def __init__(self, line, message):
+        super().__init__(f"Line {line}: {message}")
+        self.line = line
+        self.message = message
+
+
+def export_lines(positions, programs):
+    """
+    Serialize a library one line at a time
+
+    Args:
+        positions: Dictionary of saved positions by id
+        programs: Dictionary of programs by id
+
+    Yields:
+        bytes: One NDJSON line each
+    """
+    header = {'kind': 'header', 'format': FORMAT, 'version': FORMAT_VERSION,
+              'exported': datetime.datetime.now().isoformat()}
+    yield json.dumps(header).encode() + b'\n'
+    # Copy only the ids; items deleted while the export runs are left out
+    for kind, items in (('position', positions), ('program', programs)):
+        for item_id in list(items):
+            item = items.get(item_id)
+            if item is not None:
+                yield json.dumps({'kind': kind, 'data': item}).encode() + b'\n'
+
+
+def chunked(lines, compress=False):
+    """
+    Group lines into chunks of about _CHUNK_SIZE bytes, gzip compressed if asked
+
+    Yields:
+        bytes
+    """
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16) if compress else None
+    buffer = []
+    size = 0
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size >= _CHUNK_SIZE:
+            data = b''.join(buffer)
+            buffer, size = [], 0
+            data = compressor.compress(data) if compressor else data
+            if data:
+                yield data
+    data = b''.join(buffer)
+    if compressor:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
+
+
+async def read_records(chunks):
+    """
+    Parse an NDJSON body as it arrives, decompressing gzip bodies
+
+    Args:
+        chunks: Async iterable of the body's bytes
+
+    Yields:
+        (line number, kind, data) for each record, or (line number, None, RecordError)
+        for a line that is not a record; blank lines and the header are skipped
+
+    Raises:
+        RecordError: If the body is not a library file, is corrupt or holds a
+                     record over TRANSFER_CONFIG['MAX_RECORD_BYTES']
+    """
+    decompressor = None
+    sniffed = False
+    pending = b''
+    line_number = 0
+    async for chunk in chunks:
+        if not sniffed:
+            if len(chunk) < 2 and not pending:
+                pending = chunk
+                continue
+            chunk, pending = pending + chunk, b''
+            sniffed = True
+            if chunk[:2] == _GZIP_MAGIC:
+                decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+        for data in _inflate(decompressor, chunk, line_number):
+            pending += data
+            lines = pending.split(b'\n')
+            pending = lines.pop()
+            if len(pending) > TRANSFER_CONFIG['MAX_RECORD_BYTES']:
+                raise RecordError(line_number + 1, f"Record larger than {TRANSFER_CONFIG['MAX_RECORD_BYTES']} bytes")
+            for line in lines:
+                line_number += 1
+                result = _parse_line(line_number, line)
+                if result is not None:
+                    yield result
+
+    if decompressor and not decompressor.eof:
+        raise RecordError(line_number + 1, "Truncated gzip data")
+    if pending:
+        line_number += 1
+        result = _parse_line(line_number, pending)
+        if result is not None:
+            yield result
+
+
+def _inflate(decompressor, chunk, line_number):
+    """Decompressed pieces of a chunk of at most _CHUNK_SIZE bytes each, or the chunk if not compressed"""
+    if decompressor is None:
+        yield chunk
+        return
+    try:
+        yield decompressor.decompress(chunk, _CHUNK_SIZE)
+        while decompressor.unconsumed_tail:
+            yield decompressor.decompress(decompressor.unconsumed_tail, _CHUNK_SIZE)
+    except zlib.error as e:
+        raise RecordError(line_number + 1, f"Corrupt gzip data: {e}") from e
+
+
+def _parse_line(line_number, line):
+    if not line.strip():
+        return None
+    try:
+        record = json.loads(line)
+    except ValueError as e:
+        return line_number, None, RecordError(line_number, f"Invalid JSON: {e}")
+    if not isinstance(record, dict):
+        return line_number, None, RecordError(line_number, "Record is not an object")
+
+    kind = record.get('kind')
+    if kind == 'header':
+        if record.get('format') != FORMAT or record.get('version', 0) > FORMAT_VERSION:
+            raise RecordError(line_number, f"Unsupported file format {record.get('format')} "
+                                           f"version {record.get('version')}")
+        return None
+    if kind not in ('position', 'program') or not isinstance(record.get('data'), dict):
+        return line_number, None, RecordError(line_number, "Expected a position or program record")
+    return line_number, kind, record['data']
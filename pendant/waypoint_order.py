@@ -0,0 +1,331 @@
+"""
+Waypoint ordering.
+
+Reorders the points a program visits so it spends less time travelling
+between them. The cost of going from one point to another is the joint space
+move time of trajectory.estimate_duration() under the configured velocity and
+acceleration limits (computed for all pairs at once by
+trajectory.duration_matrix()). An order is built with nearest neighbour and
+improved with 2-opt, which reverses a stretch of the order whenever that
+shortens it. Move times are not symmetric (each move runs at the velocity of
+the step it moves to), so a reversal's cost is computed from prefix sums of
+the forward and backward move times along the current order, and each 2-opt
+pass is followed by one that moves single waypoints to a better place.
+
+In a program, a waypoint is a move step together with the wait and io steps
+that follow it, so whatever the program does at a point stays with the point.
+Only moveJ steps and moveL steps that give their full orientation can move:
+a moveL that inherits its orientation would change target when reordered.
+Consecutive movable waypoints form a free-order segment; steps that cannot
+move split segments. The caller may instead give the step ranges that are
+free to reorder. With keep_ends the first and last waypoint of each segment
+stay in place, so a taught approach and exit (e.g. a return home) are kept.
+
+A segment is only reordered when its predicted travel time improves; the
+predicted saving is the difference of the compiled cycle times.
+"""
+import numpy as np
+
+from config import ROBOT_CONFIG, WAYPOINT_ORDER_CONFIG
+import kinematics
+import program_compiler
+import trajectory
+
+JOINTS = trajectory.JOINTS
+
+MOVE_TYPES = ('moveJ', 'moveL')
+
+# Default velocity of a move step without one, as in program_compiler
+DEFAULT_VELOCITY = 50
+
+
+def path_cost(cost, start, end, order):
+    """
+    Travel time of visiting waypoints in an order
+
+    Args:
+        cost: Matrix of move times between waypoints
+        start: Move times from the fixed start to each waypoint, or None
+        end: Move times from each waypoint to the fixed end, or None
+        order: Waypoint indices
+    """
+    if not order:
+        return 0.0
+    total = float(sum(cost[a, b] for a, b in zip(order, order[1:])))
+    if start is not None:
+        total += float(start[order[0]])
+    if end is not None:
+        total += float(end[order[-1]])
+    return total
+
+
+def order_waypoints(cost, start=None, end=None):
+    """
+    Visiting order with a short total travel time (nearest neighbour, then 2-opt and relocation)
+
+    Args:
+        cost: (n, n) matrix where [i, j] is the move time from waypoint i to j
+        start: Move times from a fixed start pose to each waypoint, or None for a free start
+        end: Move times from each waypoint to a fixed end pose, or None for a free end
+
+    Returns:
+        List of waypoint indices
+    """
+    n = len(cost)
+    if n <= 1:
+        return list(range(n))
+
+    # Add the start and end as nodes n and n + 1 at the ends of the path; a
+    # free start or end costs nothing to reach
+    full = np.zeros((n + 2, n + 2))
+    full[:n, :n] = cost
+    if start is not None:
+        full[n, :n] = start
+    if end is not None:
+        full[:n, n + 1] = end
+
+    # Nearest neighbour from the start
+    path = [n]
+    remaining = np.ones(n, dtype=bool)
+    for _ in range(n):
+        candidates = np.where(remaining, full[path[-1], :n], np.inf)
+        nearest = int(np.argmin(candidates))
+        path.append(nearest)
+        remaining[nearest] = False
+    path.append(n + 1)
+    path = np.array(path)
+
+    for _ in range(WAYPOINT_ORDER_CONFIG['MAX_PASSES']):
+        improved = _two_opt_pass(full, path)
+        improved = _relocate_pass(full, path) or improved
+        if not improved:
+            break
+    return [int(node) for node in path[1:-1]]
+
+
+def _two_opt_pass(full, path):
+    """Reverse path[i..j] where that shortens the path, the best j for each i; True if anything changed"""
+    n = len(path) - 2
+    improved = False
+    for i in range(1, n):
+        forward = np.concatenate(([0.0], np.cumsum(full[path[:-1], path[1:]])))
+        backward = np.concatenate(([0.0], np.cumsum(full[path[1:], path[:-1]])))
+        j = np.arange(i + 1, n + 1)
+        before = full[path[i - 1], path[i]] + (forward[j] - forward[i]) + full[path[j], path[j + 1]]
+        after = full[path[i - 1], path[j]] + (backward[j] - backward[i]) + full[path[i], path[j + 1]]
+        gain = before - after
+        best = int(np.argmax(gain))
+        if gain[best] > WAYPOINT_ORDER_CONFIG['MIN_GAIN']:
+            path[i:j[best] + 1] = path[i:j[best] + 1][::-1].copy()
+            improved = True
+    return improved
+
+
+def _relocate_pass(full, path):
+    """
+    Move single waypoints to the best place elsewhere in the path; True if anything changed
+
+    With asymmetric move times a reversal also reverses every move inside
+    it, so 2-opt alone gets stuck where moving one waypoint would help.
+    """
+    n = len(path) - 2
+    improved = False
+    for i in range(1, n + 1):
+        node = path[i]
+        removed = np.delete(path, i)
+        # Saving from taking the waypoint out, and the cost of putting it between removed[k] and removed[k + 1]
+        saving = full[path[i - 1], node] + full[node, path[i + 1]] - full[path[i - 1], path[i + 1]]
+        insert = full[removed[:-1], node] + full[node, removed[1:]] - full[removed[:-1], removed[1:]]
+        best = int(np.argmin(insert))
+        if best != i - 1 and saving - insert[best] > WAYPOINT_ORDER_CONFIG['MIN_GAIN']:
+            path[:] = np.insert(removed, best + 1, node)
+            improved = True
+    return improved
+
+
+def _waypoints(program, compiled):
+    """
+    Split a program's steps into waypoints
+
+    Returns:
+        List of (list of step positions, bound CompiledStep of its move or
+        None, whether it may be reordered)
+    """
+    waypoints = []
+    for position, step in enumerate(compiled):
+        if step.type in MOVE_TYPES or not waypoints:
+            data = program['steps'][position].get('data', {})
+            movable = (step.type == 'moveJ' or (step.type == 'moveL' and all(
+                axis in data.get('position', {}) for axis in program_compiler.ORIENTATION_AXES))) \
+                and not step.error and step.joint_target is not None
+            waypoints.append(([position], step if step.type in MOVE_TYPES else None, movable))
+        else:
+            waypoints[-1][0].append(position)
+    return waypoints
+
+
+def _segments(waypoints, ranges, keep_ends):
+    """
+    Free-order segments as lists of waypoint positions
+
+    Args:
+        ranges: List of (first, last) 1-based step numbers whose waypoints may be
+                reordered, or None for every run of movable waypoints
+    """
+    def group(waypoint):
+        positions, _, movable = waypoint
+        if not movable:
+            return None
+        if ranges is None:
+            return 0
+        for number, (first, last) in enumerate(ranges):
+            if first <= positions[0] + 1 and positions[-1] + 1 <= last:
+                return number
+        return None
+
+    segments = []
+    current, current_group = [], None
+    for position, waypoint in enumerate(waypoints):
+        waypoint_group = group(waypoint)
+        if waypoint_group is None or waypoint_group != current_group:
+            segments.append(current)
+            current = []
+        if waypoint_group is not None:
+            current.append(position)
+        current_group = waypoint_group
+    segments.append(current)
+
+    if keep_ends:
+        segments = [segment[1:-1] for segment in segments]
+    return [segment for segment in segments if len(segment) >= 2]
+
+
+def _cycle_time(program, start_joint_positions):
+    compiled = program_compiler.compile_program(program)
+    plan = compiled.bind(start_joint_positions, kinematics.ForwardKinematics().calculate(start_joint_positions))
+    return sum(step.duration for step in plan if not step.error), plan
+
+
+def optimize_program(program, start_joint_positions=None, ranges=None, keep_ends=True):
+    """
+    Reorder the free-order segments of a program to shorten its travel time
+
+    Args:
+        program: Program dictionary
+        start_joint_positions: Where the robot starts, defaults to the home position
+        ranges: List of (first, last) 1-based step numbers that may be reordered,
+                or None for every run of movable waypoints (see the module docstring)
+        keep_ends: Keep the first and last waypoint of each segment in place
+
+    Returns:
+        Dictionary with the reordered program, the new order of the original
+        step numbers, per-segment travel times and the cycle times before and after
+
+    Raises:
+        ValueError: If the program has more than WAYPOINT_ORDER_CONFIG['MAX_WAYPOINTS'] waypoints to order
+    """
+    start = dict(ROBOT_CONFIG['HOME_POSITION'])
+    start.update(start_joint_positions or {})
+    cycle_before, plan = _cycle_time(program, start)
+    waypoints = _waypoints(program, plan)
+    segments = _segments(waypoints, ranges, keep_ends)
+    if sum(len(segment) for segment in segments) > WAYPOINT_ORDER_CONFIG['MAX_WAYPOINTS']:
+        raise ValueError(f"More than {WAYPOINT_ORDER_CONFIG['MAX_WAYPOINTS']} waypoints to order")
+
+    def velocity(step):
+        return step.data.get('velocity', DEFAULT_VELOCITY)
+
+    new_order = list(range(len(waypoints)))
+    reports = []
+    for segment in segments:
+        first, last = segment[0], segment[-1]
+        # The pose before the segment, and the next move after it (if any)
+        before = next((waypoints[position][1].joint_target for position in range(first - 1, -1, -1)
+                       if waypoints[position][1] is not None and waypoints[position][1].joint_target), start)
+        after = next((waypoints[position][1] for position in range(last + 1, len(waypoints))
+                      if waypoints[position][1] is not None and waypoints[position][1].joint_target), None)
+
+        moves = [waypoints[position][1] for position in segment]
+        points = [move.joint_target for move in moves] + [before, after.joint_target if after else before]
+        velocities = [velocity(move) for move in moves] + [100, velocity(after) if after else 100]
+        matrix = trajectory.duration_matrix(points, velocities)
+        n = len(moves)
+        cost, start_cost = matrix[:n, :n], matrix[n, :n]
+        end_cost = matrix[:n, n + 1] if after else None
+
+        taught = list(range(n))
+        order = order_waypoints(cost, start_cost, end_cost)
+        taught_time = path_cost(cost, start_cost, end_cost, taught)
+        ordered_time = path_cost(cost, start_cost, end_cost, order)
+        if ordered_time >= taught_time:
+            order = taught
+            ordered_time = taught_time
+        for offset, index in enumerate(order):
+            new_order[first + offset] = segment[index]
+        reports.append({
+            'steps': [waypoints[first][0][0] + 1, waypoints[last][0][-1] + 1],
+            'waypoints': n,
+            'travel_time_before': taught_time,
+            'travel_time_after': ordered_time
+        })
+
+    step_order = [position for waypoint in new_order for position in waypoints[waypoint][0]]
+    reordered = dict(program)
+    reordered['steps'] = [program['steps'][position] for position in step_order]
+    cycle_after = _cycle_time(reordered, start)[0] if reports else cycle_before
+    return {
+        'program': reordered,
+        'order': [position + 1 for position in step_order],
+        'segments': reports,
+        'cycle_time_before': cycle_before,
+        'cycle_time_after': cycle_after,
+        'saving': cycle_before - cycle_after
+    }
+
+
+def optimize_positions(positions, start_joint_positions=None, velocity=DEFAULT_VELOCITY, return_to_start=False):
+    """
+    Visiting order for a set of saved positions
+
+    Args:
+        positions: List of saved positions, in their current order
+        start_joint_positions: Where the robot starts, defaults to the home position
+        velocity: Velocity percentage of the moves
+        return_to_start: Whether the robot returns to the start pose at the end
+
+    Returns:
+        Dictionary with the ordered position ids, moveJ steps visiting them and
+        the travel times of the given and the new order
+
+    Raises:
+        ValueError: If there are more than WAYPOINT_ORDER_CONFIG['MAX_WAYPOINTS'] positions
+    """
+    if len(positions) > WAYPOINT_ORDER_CONFIG['MAX_WAYPOINTS']:
+        raise ValueError(f"More than {WAYPOINT_ORDER_CONFIG['MAX_WAYPOINTS']} waypoints to order")
+    start = dict(ROBOT_CONFIG['HOME_POSITION'])
+    start.update(start_joint_positions or {})
+
+    n = len(positions)
+    points = [position['joint_positions'] for position in positions] + [start]
+    matrix = trajectory.duration_matrix(points, [velocity] * (n + 1))
+    cost, start_cost = matrix[:n, :n], matrix[n, :n]
+    end_cost = matrix[:n, n] if return_to_start else None
+
+    taught = list(range(n))
+    order = order_waypoints(cost, start_cost, end_cost)
+    taught_time = path_cost(cost, start_cost, end_cost, taught)
+    ordered_time = path_cost(cost, start_cost, end_cost, order)
+    if ordered_time >= taught_time:
+        order, ordered_time = taught, taught_time
+
+    steps = [{'type': 'moveJ', 'data': {'joint_positions': positions[index]['joint_positions'], 'velocity': velocity}}
+             for index in order]
+    if return_to_start and n:
+        steps.append({'type': 'moveJ', 'data': {'joint_positions': start, 'velocity': velocity}})
+    return {
+        'order': [positions[index]['id'] for index in order],
+        'steps': steps,
+        'travel_time_before': taught_time,
+        'travel_time_after': ordered_time,
+        'saving': taught_time - ordered_time
+    }